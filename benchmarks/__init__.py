@@ -0,0 +1,17 @@
+'''A reproducible benchmark suite for the hot paths of :mod:`ms_deisotope`:
+deconvolution, reading and writing mzML, and LC-MS feature deconvolution.
+
+Cases are measured with both the pure Python and the compiled ``_c``
+implementations, each in its own interpreter, reporting the best wall time,
+scans per second, peaks per second and peak memory of each case. Results can
+be saved as JSON and used as the baseline for a later run::
+
+    python -m benchmarks run -o baseline.json
+    # ... make changes ...
+    python -m benchmarks run -b baseline.json
+
+The second command marks the cases which got slower by more than
+``--threshold`` and exits with a non-zero status if any did. Use
+``-k <text>`` to run only the cases whose name contains ``<text>``, and
+``--scale`` to make each case do more or less work.
+'''
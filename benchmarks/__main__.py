@@ -0,0 +1,113 @@
+'''Command line interface for the benchmark suite, run as ``python -m benchmarks``.
+
+This module must not import :mod:`ms_deisotope` at the top level, as the
+``worker`` command has to choose an implementation before it is imported.
+'''
+import json
+import sys
+
+from collections import OrderedDict
+
+import click
+
+from . import runner
+
+
+@click.group()
+def cli():
+    '''Benchmarks for the hot paths of ms_deisotope.'''
+    pass
+
+
+@cli.command("run", short_help="Run the benchmarks and optionally compare them against a baseline")
+@click.option("-i", "--implementation", type=click.Choice(runner.IMPLEMENTATIONS + ("both", )), default="both",
+              help="Which implementation of ms_deisotope to measure. Defaults to both")
+@click.option("-r", "--repeat", type=click.IntRange(1), default=3,
+              help="The number of timed runs of each case")
+@click.option("-k", "--pattern", default=None, help="Only run cases whose name contains this text")
+@click.option("-s", "--scale", type=float, default=1.0,
+              help="A multiplier on the amount of work each case does")
+@click.option("--no-memory", is_flag=True, default=False, help="Skip measuring peak memory")
+@click.option("-o", "--output", type=click.Path(dir_okay=False, writable=True), default=None,
+              help="Write the results to this path as JSON, e.g. to save them as a baseline")
+@click.option("-b", "--baseline", type=click.Path(exists=True, dir_okay=False), default=None,
+              help="Compare the results against the results saved in this file")
+@click.option("-t", "--threshold", type=float, default=0.1,
+              help="The relative slow down beyond which a case is reported as a regression")
+@click.option("--memory-threshold", type=float, default=None,
+              help="The relative growth of peak memory beyond which a case is reported as a regression")
+def run(implementation, repeat, pattern, scale, no_memory, output, baseline, threshold, memory_threshold):
+    '''Run the benchmark cases, each implementation in its own interpreter.
+
+    Exits with a non-zero status if a baseline is given and any case regressed.
+    '''
+    if implementation == "both":
+        implementations = runner.IMPLEMENTATIONS
+    else:
+        implementations = (implementation, )
+    results = []
+    environments = OrderedDict()
+    for name in implementations:
+        click.echo("Measuring the %s implementation" % (name, ), err=True)
+        impl_results, environment = runner.run_implementation(
+            name, repeat=repeat, pattern=pattern, scale=scale, measure_memory=not no_memory)
+        if environment.get("available", True):
+            environments[name] = environment
+        else:
+            click.secho("The %s implementation is not available" % (name, ), fg='yellow', err=True)
+        results.extend(impl_results)
+    if output is not None:
+        runner.save_results(output, results, environments)
+    comparisons = None
+    if baseline is not None:
+        comparisons = runner.compare(results, runner.load_results(baseline))
+    click.echo(runner.format_report(results, comparisons, threshold, memory_threshold))
+    if comparisons and any(c.is_regression(threshold, memory_threshold) for c in comparisons):
+        sys.exit(1)
+
+
+@cli.command("compare", short_help="Compare two saved sets of results")
+@click.argument("results", type=click.Path(exists=True, dir_okay=False))
+@click.argument("baseline", type=click.Path(exists=True, dir_okay=False))
+@click.option("-t", "--threshold", type=float, default=0.1,
+              help="The relative slow down beyond which a case is reported as a regression")
+@click.option("--memory-threshold", type=float, default=None,
+              help="The relative growth of peak memory beyond which a case is reported as a regression")
+def compare(results, baseline, threshold, memory_threshold):
+    '''Compare the saved RESULTS against the saved BASELINE.
+
+    Exits with a non-zero status if any case regressed.
+    '''
+    results = runner.load_results(results)
+    comparisons = runner.compare(results, runner.load_results(baseline))
+    click.echo(runner.format_report(results, comparisons, threshold, memory_threshold))
+    if any(c.is_regression(threshold, memory_threshold) for c in comparisons):
+        sys.exit(1)
+
+
+@cli.command("worker", hidden=True)
+@click.argument("implementation", type=click.Choice(runner.IMPLEMENTATIONS))
+@click.argument("output", type=click.Path(dir_okay=False, writable=True))
+@click.option("--repeat", type=int, default=3)
+@click.option("--pattern", default=None)
+@click.option("--scale", type=float, default=1.0)
+@click.option("--no-memory", is_flag=True, default=False)
+def worker(implementation, output, repeat, pattern, scale, no_memory):
+    '''Run the benchmark cases with one implementation in this interpreter.'''
+    available = runner.select_implementation(implementation)
+    results = []
+    if available:
+        results = runner.run_in_process(
+            implementation, repeat=repeat, pattern=pattern, scale=scale,
+            measure_memory=not no_memory, log=lambda message: click.echo(message, err=True))
+    environment = runner.environment_description(implementation)
+    environment['available'] = available
+    with open(output, 'wt') as handle:
+        json.dump({
+            "environment": environment,
+            "results": [result.to_dict() for result in results]
+        }, handle, indent=2)
+
+
+if __name__ == '__main__':
+    cli()
@@ -0,0 +1,314 @@
+'''The benchmark cases, covering the hot paths of deconvolution, reading, writing
+and LC-MS feature processing.
+
+Each case does its expensive setup once in :meth:`BenchmarkCase.setup`, then
+rebuilds any input the measured code consumes or mutates in
+:meth:`BenchmarkCase.prepare`, which is not timed, before each timed call to
+:meth:`BenchmarkCase.run`.
+'''
+import os
+import shutil
+import tempfile
+
+import ms_deisotope
+from ms_peak_picker import pick_peaks
+
+from ms_deisotope.averagine import peptide
+from ms_deisotope.scoring import PenalizedMSDeconVFitter, MSDeconVFitter
+from ms_deisotope.data_source.mzml import MzMLLoader
+from ms_deisotope.output.mzml import MzMLSerializer
+from ms_deisotope.feature_map.feature_map import LCMSFeatureForest, StreamingLCMSFeatureForest
+from ms_deisotope.feature_map.feature_processor import LCMSFeatureProcessor
+from ms_deisotope.tools.deisotoper.workflow import SampleConsumer
+
+from ms_deisotope.test.common import datafile
+
+from .synthetic import SyntheticSpectrumGenerator, SyntheticLCMSGenerator
+
+
+class BenchmarkCase(object):
+    """A unit of work to be timed.
+
+    Attributes
+    ----------
+    name : str
+        A unique name for the case, used to match results against a baseline
+    scale : float
+        A multiplier on the amount of work done by each run
+    """
+    name = None
+
+    def __init__(self, scale=1.0):
+        self.scale = scale
+
+    def _scaled(self, count):
+        return max(int(round(count * self.scale)), 1)
+
+    def setup(self):
+        """Do the expensive, untimed work needed before any runs, like generating data"""
+        pass
+
+    def prepare(self):
+        """Build the input for one run. Not timed.
+
+        Returns
+        -------
+        object
+        """
+        return None
+
+    def run(self, state):
+        """Do the work being measured.
+
+        Parameters
+        ----------
+        state : object
+            The value returned by :meth:`prepare`
+
+        Returns
+        -------
+        n_scans : int
+            The number of scans processed
+        n_peaks : int
+            The number of peaks or data points processed
+        """
+        raise NotImplementedError()
+
+    def teardown(self):
+        pass
+
+    def __repr__(self):
+        return "%s(%r)" % (self.__class__.__name__, self.name)
+
+
+def _ms1_deconvolution_args():
+    _, _, ms1_deconvolution_args, _ = SampleConsumer.default_processing_configuration()
+    return ms1_deconvolution_args
+
+
+class CentroidDeconvolutionCase(BenchmarkCase):
+    """Deconvolute synthetic centroided spectra with :func:`~.deconvolute_peaks`, using the
+    same settings the ``deisotope`` command uses for MS1 scans.
+    """
+
+    def __init__(self, name, n_spectra=8, scale=1.0, **generator_args):
+        super(CentroidDeconvolutionCase, self).__init__(scale)
+        self.name = name
+        self.n_spectra = n_spectra
+        self.generator_args = generator_args
+        self.spectra = []
+        self.deconvolution_args = None
+
+    def setup(self):
+        generator = SyntheticSpectrumGenerator(**self.generator_args)
+        self.spectra = [generator.centroid() for _ in range(self._scaled(self.n_spectra))]
+        self.deconvolution_args = _ms1_deconvolution_args()
+
+    def prepare(self):
+        return [peaks.clone() for peaks in self.spectra]
+
+    def run(self, state):
+        n_peaks = 0
+        for peaks in state:
+            n_peaks += len(peaks)
+            ms_deisotope.deconvolute_peaks(
+                peaks, decon_config=self.deconvolution_args, charge_range=(1, 8))
+        return len(state), n_peaks
+
+
+class ProfileDeconvolutionCase(CentroidDeconvolutionCase):
+    """Pick peaks from synthetic profile spectra, then deconvolute them."""
+
+    def setup(self):
+        super(ProfileDeconvolutionCase, self).setup()
+        generator = SyntheticSpectrumGenerator(**self.generator_args)
+        self.spectra = [generator.profile() for _ in range(self._scaled(self.n_spectra))]
+
+    def prepare(self):
+        return self.spectra
+
+    def run(self, state):
+        n_points = 0
+        for mz_array, intensity_array in state:
+            n_points += len(mz_array)
+            peaks = pick_peaks(mz_array, intensity_array, peak_mode='profile')
+            ms_deisotope.deconvolute_peaks(
+                peaks, decon_config=self.deconvolution_args, charge_range=(1, 8))
+        return len(state), n_points
+
+
+class GraphDeconvoluterCase(CentroidDeconvolutionCase):
+    """Drive :class:`~.AveraginePeakDependenceGraphDeconvoluter` directly, without the
+    priority target handling of :func:`~.deconvolute_peaks`.
+    """
+
+    def run(self, state):
+        n_peaks = 0
+        for peaks in state:
+            n_peaks += len(peaks)
+            deconvoluter = ms_deisotope.AveraginePeakDependenceGraphDeconvoluter(
+                peaks, averagine=peptide, scorer=PenalizedMSDeconVFitter(20., 2.),
+                max_missed_peaks=3, use_quick_charge=True)
+            deconvoluter.deconvolute(charge_range=(1, 8), truncate_after=0.95, ignore_below=0.05)
+        return len(state), n_peaks
+
+
+class MzMLIterationCase(BenchmarkCase):
+    """Read every scan bunch of an mzML file, decoding each scan's arrays."""
+
+    def __init__(self, name, path, scale=1.0):
+        super(MzMLIterationCase, self).__init__(scale)
+        self.name = name
+        self.path = path
+
+    def run(self, state):
+        n_scans = 0
+        n_points = 0
+        for _ in range(self._scaled(1)):
+            reader = MzMLLoader(self.path)
+            for bunch in reader:
+                for scan in [bunch.precursor] + list(bunch.products):
+                    n_scans += 1
+                    n_points += len(scan.arrays.mz)
+            reader.close()
+        return n_scans, n_points
+
+
+class MzMLWritingCase(BenchmarkCase):
+    """Write the scan bunches of an mzML file with deconvoluted peak lists attached using
+    :meth:`MzMLSerializer.save_scan_bunch`.
+
+    The peak lists are synthetic so that the case does not depend on the speed of
+    deconvolution.
+    """
+
+    def __init__(self, name, path, peaks_per_scan=200, scale=1.0):
+        super(MzMLWritingCase, self).__init__(scale)
+        self.name = name
+        self.path = path
+        self.peaks_per_scan = peaks_per_scan
+        self.bunches = []
+        self.directory = None
+
+    def setup(self):
+        generator = SyntheticSpectrumGenerator(n_envelopes=self.peaks_per_scan)
+        reader = MzMLLoader(self.path)
+        for _ in range(self._scaled(1)):
+            reader.reset()
+            for bunch in reader:
+                for scan in [bunch.precursor] + list(bunch.products):
+                    scan.deconvoluted_peak_set = generator.deconvoluted()
+                self.bunches.append(bunch)
+        reader.close()
+        self.directory = tempfile.mkdtemp()
+
+    def run(self, state):
+        n_scans = 0
+        n_peaks = 0
+        path = os.path.join(self.directory, "benchmark.mzML")
+        with open(path, 'wb') as handle:
+            writer = MzMLSerializer(handle, n_spectra=len(self.bunches) * 10, deconvoluted=True,
+                                    sample_name="benchmark", build_extra_index=True)
+            for bunch in self.bunches:
+                writer.save_scan_bunch(bunch)
+                for scan in [bunch.precursor] + list(bunch.products):
+                    n_scans += 1
+                    n_peaks += len(scan.deconvoluted_peak_set)
+            writer.complete()
+        return n_scans, n_peaks
+
+    def teardown(self):
+        if self.directory is not None:
+            shutil.rmtree(self.directory, ignore_errors=True)
+
+
+class LCMSFeatureDeconvolutionCase(BenchmarkCase):
+    """Deconvolute the features of a synthetic LC-MS run with :class:`~.LCMSFeatureProcessor`"""
+
+    def __init__(self, name, n_envelopes=40, n_scans=60, scale=1.0):
+        super(LCMSFeatureDeconvolutionCase, self).__init__(scale)
+        self.name = name
+        self.n_envelopes = n_envelopes
+        self.n_scans = n_scans
+        self.feature_map = None
+        self.n_peaks = 0
+
+    def setup(self):
+        generator = SyntheticLCMSGenerator(
+            SyntheticSpectrumGenerator(n_envelopes=self._scaled(self.n_envelopes), seed=2),
+            n_scans=self.n_scans)
+        forest = LCMSFeatureForest(error_tolerance=2e-5)
+        for time, peaks in generator.scans():
+            for peak in peaks:
+                forest.handle_peak(peak, time)
+                self.n_peaks += 1
+        self.feature_map = forest
+
+    def run(self, state):
+        # The processor copies the features it is given, so the input is not consumed
+        processor = LCMSFeatureProcessor(self.feature_map, peptide, MSDeconVFitter(10.))
+        processor.deconvolute(maxiter=3)
+        return self.n_scans, self.n_peaks
+
+
+class _SyntheticScan(object):
+    def __init__(self, scan_time, peak_set):
+        self.scan_time = scan_time
+        self.peak_set = peak_set
+
+
+class StreamingFeatureForestCase(BenchmarkCase):
+    """Aggregate the peaks of a long synthetic LC-MS run into features with
+    :class:`~.StreamingLCMSFeatureForest`
+    """
+
+    def __init__(self, name, n_envelopes=400, n_scans=600, scale=1.0):
+        super(StreamingFeatureForestCase, self).__init__(scale)
+        self.name = name
+        self.n_envelopes = n_envelopes
+        self.n_scans = n_scans
+        self.scans = []
+
+    def setup(self):
+        n_scans = self._scaled(self.n_scans)
+        generator = SyntheticLCMSGenerator(
+            SyntheticSpectrumGenerator(n_envelopes=self._scaled(self.n_envelopes), seed=3),
+            n_scans=n_scans, time_range=(0., n_scans / 10.))
+        self.scans = [_SyntheticScan(time, peaks) for time, peaks in generator.scans()]
+
+    def run(self, state):
+        forest = StreamingLCMSFeatureForest(error_tolerance=2e-5, maximum_time_gap=0.25, minimum_intensity=0)
+        for _ in forest.extract_features(self.scans):
+            pass
+        return len(self.scans), forest.count
+
+
+def default_cases(scale=1.0):
+    """Build the standard set of benchmark cases
+
+    Parameters
+    ----------
+    scale : float, optional
+        A multiplier on the amount of work each case does
+
+    Returns
+    -------
+    list of :class:`BenchmarkCase`
+    """
+    high_charge = {3: 0.2, 4: 0.2, 5: 0.2, 6: 0.2, 7: 0.1, 8: 0.1}
+    return [
+        CentroidDeconvolutionCase(
+            "deconvolute_peaks.centroid.sparse", n_spectra=10, n_envelopes=50, scale=scale),
+        CentroidDeconvolutionCase(
+            "deconvolute_peaks.centroid.dense", n_spectra=2, n_envelopes=300, n_noise_peaks=300,
+            scale=scale),
+        ProfileDeconvolutionCase(
+            "deconvolute_peaks.profile", n_spectra=4, n_envelopes=100, n_noise_peaks=100, scale=scale),
+        GraphDeconvoluterCase(
+            "graph_deconvoluter.high_charge", n_spectra=4, n_envelopes=100, charge_weights=high_charge,
+            scale=scale),
+        MzMLIterationCase("mzml.iterate", datafile("small.mzML"), scale=scale),
+        MzMLWritingCase("mzml.write", datafile("small.mzML"), scale=scale),
+        StreamingFeatureForestCase("lcms_feature.streaming_forest", scale=scale),
+        LCMSFeatureDeconvolutionCase("lcms_feature.deconvolute", scale=scale),
+    ]
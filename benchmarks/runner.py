@@ -0,0 +1,388 @@
+'''Time benchmark cases, record their results and compare them against a baseline.
+
+Whether :mod:`ms_deisotope` uses its compiled ``_c`` extensions is decided when
+it is first imported, so each implementation is measured in its own
+interpreter. :func:`select_implementation` must be called before anything
+imports :mod:`ms_deisotope`, which is why this module only uses the standard
+library.
+'''
+import gc
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import traceback
+
+try:
+    import tracemalloc
+except ImportError:
+    # Python 2 cannot measure peak memory
+    tracemalloc = None
+
+from collections import OrderedDict
+from timeit import default_timer
+
+
+PURE_PYTHON = "python"
+COMPILED = "c"
+IMPLEMENTATIONS = (PURE_PYTHON, COMPILED)
+
+_EXTENSION_PACKAGE = "ms_deisotope._c"
+
+
+class _CompiledExtensionBlocker(object):
+    """A :data:`sys.meta_path` finder which makes every compiled extension module of
+    :mod:`ms_deisotope` fail to import, so that the pure Python fallbacks are used
+    """
+
+    def _check(self, fullname):
+        if fullname == _EXTENSION_PACKAGE or fullname.startswith(_EXTENSION_PACKAGE + "."):
+            raise ImportError("%s is disabled to benchmark the pure Python implementation" % fullname)
+
+    def find_spec(self, fullname, path=None, target=None):
+        self._check(fullname)
+        return None
+
+    def find_module(self, fullname, path=None):
+        self._check(fullname)
+        return None
+
+
+def has_compiled_extensions():
+    try:
+        import ms_deisotope._c.deconvoluter_base  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+
+def select_implementation(implementation):
+    """Make this interpreter use the given implementation of :mod:`ms_deisotope`.
+
+    Parameters
+    ----------
+    implementation : str
+        Either ``"python"`` or ``"c"``
+
+    Returns
+    -------
+    bool
+        Whether the implementation is available
+    """
+    if implementation == PURE_PYTHON:
+        if "ms_deisotope" in sys.modules:
+            raise RuntimeError("ms_deisotope was imported before the implementation was selected")
+        sys.meta_path.insert(0, _CompiledExtensionBlocker())
+        return True
+    elif implementation == COMPILED:
+        return has_compiled_extensions()
+    raise ValueError("Unknown implementation %r" % (implementation, ))
+
+
+class BenchmarkResult(object):
+    """The measurements of one benchmark case with one implementation.
+
+    Attributes
+    ----------
+    name : str
+        The name of the case
+    implementation : str
+        The implementation measured
+    times : list of float
+        The wall time of each timed run, in seconds
+    n_scans : int
+        The number of scans processed by each run
+    n_peaks : int
+        The number of peaks or data points processed by each run
+    peak_memory : int
+        The largest amount of memory allocated by Python during one run,
+        in bytes, or :const:`None` if it was not measured
+    error : str
+        The error raised by the case, if it could not be run
+    """
+
+    def __init__(self, name, implementation, times=None, n_scans=0, n_peaks=0, peak_memory=None,
+                 error=None):
+        self.name = name
+        self.implementation = implementation
+        self.times = list(times or [])
+        self.n_scans = n_scans
+        self.n_peaks = n_peaks
+        self.peak_memory = peak_memory
+        self.error = error
+
+    @property
+    def key(self):
+        return (self.name, self.implementation)
+
+    @property
+    def best_time(self):
+        if not self.times:
+            return None
+        return min(self.times)
+
+    @property
+    def median_time(self):
+        if not self.times:
+            return None
+        times = sorted(self.times)
+        n = len(times)
+        if n % 2:
+            return times[n // 2]
+        return (times[n // 2 - 1] + times[n // 2]) / 2.
+
+    def _rate(self, count):
+        best = self.best_time
+        if not best:
+            return None
+        return count / best
+
+    @property
+    def scans_per_second(self):
+        return self._rate(self.n_scans)
+
+    @property
+    def peaks_per_second(self):
+        return self._rate(self.n_peaks)
+
+    def to_dict(self):
+        return OrderedDict([
+            ("name", self.name),
+            ("implementation", self.implementation),
+            ("times", self.times),
+            ("best_time", self.best_time),
+            ("median_time", self.median_time),
+            ("n_scans", self.n_scans),
+            ("n_peaks", self.n_peaks),
+            ("scans_per_second", self.scans_per_second),
+            ("peaks_per_second", self.peaks_per_second),
+            ("peak_memory", self.peak_memory),
+            ("error", self.error),
+        ])
+
+    @classmethod
+    def from_dict(cls, state):
+        return cls(
+            state['name'], state['implementation'], state.get('times'), state.get('n_scans', 0),
+            state.get('n_peaks', 0), state.get('peak_memory'), state.get('error'))
+
+    def __repr__(self):
+        return "BenchmarkResult(%r, %r, best_time=%r)" % (self.name, self.implementation, self.best_time)
+
+
+def measure(case, implementation, repeat=3, measure_memory=True):
+    """Time `case`, after one untimed warm up run.
+
+    Parameters
+    ----------
+    case : :class:`~.BenchmarkCase`
+        The case to run
+    implementation : str
+        The implementation in use, to label the result with
+    repeat : int, optional
+        The number of timed runs
+    measure_memory : bool, optional
+        Whether to make one more run while tracing memory allocations.
+        This run is not timed, as tracing slows allocation down
+
+    Returns
+    -------
+    :class:`BenchmarkResult`
+    """
+    result = BenchmarkResult(case.name, implementation)
+    try:
+        case.setup()
+        case.run(case.prepare())
+        for _ in range(repeat):
+            state = case.prepare()
+            gc.collect()
+            start = default_timer()
+            result.n_scans, result.n_peaks = case.run(state)
+            result.times.append(default_timer() - start)
+        if measure_memory and tracemalloc is not None:
+            state = case.prepare()
+            gc.collect()
+            tracemalloc.start()
+            try:
+                case.run(state)
+                _, result.peak_memory = tracemalloc.get_traced_memory()
+            finally:
+                tracemalloc.stop()
+    except Exception:
+        result.error = traceback.format_exc()
+    finally:
+        case.teardown()
+    return result
+
+
+def environment_description(implementation=None):
+    description = OrderedDict([
+        ("date", time.strftime("%Y-%m-%dT%H:%M:%S")),
+        ("python", platform.python_version()),
+        ("platform", platform.platform()),
+    ])
+    if implementation is not None:
+        import numpy
+        import ms_deisotope
+        description['implementation'] = implementation
+        description['ms_deisotope'] = ms_deisotope.version
+        description['numpy'] = numpy.__version__
+    return description
+
+
+def run_in_process(implementation, repeat=3, pattern=None, scale=1.0, measure_memory=True,
+                   log=None):
+    """Run the benchmark cases in this interpreter, which must already be using
+    `implementation`, as chosen by :func:`select_implementation`.
+
+    Returns
+    -------
+    list of :class:`BenchmarkResult`
+    """
+    from .cases import default_cases
+    results = []
+    for case in default_cases(scale):
+        if pattern and pattern not in case.name:
+            continue
+        if log is not None:
+            log("Running %s (%s)" % (case.name, implementation))
+        results.append(measure(case, implementation, repeat, measure_memory))
+    return results
+
+
+def run_implementation(implementation, repeat=3, pattern=None, scale=1.0, measure_memory=True):
+    """Run the benchmark cases with `implementation` in a new interpreter.
+
+    Returns
+    -------
+    results : list of :class:`BenchmarkResult`
+    environment : dict
+        A description of the interpreter the cases ran in
+    """
+    handle, output_path = tempfile.mkstemp(suffix=".json")
+    os.close(handle)
+    command = [
+        sys.executable, "-m", "benchmarks", "worker", implementation,
+        output_path, "--repeat", str(repeat), "--scale", str(scale)]
+    if pattern:
+        command.extend(["--pattern", pattern])
+    if not measure_memory:
+        command.append("--no-memory")
+    try:
+        # Some of the code being measured prints progress messages, which would bury the report
+        with open(os.devnull, 'w') as devnull:
+            subprocess.check_call(command, stdout=devnull)
+        with open(output_path, 'rt') as handle:
+            state = json.load(handle)
+    finally:
+        os.remove(output_path)
+    return [BenchmarkResult.from_dict(r) for r in state['results']], state['environment']
+
+
+def save_results(path, results, environments=None):
+    state = OrderedDict([
+        ("environment", environment_description()),
+        ("implementations", environments or {}),
+        ("results", [result.to_dict() for result in results]),
+    ])
+    with open(path, 'wt') as handle:
+        json.dump(state, handle, indent=2)
+
+
+def load_results(path):
+    with open(path, 'rt') as handle:
+        state = json.load(handle)
+    return [BenchmarkResult.from_dict(r) for r in state['results']]
+
+
+class Comparison(object):
+    """How one result differs from its baseline.
+
+    Attributes
+    ----------
+    result : :class:`BenchmarkResult`
+    baseline : :class:`BenchmarkResult`
+    time_change : float
+        The relative change in the best time, positive when slower
+    memory_change : float
+        The relative change in peak memory, positive when larger
+    """
+
+    def __init__(self, result, baseline):
+        self.result = result
+        self.baseline = baseline
+        self.time_change = self._change(result.best_time, baseline.best_time)
+        self.memory_change = self._change(result.peak_memory, baseline.peak_memory)
+
+    @staticmethod
+    def _change(value, reference):
+        if value is None or not reference:
+            return None
+        return value / float(reference) - 1
+
+    def is_regression(self, threshold=0.1, memory_threshold=None):
+        if self.result.error and not self.baseline.error:
+            return True
+        if self.time_change is not None and self.time_change > threshold:
+            return True
+        if memory_threshold is not None and self.memory_change is not None and \
+                self.memory_change > memory_threshold:
+            return True
+        return False
+
+
+def compare(results, baseline):
+    """Match each result to the baseline result of the same case and implementation.
+
+    Returns
+    -------
+    list of :class:`Comparison`
+    """
+    index = {b.key: b for b in baseline}
+    return [Comparison(result, index[result.key]) for result in results if result.key in index]
+
+
+def _format_change(change):
+    if change is None:
+        return "-"
+    return "%+0.1f%%" % (change * 100, )
+
+
+def format_report(results, comparisons=None, threshold=0.1, memory_threshold=None):
+    """Render results, and their changes relative to a baseline, as a text table
+
+    Returns
+    -------
+    str
+    """
+    comparisons = {c.result.key: c for c in (comparisons or [])}
+    header = ["case", "impl", "best (s)", "scans/s", "peaks/s", "memory (MB)"]
+    if comparisons:
+        header.extend(["time", "memory", ""])
+    rows = [header]
+    failures = []
+    for result in results:
+        if result.error:
+            failures.append("%s (%s) failed: %s" % (
+                result.name, result.implementation, result.error.strip().splitlines()[-1]))
+            continue
+        row = [
+            result.name, result.implementation, "%0.4f" % result.best_time,
+            "%0.1f" % result.scans_per_second, "%0.1f" % result.peaks_per_second,
+            "-" if result.peak_memory is None else "%0.2f" % (result.peak_memory / 2. ** 20)]
+        if comparisons:
+            comparison = comparisons.get(result.key)
+            if comparison is None:
+                row.extend(["-", "-", "new"])
+            else:
+                row.extend([
+                    _format_change(comparison.time_change), _format_change(comparison.memory_change),
+                    "REGRESSION" if comparison.is_regression(threshold, memory_threshold) else ""])
+        rows.append(row)
+    widths = [max(len(row[i]) for row in rows) for i in range(len(header))]
+    lines = ["  ".join(cell.ljust(width) for cell, width in zip(row, widths)).rstrip() for row in rows]
+    lines.extend(failures)
+    return "\n".join(lines)
@@ -0,0 +1,264 @@
+'''Generate reproducible synthetic mass spectra and LC-MS runs to benchmark against.
+
+Every generator takes a ``seed`` so the same parameters always produce the same
+data, which keeps timings comparable between runs and between implementations.
+'''
+import random
+
+import numpy as np
+
+from ms_peak_picker import FittedPeak, PeakSet
+
+from ms_deisotope.averagine import peptide, mass_charge_ratio, PROTON
+from ms_deisotope.peak_set import DeconvolutedPeak, DeconvolutedPeakSet
+
+
+#: A charge state distribution resembling a tryptic digest
+TRYPTIC_CHARGE_WEIGHTS = {1: 0.1, 2: 0.45, 3: 0.3, 4: 0.1, 5: 0.05}
+
+
+class SyntheticEnvelope(object):
+    """The isotopic pattern of one synthetic analyte.
+
+    Attributes
+    ----------
+    neutral_mass : float
+        The monoisotopic neutral mass of the analyte
+    charge : int
+        The charge state the analyte was observed in
+    intensity : float
+        The total intensity of the isotopic pattern
+    """
+
+    __slots__ = ("neutral_mass", "charge", "intensity")
+
+    def __init__(self, neutral_mass, charge, intensity):
+        self.neutral_mass = neutral_mass
+        self.charge = charge
+        self.intensity = intensity
+
+    @property
+    def mz(self):
+        return mass_charge_ratio(self.neutral_mass, self.charge)
+
+    def theoretical_peaks(self, averagine=peptide, truncate_after=0.95):
+        """Get the (m/z, intensity) pairs of this envelope's isotopic peaks
+
+        Returns
+        -------
+        list of tuple
+        """
+        tid = averagine.isotopic_cluster(self.mz, self.charge, truncate_after=truncate_after)
+        return [(p.mz, p.intensity * self.intensity) for p in tid]
+
+    def __repr__(self):
+        return "SyntheticEnvelope(%0.4f, %d, %0.2f)" % (self.neutral_mass, self.charge, self.intensity)
+
+
+class SyntheticSpectrumGenerator(object):
+    """Generate mass spectra made of averagine isotopic patterns plus random noise peaks.
+
+    Attributes
+    ----------
+    n_envelopes : int
+        The number of isotopic patterns in each spectrum, which controls the peak density
+    mz_range : tuple of float
+        The m/z interval the monoisotopic peaks are drawn from
+    charge_weights : dict
+        A mapping from charge state to the relative frequency of that charge state
+    n_noise_peaks : int
+        The number of single, non-isotopic peaks to add to each spectrum
+    intensity_range : tuple of float
+        The interval envelope intensities are drawn from, log-uniformly
+    full_width_at_half_max : float
+        The width of each peak
+    averagine : :class:`~.Averagine`
+        The model used to produce isotopic patterns
+    random : :class:`random.Random`
+        The seeded source of randomness
+    """
+
+    def __init__(self, n_envelopes=100, mz_range=(400., 1600.), charge_weights=None, n_noise_peaks=0,
+                 intensity_range=(1e3, 1e6), full_width_at_half_max=0.01, averagine=peptide, seed=1):
+        if charge_weights is None:
+            charge_weights = TRYPTIC_CHARGE_WEIGHTS
+        self.n_envelopes = n_envelopes
+        self.mz_range = mz_range
+        self.charge_weights = dict(charge_weights)
+        self.n_noise_peaks = n_noise_peaks
+        self.intensity_range = intensity_range
+        self.full_width_at_half_max = full_width_at_half_max
+        self.averagine = averagine
+        self.random = random.Random(seed)
+
+    def _random_charge(self):
+        charges = sorted(self.charge_weights)
+        threshold = self.random.random() * sum(self.charge_weights.values())
+        total = 0
+        for charge in charges:
+            total += self.charge_weights[charge]
+            if threshold <= total:
+                return charge
+        return charges[-1]
+
+    def _random_intensity(self):
+        lo, hi = np.log10(self.intensity_range[0]), np.log10(self.intensity_range[1])
+        return 10 ** self.random.uniform(lo, hi)
+
+    def envelopes(self):
+        """Draw a new set of analytes
+
+        Returns
+        -------
+        list of :class:`SyntheticEnvelope`
+        """
+        result = []
+        for _ in range(self.n_envelopes):
+            charge = self._random_charge()
+            mz = self.random.uniform(*self.mz_range)
+            neutral_mass = (mz - PROTON) * charge
+            result.append(SyntheticEnvelope(neutral_mass, charge, self._random_intensity()))
+        return result
+
+    def _noise_points(self):
+        lo = self.intensity_range[0]
+        return [(self.random.uniform(*self.mz_range), self.random.uniform(lo / 2., lo * 5.))
+                for _ in range(self.n_noise_peaks)]
+
+    def points(self, envelopes=None):
+        """Get the (m/z, intensity) pairs of every peak in a spectrum, sorted by m/z
+
+        Parameters
+        ----------
+        envelopes : list of :class:`SyntheticEnvelope`, optional
+            The analytes to include. If omitted, new ones are drawn with :meth:`envelopes`
+
+        Returns
+        -------
+        list of tuple
+        """
+        if envelopes is None:
+            envelopes = self.envelopes()
+        points = []
+        for envelope in envelopes:
+            points.extend(envelope.theoretical_peaks(self.averagine))
+        points.extend(self._noise_points())
+        points.sort()
+        return points
+
+    def centroid(self, envelopes=None):
+        """Generate a centroided spectrum
+
+        Returns
+        -------
+        :class:`ms_peak_picker.PeakSet`
+        """
+        fwhm = self.full_width_at_half_max
+        peaks = [FittedPeak(mz, intensity, intensity / 100., i, i, fwhm, intensity * fwhm)
+                 for i, (mz, intensity) in enumerate(self.points(envelopes))]
+        peak_set = PeakSet(peaks)
+        peak_set.reindex()
+        return peak_set
+
+    def profile(self, envelopes=None, points_per_width=8):
+        """Generate a profile spectrum by summing a Gaussian peak shape for each peak,
+        sampled only near the peaks as instruments do.
+
+        Parameters
+        ----------
+        points_per_width : int, optional
+            The number of points sampled per full width at half max
+
+        Returns
+        -------
+        mz_array : :class:`np.ndarray`
+        intensity_array : :class:`np.ndarray`
+        """
+        points = self.points(envelopes)
+        fwhm = self.full_width_at_half_max
+        sigma = fwhm / 2.3548
+        span = np.arange(-4 * fwhm, 4 * fwhm, fwhm / points_per_width)
+        centers = np.array([p[0] for p in points])
+        mz_array = np.unique(np.round((centers[:, None] + span[None, :]).ravel(), 6))
+        intensity_array = np.zeros_like(mz_array)
+        for mz, intensity in points:
+            lo, hi = np.searchsorted(mz_array, (mz - 4 * fwhm, mz + 4 * fwhm))
+            window = mz_array[lo:hi]
+            intensity_array[lo:hi] += intensity * np.exp(-(window - mz) ** 2 / (2 * sigma ** 2))
+        return mz_array, intensity_array
+
+    def deconvoluted(self, envelopes=None):
+        """Generate a deconvoluted spectrum with one peak per analyte, as if it had been
+        perfectly deconvoluted
+
+        Returns
+        -------
+        :class:`~.DeconvolutedPeakSet`
+        """
+        if envelopes is None:
+            envelopes = self.envelopes()
+        peaks = []
+        for envelope in envelopes:
+            mass = envelope.neutral_mass
+            peaks.append(DeconvolutedPeak(
+                mass, envelope.intensity, envelope.charge, envelope.intensity / 100., -1,
+                self.full_width_at_half_max, score=100.0,
+                envelope=envelope.theoretical_peaks(self.averagine), mz=envelope.mz))
+        peak_set = DeconvolutedPeakSet(peaks)
+        peak_set.reindex()
+        return peak_set
+
+
+class SyntheticLCMSGenerator(object):
+    """Generate the centroided MS1 scans of an LC-MS run in which each analyte
+    elutes with a Gaussian chromatographic profile.
+
+    Attributes
+    ----------
+    spectrum_generator : :class:`SyntheticSpectrumGenerator`
+        Draws the analytes and their isotopic patterns
+    n_scans : int
+        The number of scans in the run
+    time_range : tuple of float
+        The time of the first and last scan, in minutes
+    peak_width : float
+        The standard deviation of each analyte's elution profile, in minutes
+    """
+
+    def __init__(self, spectrum_generator=None, n_scans=100, time_range=(0., 10.), peak_width=0.2):
+        if spectrum_generator is None:
+            spectrum_generator = SyntheticSpectrumGenerator()
+        self.spectrum_generator = spectrum_generator
+        self.n_scans = n_scans
+        self.time_range = time_range
+        self.peak_width = peak_width
+
+    def scans(self, minimum_abundance=0.01):
+        """Generate the run
+
+        Parameters
+        ----------
+        minimum_abundance : float, optional
+            Analytes are left out of a scan once their elution profile drops below
+            this fraction of its apex
+
+        Returns
+        -------
+        list of tuple
+            (scan time, :class:`ms_peak_picker.PeakSet`) pairs
+        """
+        generator = self.spectrum_generator
+        envelopes = generator.envelopes()
+        apexes = [generator.random.uniform(*self.time_range) for _ in envelopes]
+        times = np.linspace(self.time_range[0], self.time_range[1], self.n_scans)
+        result = []
+        for time in times:
+            present = []
+            for envelope, apex in zip(envelopes, apexes):
+                scale = np.exp(-(time - apex) ** 2 / (2 * self.peak_width ** 2))
+                if scale < minimum_abundance:
+                    continue
+                present.append(SyntheticEnvelope(
+                    envelope.neutral_mass, envelope.charge, envelope.intensity * scale))
+            result.append((float(time), generator.centroid(present)))
+        return result
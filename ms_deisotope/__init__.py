@@ -16,7 +16,9 @@ from .deconvolution import (
     CompositionListPeakDependenceGraphDeconvoluter,
     deconvolute_peaks)
 from .scoring import MSDeconVFitter, PenalizedMSDeconVFitter, DistinctPatternFitter, IsotopicFitRecord
-from .peak_set import DeconvolutedPeak, DeconvolutedPeakSet, DeconvolutedPeakSolution
+from .peak_set import (
+    DeconvolutedPeak, DeconvolutedPeakSet, DeconvolutedPeakSolution,
+    ColumnarDeconvolutedPeakSet)
 from .processor import ScanProcessor
 from .data_source import MzMLLoader, MzXMLLoader, MSFileLoader
 
@@ -36,6 +38,7 @@ __all__ = [
     "AveraginePeakDependenceGraphDeconvoluter", "CompositionListPeakDependenceGraphDeconvoluter",
     "MSDeconVFitter", "PenalizedMSDeconVFitter", "DistinctPatternFitter", "IsotopicFitRecord",
     "DeconvolutedPeak", "DeconvolutedPeakSet", "DeconvolutedPeakSolution",
+    "ColumnarDeconvolutedPeakSet",
     "MzMLLoader", "MzXMLLoader", "MSFileLoader", "ScanProcessor",
     "deconvolute_peaks", 'version'
 ]
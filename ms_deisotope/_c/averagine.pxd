@@ -76,7 +76,14 @@ cdef class AveragineCache(object):
         public Averagine averagine
         public double cache_truncation
         public bint enabled
-    
+        public object eviction_policy
+        public size_t hits
+        public size_t misses
+        public size_t evictions
+
+    cdef void _evict(self, object keys)
+    cpdef TheoreticalIsotopicPattern _cache_lookup(self, tuple key)
+    cpdef _cache_store(self, tuple key, TheoreticalIsotopicPattern tid)
     cdef TheoreticalIsotopicPattern has_mz_charge_pair(self, double mz, int charge=*, double charge_carrier=*, double truncate_after=*, double ignore_below=*)
     cpdef TheoreticalIsotopicPattern isotopic_cluster(self, double mz, int charge=*, double charge_carrier=*, double truncate_after=*, double ignore_below=*)
 
@@ -333,6 +333,11 @@ cdef class TheoreticalIsotopicPattern(object):
     def monoisotopic_mz(self):
         return self.get_monoisotopic_mz()
 
+    @property
+    def truncated_tid(self):
+        """The peaks which remain after truncation and thresholding"""
+        return self.get_processed_peaks()
+
     @cython.cdivision
     cpdef TheoreticalIsotopicPattern ignore_below(self, double ignore_below=0.0):
         """Discards peaks whose intensity is below ``ignore_below``.
@@ -687,9 +692,19 @@ cdef class AveragineCache(object):
         The averagine to use to generate new isotopic patterns
     cache_truncation : float
         Number of decimal places to round off the m/z for caching purposes
+    eviction_policy : :class:`~.CacheEvictionPolicy`
+        The policy deciding which cached patterns to discard to bound the size of
+        the cache. If :const:`None`, the cache grows without bound.
+    hits : int
+        The number of lookups answered from the cache
+    misses : int
+        The number of lookups which required a new pattern to be generated
+    evictions : int
+        The number of cached patterns discarded by :attr:`eviction_policy`
     """
 
-    def __init__(self, object averagine, object backend=None, double cache_truncation=1.):
+    def __init__(self, object averagine, object backend=None, double cache_truncation=1.,
+                 object eviction_policy=None):
         if backend is None:
             backend = {}
         self.backend = dict(backend)
@@ -700,18 +715,54 @@ cdef class AveragineCache(object):
             self.averagine = Averagine(averagine)
         self.cache_truncation = cache_truncation
         self.enabled = True
+        self.eviction_policy = eviction_policy
+        self.reset_statistics()
+        if eviction_policy is not None:
+            eviction_policy.clear()
+            for key, value in list(self.backend.items()):
+                self._evict(eviction_policy.admit(key, value))
 
     def __reduce__(self):
         return self.__class__, self.__getstate__()
 
     def __getstate__(self):
-        return self.averagine, self.backend, self.cache_truncation
+        return self.averagine, self.backend, self.cache_truncation, self.eviction_policy
 
     def __setstate__(self, state):
-        avg, store, trunc = state
+        avg, store, trunc, policy = state
         self.averagine = Averagine(avg)
-        self.store = dict(store)
+        self.backend = dict(store)
         self.cache_truncation = trunc
+        self.eviction_policy = policy
+
+    def reset_statistics(self):
+        """Reset :attr:`hits`, :attr:`misses` and :attr:`evictions` to zero
+        """
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    cdef void _evict(self, object keys):
+        for key in keys:
+            self.backend.pop(key, None)
+            self.evictions += 1
+
+    cpdef TheoreticalIsotopicPattern _cache_lookup(self, tuple key):
+        cdef:
+            PyObject* pvalue
+        pvalue = PyDict_GetItem(self.backend, key)
+        if pvalue == NULL:
+            self.misses += 1
+            return None
+        self.hits += 1
+        if self.eviction_policy is not None:
+            self.eviction_policy.touch(key)
+        return <TheoreticalIsotopicPattern>pvalue
+
+    cpdef _cache_store(self, tuple key, TheoreticalIsotopicPattern tid):
+        PyDict_SetItem(self.backend, key, tid)
+        if self.eviction_policy is not None:
+            self._evict(self.eviction_policy.admit(key, tid))
 
     @cython.cdivision
     cdef TheoreticalIsotopicPattern has_mz_charge_pair(self, double mz, int charge=1, double charge_carrier=PROTON, double truncate_after=0.95,
@@ -719,7 +770,6 @@ cdef class AveragineCache(object):
         cdef:
             double key_mz
             tuple cache_key
-            PyObject* pvalue
             TheoreticalIsotopicPattern tid
         if self.enabled:
             if self.cache_truncation == 0.0:
@@ -732,13 +782,12 @@ cdef class AveragineCache(object):
             # its own hash value without invoking any Python operations turns out to be just a bit slower
             # than the bare tuple itself.
             cache_key = (key_mz, charge, charge_carrier, truncate_after)
-            pvalue = PyDict_GetItem(self.backend, cache_key)
-            if pvalue == NULL:
+            tid = self._cache_lookup(cache_key)
+            if tid is None:
                 tid = self.averagine._isotopic_cluster(mz, charge, charge_carrier, truncate_after)
-                PyDict_SetItem(self.backend, cache_key, tid.clone())
+                self._cache_store(cache_key, tid.clone())
                 return tid
             else:
-                tid = <TheoreticalIsotopicPattern>pvalue
                 tid = tid.clone_shift(mz)
                 return tid
         else:
@@ -796,6 +845,8 @@ cdef class AveragineCache(object):
 
     def clear(self):
         self.backend.clear()
+        if self.eviction_policy is not None:
+            self.eviction_policy.clear()
 
 
 cdef double _neutron_shift
@@ -8,6 +8,7 @@ cdef class LCMSFeatureMap(object):
 
     cpdef list _find_all(self, double mz, double error_tolerance)
     cpdef LCMSFeature _search(self, double mz, double error_tolerance)
+    cdef object _mz_array(self)
 
 cpdef tuple binary_search_with_flag(list array, double mz, double error_tolerance)
 cdef long binary_search(list array, double mz, double error_tolerance)
@@ -5,6 +5,11 @@ cimport cython
 from ms_deisotope._c.feature_map.lcms_feature cimport LCMSFeature
 from cpython.list cimport PyList_GET_SIZE, PyList_GET_ITEM, PyList_GetSlice
 
+import numpy as np
+
+from ms_deisotope.utils import ppm_search_intervals, ppm_search_nearest
+from ms_deisotope.feature_map.spatial_index import PackedRTree
+
 
 cdef class LCMSFeatureMap(object):
     def __init__(self, features):
@@ -69,6 +74,91 @@ cdef class LCMSFeatureMap(object):
             lo_ix = len(self) - 1
         return self[lo_ix:hi_ix]
 
+    cdef object _mz_array(self):
+        cdef:
+            size_t i, n
+            LCMSFeature feature
+        n = PyList_GET_SIZE(self.features)
+        out = np.empty(n, dtype=np.float64)
+        for i in range(n):
+            feature = <LCMSFeature>PyList_GET_ITEM(self.features, i)
+            out[i] = feature.get_mz()
+        return out
+
+    def search_intervals(self, mzs, double error_tolerance=2e-5):
+        """Find the range of features matching each of `mzs` within `error_tolerance`
+        PPM error, searching for all of them at once.
+
+        Parameters
+        ----------
+        mzs : array-like
+            The m/z values to search for
+        error_tolerance : float, optional
+            The PPM error tolerance to use
+
+        Returns
+        -------
+        starts : np.ndarray
+            The position of the first matching feature for each query
+        ends : np.ndarray
+            One past the position of the last matching feature for each query
+        """
+        return ppm_search_intervals(self._mz_array(), mzs, error_tolerance)
+
+    def search_many(self, mzs, double error_tolerance=2e-5):
+        """Find the feature nearest to each of `mzs` within `error_tolerance` PPM error.
+
+        Parameters
+        ----------
+        mzs : array-like
+            The m/z values to search for
+        error_tolerance : float, optional
+            The PPM error tolerance to use
+
+        Returns
+        -------
+        list
+            The best matching feature for each query, or :const:`None`
+        """
+        indices = ppm_search_nearest(self._mz_array(), mzs, error_tolerance)
+        return [self.features[i] if i >= 0 else None for i in indices.tolist()]
+
+    def find_all_many(self, mzs, double error_tolerance=2e-5):
+        """Find all features matching each of `mzs` within `error_tolerance` PPM error.
+
+        Parameters
+        ----------
+        mzs : array-like
+            The m/z values to search for
+        error_tolerance : float, optional
+            The PPM error tolerance to use
+
+        Returns
+        -------
+        list of list
+            The matching features for each query
+        """
+        starts, ends = self.search_intervals(mzs, error_tolerance)
+        return [<list>PyList_GetSlice(self.features, i, j)
+                for i, j in zip(starts.tolist(), ends.tolist())]
+
+    def build_spatial_index(self, node_size=16):
+        """Build a :class:`~.PackedRTree` over the m/z and elution time range of the
+        features, to search both dimensions at once.
+
+        The index is not updated when the features change.
+
+        Parameters
+        ----------
+        node_size : int, optional
+            The largest number of children of each node of the tree
+
+        Returns
+        -------
+        :class:`~.PackedRTree`
+        """
+        return PackedRTree.from_features(self.features, use_mz=True, node_size=node_size)
+
     def __repr__(self):
         return "{self.__class__.__name__}(<{size} features>)".format(self=self, size=len(self))
 
@@ -120,9 +120,9 @@ cdef class DependenceCluster(SpanningMixin):
         self.dependencies.sort(reverse=self.maximize)
         self._reset()
 
-    cpdef list disjoint_subset(self):
+    cpdef list disjoint_subset(self, method="greedy"):
         graph = self.build_graph()
-        return graph.find_heaviest_path()
+        return graph.find_heaviest_path(method)
 
     cpdef ConnectedSubgraph build_graph(self):
         graph = ConnectedSubgraph(self.dependencies, maximize=self.maximize)
@@ -139,15 +139,20 @@ cdef class DependenceCluster(SpanningMixin):
         """
         return self.dependencies[0]
 
-    cpdef list disjoint_best_fits(self):
+    cpdef list disjoint_best_fits(self, method="greedy"):
         """
         Compute the best set of disjoint isotopic fits spanning this cluster
 
+        Parameters
+        ----------
+        method : str, optional
+            The subgraph solver to use, as in :meth:`~.ConnectedSubgraph.find_heaviest_path`
+
         Returns
         -------
         list of IsotopicFitRecord
         """
-        fit_sets = tuple(self.disjoint_subset())
+        fit_sets = tuple(self.disjoint_subset(method))
         best_fits = fit_sets
         return [node.fit for node in best_fits]
 
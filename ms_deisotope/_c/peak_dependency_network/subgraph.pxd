@@ -10,9 +10,12 @@ cdef class FitNode(SpanningMixin):
     cdef:
         public size_t index
         public IsotopicFitRecord fit
-        public set edges
+        public set _edges
         public set overlap_edges
+        public tuple members
         public set peak_indices
+        public long peak_offset
+        public object peak_mask
         public long _hash
         public double score
 
@@ -14,8 +14,9 @@ cdef class FitNode(SpanningMixin):
     def __init__(self, IsotopicFitRecord fit, size_t index=-1):
         self.index = index
         self.fit = fit
-        self.edges = set()
+        self._edges = set()
         self.overlap_edges = set()
+        self.members = None
         self.peak_indices = set()
         self._hash = hash(fit)
         self.score = fit.score
@@ -28,8 +29,9 @@ cdef class FitNode(SpanningMixin):
         node = FitNode.__new__(FitNode)
         node.index = index
         node.fit = fit
-        node.edges = set()
+        node._edges = set()
         node.overlap_edges = set()
+        node.members = None
         node.peak_indices = set()
         node._hash = hash(fit)
         node.score = fit.score
@@ -39,13 +41,27 @@ cdef class FitNode(SpanningMixin):
     cdef void _init_fields(self, list experimental):
         cdef:
             size_t i, n
+            long offset
             FittedPeak peak
+            object mask, one
         n = PyList_Size(experimental)
+        offset = -1
         for i in range(n):
             # Placeholder Peaks have a peak_count of -1
             peak = <FittedPeak>PyList_GetItem(experimental, i)
             if peak.peak_count >= 0:
                 PySet_Add(self.peak_indices, peak)
+                if offset == -1 or peak.peak_count < offset:
+                    offset = peak.peak_count
+        mask = 0
+        # Shift a Python integer, which does not overflow for wide masks
+        one = 1
+        for i in range(n):
+            peak = <FittedPeak>PyList_GetItem(experimental, i)
+            if peak.peak_count >= 0:
+                mask |= one << (peak.peak_count - offset)
+        self.peak_offset = offset if offset != -1 else 0
+        self.peak_mask = mask
         if n > 0:
             self.end = peak.mz
             self.start = (<FittedPeak>PyList_GetItem(experimental, 0)).mz
@@ -68,13 +84,47 @@ cdef class FitNode(SpanningMixin):
     def __ne__(self, FitNode other):
         return self.fit is not other.fit
 
+    @property
+    def edges(self):
+        """The nodes sharing no peaks with this node.
+
+        Once this node belongs to a :class:`ConnectedSubgraph`, this is every other
+        node in :attr:`members` not in :attr:`overlap_edges`. It is built each time it
+        is requested rather than stored, as nearly every pair of nodes of a large graph
+        is disjoint.
+        """
+        cdef:
+            set edges
+            size_t i, n
+            FitNode node
+        if self.members is None:
+            return self._edges
+        edges = set()
+        n = PyTuple_Size(self.members)
+        for i in range(n):
+            node = <FitNode>PyTuple_GetItem(self.members, i)
+            if node is not self and node not in self.overlap_edges:
+                PySet_Add(edges, node)
+        return edges
+
     cpdef bint isdisjoint(self, FitNode other):
-        return self.peak_indices.isdisjoint(other.peak_indices)
+        cdef:
+            long shift
+        if self.peak_offset <= other.peak_offset:
+            shift = other.peak_offset - self.peak_offset
+            if shift >= self.peak_mask.bit_length():
+                return True
+            return not ((self.peak_mask >> shift) & other.peak_mask)
+        else:
+            shift = self.peak_offset - other.peak_offset
+            if shift >= other.peak_mask.bit_length():
+                return True
+            return not ((other.peak_mask >> shift) & self.peak_mask)
 
     cpdef visit(self, FitNode other):
         if self.isdisjoint(other):
-            PySet_Add(self.edges, other)
-            PySet_Add(other.edges, self)
+            PySet_Add(self._edges, other)
+            PySet_Add(other._edges, self)
         else:
             PySet_Add(self.overlap_edges, other)
             PySet_Add(other.overlap_edges, self)
@@ -89,7 +139,7 @@ cpdef bint span_overlap(FitNode a, FitNode b):
 
 
 cpdef bint peak_overlap(FitNode a, FitNode b):
-    return len(a.peak_indices & b.peak_indices) > 0
+    return not a.isdisjoint(b)
 
 
 @cython.nonecheck(False)
@@ -152,6 +202,10 @@ cdef class GreedySubgraphSelection(object):
         return self._select_best_subset()
 
 
+def _node_span(FitNode node):
+    return node.start, node.end
+
+
 @cython.freelist(5)
 cdef class ConnectedSubgraph(object):
     def __init__(self, object fits, bint maximize=True):
@@ -175,16 +229,25 @@ cdef class ConnectedSubgraph(object):
         cdef:
             size_t i, j, n
             FitNode node, other
+            list nodes
 
-        n = PyTuple_Size(self.nodes)
+        # Two nodes can only share a peak if their m/z spans overlap, so sweeping
+        # over the nodes in order of their start, each node need only visit the
+        # nodes starting before it ends. Every pair skipped is disjoint. Only the
+        # overlapping pairs are stored, the disjoint pairs are implied by them.
+        nodes = sorted(self.nodes, key=_node_span)
+        n = PyList_Size(nodes)
 
         for i in range(n):
-            node = <FitNode>PyTuple_GetItem(self.nodes, i)
-            for j in range(n):
-                if i == j:
-                    continue
-                other = <FitNode>PyTuple_GetItem(self.nodes, j)
-                node.visit(other)
+            node = <FitNode>PyList_GetItem(nodes, i)
+            node.members = self.nodes
+            for j in range(i + 1, n):
+                other = <FitNode>PyList_GetItem(nodes, j)
+                if other.start > node.end:
+                    break
+                if not node.isdisjoint(other):
+                    PySet_Add(node.overlap_edges, other)
+                    PySet_Add(other.overlap_edges, node)
 
     def __getitem__(self, i):
         return self.nodes[i]
@@ -203,5 +266,11 @@ cdef class ConnectedSubgraph(object):
         if method == "greedy":
             solution = GreedySubgraphSelection(self, maximize=self.maximize)
             return solution.select()
+        elif method == "interval":
+            from ms_deisotope.peak_dependency_network.subgraph import IntervalSchedulingSelection
+            return IntervalSchedulingSelection.solve(tuple(self), maximize=self.maximize)
+        elif method == "branch_and_bound":
+            from ms_deisotope.peak_dependency_network.subgraph import BranchAndBoundSelection
+            return BranchAndBoundSelection.solve(tuple(self), maximize=self.maximize)
         else:
             raise NotImplementedError(method)
@@ -11,8 +11,11 @@ from libc.stdlib cimport malloc, free
 from ms_deisotope._c.averagine cimport mass_charge_ratio
 from ms_peak_picker._c.peak_set cimport PeakBase
 
+import numpy as np
 cimport numpy as np
 
+from ms_deisotope.utils import ppm_search_intervals, ppm_search_nearest
+
 np.import_array()
 
 
@@ -600,6 +603,82 @@ cdef class DeconvolutedPeakSet:
 
         return self.__class__(acc).reindex()
 
+    def _search_array(self, bint use_mz=False):
+        if not self.indexed:
+            self.reindex()
+        if use_mz:
+            return np.array([p.mz for p in self._mz_ordered], dtype=np.float64)
+        return np.array([p.neutral_mass for p in self.peaks], dtype=np.float64)
+
+    def search_intervals(self, neutral_masses, double error_tolerance=1e-5, bint use_mz=False):
+        """Find the range of peaks matching each of `neutral_masses` within `error_tolerance`
+        PPM error, searching for all of them at once.
+
+        If ``use_mz`` is :const:`True`, the ranges are positions in the m/z ordering
+        instead of the neutral mass ordering.
+
+        Parameters
+        ----------
+        neutral_masses : array-like
+            The masses to search for
+        error_tolerance : float
+            The PPM error tolerance to apply
+        use_mz : bool
+            Whether to search using m/z instead of neutral mass
+
+        Returns
+        -------
+        starts : np.ndarray
+            The position of the first matching peak for each query
+        ends : np.ndarray
+            One past the position of the last matching peak for each query
+        """
+        return ppm_search_intervals(
+            self._search_array(use_mz), neutral_masses, error_tolerance, strict=True)
+
+    def has_peaks(self, neutral_masses, double error_tolerance=1e-5, bint use_mz=False):
+        """Find the peak that best matches each of `neutral_masses` within `error_tolerance`
+        PPM error, searching for all of them at once.
+
+        Parameters
+        ----------
+        neutral_masses : array-like
+            The masses to search for
+        error_tolerance : float
+            The PPM error tolerance to apply
+        use_mz : bool
+            Whether to search using m/z instead of neutral mass
+
+        Returns
+        -------
+        list
+            The best matching :class:`DeconvolutedPeak` for each query, or :const:`None`
+        """
+        indices = ppm_search_nearest(
+            self._search_array(use_mz), neutral_masses, error_tolerance, strict=True)
+        ordered = self._mz_ordered if use_mz else self.peaks
+        return [ordered[i] if i >= 0 else None for i in indices.tolist()]
+
+    def all_peaks_for_many(self, neutral_masses, double tolerance=1e-5):
+        """Find all peaks that match each of `neutral_masses` within `tolerance`
+        PPM error, searching for all of them at once.
+
+        Parameters
+        ----------
+        neutral_masses : array-like
+            The masses to search for
+        tolerance : float
+            The PPM error tolerance to apply
+
+        Returns
+        -------
+        list of tuple of DeconvolutedPeak
+            The matching peaks for each query
+        """
+        starts, ends = self.search_intervals(neutral_masses, tolerance)
+        return [<tuple>PyTuple_GetSlice(self.peaks, i, j)
+                for i, j in zip(starts.tolist(), ends.tolist())]
+
 cdef double INF
 INF = float('inf')
 
@@ -1096,6 +1175,20 @@ cdef class DeconvolutedPeakSetIndexed(DeconvolutedPeakSet):
         cell = self.interval_index.index[i]
         return cell
 
+    def _search_array(self, bint use_mz=False):
+        cdef:
+            size_t i
+            np.ndarray[double, ndim=1] out
+        if not self.indexed:
+            self.reindex()
+        out = np.empty(self._size, dtype=np.float64)
+        for i in range(self._size):
+            if use_mz:
+                out[i] = self.mz_array[i]
+            else:
+                out[i] = self.neutral_mass_array[i]
+        return out
+
 
 
 cdef int _binary_search_with_hint(double* array, double target, double error_tolerance, size_t n, size_t hint, size_t* out) nogil:
@@ -1,6 +1,12 @@
 # -*- coding: utf-8 -*-
 
-from collections import defaultdict
+import json
+import sys
+
+from collections import defaultdict, OrderedDict
+
+import numpy as np
+
 from brainpy import (
     calculate_mass, neutral_mass, PROTON,
     isotopic_variants, mass_charge_ratio)
@@ -146,6 +152,11 @@ class TheoreticalIsotopicPattern(object):
     def monoisotopic_mz(self):
         return self.origin
 
+    @property
+    def truncated_tid(self):
+        """The peaks which remain after truncation and thresholding"""
+        return self.peaklist
+
     def __repr__(self):
         return "TheoreticalIsotopicPattern(%0.4f, charge=%d, (%s))" % (
             self.monoisotopic_mz,
@@ -402,6 +413,216 @@ def isotopic_shift(charge=1):
     return _neutron_shift / float(charge)
 
 
+class CacheEvictionPolicy(object):
+    """Decides which entries an :class:`AveragineCache` should discard to stay
+    within a budget.
+
+    The cache informs the policy each time an entry is read with :meth:`touch`
+    and each time a new entry is stored with :meth:`admit`, which returns the keys
+    of the entries which must be removed to make room for it.
+    """
+
+    def touch(self, key):
+        """Record that the entry for `key` was read from the cache
+
+        Parameters
+        ----------
+        key : tuple
+            The cache key
+        """
+        raise NotImplementedError()
+
+    def admit(self, key, value):
+        """Record that `value` was stored under `key` in the cache
+
+        Parameters
+        ----------
+        key : tuple
+            The cache key
+        value : :class:`TheoreticalIsotopicPattern`
+            The cached value
+
+        Returns
+        -------
+        list
+            The keys of entries to evict from the cache
+        """
+        raise NotImplementedError()
+
+    def clear(self):
+        """Forget all tracked entries
+        """
+        raise NotImplementedError()
+
+    def __len__(self):
+        raise NotImplementedError()
+
+    def __repr__(self):
+        return "%s(%r)" % (self.__class__.__name__, self.budget)
+
+
+class LRUEvictionPolicy(CacheEvictionPolicy):
+    """Evict the least recently used entries once more than :attr:`max_entries`
+    entries are cached.
+
+    Attributes
+    ----------
+    max_entries : int
+        The maximum number of entries to keep
+    """
+
+    def __init__(self, max_entries=10000):
+        self.max_entries = max_entries
+        self.order = OrderedDict()
+
+    @property
+    def budget(self):
+        return self.max_entries
+
+    def __len__(self):
+        return len(self.order)
+
+    def __reduce__(self):
+        return self.__class__, (self.max_entries, )
+
+    def touch(self, key):
+        self.order[key] = self.order.pop(key)
+
+    def admit(self, key, value):
+        self.order[key] = None
+        evicted = []
+        while len(self.order) > self.max_entries:
+            evicted.append(self.order.popitem(last=False)[0])
+        return evicted
+
+    def clear(self):
+        self.order.clear()
+
+
+def isotopic_pattern_size(tid):
+    """Estimate the number of bytes of memory used by a :class:`TheoreticalIsotopicPattern`
+
+    Parameters
+    ----------
+    tid : :class:`TheoreticalIsotopicPattern`
+        The isotopic pattern to measure
+
+    Returns
+    -------
+    int
+    """
+    return sys.getsizeof(tid) + sys.getsizeof(tid.peaklist) + sum(map(sys.getsizeof, tid.peaklist))
+
+
+class SizeEvictionPolicy(CacheEvictionPolicy):
+    """Evict the least recently used entries once the cached isotopic patterns
+    are estimated to use more than :attr:`max_bytes` bytes of memory.
+
+    Attributes
+    ----------
+    max_bytes : int
+        The maximum number of bytes the cached values may occupy
+    total_bytes : int
+        The estimated number of bytes the cached values currently occupy
+    """
+
+    def __init__(self, max_bytes=2 ** 26):
+        self.max_bytes = max_bytes
+        self.order = OrderedDict()
+        self.total_bytes = 0
+
+    @property
+    def budget(self):
+        return self.max_bytes
+
+    def __len__(self):
+        return len(self.order)
+
+    def __reduce__(self):
+        return self.__class__, (self.max_bytes, )
+
+    def touch(self, key):
+        self.order[key] = self.order.pop(key)
+
+    def admit(self, key, value):
+        size = isotopic_pattern_size(value)
+        self.total_bytes += size - self.order.pop(key, 0)
+        self.order[key] = size
+        evicted = []
+        while self.total_bytes > self.max_bytes and self.order:
+            evicted_key, evicted_size = self.order.popitem(last=False)
+            self.total_bytes -= evicted_size
+            evicted.append(evicted_key)
+        return evicted
+
+    def clear(self):
+        self.order.clear()
+        self.total_bytes = 0
+
+
+class LFUEvictionPolicy(CacheEvictionPolicy):
+    """Evict the least frequently used entries once more than :attr:`max_entries`
+    entries are cached, breaking ties by evicting the least recently used entry.
+
+    Entries are grouped into buckets by their use count so that both reads and
+    evictions take constant time.
+
+    Attributes
+    ----------
+    max_entries : int
+        The maximum number of entries to keep
+    """
+
+    def __init__(self, max_entries=10000):
+        self.max_entries = max_entries
+        self.counts = {}
+        self.buckets = defaultdict(OrderedDict)
+        self.minimum_count = 0
+
+    @property
+    def budget(self):
+        return self.max_entries
+
+    def __len__(self):
+        return len(self.counts)
+
+    def __reduce__(self):
+        return self.__class__, (self.max_entries, )
+
+    def touch(self, key):
+        count = self.counts[key]
+        bucket = self.buckets[count]
+        del bucket[key]
+        if not bucket:
+            del self.buckets[count]
+            if self.minimum_count == count:
+                self.minimum_count = count + 1
+        self.counts[key] = count + 1
+        self.buckets[count + 1][key] = None
+
+    def admit(self, key, value):
+        if key in self.counts:
+            self.touch(key)
+            return []
+        evicted = []
+        while len(self.counts) >= self.max_entries:
+            bucket = self.buckets[self.minimum_count]
+            evicted_key = bucket.popitem(last=False)[0]
+            if not bucket:
+                del self.buckets[self.minimum_count]
+            del self.counts[evicted_key]
+            evicted.append(evicted_key)
+        self.counts[key] = 1
+        self.buckets[1][key] = None
+        self.minimum_count = 1
+        return evicted
+
+    def clear(self):
+        self.counts.clear()
+        self.buckets.clear()
+        self.minimum_count = 0
+
+
 @dict_proxy("averagine")
 class AveragineCache(object):
     """A wrapper around a :class:`Averagine` instance which will cache isotopic patterns
@@ -413,26 +634,71 @@ class AveragineCache(object):
         The averagine to use to generate new isotopic patterns
     cache_truncation : float
         Number of decimal places to round off the m/z for caching purposes
+    eviction_policy : :class:`CacheEvictionPolicy`
+        The policy deciding which cached patterns to discard to bound the size of
+        the cache. If :const:`None`, the cache grows without bound.
+    hits : int
+        The number of lookups answered from the cache
+    misses : int
+        The number of lookups which required a new pattern to be generated
+    evictions : int
+        The number of cached patterns discarded by :attr:`eviction_policy`
     """
 
-    def __init__(self, averagine, backend=None, cache_truncation=1.0):
+    def __init__(self, averagine, backend=None, cache_truncation=1.0, eviction_policy=None):
         if backend is None:
             backend = {}
         self.backend = backend
         self.averagine = Averagine(averagine)
         self.cache_truncation = cache_truncation
+        self.eviction_policy = eviction_policy
+        self.reset_statistics()
+        if eviction_policy is not None:
+            eviction_policy.clear()
+            for key, value in list(backend.items()):
+                self._evict(eviction_policy.admit(key, value))
+
+    def reset_statistics(self):
+        """Reset :attr:`hits`, :attr:`misses` and :attr:`evictions` to zero
+        """
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _evict(self, keys):
+        for key in keys:
+            self.backend.pop(key, None)
+            self.evictions += 1
+
+    def _cache_lookup(self, key):
+        try:
+            tid = self.backend[key]
+        except KeyError:
+            self.misses += 1
+            return None
+        self.hits += 1
+        if self.eviction_policy is not None:
+            self.eviction_policy.touch(key)
+        return tid
+
+    def _cache_store(self, key, tid):
+        self.backend[key] = tid
+        if self.eviction_policy is not None:
+            self._evict(self.eviction_policy.admit(key, tid))
 
     def has_mz_charge_pair(self, mz, charge=1, charge_carrier=PROTON, truncate_after=0.95, ignore_below=0.0):
         if self.cache_truncation == 0.0:
             key_mz = mz
         else:
             key_mz = round(mz / self.cache_truncation) * self.cache_truncation
-        if (key_mz, charge, charge_carrier) in self.backend:
-            return self.backend[key_mz, charge, charge_carrier].clone().shift(mz)
+        key = (key_mz, charge, charge_carrier)
+        tid = self._cache_lookup(key)
+        if tid is not None:
+            return tid.clone().shift(mz)
         else:
             tid = self.averagine.isotopic_cluster(
                 mz, charge, charge_carrier, truncate_after, ignore_below)
-            self.backend[key_mz, charge, charge_carrier] = tid.clone()
+            self._cache_store(key, tid.clone())
             return tid
 
     def isotopic_cluster(self, mz, charge=1, charge_carrier=PROTON, truncate_after=0.95, ignore_below=0.0):
@@ -469,6 +735,8 @@ class AveragineCache(object):
 
     def clear(self):
         self.backend.clear()
+        if self.eviction_policy is not None:
+            self.eviction_policy.clear()
 
 
 try:
@@ -477,3 +745,292 @@ try:
     from ms_deisotope._c.averagine import AveragineCache, isotopic_shift
 except ImportError:
     pass
+
+
+try:
+    from brainpy._c.isotopic_distribution import TheoreticalPeak as _TheoreticalPeak
+except ImportError:
+    from brainpy import Peak as _TheoreticalPeak
+
+
+class AveragineTable(object):
+    """A precomputed table of the isotopic patterns an :class:`Averagine` produces over
+    a range of neutral masses, sampled at evenly spaced mass bins.
+
+    Each row holds the untruncated pattern for one mass bin as the abundance of each
+    isotopic peak and its mass offset from the monoisotopic peak. Because the offsets
+    are neutral masses, a single table covers every charge state. A pattern for an
+    arbitrary m/z is looked up in constant time by interpolating between the two
+    bins neighboring its neutral mass and shifting the result to the query m/z.
+
+    Tables can be written to disk with :meth:`save` and loaded with :meth:`load`.
+    When memory-mapped, the pages holding the table are shared read-only by every
+    process which loads the same file.
+
+    Attributes
+    ----------
+    averagine : :class:`Averagine`
+        The isotopic model the table was built from
+    intensities : :class:`np.ndarray`
+        The abundance of each isotopic peak for each mass bin, padded with zeros
+    offsets : :class:`np.ndarray`
+        The mass of each isotopic peak minus the monoisotopic mass for each mass bin
+    minimum_mass : float
+        The neutral mass of the first bin
+    mass_step : float
+        The distance between consecutive bins
+    path : str or :const:`None`
+        The file the table was loaded from, if any
+    """
+
+    def __init__(self, averagine, intensities, offsets, minimum_mass, mass_step, path=None):
+        self.averagine = Averagine(averagine)
+        self.intensities = intensities
+        self.offsets = offsets
+        self.minimum_mass = float(minimum_mass)
+        self.mass_step = float(mass_step)
+        self.path = path
+
+    @property
+    def maximum_mass(self):
+        return self.minimum_mass + (len(self) - 1) * self.mass_step
+
+    def __len__(self):
+        return self.intensities.shape[0]
+
+    def __repr__(self):
+        return "%s(%r, %0.2f-%0.2f, step=%0.3f)" % (
+            self.__class__.__name__, self.averagine, self.minimum_mass,
+            self.maximum_mass, self.mass_step)
+
+    def __reduce__(self):
+        # Avoid copying a memory-mapped table through a pickle, instead letting the
+        # receiving process map the same file.
+        if self.path is not None:
+            return self.load, (self.path, )
+        return self.__class__, (self.averagine, self.intensities, self.offsets,
+                                self.minimum_mass, self.mass_step)
+
+    @classmethod
+    def build(cls, averagine, minimum_mass=50.0, maximum_mass=20000.0, mass_step=1.0):
+        """Compute the isotopic pattern of `averagine` at every mass bin from
+        `minimum_mass` to `maximum_mass`.
+
+        Parameters
+        ----------
+        averagine : :class:`Averagine` or :class:`Mapping`
+            The isotopic model to tabulate
+        minimum_mass : float, optional
+            The smallest neutral mass to cover
+        maximum_mass : float, optional
+            The largest neutral mass to cover
+        mass_step : float, optional
+            The distance between consecutive bins
+
+        Returns
+        -------
+        :class:`AveragineTable`
+        """
+        averagine = Averagine(averagine)
+        masses = np.arange(minimum_mass, maximum_mass + mass_step, mass_step)
+        rows = []
+        width = 0
+        for mass in masses:
+            composition = averagine.scale(mass_charge_ratio(mass, 1, PROTON), 1, PROTON)
+            peaks = isotopic_variants(composition, charge=0)
+            monoisotopic_mass = peaks[0].mz
+            rows.append([(p.intensity, p.mz - monoisotopic_mass) for p in peaks])
+            width = max(width, len(peaks))
+        intensities = np.zeros((len(rows), width))
+        offsets = np.zeros((len(rows), width))
+        for i, row in enumerate(rows):
+            for j, (intensity, offset) in enumerate(row):
+                intensities[i, j] = intensity
+                offsets[i, j] = offset
+            # Extend the offsets past the end of the pattern so that interpolating
+            # against a longer neighboring pattern stays on the isotopic ladder
+            for j in range(len(row), width):
+                offsets[i, j] = offsets[i, j - 1] + _neutron_shift
+        return cls(averagine, intensities, offsets, masses[0], mass_step)
+
+    def save(self, path):
+        """Write the table to `path` as a NumPy array file, with its parameters
+        stored alongside it in ``path + ".json"``.
+
+        Parameters
+        ----------
+        path : str
+            The path to write to
+        """
+        with open(path, 'wb') as fh:
+            np.save(fh, np.stack([self.intensities, self.offsets]))
+        with open(path + ".json", 'wt') as fh:
+            json.dump({
+                "averagine": dict(self.averagine.base_composition),
+                "minimum_mass": self.minimum_mass,
+                "mass_step": self.mass_step,
+            }, fh, sort_keys=True, indent=2)
+        self.path = path
+
+    @classmethod
+    def load(cls, path, mmap=True):
+        """Read a table written by :meth:`save`.
+
+        Parameters
+        ----------
+        path : str
+            The path the table was saved to
+        mmap : bool, optional
+            Whether to memory-map the table read-only instead of reading it into memory.
+            Defaults to :const:`True`
+
+        Returns
+        -------
+        :class:`AveragineTable`
+        """
+        with open(path + ".json", 'rt') as fh:
+            metadata = json.load(fh)
+        data = np.load(path, mmap_mode='r' if mmap else None)
+        return cls(metadata['averagine'], data[0], data[1], metadata['minimum_mass'],
+                   metadata['mass_step'], path=path)
+
+    def covers(self, mz, charge=1, charge_carrier=PROTON):
+        """Test whether the neutral mass of `mz` at `charge` falls within the table
+
+        Returns
+        -------
+        bool
+        """
+        mass = neutral_mass(mz, charge, charge_carrier)
+        return self.minimum_mass <= mass <= self.maximum_mass
+
+    def _interpolate(self, mass):
+        position = (mass - self.minimum_mass) / self.mass_step
+        i = min(int(position), len(self) - 1)
+        fraction = position - i
+        if fraction > 0 and i + 1 < len(self):
+            intensities = self.intensities[i] * (1 - fraction) + self.intensities[i + 1] * fraction
+            offsets = self.offsets[i] * (1 - fraction) + self.offsets[i + 1] * fraction
+        else:
+            intensities = self.intensities[i]
+            offsets = self.offsets[i]
+        n = np.count_nonzero(intensities)
+        return intensities[:n], offsets[:n]
+
+    def isotopic_cluster(self, mz, charge=1, charge_carrier=PROTON, truncate_after=0.95, ignore_below=0.0):
+        """Look up the theoretical isotopic pattern for the given m/z and charge state, thresholded
+        by theoretical peak height and density.
+
+        Mimics :meth:`.Averagine.isotopic_cluster`, but interpolates the pattern from the table.
+
+        Parameters
+        ----------
+        mz : float
+            The reference m/z to calculate the neutral mass to interpolate from
+        charge : int, optional
+            The reference charge state to calculate the neutral mass. Defaults to 1
+        charge_carrier : float, optional
+            The mass of the charge carrier. Defaults to the mass of a proton.
+        truncate_after : float, optional
+            The percentage of the signal in the theoretical isotopic pattern to include.
+            Defaults to 0.95, including the first 95% of the signal in the generated pattern
+        ignore_below : float, optional
+            Omit theoretical peaks whose intensity is below this number.
+            Defaults to 0.0
+
+        Returns
+        -------
+        :class:`.TheoreticalIsotopicPattern`
+            The interpolated and thresholded pattern
+
+        Raises
+        ------
+        ValueError
+            If the neutral mass is not covered by the table
+        """
+        mass = neutral_mass(mz, charge, charge_carrier)
+        if not (self.minimum_mass <= mass <= self.maximum_mass):
+            raise ValueError("Mass %f is outside of the table's range (%f, %f)" % (
+                mass, self.minimum_mass, self.maximum_mass))
+        intensities, offsets = self._interpolate(mass)
+        abs_charge = abs(charge)
+        peaklist = [
+            _TheoreticalPeak(mz + offset / abs_charge, intensity, charge)
+            for intensity, offset in zip(intensities.tolist(), offsets.tolist())
+        ]
+        tid = TheoreticalIsotopicPattern(peaklist, mz, 0)
+        if truncate_after < 1.0:
+            tid.truncate_after(truncate_after)
+        if ignore_below > 0:
+            tid.ignore_below(ignore_below)
+        return tid
+
+
+class AveragineTableCache(AveragineCache):
+    """An :class:`AveragineCache` which looks up isotopic patterns in a precomputed
+    :class:`AveragineTable` instead of generating them, falling back to the cached
+    generation strategy of :class:`AveragineCache` for masses outside of the table.
+
+    Because it is an :class:`AveragineCache`, it can be passed anywhere an
+    averagine is accepted by a deconvoluter.
+
+    Attributes
+    ----------
+    table : :class:`AveragineTable`
+        The precomputed isotopic pattern table
+    """
+
+    def __init__(self, table, backend=None, cache_truncation=1.0, eviction_policy=None):
+        if not isinstance(table, AveragineTable):
+            table = AveragineTable.load(table)
+        super(AveragineTableCache, self).__init__(
+            table.averagine, backend, cache_truncation, eviction_policy)
+        self.table = table
+
+    def __reduce__(self):
+        return self.__class__, (self.table, None, self.cache_truncation, self.eviction_policy)
+
+    def isotopic_cluster(self, mz, charge=1, charge_carrier=PROTON, truncate_after=0.95, ignore_below=0.0):
+        """Generate a theoretical isotopic pattern for the given m/z and charge state, thresholded
+        by theoretical peak height and density.
+
+        Patterns are cached like :class:`AveragineCache`, but a pattern which is not already
+        cached is interpolated from :attr:`table` when it covers the neutral mass.
+
+        Parameters
+        ----------
+        mz : float
+            The reference m/z to calculate the neutral mass to interpolate from
+        charge : int, optional
+            The reference charge state to calculate the neutral mass. Defaults to 1
+        charge_carrier : float, optional
+            The mass of the charge carrier. Defaults to the mass of a proton.
+        truncate_after : float, optional
+            The percentage of the signal in the theoretical isotopic pattern to include.
+            Defaults to 0.95, including the first 95% of the signal in the generated pattern
+        ignore_below : float, optional
+            Omit theoretical peaks whose intensity is below this number.
+            Defaults to 0.0
+
+        Returns
+        -------
+        :class:`.TheoreticalIsotopicPattern`
+            The generated and thresholded pattern
+        """
+        if self.cache_truncation == 0.0:
+            key_mz = mz
+        else:
+            key_mz = round(mz / self.cache_truncation) * self.cache_truncation
+        key = (key_mz, charge, charge_carrier, truncate_after, ignore_below)
+        tid = self._cache_lookup(key)
+        if tid is not None:
+            return tid.clone().shift(mz)
+        if self.table.covers(mz, charge, charge_carrier):
+            tid = self.table.isotopic_cluster(mz, charge, charge_carrier, truncate_after, ignore_below)
+        else:
+            tid = self.averagine.isotopic_cluster(mz, charge, charge_carrier, truncate_after, ignore_below)
+        self._cache_store(key, tid.clone())
+        return tid
+
+    def __repr__(self):
+        return "AveragineTableCache(%r)" % self.table
@@ -24,7 +24,7 @@ from .scan import (
     _ScanIteratorImplBase, _SingleScanIteratorImpl,
     _FakeGroupedScanIteratorImpl, _GroupedScanIteratorImpl,
     ScanDataSource, ScanIterator, RandomAccessScanSource,
-    ScanFileMetadataBase)
+    ScanFileMetadataBase, ScanTimeIndex, RollingScanAverager)
 
 
 __all__ = [
@@ -35,7 +35,7 @@ __all__ = [
     "IsolationWindow",
 
     "ScanDataSource", "ScanIterator", "RandomAccessScanSource",
-    "ScanFileMetadataBase",
+    "ScanFileMetadataBase", "ScanTimeIndex", "RollingScanAverager",
 
     "_ScanIteratorImplBase", "_SingleScanIteratorImpl",
     "_FakeGroupedScanIteratorImpl", "_GroupedScanIteratorImpl",
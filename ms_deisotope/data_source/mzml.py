@@ -1,7 +1,13 @@
+import os
+import re
+import mmap
+
 from six import string_types as basestring
 
 import numpy as np
+from lxml import etree
 from pyteomics import mzml
+from . import _compression
 from .common import (
     PrecursorInformation, ScanDataSource,
     ChargeNotProvided, ActivationInformation,
@@ -52,6 +58,88 @@ class _MzMLParser(mzml.MzML):
         return dtype
 
 
+_binary_pattern = re.compile(br"(<binary>)([^<]*)(</binary>)")
+_spectrum_close_tag = b"</spectrum>"
+
+_primary_array_names = ("m/z array", "intensity array")
+
+
+class LazyArrayRecord(object):
+    """A binary data array which has not been decoded yet, holding the location
+    of its base64-encoded bytes in a memory-mapped file.
+
+    The array is decoded and decompressed on the first call to :meth:`decode`,
+    and cached after that. This has the same :meth:`decode` interface as the
+    array records :mod:`pyteomics` produces when it does not decode binary data.
+
+    Attributes
+    ----------
+    source : :class:`mmap.mmap`
+        The memory-mapped file the array is stored in
+    start : int
+        The byte offset where the encoded array starts
+    end : int
+        The byte offset where the encoded array ends
+    compression : str
+        The name of the compression method used on the array
+    dtype : type
+        The numerical type of the array's values
+    decoder : :class:`pyteomics.auxiliary.utils.BinaryArrayConversionMixin`
+        The object which knows how to decode the array
+    """
+    __slots__ = ('source', 'start', 'end', 'compression', 'dtype', 'decoder', '_array')
+
+    def __init__(self, source, start, end, compression, dtype, decoder):
+        self.source = source
+        self.start = start
+        self.end = end
+        self.compression = compression
+        self.dtype = dtype
+        self.decoder = decoder
+        self._array = None
+
+    @property
+    def is_decoded(self):
+        return self._array is not None
+
+    def __len__(self):
+        return self.end - self.start
+
+    def decode(self):
+        """Decode the array from the memory-mapped file, if it has not been
+        decoded already.
+
+        Returns
+        -------
+        np.ndarray
+        """
+        if self._array is None:
+            encoded = self.source[self.start:self.end].decode('ascii')
+            if encoded:
+                self._array = self.decoder.decode_data_array(
+                    encoded, self.compression, self.dtype)
+            else:
+                self._array = np.array([], dtype=self.dtype)
+        return self._array
+
+    def __getstate__(self):
+        # The memory map cannot be shared with another process, so decode
+        # the array before sending it anywhere.
+        return {'compression': self.compression, 'dtype': self.dtype, '_array': self.decode()}
+
+    def __setstate__(self, state):
+        self.source = None
+        self.start = self.end = 0
+        self.decoder = None
+        self.compression = state['compression']
+        self.dtype = state['dtype']
+        self._array = state['_array']
+
+    def __repr__(self):
+        return "{self.__class__.__name__}({self.start}, {self.end}, {self.compression!r}, {self.dtype!r})".format(
+            self=self)
+
+
 class MzMLDataInterface(ScanDataSource):
     """Provides implementations of all of the methods needed to implement the
     :class:`ScanDataSource` for mzML files. Not intended for direct instantiation.
@@ -91,6 +179,12 @@ class MzMLDataInterface(ScanDataSource):
         pinfo_dict = scan["precursorList"]['precursor'][0]["selectedIonList"]['selectedIon'][0]
         return pinfo_dict
 
+    def _precursor_scan_id(self, scan):
+        try:
+            return scan["precursorList"]['precursor'][0]['spectrumRef']
+        except (KeyError, IndexError):
+            return None
+
     def _precursor_information(self, scan):
         """Returns information about the precursor ion,
         if any, that this scan was derived form.
@@ -532,6 +626,31 @@ class MzMLLoader(MzMLDataInterface, XMLReaderBase, _MzMLMetadataLoader):
         Path to file to read from.
     source: pyteomics.mzml.MzML
         Underlying scan data source
+
+    Parameters
+    ----------
+    source_file: str or file-like
+        The file to read from.
+    use_index: bool, optional
+        Whether to use the file's byte offset index for random access. Defaults to :const:`True`
+    decode_binary: bool, optional
+        Whether to decode binary data arrays while parsing each spectrum. Defaults to :const:`True`
+    lazy_arrays: bool, optional
+        Whether to defer decoding binary data arrays until :attr:`Scan.arrays` is first
+        accessed. When the file is an uncompressed file on disk and the index is used, the
+        file is memory-mapped and the encoded arrays are never copied out of it until they
+        are decoded, which makes reading only scan headers much cheaper. Implies
+        ``decode_binary=False``. Defaults to :const:`False`
+    skip_extra_arrays: bool, optional
+        Whether to discard all binary data arrays other than the m/z and intensity arrays.
+        Defaults to :const:`False`
+    read_ahead: int, optional
+        The number of scans whose binary data arrays are decoded on a thread pool ahead
+        of the consumer while iterating. If 0, arrays are decoded on demand on the iterating
+        thread. When greater than 0, implies ``decode_binary=False``. Defaults to 0
+    decode_threads: int, optional
+        The number of threads used to decode scans when ``read_ahead`` is greater than 0.
+        Defaults to 2
     """
 
     _parser_cls = _MzMLParser
@@ -540,7 +659,12 @@ class MzMLLoader(MzMLDataInterface, XMLReaderBase, _MzMLMetadataLoader):
     def prebuild_byte_offset_file(path):
         return _MzMLParser.prebuild_byte_offset_file(path)
 
-    def __init__(self, source_file, use_index=True, decode_binary=True, **kwargs):
+    def __init__(self, source_file, use_index=True, decode_binary=True, lazy_arrays=False,
+                 skip_extra_arrays=False, read_ahead=0, decode_threads=2, **kwargs):
+        if lazy_arrays or read_ahead > 0:
+            decode_binary = False
+        self._read_ahead = read_ahead
+        self._decode_threads = decode_threads
         self.source_file = source_file
         self._source = self._parser_cls(source_file, read_schema=True, iterative=True,
                                         huge_tree=True, decode_binary=decode_binary,
@@ -548,6 +672,11 @@ class MzMLLoader(MzMLDataInterface, XMLReaderBase, _MzMLMetadataLoader):
         self.initialize_scan_cache()
         self._use_index = use_index
         self._decode_binary = decode_binary
+        self._lazy_arrays = lazy_arrays
+        self._skip_extra_arrays = skip_extra_arrays
+        self._memory_map = None
+        if lazy_arrays and use_index:
+            self._memory_map = self._open_memory_map()
         self._run_information = self._get_run_attributes()
         self._instrument_config = {
             k.id: k for k in self.instrument_configuration()
@@ -606,7 +735,92 @@ class MzMLLoader(MzMLDataInterface, XMLReaderBase, _MzMLMetadataLoader):
         else:
             start = 0
         for key in keys[start:]:
-            yield scan_source.get_by_id(key)
+            if self._memory_map is not None:
+                yield self._get_lazy_spectrum(offset_provider[key])
+            else:
+                yield scan_source.get_by_id(key)
+
+    def _make_default_iterator(self):
+        if self._memory_map is not None:
+            return self._yield_from_index(self._source, None)
+        return super(MzMLLoader, self)._make_default_iterator()
+
+    def _open_memory_map(self):
+        path = self.source_file
+        if not isinstance(path, basestring) or not os.path.isfile(path):
+            return None
+        if _compression.test_gzipped(path):
+            return None
+        with open(path, 'rb') as handle:
+            try:
+                return mmap.mmap(handle.fileno(), 0, access=mmap.ACCESS_READ)
+            except (ValueError, mmap.error):
+                # Empty files cannot be memory-mapped
+                return None
+
+    def _get_lazy_spectrum(self, offset):
+        """Parse the spectrum starting at `offset` in the memory-mapped file,
+        without reading its binary data arrays.
+
+        The text of each ``<binary>`` element is replaced with a placeholder before
+        the spectrum is parsed, and the arrays :mod:`pyteomics` produces for them are
+        replaced with :class:`LazyArrayRecord` instances pointing back into the file.
+
+        Parameters
+        ----------
+        offset : int
+            The byte offset of the spectrum's opening tag
+
+        Returns
+        -------
+        dict
+        """
+        end = self._memory_map.find(_spectrum_close_tag, offset)
+        if end == -1:
+            raise ValueError("Could not find the end of the spectrum starting at %d" % (offset, ))
+        end += len(_spectrum_close_tag)
+        spans = []
+
+        def _replace_binary(match):
+            spans.append((offset + match.start(2), offset + match.end(2)))
+            return match.group(1) + str(len(spans) - 1).encode('ascii') + match.group(3)
+
+        text = _binary_pattern.sub(_replace_binary, self._memory_map[offset:end])
+        data = self._source._get_info_smart(etree.fromstring(text))
+        if not spans:
+            return data
+        record_type = self._source.binary_array_record
+        for key, value in list(data.items()):
+            if isinstance(value, record_type):
+                start, stop = spans[int(value.data)]
+                data[key] = LazyArrayRecord(
+                    self._memory_map, start, stop, value.compression, value.dtype, self._source)
+        return data
+
+    def _get_scan_by_id_raw(self, scan_id):
+        if self._memory_map is None:
+            return super(MzMLLoader, self)._get_scan_by_id_raw(scan_id)
+        try:
+            offset = self.index[scan_id]
+        except (KeyError, AttributeError):
+            raise KeyError(scan_id)
+        return self._get_lazy_spectrum(offset)
+
+    def _make_scan(self, data):
+        if self._skip_extra_arrays:
+            array_types = (np.ndarray, LazyArrayRecord, self._source.binary_array_record)
+            for key, value in list(data.items()):
+                if key not in _primary_array_names and isinstance(value, array_types):
+                    data.pop(key)
+        return super(MzMLLoader, self)._make_scan(data)
+
+    def close(self):
+        super(MzMLLoader, self).close()
+        if self._memory_map is not None:
+            self._memory_map.close()
+            self._memory_map = None
 
     def __reduce__(self):
-        return self.__class__, (self.source_file, self._use_index, self._decode_binary)
+        return self.__class__, (self.source_file, self._use_index, self._decode_binary,
+                                self._lazy_arrays, self._skip_extra_arrays, self._read_ahead,
+                                self._decode_threads)
@@ -125,6 +125,16 @@ class MzXMLDataInterface(ScanDataSource):
             An array of intensity values for this scan
         """
         try:
+            decode = not self._decode_binary
+        except AttributeError:
+            decode = False
+        try:
+            if decode:
+                # Both records refer to the same interleaved peak array, so decode it only once
+                record = scan['m/z array']
+                peaks = self._source.decode_data_array(record.data, record.compression, record.dtype)
+                return (self._source._convert_array('m/z array', peaks['m/z array']),
+                        self._source._convert_array('intensity array', peaks['intensity array']))
             return (scan['m/z array'], scan["intensity array"])
         except KeyError:
             return np.array([]), np.array([])
@@ -367,18 +377,43 @@ class MzXMLLoader(MzXMLDataInterface, XMLReaderBase, _MzXMLMetadataLoader):
         Path to file to read from.
     source: pyteomics.mzxml.MzXML
         Underlying scan data source
+
+    Parameters
+    ----------
+    source_file: str or file-like
+        The file to read from.
+    use_index: bool, optional
+        Whether to use the file's byte offset index for random access. Defaults to :const:`True`
+    decode_binary: bool, optional
+        Whether to decode binary data arrays while parsing each scan. Defaults to :const:`True`
+    read_ahead: int, optional
+        The number of scans whose binary data arrays are decoded on a thread pool ahead
+        of the consumer while iterating. If 0, arrays are decoded on the iterating thread.
+        When greater than 0, implies ``decode_binary=False``. Defaults to 0
+    decode_threads: int, optional
+        The number of threads used to decode scans when ``read_ahead`` is greater than 0.
+        Defaults to 2
     """
 
+    _parser_cls = _MzXMLParser
+
     @staticmethod
     def prebuild_byte_offset_file(path):
         return _MzXMLParser.prebuild_byte_offset_file(path)
 
-    def __init__(self, source_file, use_index=True, **kwargs):
+    def __init__(self, source_file, use_index=True, decode_binary=True, read_ahead=0,
+                 decode_threads=2, **kwargs):
+        if read_ahead > 0:
+            decode_binary = False
+        self._read_ahead = read_ahead
+        self._decode_threads = decode_threads
         self.source_file = source_file
         self._source = _MzXMLParser(source_file, read_schema=True, iterative=True,
-                                    huge_tree=True, use_index=use_index)
+                                    huge_tree=True, decode_binary=decode_binary,
+                                    use_index=use_index)
         self.initialize_scan_cache()
         self._use_index = use_index
+        self._decode_binary = decode_binary
         self._scan_index_lookup = None
         if self._use_index:
             self._build_scan_index_lookup()
@@ -423,3 +458,7 @@ class MzXMLLoader(MzXMLDataInterface, XMLReaderBase, _MzXMLMetadataLoader):
         for key in keys[start:]:
             scan = scan_source.get_by_id(key, "num")
             yield scan
+
+    def __reduce__(self):
+        return self.__class__, (self.source_file, self._use_index, self._decode_binary,
+                                self._read_ahead, self._decode_threads)
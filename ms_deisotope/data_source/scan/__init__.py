@@ -13,6 +13,10 @@ from .loader import (
     ScanDataSource, ScanIterator, RandomAccessScanSource,
     ScanFileMetadataBase)
 
+from .time_index import ScanTimeIndex
+
+from .averaging import RollingScanAverager
+
 
 __all__ = [
     "ScanBunch", "Scan", "ProcessedScan",
@@ -24,5 +28,5 @@ __all__ = [
     "_FakeGroupedScanIteratorImpl", "_GroupedScanIteratorImpl",
 
     "ScanDataSource", "ScanIterator", "RandomAccessScanSource",
-    "ScanFileMetadataBase",
+    "ScanFileMetadataBase", "ScanTimeIndex", "RollingScanAverager",
 ]
@@ -1,4 +1,5 @@
 import abc
+import os
 from weakref import WeakValueDictionary
 
 from ms_deisotope.utils import add_metaclass
@@ -7,9 +8,12 @@ from ms_deisotope.data_source.metadata.file_information import FileInformation
 
 
 from .scan import Scan
+from .time_index import ScanTimeIndex
 from .scan_iterator import (
     _SingleScanIteratorImpl,
-    _GroupedScanIteratorImpl)
+    _GroupedScanIteratorImpl,
+    _ReadAheadScanLoader,
+    _null_scan_packer)
 
 
 @add_metaclass(abc.ABCMeta)
@@ -65,6 +69,28 @@ class ScanDataSource(object):
         """
         raise NotImplementedError()
 
+    def _precursor_scan_id(self, scan):
+        """Returns the id of the scan the precursor ion of this
+        scan was selected from, if the scan records it.
+
+        Unlike :meth:`_precursor_information`, this should not search
+        the file for the precursor scan if it is not recorded.
+
+        Parameters
+        ----------
+        scan : Mapping
+            The underlying scan information storage,
+            usually a `dict`
+
+        Returns
+        -------
+        str or None
+        """
+        pinfo = self._precursor_information(scan)
+        if pinfo is None:
+            return None
+        return pinfo.precursor_scan_id
+
     @abc.abstractmethod
     def _scan_title(self, scan):
         """Returns a verbose name for this scan, if one
@@ -236,6 +262,13 @@ class ScanIterator(ScanDataSource):
 
     iteration_mode = 'group'
 
+    #: The number of scans to decode ahead of the consumer on a thread pool
+    #: during iteration, or 0 to decode them on demand
+    _read_ahead = 0
+    #: The number of threads used to decode scans when :attr:`_read_ahead` is
+    #: greater than 0
+    _decode_threads = 2
+
     @abc.abstractmethod
     def next(self):
         raise NotImplementedError()
@@ -283,20 +316,27 @@ class ScanIterator(ScanDataSource):
     def _validate(self, scan):
         return True
 
-    def _single_scan_iterator(self, iterator=None):
+    def _prepare_iterator(self, iterator=None):
         if iterator is None:
             iterator = self._make_default_iterator()
+        if self._read_ahead > 0:
+            iterator = _ReadAheadScanLoader(
+                iterator, self._make_scan, self._read_ahead, self._decode_threads)
+            return iterator, _null_scan_packer
+        return iterator, self._make_scan
+
+    def _single_scan_iterator(self, iterator=None):
+        iterator, scan_packer = self._prepare_iterator(iterator)
 
         impl = _SingleScanIteratorImpl(
-            iterator, self._make_scan, self._validate, self._cache_scan)
+            iterator, scan_packer, self._validate, self._cache_scan)
         return impl
 
     def _scan_group_iterator(self, iterator=None):
-        if iterator is None:
-            iterator = self._make_default_iterator()
+        iterator, scan_packer = self._prepare_iterator(iterator)
 
         impl = _GroupedScanIteratorImpl(
-            iterator, self._make_scan, self._validate, self._cache_scan)
+            iterator, scan_packer, self._validate, self._cache_scan)
         return impl
 
     def _scan_cleared(self, scan):
@@ -404,17 +444,138 @@ class RandomAccessScanSource(ScanIterator):
         '''
         raise NotImplementedError()
 
+    _scan_time_index = None
+    _scan_time_index_checked = False
+    _scan_time_index_build_failed = False
+
+    #: Whether to build the :attr:`scan_time_index` the first time a scan is looked
+    #: up by time or a neighboring MS1 scan is searched for, if there is no saved one
+    #: to read. Building it reads every scan in the file once, so a reader used for a
+    #: single lookup may turn this off to search by loading scans instead.
+    build_scan_time_index_on_demand = True
+
     def has_ms1_scans(self):
         return True
 
     def has_msn_scans(self):
         return True
 
+    @property
+    def scan_time_index(self):
+        """The :class:`~.ScanTimeIndex` of this file, used to find scans by time
+        and neighboring MS1 scans without loading any scans.
+
+        If it has not been built with :meth:`build_scan_time_index`, it is read
+        from the file written next to the byte offset index, if there is one,
+        otherwise this is :const:`None`. Looking up scans by time or searching
+        for neighboring MS1 scans builds it on demand, see
+        :attr:`build_scan_time_index_on_demand`.
+
+        Returns
+        -------
+        :class:`~.ScanTimeIndex` or :const:`None`
+        """
+        if self._scan_time_index is None and not self._scan_time_index_checked:
+            self._scan_time_index_checked = True
+            self._scan_time_index = self._read_scan_time_index()
+        return self._scan_time_index
+
+    def _scan_time_index_file_name(self):
+        try:
+            byte_offset_file_name = self.source._byte_offset_filename
+        except AttributeError:
+            return None
+        if byte_offset_file_name is None:
+            return None
+        return ScanTimeIndex.index_file_name(byte_offset_file_name)
+
+    def _read_scan_time_index(self):
+        path = self._scan_time_index_file_name()
+        if path is None or not os.path.exists(path):
+            return None
+        try:
+            index = ScanTimeIndex.load(path)
+        except (IOError, OSError, ValueError, KeyError):
+            return None
+        # An index of a different version of the file is of no use
+        source_stat = self._scan_time_index_source_stat()
+        if len(index) != len(self) or source_stat is None or index.source_stat != source_stat:
+            return None
+        return index
+
+    def _scan_time_index_source_stat(self):
+        path = getattr(self, 'source_file', None)
+        try:
+            stat = os.stat(path)
+        except (TypeError, ValueError, OSError):
+            return None
+        return (int(stat.st_size), float(stat.st_mtime))
+
+    def _iter_scan_time_records(self):
+        for i in range(len(self)):
+            scan = self.get_scan_by_index(i)
+            precursor_scan_id = None
+            if scan.ms_level > 1:
+                pinfo = scan.precursor_information
+                if pinfo is not None:
+                    precursor_scan_id = pinfo.precursor_scan_id
+            yield scan.id, scan.scan_time, scan.ms_level, precursor_scan_id
+
+    def build_scan_time_index(self, persist=False):
+        """Build the :attr:`scan_time_index` of this file, reading the time,
+        MS level and precursor of every scan once.
+
+        Parameters
+        ----------
+        persist : bool, optional
+            Whether to write the index next to the file's byte offset index,
+            where it will be read from the next time the file is opened
+
+        Returns
+        -------
+        :class:`~.ScanTimeIndex`
+        """
+        index = ScanTimeIndex.from_records(self._iter_scan_time_records())
+        index.source_stat = self._scan_time_index_source_stat()
+        self._scan_time_index = index
+        self._scan_time_index_checked = True
+        if persist:
+            path = self._scan_time_index_file_name()
+            if path is not None:
+                with open(path, 'wb') as handle:
+                    index.save(handle)
+        return index
+
+    def _get_scan_time_index(self):
+        """Get the :attr:`scan_time_index`, building it if there is none and
+        :attr:`build_scan_time_index_on_demand` is set.
+
+        Returns
+        -------
+        :class:`~.ScanTimeIndex` or :const:`None`
+            :const:`None` if the index could not be built, in which case it
+            is not attempted again
+        """
+        time_index = self.scan_time_index
+        if time_index is not None or not self.build_scan_time_index_on_demand or \
+                self._scan_time_index_build_failed:
+            return time_index
+        try:
+            return self.build_scan_time_index()
+        except (TypeError, KeyError, IndexError, ValueError, NotImplementedError):
+            self._scan_time_index_build_failed = True
+            return None
+
     def _locate_ms1_scan(self, scan, search_range=150):
         i = 0
         initial_scan = scan
         if not self.has_ms1_scans():
             raise IndexError('Cannot locate MS1 Scan')
+        time_index = self._get_scan_time_index()
+        if time_index is not None:
+            position = time_index.locate_ms1(scan.index, search_range)
+            if position is not None:
+                return self.get_scan_by_index(position)
         while scan.ms_level != 1 and i < search_range:
             i += 1
             if scan.index <= 0:
@@ -435,6 +596,12 @@ class RandomAccessScanSource(ScanIterator):
     def find_previous_ms1(self, start_index):
         if not self.has_ms1_scans():
             return None
+        time_index = self._get_scan_time_index()
+        if time_index is not None:
+            position = time_index.previous_ms1(start_index)
+            if position is None:
+                return None
+            return self.get_scan_by_index(position)
         index = start_index - 1
         while index >= 0:
             try:
@@ -449,6 +616,12 @@ class RandomAccessScanSource(ScanIterator):
     def find_next_ms1(self, start_index):
         if not self.has_ms1_scans():
             return None
+        time_index = self._get_scan_time_index()
+        if time_index is not None:
+            position = time_index.next_ms1(start_index)
+            if position is None:
+                return None
+            return self.get_scan_by_index(position)
         index = start_index + 1
         n = len(self.index)
         while index < n:
@@ -9,7 +9,7 @@ except ImportError:
 import numpy as np
 
 from ms_peak_picker import (
-    pick_peaks, reprofile, average_signal,
+    pick_peaks, reprofile,
     scan_filter, PeakIndex, PeakSet)
 
 try:
@@ -36,6 +36,47 @@ DEFAULT_CHARGE_WHEN_NOT_RESOLVED = 1
 ChargeNotProvided = Constant("ChargeNotProvided")
 
 
+def average_signal(arrays, dx=0.01, weights=None):
+    """Average the signal of several spectra on an evenly spaced m/z axis
+    spanning all of them.
+
+    This computes the same average as :func:`ms_peak_picker.average_signal`,
+    whose C implementation does not clear the m/z axis outside of each spectrum
+    and so may return arbitrary values there.
+
+    Parameters
+    ----------
+    arrays : list of pairs of :class:`np.ndarray`
+        The m/z and intensity arrays to combine
+    dx : float, optional
+        The spacing of the averaged m/z axis
+    weights : list of float, optional
+        The weight of each entry in `arrays`. Defaults to 1.0 for each.
+
+    Returns
+    -------
+    mz_array : :class:`np.ndarray`
+    intensity_array : :class:`np.ndarray`
+    """
+    if weights is None:
+        weights = [1.0] * len(arrays)
+    elif len(arrays) != len(weights):
+        raise ValueError("`arrays` and `weights` must have the same length")
+    spectra = [(np.asarray(mz, dtype=float), np.asarray(intensity, dtype=float), weight)
+               for (mz, intensity), weight in zip(arrays, weights) if len(mz)]
+    if not spectra:
+        return np.array([], dtype=float), np.array([], dtype=float)
+    lo = max(min(mz[0] for mz, _, _ in spectra) - 1, 0)
+    hi = max(mz[-1] for mz, _, _ in spectra) + 1
+    mz_array = np.arange(lo, hi, dx, dtype=float)
+    intensity_array = np.zeros_like(mz_array)
+    total_weight = 0.0
+    for mz, intensity, weight in spectra:
+        intensity_array += np.interp(mz_array, mz, intensity, left=0, right=0) * weight
+        total_weight += weight
+    return mz_array, intensity_array / total_weight
+
+
 class ScanBunch(namedtuple("ScanBunch", ["precursor", "products"])):
     """Represents a single MS1 scan and all MSn scans derived from it
 
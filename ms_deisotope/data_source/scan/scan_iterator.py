@@ -1,3 +1,6 @@
+from collections import deque
+from multiprocessing.pool import ThreadPool
+
 from .scan import ScanBunch
 
 
@@ -9,6 +12,56 @@ def _null_scan_cacher(scan):
     return None
 
 
+def _null_scan_packer(scan):
+    return scan
+
+
+class _ReadAheadScanLoader(object):
+    """Package raw scans and decode their data arrays on a pool of threads,
+    ahead of the consumer, yielding the packaged scans in their original order.
+
+    Parsing the raw scans still happens on the consuming thread, but decoding
+    and decompressing their binary data arrays, which mostly releases the GIL,
+    overlaps with it.
+
+    Attributes
+    ----------
+    iterator : :class:`Iterator`
+        An iterator that produces raw scans
+    scan_packer : :class:`Callable`
+        A callable that will package a raw scan object into a :class:`Scan` object
+    read_ahead : int
+        The maximum number of scans being decoded ahead of the consumer at once
+    n_threads : int
+        The number of threads to decode scans with
+    """
+
+    def __init__(self, iterator, scan_packer, read_ahead=8, n_threads=2):
+        self.iterator = iterator
+        self.scan_packer = scan_packer
+        self.read_ahead = max(int(read_ahead), 1)
+        self.n_threads = max(int(n_threads), 1)
+
+    def _load(self, raw):
+        scan = self.scan_packer(raw)
+        # Accessing the arrays decodes them and caches them on the scan
+        scan.arrays
+        return scan
+
+    def __iter__(self):
+        pool = ThreadPool(self.n_threads)
+        pending = deque()
+        try:
+            for raw in self.iterator:
+                pending.append(pool.apply_async(self._load, (raw, )))
+                if len(pending) >= self.read_ahead:
+                    yield pending.popleft().get()
+            while pending:
+                yield pending.popleft().get()
+        finally:
+            pool.terminate()
+
+
 class _ScanIteratorImplBase(object):
     """Internal base class for scan iteration strategies
 
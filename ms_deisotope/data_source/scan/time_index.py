@@ -0,0 +1,204 @@
+'''An array-backed summary of every scan in a file, its acquisition time, MS level
+and precursor, which answers the questions random access readers otherwise
+answer by loading whole scans, like which scan was acquired nearest to a time,
+or where the nearest MS1 scan to a scan is.
+
+The summary is cheap to store, and may be written next to a file's byte offset
+index to skip rebuilding it the next time the file is opened.
+'''
+import numpy as np
+
+
+class ScanTimeIndex(object):
+    """The scan time, MS level and precursor of each scan in a file, in the order
+    of the file.
+
+    Parameters
+    ----------
+    scan_times : array-like
+        The acquisition time of each scan, in minutes
+    ms_levels : array-like
+        The MS level of each scan
+    precursor_indices : array-like, optional
+        The position of the scan each scan's precursor ion was selected from,
+        or -1 when there is none
+    source_stat : tuple, optional
+        The size in bytes and modification time of the data file the index was
+        built from, used to tell whether a saved index still describes that file
+
+    Attributes
+    ----------
+    scan_times : np.ndarray
+    ms_levels : np.ndarray
+    precursor_indices : np.ndarray
+    source_stat : tuple or :const:`None`
+    """
+
+    def __init__(self, scan_times, ms_levels, precursor_indices=None, source_stat=None):
+        self.scan_times = np.asarray(scan_times, dtype=np.float64)
+        self.ms_levels = np.asarray(ms_levels, dtype=np.int32)
+        if precursor_indices is None:
+            precursor_indices = np.full(len(self.scan_times), -1, dtype=np.int64)
+        self.precursor_indices = np.asarray(precursor_indices, dtype=np.int64)
+        if not (len(self.scan_times) == len(self.ms_levels) == len(self.precursor_indices)):
+            raise ValueError("Every array must have one entry per scan")
+        self.source_stat = tuple(source_stat) if source_stat is not None else None
+        self._ms1_positions = np.flatnonzero(self.ms_levels == 1)
+        self._time_sorted = bool(np.all(np.diff(self.scan_times) >= 0))
+
+    @classmethod
+    def from_records(cls, records):
+        """Build an index from one record per scan, in the order of the file.
+
+        Scans whose precursor scan is not known are assumed to be derived from the
+        nearest preceding scan with a lower MS level.
+
+        Parameters
+        ----------
+        records : iterable of tuple
+            The ``(scan_id, scan_time, ms_level, precursor_scan_id)`` of each scan, where
+            ``precursor_scan_id`` is :const:`None` if unknown
+
+        Returns
+        -------
+        ScanTimeIndex
+        """
+        records = list(records)
+        n = len(records)
+        positions = {record[0]: i for i, record in enumerate(records)}
+        scan_times = np.empty(n, dtype=np.float64)
+        ms_levels = np.empty(n, dtype=np.int32)
+        precursor_indices = np.full(n, -1, dtype=np.int64)
+        last_seen = {}
+        for i, (_, scan_time, ms_level, precursor_scan_id) in enumerate(records):
+            scan_times[i] = scan_time
+            ms_levels[i] = ms_level
+            if ms_level > 1:
+                precursor = positions.get(precursor_scan_id, -1)
+                if precursor == -1:
+                    precursor = max([j for level, j in last_seen.items() if level < ms_level] or [-1])
+                precursor_indices[i] = precursor
+            last_seen[ms_level] = i
+        return cls(scan_times, ms_levels, precursor_indices)
+
+    def __len__(self):
+        return len(self.scan_times)
+
+    def __repr__(self):
+        return "{self.__class__.__name__}(<{size} scans, {ms1} MS1>)".format(
+            self=self, size=len(self), ms1=len(self._ms1_positions))
+
+    def find_time(self, time):
+        """Find the position of the scan acquired nearest to `time`, preferring
+        the earlier scan when two are equally near.
+
+        Parameters
+        ----------
+        time : float
+            The time to search for, in minutes
+
+        Returns
+        -------
+        int or :const:`None`
+            :const:`None` if there are no scans
+        """
+        n = len(self)
+        if n == 0:
+            return None
+        if not self._time_sorted:
+            return int(np.argmin(np.abs(self.scan_times - time)))
+        i = int(np.searchsorted(self.scan_times, time, side='left'))
+        if i == n:
+            return n - 1
+        if i > 0 and (time - self.scan_times[i - 1]) <= (self.scan_times[i] - time):
+            return i - 1
+        return i
+
+    def previous_ms1(self, index):
+        """Find the position of the last MS1 scan before position `index`
+
+        Returns
+        -------
+        int or :const:`None`
+        """
+        k = int(np.searchsorted(self._ms1_positions, index, side='left')) - 1
+        if k < 0:
+            return None
+        return int(self._ms1_positions[k])
+
+    def next_ms1(self, index):
+        """Find the position of the first MS1 scan after position `index`
+
+        Returns
+        -------
+        int or :const:`None`
+        """
+        k = int(np.searchsorted(self._ms1_positions, index, side='right'))
+        if k >= len(self._ms1_positions):
+            return None
+        return int(self._ms1_positions[k])
+
+    def locate_ms1(self, index, search_range=150):
+        """Find the position of the MS1 scan at or before position `index`, or
+        failing that, after it, no more than `search_range` scans away.
+
+        Returns
+        -------
+        int or :const:`None`
+        """
+        if self.ms_levels[index] == 1:
+            return index
+        previous = self.previous_ms1(index)
+        if previous is not None and index - previous <= search_range:
+            return previous
+        following = self.next_ms1(index)
+        if following is not None and following - index <= search_range:
+            return following
+        return None
+
+    def save(self, handle):
+        """Write the index to a file in NumPy's ``.npz`` format
+
+        Parameters
+        ----------
+        handle : file-like or str
+        """
+        arrays = dict(scan_times=self.scan_times, ms_levels=self.ms_levels,
+                      precursor_indices=self.precursor_indices)
+        if self.source_stat is not None:
+            arrays['source_stat'] = np.array(self.source_stat, dtype=np.float64)
+        np.savez(handle, **arrays)
+
+    @classmethod
+    def load(cls, handle):
+        """Read an index written by :meth:`save`
+
+        Parameters
+        ----------
+        handle : file-like or str
+
+        Returns
+        -------
+        ScanTimeIndex
+        """
+        with np.load(handle) as data:
+            source_stat = None
+            if 'source_stat' in data:
+                size, mtime = data['source_stat']
+                source_stat = (int(size), float(mtime))
+            return cls(data['scan_times'], data['ms_levels'], data['precursor_indices'],
+                       source_stat=source_stat)
+
+    @staticmethod
+    def index_file_name(byte_offset_file_name):
+        """Derive the name of the file to store the index in from the name of
+        the file storing the byte offset index of the same data file.
+
+        Returns
+        -------
+        str
+        """
+        suffix = '-byte-offsets.json'
+        if byte_offset_file_name.endswith(suffix):
+            byte_offset_file_name = byte_offset_file_name[:-len(suffix)]
+        return byte_offset_file_name + '-scan-times.npz'
@@ -1,4 +1,8 @@
+import os
 import warnings
+
+from six import string_types as basestring
+
 from .common import (
     RandomAccessScanSource)
 from lxml import etree
@@ -146,6 +150,13 @@ class XMLReaderBase(RandomAccessScanSource):
         -------
         Scan
         """
+        time_index = self._get_scan_time_index()
+        if time_index is not None:
+            position = time_index.find_time(time)
+            if position is not None:
+                scan = self.get_scan_by_index(position)
+                if self._validate(scan):
+                    return scan
         scan_ids = tuple(self.index)
         lo = 0
         hi = len(scan_ids)
@@ -183,6 +194,38 @@ class XMLReaderBase(RandomAccessScanSource):
         if hi == 0 and not self._use_index:
             raise TypeError("This method requires the index. Please pass `use_index=True` during initialization")
 
+    def _iter_scan_time_records(self):
+        path = self.source_file
+        parser_cls = getattr(self, '_parser_cls', None)
+        if parser_cls is None or not isinstance(path, basestring) or not os.path.isfile(path):
+            return super(XMLReaderBase, self)._iter_scan_time_records()
+        records = self._read_scan_time_records(parser_cls, path)
+        # The headers must describe the same scans as the byte offset index, in the same order
+        if [record[0] for record in records] != list(self.index):
+            return super(XMLReaderBase, self)._iter_scan_time_records()
+        return records
+
+    def _read_scan_time_records(self, parser_cls, path):
+        # Read the file from start to end with a second parser which does not decode
+        # binary data arrays, instead of seeking to each scan with the primary parser
+        kwargs = {}
+        # Share the controlled vocabulary the primary parser already loaded
+        cv = getattr(self._source, 'cv', None)
+        if cv is not None:
+            kwargs['cv'] = cv
+        parser = parser_cls(path, read_schema=False, iterative=True, huge_tree=True,
+                            decode_binary=False, use_index=False, **kwargs)
+        records = []
+        try:
+            for data in parser:
+                ms_level = self._ms_level(data)
+                records.append((
+                    self._scan_id(data), self._scan_time(data), ms_level,
+                    self._precursor_scan_id(data) if ms_level > 1 else None))
+        finally:
+            parser.close()
+        return records
+
     def get_scan_by_index(self, index):
         """Retrieve the scan object for the specified scan index.
 
@@ -10,7 +10,7 @@ from .averagine import (
     AveragineCache, peptide, glycopeptide, glycan, neutral_mass, isotopic_variants,
     isotopic_shift, PROTON, TheoreticalIsotopicPattern)
 from .peak_set import DeconvolutedPeak, DeconvolutedPeakSolution, DeconvolutedPeakSet, Envelope
-from .scoring import IsotopicFitRecord, penalized_msdeconv
+from .scoring import IsotopicFitRecord, BatchIsotopicFitScorer, penalized_msdeconv
 from .utils import range, Base, TrivialTargetedDeconvolutionResult, DeconvolutionProcessResult
 from .envelope_statistics import a_to_a2_ratio, average_mz, most_abundant_mz
 from .peak_dependency_network import PeakDependenceGraph, NetworkedTargetedDeconvolutionResult
@@ -235,7 +235,7 @@ def quick_charge(peak_set, index, min_charge, max_charge):
         Mass Spectrometry". Analytical Chemistry, 79(15), 5620–5632. https://doi.org/10.1021/ac0700833
     """
     min_intensity = peak_set[index].intensity / 4.
-    charges = np.zeros(max_charge, dtype=int)
+    charges = np.zeros(max_charge + 1, dtype=int)
     for j in range(index + 1, len(peak_set)):
         if peak_set[j].intensity < min_intensity:
             continue
@@ -697,17 +697,20 @@ class ChargeIterator(object):
 
     def sequence_from_quickcharge(self, peak_set, peak):
         charges = quick_charge(peak_set, peak.peak_count, abs(self.lower), abs(self.upper))
-        n = charges.shape[0]
+        # Charges are compared with :const:`ChargeNotProvided` downstream, which
+        # NumPy integers cannot do, so they are converted to plain :class:`int`
+        charges = [self.sign * int(c) for c in charges]
+        n = len(charges)
         self.index = 0
         if n == 0:
             self.size = 1
             self.values = [1 * self.sign]
-        elif charges[0] != 1:
+        elif charges[0] != self.sign:
             self.size = n + 1
-            self.values = [1 * self.sign] + list(self.sign * charges)
+            self.values = [1 * self.sign] + charges
         else:
             self.size = n
-            self.values = self.sign * charges
+            self.values = charges
 
     def __iter__(self):
         return self
@@ -732,12 +735,26 @@ class ExhaustivePeakSearchDeconvoluterBase(DeconvoluterBase):
 
     This class is not meant to be instantiated, but instead used as a mixin for classes that also
     inherit from :class:`DeconvoluterBase` and provide methods `fit_theoretical_distribution`
-    and `_fit_peaks_at_charges`
+    and `_fit_peaks_at_charges`. To support batch scoring, they must also provide
+    `_make_candidate_fits`.
 
+    Attributes
+    ----------
+    use_quick_charge : bool
+        Whether or not to use :func:`quick_charge` to prune the charge states considered
+        for each peak
+    batch_scorer : :class:`~.BatchIsotopicFitScorer` or :const:`None`
+        If not :const:`None`, candidate isotopic fits are collected first and then scored
+        together in a single vectorized pass rather than one at a time. Enabled by passing
+        ``batch_scoring=True``.
     """
     def __init__(self, peaklist, *args, **kwargs):
         super(ExhaustivePeakSearchDeconvoluterBase, self).__init__(peaklist, *args, **kwargs)
         self.use_quick_charge = kwargs.get("use_quick_charge", False)
+        if kwargs.get("batch_scoring", False):
+            self.batch_scorer = BatchIsotopicFitScorer(self.scorer)
+        else:
+            self.batch_scorer = None
 
     def _get_all_peak_charge_pairs(self, peak, error_tolerance=ERROR_TOLERANCE, charge_range=(1, 8),
                                    left_search_limit=3, right_search_limit=3,
@@ -863,11 +880,85 @@ class ExhaustivePeakSearchDeconvoluterBase(DeconvoluterBase):
             recalculate_starting_peak=recalculate_starting_peak,
             use_quick_charge=self.use_quick_charge)
 
+        if self.batch_scorer is not None:
+            candidates = self._make_candidate_fits(
+                target_peaks, error_tolerance, charge_carrier=charge_carrier, truncate_after=truncate_after,
+                ignore_below=ignore_below)
+            self.batch_scorer.score_fits(self.peaklist, candidates)
+            return self._filter_candidate_fits(candidates)
+
         results = self._fit_peaks_at_charges(
             target_peaks, error_tolerance, charge_carrier=charge_carrier, truncate_after=truncate_after,
             ignore_below=ignore_below)
         return (results)
 
+    def _collect_candidate_fits(self, peak, error_tolerance=ERROR_TOLERANCE, charge_range=(1, 8),
+                                left_search_limit=3, right_search_limit=3, recalculate_starting_peak=True,
+                                charge_carrier=PROTON, truncate_after=TRUNCATE_AFTER, ignore_below=IGNORE_BELOW):
+        """Build every candidate isotopic fit for `peak` without scoring them.
+
+        This is the first half of :meth:`_fit_all_charge_states`, used when many
+        peaks' candidates are to be scored together by :attr:`batch_scorer`.
+
+        Parameters
+        ----------
+        peak : :class:`~.FittedPeak`
+            The peak to start the search from
+        error_tolerance : float, optional
+            The parts-per-million error tolerance in m/z to search with. Defaults to |ERROR_TOLERANCE|
+        charge_range : tuple, optional
+            The range of charge states to consider. Defaults to (1, 8)
+        left_search_limit : int, optional
+            The number of steps to search to the left of `peak`. Defaults to 3
+        right_search_limit : int, optional
+            The number of steps to search to the right of `peak`. Defaults to 3
+        recalculate_starting_peak : bool, optional
+            Whether or not to re-calculate the putative starting peak m/z based upon nearby
+            peaks close to where isotopic peaks for `peak` should be. Defaults to True
+        charge_carrier : float, optional
+            The mass of the charge carrier. Defaults to |PROTON|
+        truncate_after : float, optional
+            The percent of intensity to ensure is included in a theoretical isotopic pattern
+            starting from the monoisotopic peak.
+
+        Returns
+        -------
+        list
+            The unscored :class:`~.IsotopicFitRecord` instances
+        """
+        target_peaks = self._get_all_peak_charge_pairs(
+            peak, error_tolerance=error_tolerance,
+            charge_range=charge_range,
+            left_search_limit=left_search_limit,
+            right_search_limit=right_search_limit,
+            recalculate_starting_peak=recalculate_starting_peak,
+            use_quick_charge=self.use_quick_charge)
+        return self._make_candidate_fits(
+            target_peaks, error_tolerance, charge_carrier=charge_carrier, truncate_after=truncate_after,
+            ignore_below=ignore_below)
+
+    def _filter_candidate_fits(self, candidates):
+        """Apply the same criteria as :meth:`_fit_peaks_at_charges` to a list
+        of fits which have already been scored.
+
+        Parameters
+        ----------
+        candidates : list
+            The scored :class:`~.IsotopicFitRecord` instances
+
+        Returns
+        -------
+        set
+            The set of :class:`~.IsotopicFitRecord` instances which passed
+        """
+        results = []
+        for fit in candidates:
+            fit.missed_peaks = count_placeholders(fit.experimental)
+            if not self._check_fit(fit):
+                continue
+            results.append(fit)
+        return set(results)
+
     def charge_state_determination(self, peak, error_tolerance=ERROR_TOLERANCE, charge_range=(1, 8),
                                    left_search_limit=3, right_search_limit=3,
                                    charge_carrier=PROTON, truncate_after=TRUNCATE_AFTER,
@@ -1153,6 +1244,39 @@ class AveragineDeconvoluter(AveragineDeconvoluterBase, ExhaustivePeakSearchDecon
             "averagine": self.averagine
         }
 
+    def _make_candidate_fits(self, peak_charge_set, error_tolerance, charge_carrier=PROTON,
+                             truncate_after=TRUNCATE_AFTER, ignore_below=IGNORE_BELOW):
+        """Generate, match and scale the theoretical isotopic pattern for each candidate
+        (:class:`~.FittedPeak`, charge) pair like :meth:`fit_theoretical_distribution`, but
+        leave scoring to the caller.
+
+        Parameters
+        ----------
+        peak_charge_set : set
+            The set of candidate (:class:`~.FittedPeak`, charge) tuples to try to fit
+        error_tolerance : float
+            Matching error tolerance
+        charge_carrier : float, optional
+            The charge carrier to use. Defaults to |PROTON|
+
+        Returns
+        -------
+        list
+            The unscored :class:`~.IsotopicFitRecord` instances
+        """
+        candidates = []
+        for peak, charge in peak_charge_set:
+            if peak.mz < 1:
+                continue
+            tid = self.averagine.isotopic_cluster(
+                peak.mz, charge, charge_carrier=charge_carrier,
+                truncate_after=truncate_after, ignore_below=ignore_below)
+            eid = self.match_theoretical_isotopic_distribution(
+                tid.peaklist, error_tolerance=error_tolerance)
+            self.scale_theoretical_distribution(tid, eid)
+            candidates.append(IsotopicFitRecord(peak, 0, charge, tid, eid))
+        return candidates
+
 
 class MultiAveragineDeconvoluterBase(DeconvoluterBase):
 
@@ -1234,6 +1358,40 @@ class MultiAveragineDeconvoluter(MultiAveragineDeconvoluterBase, ExhaustivePeakS
             minimum_intensity, *args, **kwargs)
         # ExhaustivePeakSearchDeconvoluterBase.__init__(self, peaklist, **kwargs)
 
+    def _make_candidate_fits(self, peak_charge_set, error_tolerance, charge_carrier=PROTON,
+                             truncate_after=TRUNCATE_AFTER, ignore_below=IGNORE_BELOW):
+        """Generate, match and scale the theoretical isotopic pattern for each candidate
+        (:class:`~.FittedPeak`, charge) pair with each averagine, but leave scoring to
+        the caller.
+
+        Parameters
+        ----------
+        peak_charge_set : set
+            The set of candidate (:class:`~.FittedPeak`, charge) tuples to try to fit
+        error_tolerance : float
+            Matching error tolerance
+        charge_carrier : float, optional
+            The charge carrier to use. Defaults to |PROTON|
+
+        Returns
+        -------
+        list
+            The unscored :class:`~.IsotopicFitRecord` instances
+        """
+        candidates = []
+        for peak, charge in peak_charge_set:
+            if peak.mz < 1:
+                continue
+            for averagine in self.averagines:
+                tid = averagine.isotopic_cluster(
+                    peak.mz, charge, charge_carrier=charge_carrier,
+                    truncate_after=truncate_after, ignore_below=ignore_below)
+                eid = self.match_theoretical_isotopic_distribution(
+                    tid.peaklist, error_tolerance=error_tolerance)
+                self.scale_theoretical_distribution(tid, eid)
+                candidates.append(IsotopicFitRecord(peak, 0, charge, tid, eid, averagine))
+        return candidates
+
 
 class PeakDependenceGraphDeconvoluterBase(ExhaustivePeakSearchDeconvoluterBase):
     """Extends the concept of :class:`ExhaustivePeakSearchDeconvoluterBase` to include a way to handle
@@ -1257,10 +1415,16 @@ class PeakDependenceGraphDeconvoluterBase(ExhaustivePeakSearchDeconvoluterBase):
     peak_dependency_network : :class:`~.PeakDependenceGraph`
         The peak dependence graph onto which isotopic fit dependences on peaks
         are constructed and solved.
+    subgraph_selection_method : str
+        How the ``"disjoint"`` subgraph solver chooses the fits of each connected component,
+        one of ``"greedy"``, ``"interval"`` or ``"branch_and_bound"``, as described by
+        :meth:`~.ConnectedSubgraph.find_heaviest_path`. Passed as ``subgraph_selection_method``,
+        defaulting to ``"greedy"``.
     """
     def __init__(self, peaklist, *args, **kwargs):
         max_missed_peaks = kwargs.get("max_missed_peaks", 1)
         self.subgraph_solver_type = kwargs.get("subgraph_solver", 'disjoint')
+        self.subgraph_selection_method = kwargs.get("subgraph_selection_method", "greedy")
         super(PeakDependenceGraphDeconvoluterBase, self).__init__(peaklist, *args, **kwargs)
         self.peak_dependency_network = PeakDependenceGraph(
             self.peaklist, maximize=self.scorer.is_maximizing())
@@ -1317,7 +1481,24 @@ class PeakDependenceGraphDeconvoluterBase(ExhaustivePeakSearchDeconvoluterBase):
         results = self._fit_all_charge_states(
             peak, error_tolerance=error_tolerance, charge_range=charge_range, left_search_limit=left_search_limit,
             charge_carrier=charge_carrier, truncate_after=truncate_after, ignore_below=ignore_below)
+        return self._add_local_fits(peak, results)
 
+    def _add_local_fits(self, peak, results):
+        """Add the best fits from `results`, the candidate fits for `peak`, to the
+        peak dependence graph as described in :meth:`_explore_local`.
+
+        Parameters
+        ----------
+        peak : :class:`~.FittedPeak`
+            The peak the search started from
+        results : set
+            The scored :class:`~.IsotopicFitRecord` instances for `peak`
+
+        Returns
+        -------
+        int
+            The number of fits added to the graph
+        """
         hold = set()
         for fit in results:
             if fit.charge > 1 and len(drop_placeholders(fit.experimental)) == 1:
@@ -1370,6 +1551,11 @@ class PeakDependenceGraphDeconvoluterBase(ExhaustivePeakSearchDeconvoluterBase):
             to be truncated, excluding trailing peaks which do not contribute substantially to
             the overall shape of the isotopic pattern.
         """
+        if self.batch_scorer is not None:
+            return self._populate_graph_batched(
+                error_tolerance=error_tolerance, charge_range=charge_range,
+                left_search_limit=left_search_limit, right_search_limit=right_search_limit,
+                charge_carrier=charge_carrier, truncate_after=truncate_after, ignore_below=ignore_below)
         for peak in self.peaklist:
             if peak in self._priority_map or peak.intensity < self.minimum_intensity:
                 continue
@@ -1379,6 +1565,33 @@ class PeakDependenceGraphDeconvoluterBase(ExhaustivePeakSearchDeconvoluterBase):
                 charge_carrier=charge_carrier,
                 truncate_after=truncate_after, ignore_below=ignore_below)
 
+    def _populate_graph_batched(self, error_tolerance=ERROR_TOLERANCE, charge_range=(1, 8), left_search_limit=1,
+                                right_search_limit=0, charge_carrier=PROTON,
+                                truncate_after=TRUNCATE_AFTER, ignore_below=IGNORE_BELOW):
+        """Populate the peak dependence graph like :meth:`populate_graph`, but collect the
+        candidate fits for every peak first and score all of them in one pass with
+        :attr:`batch_scorer`.
+
+        No signal is assigned while the graph is populated, so the fits added are the same
+        as those added by visiting each peak in turn with :meth:`_explore_local`.
+        """
+        seeds = []
+        candidates = []
+        for peak in self.peaklist:
+            if peak in self._priority_map or peak.intensity < self.minimum_intensity:
+                continue
+            start = len(candidates)
+            # Mirror the arguments :meth:`_explore_local` passes to :meth:`_fit_all_charge_states`
+            candidates.extend(self._collect_candidate_fits(
+                peak, error_tolerance=error_tolerance, charge_range=charge_range,
+                left_search_limit=left_search_limit, charge_carrier=charge_carrier,
+                truncate_after=truncate_after, ignore_below=ignore_below))
+            seeds.append((peak, start, len(candidates)))
+
+        self.batch_scorer.score_fits(self.peaklist, candidates)
+        for peak, start, end in seeds:
+            self._add_local_fits(peak, self._filter_candidate_fits(candidates[start:end]))
+
     def postprocess_fits(self, error_tolerance=ERROR_TOLERANCE, charge_range=(1, 8),
                          charge_carrier=PROTON, *args, **kwargs):
         if self.fit_postprocessor is None:
@@ -1467,7 +1680,7 @@ class PeakDependenceGraphDeconvoluterBase(ExhaustivePeakSearchDeconvoluterBase):
             The solved deconvolution solutions
 
         """
-        disjoint_best_fits = cluster.disjoint_best_fits()
+        disjoint_best_fits = cluster.disjoint_best_fits(self.subgraph_selection_method)
         i = 0
         solutions = []
         for fit in disjoint_best_fits:
@@ -2027,11 +2240,15 @@ class CompositionListPeakDependenceGraphDeconvoluter(CompositionListDeconvoluter
         times as in a multi-pass method or when peak dependence is not considered
     verbose : bool
         Produce extra logging information
+    subgraph_selection_method : str
+        How the fits of each connected component of :attr:`peak_dependency_network`
+        are chosen, as described by :meth:`~.ConnectedSubgraph.find_heaviest_path`
     '''
     def __init__(self, peaklist, composition_list, scorer,
                  use_subtraction=False, scale_method='sum',
                  verbose=False, **kwargs):
         max_missed_peaks = kwargs.get("max_missed_peaks", 1)
+        self.subgraph_selection_method = kwargs.pop("subgraph_selection_method", "greedy")
         super(CompositionListPeakDependenceGraphDeconvoluter, self).__init__(
             peaklist, composition_list, scorer=scorer, use_subtraction=use_subtraction,
             scale_method=scale_method,
@@ -2078,7 +2295,7 @@ class CompositionListPeakDependenceGraphDeconvoluter(CompositionListDeconvoluter
         disjoint_envelopes = self.peak_dependency_network.find_non_overlapping_intervals()
 
         for cluster in disjoint_envelopes:
-            for fit in cluster.disjoint_best_fits():
+            for fit in cluster.disjoint_best_fits(self.subgraph_selection_method):
                 eid = fit.experimental
                 tid = fit.theoretical
                 composition = fit.data
@@ -2156,7 +2373,8 @@ def deconvolute_peaks(peaklist, decon_config=None,
                       priority_list=None, left_search_limit=3, right_search_limit=3,
                       left_search_limit_for_priorities=None, right_search_limit_for_priorities=None,
                       verbose_priorities=False, verbose=False, charge_carrier=PROTON, truncate_after=TRUNCATE_AFTER,
-                      deconvoluter_type=AveraginePeakDependenceGraphDeconvoluter, **kwargs):
+                      deconvoluter_type=AveraginePeakDependenceGraphDeconvoluter, batch_scoring=False,
+                      **kwargs):
     """Deconvolute a centroided mass spectrum
 
     This function constructs a deconvoluter object using the ``deconvoluter_type`` argument
@@ -2203,6 +2421,11 @@ def deconvolute_peaks(peaklist, decon_config=None,
         The percentage of the isotopic pattern to include. Defaults to |TRUNCATE_AFTER|
     deconvoluter_type : type or callable, optional
         A callable returning a deconvoluter. Defaults to :class:`~.AveraginePeakDependenceGraphDeconvoluter`
+    batch_scoring : bool, optional
+        Whether to score all candidate isotopic fits together with a vectorized
+        :class:`~.BatchIsotopicFitScorer` instead of one at a time. The results are
+        the same either way. Only used by deconvoluters derived from
+        :class:`ExhaustivePeakSearchDeconvoluterBase`. Defaults to :const:`False`
     **kwargs
         Additional keywords included in ``decon_config``
 
@@ -2221,6 +2444,8 @@ def deconvolute_peaks(peaklist, decon_config=None,
     decon_config.update(kwargs)
     decon_config.setdefault("use_subtraction", True)
     decon_config.setdefault("scale_method", SCALE_METHOD)
+    if batch_scoring:
+        decon_config["batch_scoring"] = True
     decon = deconvoluter_type(peaklist=peaklist, **decon_config)
 
     if verbose_priorities or verbose:
@@ -2,6 +2,8 @@ import operator
 
 from collections import namedtuple
 
+import numpy as np
+
 from ms_deisotope.averagine import mass_charge_ratio
 
 intensity_getter = operator.attrgetter("intensity")
@@ -53,22 +55,76 @@ class CoIsolation(_CoIsolation):
         return mass_charge_ratio(self.neutral_mass, self.charge)
 
 
+class PeakIntensityIndex(object):
+    """Peaks ordered by m/z with the running total of their intensities, which
+    gives the total intensity of the peaks in any m/z interval by two binary
+    searches.
+
+    Attributes
+    ----------
+    peaks : list
+        The peaks, in ascending m/z order
+    mz_array : np.ndarray
+        The m/z of each peak
+    intensity_array : np.ndarray
+        The intensity of each peak
+    cumulative_intensity : np.ndarray
+        The total intensity of the first ``i`` peaks at position ``i``
+    """
+
+    def __init__(self, peaks):
+        self.peaks = sorted(peaks, key=mz_getter)
+        n = len(self.peaks)
+        self.mz_array = np.array([p.mz for p in self.peaks], dtype=np.float64)
+        self.intensity_array = np.array([p.intensity for p in self.peaks], dtype=np.float64)
+        self.cumulative_intensity = np.zeros(n + 1, dtype=np.float64)
+        np.cumsum(self.intensity_array, out=self.cumulative_intensity[1:])
+
+    def __len__(self):
+        return len(self.peaks)
+
+    def bounds(self, lower_bounds, upper_bounds):
+        """Find the slice of :attr:`peaks` within each of the m/z intervals,
+        including their edges.
+
+        Parameters
+        ----------
+        lower_bounds, upper_bounds : float or array-like
+            The limits of each interval
+
+        Returns
+        -------
+        starts, ends : np.ndarray
+        """
+        starts = np.searchsorted(self.mz_array, lower_bounds, side='left')
+        ends = np.searchsorted(self.mz_array, upper_bounds, side='right')
+        return starts, np.maximum(starts, ends)
+
+    def total_intensity(self, lower_bounds, upper_bounds):
+        """Sum the intensity of the peaks within each of the m/z intervals
+
+        Returns
+        -------
+        float or np.ndarray
+        """
+        starts, ends = self.bounds(lower_bounds, upper_bounds)
+        return self.cumulative_intensity[ends] - self.cumulative_intensity[starts]
+
+
 class PrecursorPurityEstimator(object):
 
     def __init__(self, lower_extension=1.5, default_width=1.5):
         self.lower_extension = lower_extension
         self.default_width = default_width
 
+    def _isolation_bounds(self, mz, isolation_window):
+        if isolation_window is None:
+            return mz - self.default_width, mz + self.default_width
+        return isolation_window.lower_bound, isolation_window.upper_bound
+
     def precursor_purity(self, scan, precursor_peak):
         peak_set = scan.peak_set
-        mz = precursor_peak.mz
-        isolation_window = scan.isolation_window
-        if isolation_window is None:
-            lower_bound = mz - self.default_width
-            upper_bound = mz + self.default_width
-        else:
-            lower_bound = isolation_window.lower_bound
-            upper_bound = isolation_window.upper_bound
+        lower_bound, upper_bound = self._isolation_bounds(precursor_peak.mz, scan.isolation_window)
         envelope = precursor_peak.envelope
         assigned = sum([p.intensity for p in envelope])
         total = sum([p.intensity for p in peak_set.between(lower_bound, upper_bound)])
@@ -79,15 +135,7 @@ class PrecursorPurityEstimator(object):
 
     def coisolation(self, scan, precursor_peak, relative_intensity_threshold=0.1, ignore_singly_charged=False):
         peak_set = scan.deconvoluted_peak_set
-        mz = precursor_peak.mz
-
-        isolation_window = scan.isolation_window
-        if isolation_window is None:
-            lower_bound = mz - self.default_width
-            upper_bound = mz + self.default_width
-        else:
-            lower_bound = isolation_window.lower_bound
-            upper_bound = isolation_window.upper_bound
+        lower_bound, upper_bound = self._isolation_bounds(precursor_peak.mz, scan.isolation_window)
         extended_lower_bound = lower_bound - self.lower_extension
 
         peaks = peak_set.between(extended_lower_bound, upper_bound, use_mz=True)
@@ -100,6 +148,75 @@ class PrecursorPurityEstimator(object):
         ]
         return others
 
+    def estimate_batch(self, scan, precursor_peaks, isolation_windows=None, relative_intensity_threshold=0.1,
+                       ignore_singly_charged=False):
+        """Estimate the purity and find the coisolating ions of many precursor ions
+        selected from the same scan at once.
+
+        The peaks of `scan` are indexed once, so that each isolation window costs
+        a binary search rather than a pass over its peaks.
+
+        Parameters
+        ----------
+        scan : :class:`~.Scan`
+            The precursor scan, with both :attr:`peak_set` and :attr:`deconvoluted_peak_set`
+        precursor_peaks : list of :class:`~.DeconvolutedPeak`
+            The deconvoluted precursor ions
+        isolation_windows : list, optional
+            The :class:`~.IsolationWindow` of each precursor ion, or :const:`None` for any whose
+            window is :attr:`default_width` around its m/z. If not provided, :attr:`scan.isolation_window`
+            is used for every precursor ion, as :meth:`__call__` does.
+        relative_intensity_threshold : float, optional
+            The fraction of the precursor ion's intensity an ion must exceed to be reported
+            as coisolating with it
+        ignore_singly_charged : bool, optional
+            Whether to omit singly charged ions from the coisolating ions
+
+        Returns
+        -------
+        list of tuple
+            The purity and the list of :class:`CoIsolation` of each precursor ion
+        """
+        n = len(precursor_peaks)
+        if n == 0:
+            return []
+        if isolation_windows is None:
+            isolation_windows = [scan.isolation_window] * n
+        lower_bounds = np.empty(n, dtype=np.float64)
+        upper_bounds = np.empty(n, dtype=np.float64)
+        for i, (peak, window) in enumerate(zip(precursor_peaks, isolation_windows)):
+            lower_bounds[i], upper_bounds[i] = self._isolation_bounds(peak.mz, window)
+
+        totals = PeakIntensityIndex(scan.peak_set).total_intensity(lower_bounds, upper_bounds).tolist()
+        deconvoluted = PeakIntensityIndex(scan.deconvoluted_peak_set)
+        starts, ends = deconvoluted.bounds(lower_bounds - self.lower_extension, upper_bounds)
+
+        results = []
+        for i, precursor_peak in enumerate(precursor_peaks):
+            total = totals[i]
+            if total == 0:
+                purity = 0
+            else:
+                purity = 1 - (sum([p.intensity for p in precursor_peak.envelope]) / total)
+            start = starts[i]
+            # Only ions above the intensity threshold need to be examined one by one
+            candidates = np.flatnonzero(
+                deconvoluted.intensity_array[start:ends[i]] > (
+                    precursor_peak.intensity * relative_intensity_threshold)) + start
+            lower_bound = lower_bounds[i]
+            others = []
+            for j in candidates.tolist():
+                p = deconvoluted.peaks[j]
+                if p == precursor_peak or p.envelope[-1].mz <= lower_bound:
+                    continue
+                if ignore_singly_charged and abs(p.charge) == 1:
+                    continue
+                others.append(CoIsolation(p.neutral_mass, p.intensity, p.charge))
+            # Report the ions in order of neutral mass, like :meth:`coisolation`
+            others.sort(key=operator.attrgetter("neutral_mass"))
+            results.append((purity, others))
+        return results
+
     def __call__(self, scan, precursor_peak):
         purity = self.precursor_purity(scan, precursor_peak)
         coisolation = self.coisolation(scan, precursor_peak)
@@ -3,7 +3,9 @@ import operator
 from collections import defaultdict
 
 from ms_deisotope.peak_dependency_network.intervals import SpanningMixin, IntervalTreeNode
-from ms_deisotope.peak_dependency_network.subgraph import GreedySubgraphSelection
+from ms_deisotope.peak_dependency_network.subgraph import (
+    GreedySubgraphSelection, IntervalSchedulingSelection, BranchAndBoundSelection,
+    peak_index_mask, masks_overlap)
 
 from .lcms_feature import EmptyFeature
 from .feature_fit import map_coord
@@ -96,9 +98,9 @@ class DependenceCluster(SpanningMixin):
         self.dependencies.sort(key=lambda x: x.score)
         self._reset()
 
-    def disjoint_subset(self):
+    def disjoint_subset(self, method="greedy"):
         graph = ConnectedSubgraph(self.dependencies, maximize=self.maximize)
-        return graph.find_heaviest_path()
+        return graph.find_heaviest_path(method)
 
     def _best_fit(self):
         """
@@ -111,15 +113,20 @@ class DependenceCluster(SpanningMixin):
         """
         return self.dependencies[0]
 
-    def disjoint_best_fits(self):
+    def disjoint_best_fits(self, method="greedy"):
         """
         Compute the best set of disjoint isotopic fits spanning this cluster
 
+        Parameters
+        ----------
+        method : str, optional
+            The subgraph solver to use, as in :meth:`ConnectedSubgraph.find_heaviest_path`
+
         Returns
         -------
         list of LCMSFeatureSetFit
         """
-        fit_sets = tuple(self.disjoint_subset())
+        fit_sets = tuple(self.disjoint_subset(method))
         best_fits = fit_sets
         return [node.fit for node in best_fits]
 
@@ -169,13 +176,16 @@ class DependenceCluster(SpanningMixin):
 class FeatureSetFitNode(SpanningMixin):
     def __init__(self, fit, index=None):
         self.fit = fit
-        self.edges = set()
+        self._edges = set()
         self.overlap_edges = set()
+        self.members = None
 
         self._hash = None
         self.score = fit.score
 
         self.feature_indices = {(f.mz, f.start_time, f.end_time) for f in fit.features if is_valid(f)}
+        self.feature_offset = None
+        self.feature_mask = None
 
         self.start = (fit.start[0], max(f.start_time for f in fit.features if is_valid(f)))
         self.end = (fit.end[0], min(f.end_time for f in fit.features if is_valid(f)))
@@ -197,23 +207,55 @@ class FeatureSetFitNode(SpanningMixin):
     def __ne__(self, other):
         return self.fit is not other.fit
 
+    @property
+    def edges(self):
+        """The nodes sharing no features with this node.
+
+        Once this node belongs to a :class:`ConnectedSubgraph`, this is every other
+        node in :attr:`members` not in :attr:`overlap_edges`, built when requested
+        rather than stored.
+        """
+        if self.members is None:
+            return self._edges
+        overlaps = self.overlap_edges
+        return {node for node in self.members if node is not self and node not in overlaps}
+
     def visit(self, other):
         if self.isdisjoint(other):
-            self.edges.add(other)
-            other.edges.add(self)
+            self._edges.add(other)
+            other._edges.add(self)
         else:
             self.overlap_edges.add(other)
             other.overlap_edges.add(self)
 
+    def index_features(self, feature_ids):
+        """Pack :attr:`feature_indices` into a bitmask for fast overlap tests.
+
+        Parameters
+        ----------
+        feature_ids : dict
+            A mapping from each feature key to a unique integer, shared by every
+            node to be compared with this one
+        """
+        self.feature_offset, self.feature_mask = peak_index_mask(
+            feature_ids[key] for key in self.feature_indices)
+
     def isdisjoint(self, other):
-        return self.feature_indices.isdisjoint(other.feature_indices)
+        if self.feature_mask is None or other.feature_mask is None:
+            return self.feature_indices.isdisjoint(other.feature_indices)
+        return not masks_overlap(
+            self.feature_offset, self.feature_mask, other.feature_offset, other.feature_mask)
 
     def __repr__(self):
         return "FeatureSetFitNode(%r)" % self.fit
 
     @staticmethod
     def overlap(a, b):
-        return len(a.feature_indices & b.feature_indices) > 0
+        return not a.isdisjoint(b)
+
+    @staticmethod
+    def mz_span(node):
+        return node.start[0], node.end[0]
 
 
 class ConnectedSubgraph(object):
@@ -224,6 +266,7 @@ class ConnectedSubgraph(object):
         for node in self.nodes:
             node.index = i
             i += 1
+        self._index_features()
         self.populate_edges()
 
     def __getitem__(self, i):
@@ -235,22 +278,61 @@ class ConnectedSubgraph(object):
     def __len__(self):
         return len(self.nodes)
 
+    def _index_features(self):
+        # Numbering the features in m/z order keeps each node's features close
+        # together, and so its bitmask short
+        keys = set()
+        for node in self.nodes:
+            keys.update(node.feature_indices)
+        feature_ids = {key: i for i, key in enumerate(sorted(keys))}
+        for node in self.nodes:
+            node.index_features(feature_ids)
+
     def populate_edges(self):
-        for i in range(len(self.nodes)):
-            node = self.nodes[i]
-            for j in range(len(self.nodes)):
-                if i == j:
-                    continue
-                other = self.nodes[j]
-                node.visit(other)
+        # Two nodes can only share a feature if their m/z spans overlap, so sweeping
+        # over the nodes in order of their start, each node need only visit the
+        # nodes starting before it ends. Every pair skipped is disjoint. Only the
+        # overlapping pairs are stored, the disjoint pairs are implied by them.
+        nodes = sorted(self.nodes, key=FeatureSetFitNode.mz_span)
+        n = len(nodes)
+        for i in range(n):
+            node = nodes[i]
+            node.members = self.nodes
+            end = node.end[0]
+            for j in range(i + 1, n):
+                other = nodes[j]
+                if other.start[0] > end:
+                    break
+                if not node.isdisjoint(other):
+                    node.overlap_edges.add(other)
+                    other.overlap_edges.add(node)
 
     def find_heaviest_path(self, method="greedy"):
+        """Select a set of nodes which do not share any features.
+
+        Parameters
+        ----------
+        method : str, optional
+            The solver to use. ``"greedy"`` takes nodes in order of score, ``"interval"``
+            solves the weighted interval scheduling problem over the nodes' m/z spans,
+            ignoring time, and ``"branch_and_bound"`` searches for the best set of nodes
+            sharing no features
+
+        Returns
+        -------
+        list of :class:`FeatureSetFitNode`
+        """
         if len(self) == 1:
             return set(self.nodes)
         if method == "greedy":
             solution = GreedySubgraphSelection.solve(
                 tuple(self), maximize=self.maximize, overlap_fn=FeatureSetFitNode.overlap)
             return solution
+        elif method == "interval":
+            return IntervalSchedulingSelection.solve(
+                tuple(self), maximize=self.maximize, span_fn=FeatureSetFitNode.mz_span)
+        elif method == "branch_and_bound":
+            return BranchAndBoundSelection.solve(tuple(self), maximize=self.maximize)
         else:
             raise NotImplementedError(method)
 
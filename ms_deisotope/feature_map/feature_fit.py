@@ -87,6 +87,10 @@ class LCMSFeatureSetFit(object):
     def npeaks(self):
         return len(self)
 
+    @property
+    def n_points(self):
+        return len(self.scores)
+
     def __repr__(self):
         return "LCMSFeatureSetFit(score=%0.5f, charge=%d, size=%d, monoisotopic_mz=%0.5f, %0.2f-%0.2f)" % (
             self.score, self.charge, len(self), self.monoisotopic_feature.mz,
@@ -1,7 +1,17 @@
+import os
+import heapq
+import pickle
+import tempfile
+
 from collections import defaultdict
+
+import numpy as np
+
 from .lcms_feature import LCMSFeature
+from .spatial_index import PackedRTree
 from ms_deisotope.data_source.common import ProcessedScan
 from ms_deisotope import DeconvolutedPeakSet
+from ms_deisotope.utils import ppm_search_intervals, ppm_search_nearest
 from ms_peak_picker import PeakSet
 
 
@@ -59,6 +69,79 @@ class LCMSFeatureMap(object):
             lo_ix = len(self) - 1
         return self[lo_ix:hi_ix]
 
+    def search_intervals(self, mzs, error_tolerance=2e-5):
+        """Find the range of features matching each of `mzs` within `error_tolerance`
+        PPM error, searching for all of them at once.
+
+        Parameters
+        ----------
+        mzs : array-like
+            The m/z values to search for
+        error_tolerance : float, optional
+            The PPM error tolerance to use
+
+        Returns
+        -------
+        starts : np.ndarray
+            The position of the first matching feature for each query
+        ends : np.ndarray
+            One past the position of the last matching feature for each query
+        """
+        return ppm_search_intervals(_attribute_array(self.features, 'mz'), mzs, error_tolerance)
+
+    def search_many(self, mzs, error_tolerance=2e-5):
+        """Find the feature nearest to each of `mzs` within `error_tolerance` PPM error.
+
+        Parameters
+        ----------
+        mzs : array-like
+            The m/z values to search for
+        error_tolerance : float, optional
+            The PPM error tolerance to use
+
+        Returns
+        -------
+        list
+            The best matching feature for each query, or :const:`None`
+        """
+        indices = ppm_search_nearest(_attribute_array(self.features, 'mz'), mzs, error_tolerance)
+        return [self.features[i] if i >= 0 else None for i in indices.tolist()]
+
+    def find_all_many(self, mzs, error_tolerance=2e-5):
+        """Find all features matching each of `mzs` within `error_tolerance` PPM error.
+
+        Parameters
+        ----------
+        mzs : array-like
+            The m/z values to search for
+        error_tolerance : float, optional
+            The PPM error tolerance to use
+
+        Returns
+        -------
+        list of list
+            The matching features for each query
+        """
+        starts, ends = self.search_intervals(mzs, error_tolerance)
+        return [self.features[i:j] for i, j in zip(starts.tolist(), ends.tolist())]
+
+    def build_spatial_index(self, node_size=16):
+        """Build a :class:`~.PackedRTree` over the m/z and elution time range of the
+        features, to search both dimensions at once.
+
+        The index is not updated when the features change.
+
+        Parameters
+        ----------
+        node_size : int, optional
+            The largest number of children of each node of the tree
+
+        Returns
+        -------
+        :class:`~.PackedRTree`
+        """
+        return PackedRTree.from_features(self.features, use_mz=True, node_size=node_size)
+
     def __repr__(self):
         return "{self.__class__.__name__}(<{size} features>)".format(self=self, size=len(self))
 
@@ -134,6 +217,7 @@ class LCMSFeatureForest(LCMSFeatureMap):
             feature.insert(peak, scan_time)
             self.insert_feature(feature, index)
         self.count += 1
+        return feature
 
     def insert_feature(self, feature, index):
         if index[0] != 0:
@@ -158,6 +242,234 @@ class LCMSFeatureForest(LCMSFeatureMap):
         self.features = smooth_overlaps(self.features, self.error_tolerance)
 
 
+class StreamingLCMSFeatureForest(object):
+    """Aggregate peaks into features like :class:`LCMSFeatureForest`, but one scan at a time,
+    keeping only the features which can still be extended in memory.
+
+    Scans must be added in order of increasing time. A feature which has gone more than
+    :attr:`maximum_time_gap` without a new peak can no longer be extended, because any
+    later peak would be split from it by :meth:`LCMSFeature.split_sparse` anyway, so it is
+    removed from the active feature index and handed back to the caller, who can yield it
+    downstream or spill it to disk with :class:`FeatureSpillStore`. Memory use is bounded
+    by the number of features eluting at once, rather than the length of the run.
+
+    Features which close at the same time and are within :attr:`error_tolerance` of each
+    other and overlap in time are merged as :func:`smooth_overlaps` does for a complete forest.
+
+    Examples
+    --------
+    >>> forest = StreamingLCMSFeatureForest(error_tolerance=2e-5, maximum_time_gap=0.25)
+    >>> store = FeatureSpillStore()
+    >>> store.extend(forest.extract_features(scans))  # doctest: +SKIP
+
+    Attributes
+    ----------
+    active : :class:`LCMSFeatureForest`
+        The features which may still be extended, ordered by m/z
+    error_tolerance : float
+        The mass error tolerance between peaks and possible features (in ppm)
+    maximum_time_gap : float
+        The longest time a feature may go without a new peak and still be extended
+    minimum_mz : float
+        Peaks below this m/z are ignored
+    maximum_mz : float
+        Peaks above this m/z are ignored
+    minimum_intensity : float
+        Peaks below this intensity are ignored
+    last_time : float
+        The time of the last scan added
+    count : int
+        The number of peaks accumulated
+    features_closed : int
+        The number of features handed back so far
+    max_active_features : int
+        The largest number of features held in :attr:`active` at once
+    """
+
+    def __init__(self, error_tolerance=1e-5, maximum_time_gap=0.25, minimum_mz=160, minimum_intensity=500.,
+                 maximum_mz=float('inf')):
+        self.active = LCMSFeatureForest(error_tolerance=error_tolerance)
+        self.error_tolerance = error_tolerance
+        self.maximum_time_gap = maximum_time_gap
+        self.minimum_mz = minimum_mz
+        self.maximum_mz = maximum_mz
+        self.minimum_intensity = minimum_intensity
+        self.last_time = None
+        self.count = 0
+        self.features_closed = 0
+        self.max_active_features = 0
+        # A min-heap of (end time, sequence number, feature). A feature which was extended
+        # after its entry was pushed is re-pushed with its new end time when its stale entry
+        # reaches the top, so extending a feature never touches the heap.
+        self._end_time_heap = []
+        self._sequence = 0
+
+    def __len__(self):
+        return len(self.active)
+
+    def _track(self, feature):
+        heapq.heappush(self._end_time_heap, (feature.end_time, self._sequence, feature))
+        self._sequence += 1
+
+    def _close_features(self, time):
+        horizon = time - self.maximum_time_gap
+        heap = self._end_time_heap
+        closing = []
+        while heap and heap[0][0] < horizon:
+            end_time, _, feature = heapq.heappop(heap)
+            if feature.end_time != end_time:
+                self._track(feature)
+            else:
+                closing.append(feature)
+        if not closing:
+            return closing
+        closing_ids = set(map(id, closing))
+        self.active.features = [f for f in self.active.features if id(f) not in closing_ids]
+        if len(closing) > 1:
+            closing = smooth_overlaps(closing, self.error_tolerance)
+        self.features_closed += len(closing)
+        return closing
+
+    def add_peaks(self, peaks, time):
+        """Add the peaks of one scan.
+
+        Parameters
+        ----------
+        peaks : Iterable of :class:`~.FittedPeak`
+            The peaks of the scan
+        time : float
+            The time of the scan, which may not be earlier than the previous scan
+
+        Returns
+        -------
+        list of :class:`~.LCMSFeature`
+            The features which can no longer be extended, now that this scan was added
+        """
+        if self.last_time is not None and time < self.last_time:
+            raise ValueError("Scans must be added in time order, but %r came after %r" % (time, self.last_time))
+        self.last_time = time
+        closed = self._close_features(time)
+        n_features = len(self.active)
+        for peak in peaks:
+            if peak.mz < self.minimum_mz or peak.mz > self.maximum_mz or peak.intensity < self.minimum_intensity:
+                continue
+            feature = self.active.handle_peak(peak, time)
+            self.count += 1
+            if len(self.active) > n_features:
+                n_features += 1
+                self._track(feature)
+        if n_features > self.max_active_features:
+            self.max_active_features = n_features
+        return closed
+
+    def add_scan(self, scan):
+        """Add the peaks of `scan`, using its :attr:`peak_set` and :attr:`scan_time`.
+
+        Returns
+        -------
+        list of :class:`~.LCMSFeature`
+            The features which can no longer be extended, now that this scan was added
+        """
+        return self.add_peaks(scan.peak_set, scan.scan_time)
+
+    def complete(self):
+        """Close all remaining features, at the end of the run.
+
+        Returns
+        -------
+        list of :class:`~.LCMSFeature`
+        """
+        closing = self.active.features
+        self.active.features = []
+        self._end_time_heap = []
+        if len(closing) > 1:
+            closing = smooth_overlaps(closing, self.error_tolerance)
+        self.features_closed += len(closing)
+        return closing
+
+    def extract_features(self, scans):
+        """Aggregate the peaks of `scans`, yielding each feature as soon as it is complete.
+
+        Parameters
+        ----------
+        scans : Iterable of :class:`~.ProcessedScan`
+            The scans to aggregate, in time order, with centroided peaks
+
+        Yields
+        ------
+        :class:`~.LCMSFeature`
+        """
+        for scan in scans:
+            for feature in self.add_scan(scan):
+                yield feature
+        for feature in self.complete():
+            yield feature
+
+
+class FeatureSpillStore(object):
+    """An append-only file of pickled features, so that features can be moved out
+    of memory as they are completed and read back later, one at a time.
+
+    Attributes
+    ----------
+    path : str
+        The path to the file features are written to
+    """
+
+    def __init__(self, path=None):
+        self._owns_file = path is None
+        if path is None:
+            handle, path = tempfile.mkstemp(suffix=".features")
+            os.close(handle)
+        self.path = path
+        self.handle = open(path, 'wb')
+        self._count = 0
+
+    def add(self, feature):
+        pickle.dump(feature, self.handle, -1)
+        self._count += 1
+
+    def extend(self, features):
+        for feature in features:
+            self.add(feature)
+
+    def __len__(self):
+        return self._count
+
+    def __iter__(self):
+        self.handle.flush()
+        with open(self.path, 'rb') as handle:
+            for _ in range(self._count):
+                yield pickle.load(handle)
+
+    def to_feature_map(self):
+        """Read every feature back into memory
+
+        Returns
+        -------
+        :class:`LCMSFeatureMap`
+        """
+        return LCMSFeatureMap(list(self))
+
+    def close(self):
+        """Close the file, removing it if it was a temporary file created by this object"""
+        self.handle.close()
+        if self._owns_file:
+            try:
+                os.remove(self.path)
+            except OSError:
+                pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def __repr__(self):
+        return "{self.__class__.__name__}({self.path!r}, <{size} features>)".format(self=self, size=len(self))
+
+
 def smooth_overlaps(feature_list, error_tolerance=1e-5):
     feature_list = sorted(feature_list, key=lambda x: x.mz)
     out = []
@@ -439,6 +751,10 @@ def search_sweep_neutral(array, neutral_mass, error_tolerance=1e-5):
     return 0, 0
 
 
+def _attribute_array(features, attribute):
+    return np.array([getattr(feature, attribute) for feature in features], dtype=np.float64)
+
+
 class DeconvolutedLCMSFeatureMap(object):
 
     def __init__(self, features):
@@ -519,6 +835,97 @@ class DeconvolutedLCMSFeatureMap(object):
                 lo_ix = len(self) - 1
             return self[lo_ix:hi_ix]
 
+    def _search_array(self, use_mz=False):
+        if use_mz:
+            return _attribute_array(self._by_mz, 'mz')
+        return _attribute_array(self.features, 'neutral_mass')
+
+    def search_intervals(self, masses, error_tolerance=2e-5, use_mz=False):
+        """Find the range of features matching each of `masses` within `error_tolerance`
+        PPM error, searching for all of them at once.
+
+        If `use_mz` is :const:`True`, the ranges are positions in the m/z ordering
+        instead of the neutral mass ordering.
+
+        Parameters
+        ----------
+        masses : array-like
+            The neutral masses, or m/z values, to search for
+        error_tolerance : float, optional
+            The PPM error tolerance to use
+        use_mz : bool, optional
+            Whether to search using m/z instead of neutral mass
+
+        Returns
+        -------
+        starts : np.ndarray
+            The position of the first matching feature for each query
+        ends : np.ndarray
+            One past the position of the last matching feature for each query
+        """
+        return ppm_search_intervals(self._search_array(use_mz), masses, error_tolerance)
+
+    def search_many(self, masses, error_tolerance=2e-5, use_mz=False):
+        """Find the feature nearest to each of `masses` within `error_tolerance` PPM error.
+
+        Parameters
+        ----------
+        masses : array-like
+            The neutral masses, or m/z values, to search for
+        error_tolerance : float, optional
+            The PPM error tolerance to use
+        use_mz : bool, optional
+            Whether to search using m/z instead of neutral mass
+
+        Returns
+        -------
+        list
+            The best matching feature for each query, or :const:`None`
+        """
+        collection = self._by_mz if use_mz else self.features
+        indices = ppm_search_nearest(self._search_array(use_mz), masses, error_tolerance)
+        return [collection[i] if i >= 0 else None for i in indices.tolist()]
+
+    def find_all_many(self, masses, error_tolerance=2e-5, use_mz=False):
+        """Find all features matching each of `masses` within `error_tolerance` PPM error.
+
+        Parameters
+        ----------
+        masses : array-like
+            The neutral masses, or m/z values, to search for
+        error_tolerance : float, optional
+            The PPM error tolerance to use
+        use_mz : bool, optional
+            Whether to search using m/z instead of neutral mass
+
+        Returns
+        -------
+        list of list
+            The matching features for each query
+        """
+        collection = self._by_mz if use_mz else self.features
+        starts, ends = self.search_intervals(masses, error_tolerance, use_mz)
+        return [collection[i:j] for i, j in zip(starts.tolist(), ends.tolist())]
+
+    def build_spatial_index(self, use_mz=False, node_size=16):
+        """Build a :class:`~.PackedRTree` over the neutral mass, or m/z, and elution
+        time range of the features, to search both dimensions at once.
+
+        The index is not updated when the features change.
+
+        Parameters
+        ----------
+        use_mz : bool, optional
+            Whether to index m/z instead of neutral mass
+        node_size : int, optional
+            The largest number of children of each node of the tree
+
+        Returns
+        -------
+        :class:`~.PackedRTree`
+        """
+        return PackedRTree.from_features(self.features, use_mz=use_mz, node_size=node_size)
+
     def __repr__(self):
         return "{self.__class__.__name__}(<{size} features>)".format(self=self, size=len(self))
 
@@ -552,6 +959,9 @@ def convert_map_to_scan_peak_list(feature_map, peak_loader, time_precision=4, de
 
 
 class _FeatureIndex(object):
+    _attribute = None
+    _values = None
+
     def __iter__(self):
         return iter(self.features)
 
@@ -570,10 +980,53 @@ class _FeatureIndex(object):
     def __repr__(self):
         return "{self.__class__.__name__}(<{size} features>)".format(self=self, size=len(self))
 
+    def search_intervals(self, values, error_tolerance=2e-5):
+        """Find the range of features matching each of `values` within `error_tolerance`
+        PPM error, searching for all of them at once.
+
+        Parameters
+        ----------
+        values : array-like
+            The values to search for
+        error_tolerance : float, optional
+            The PPM error tolerance to use
+
+        Returns
+        -------
+        starts : np.ndarray
+            The position of the first matching feature for each query
+        ends : np.ndarray
+            One past the position of the last matching feature for each query
+        """
+        if self._values is None:
+            self._values = _attribute_array(self.features, self._attribute)
+        return ppm_search_intervals(self._values, values, error_tolerance)
+
+    def find_all_many(self, values, error_tolerance=2e-5):
+        """Find all features matching each of `values` within `error_tolerance` PPM error.
+
+        Parameters
+        ----------
+        values : array-like
+            The values to search for
+        error_tolerance : float, optional
+            The PPM error tolerance to use
+
+        Returns
+        -------
+        list of list
+            The matching features for each query
+        """
+        starts, ends = self.search_intervals(values, error_tolerance)
+        return [self.features[i:j] for i, j in zip(starts.tolist(), ends.tolist())]
+
 
 class MZIndex(_FeatureIndex):
+    _attribute = 'mz'
+
     def __init__(self, features):
         self.features = sorted(features, key=lambda x: x.mz)
+        self._values = None
 
     def find_all(self, mz, error_tolerance=2e-5):
         bounds = search_sweep(self.features, mz, error_tolerance)
@@ -585,8 +1038,11 @@ class MZIndex(_FeatureIndex):
 
 
 class NeutralMassIndex(_FeatureIndex):
+    _attribute = 'neutral_mass'
+
     def __init__(self, features):
         self.features = sorted(features, key=lambda x: x.neutral_mass)
+        self._values = None
 
     def find_all(self, mass, error_tolerance=2e-5):
         bounds = search_sweep_neutral(self.features, mass, error_tolerance)
@@ -1,3 +1,7 @@
+import copy
+import multiprocessing
+
+from bisect import bisect_left, bisect_right
 from collections import defaultdict
 from itertools import product
 
@@ -16,8 +20,9 @@ from .feature_fit import (
     LCMSFeatureSetFit,
     DeconvolutedLCMSFeatureTreeNode,
     DeconvolutedLCMSFeature)
-from .dependence_network import FeatureDependenceGraph
+from .dependence_network import FeatureDependenceGraph, is_valid
 from .profile_transform import binsearch, smooth_leveled
+from .spatial_index import PackedRTree
 from ms_deisotope.peak_dependency_network.intervals import Interval, IntervalTreeNode
 from ms_deisotope.averagine import AveragineCache, PROTON, isotopic_shift
 from ms_deisotope.deconvolution import (
@@ -53,18 +58,9 @@ class LCMSFeatureProcessorBase(object):
     def create_theoretical_distribution(self, mz, charge, charge_carrier=PROTON, truncate_after=0.8,
                                         ignore_below=0.05):
         base_tid = self.averagine.isotopic_cluster(
-            mz, charge, truncate_after=truncate_after, charge_carrier=charge_carrier)
-        total = 0
-        kept_tid = []
-        for i, p in enumerate(base_tid):
-            if p.intensity < ignore_below and i > 1:
-                continue
-            else:
-                total += p.intensity
-                kept_tid.append(p)
-        for p in kept_tid:
-            p.intensity /= total
-        return kept_tid
+            mz, charge, truncate_after=truncate_after, ignore_below=ignore_below,
+            charge_carrier=charge_carrier)
+        return base_tid
 
     def find_all_features(self, mz, error_tolerance=2e-5):
         return self.feature_map.find_all(mz, error_tolerance)
@@ -82,6 +78,8 @@ class LCMSFeatureProcessorBase(object):
 
     def _find_thresholded_score(self, scores, percentage):
         scores = np.array(scores)
+        if len(scores) == 0:
+            return 0
         maximum = scores.max()
         threshold = maximum * percentage
         return scores[scores > threshold].mean()
@@ -90,7 +88,8 @@ class LCMSFeatureProcessorBase(object):
                          charge_carrier=PROTON, truncate_after=0.8, max_missed_peaks=1,
                          threshold_scale=0.3, feature=None):
         base_tid = self.create_theoretical_distribution(mz, charge, charge_carrier, truncate_after)
-        feature_groups = self.match_theoretical_isotopic_distribution(base_tid, error_tolerance, interval=feature)
+        feature_groups = self.match_theoretical_isotopic_distribution(
+            base_tid.truncated_tid, error_tolerance, interval=feature)
         feature_fits = []
         for features in product(*feature_groups):
             if all(f is None for f in features):
@@ -105,7 +104,7 @@ class LCMSFeatureProcessorBase(object):
             times = []
             counter = 0
             for eid in feat_iter:
-                cleaned_eid, tid, n_missing = self.conform_envelopes(eid, base_tid)
+                cleaned_eid, tid, n_missing = self.conform_envelopes(eid, base_tid.truncated_tid)
                 if n_missing > max_missed_peaks:
                     continue
                 score = self.scorer.evaluate(None, cleaned_eid, tid)
@@ -120,10 +119,10 @@ class LCMSFeatureProcessorBase(object):
                 if f is None:
                     missing_features += 1
             fit = LCMSFeatureSetFit(
-                features, base_tid, final_score, charge, missing_features,
+                features, base_tid, final_score, charge,
                 neutral_mass=neutral_mass(features[0].mz, charge, charge_carrier),
                 missing_features=missing_features,
-                scores=scores, times=times)
+                scores=np.array(scores), times=np.array(times))
             if self.scorer.reject_score(fit.score):
                 continue
             feature_fits.append(fit)
@@ -271,9 +270,87 @@ class PrecursorMap(object):
         return pinfo
 
 
+def feature_key(feature):
+    """A key which identifies `feature` across processes, the same
+    one :class:`~.FeatureSetFitNode` uses to compare features.
+    """
+    return (feature.mz, feature.start_time, feature.end_time)
+
+
+class FeatureMapPartition(object):
+    """A slab of an :class:`~.LCMSFeatureMap` covering a range of m/z
+    which can be searched for isotopic pattern fits on its own.
+
+    Attributes
+    ----------
+    start_mz : float
+        The lowest m/z of a feature to seed fits from
+    end_mz : float
+        The m/z of a feature to stop seeding fits at, exclusive
+    features : list of :class:`~.LCMSFeature`
+        The features between `start_mz` and `end_mz`, and the features
+        in the margins on either side which the isotopic patterns fit
+        to those features may reach
+    """
+
+    def __init__(self, start_mz, end_mz, features):
+        self.start_mz = start_mz
+        self.end_mz = end_mz
+        self.features = features
+
+    def is_seed(self, feature):
+        return self.start_mz <= feature.mz < self.end_mz
+
+    def __len__(self):
+        return len(self.features)
+
+    def __repr__(self):
+        return "FeatureMapPartition(%0.3f, %0.3f, %d)" % (self.start_mz, self.end_mz, len(self))
+
+
+class _PartitionFitCollector(object):
+    """Collects the fits seeded by the features of a :class:`FeatureMapPartition`
+    in a worker process.
+
+    Each partition is processed by a copy of `processor`, a processor configured
+    like the one which made the partitions, but holding no features of its own,
+    so that the worker uses the same :class:`~.AveragineCache` and any behavior
+    overridden by a subclass.
+
+    The fits are returned with each of their features replaced by its
+    :func:`feature_key`, so that they can be matched to the features of the
+    original feature map without sending the features back.
+    """
+
+    def __init__(self, processor, fit_args):
+        self.processor = processor
+        self.fit_args = fit_args
+
+    def __call__(self, partition):
+        # The partition's features are already this process's own copies,
+        # so they do not need to be cloned again
+        processor = copy.copy(self.processor)
+        processor.feature_map = LCMSFeatureMap(partition.features)
+        processor.orphaned_nodes = []
+        processor.build_dependence_network()
+        n_seeds = 0
+        for feature in sorted(processor.feature_map, key=lambda x: x.mz, reverse=True):
+            if not partition.is_seed(feature):
+                continue
+            processor.charge_state_determination(feature, **self.fit_args)
+            n_seeds += 1
+        packed = []
+        for fit in processor.dependence_network.dependencies:
+            keys = [feature_key(f) if is_valid(f) else f for f in fit.features]
+            packed.append((
+                keys, fit.theoretical, fit.score, fit.charge, fit.missing_features,
+                fit.neutral_mass, fit.scores, fit.times))
+        return n_seeds, packed
+
+
 class LCMSFeatureProcessor(LCMSFeatureProcessorBase):
     def __init__(self, feature_map, averagine, scorer, precursor_map=None, minimum_size=3,
-                 maximum_time_gap=0.25):
+                 maximum_time_gap=0.25, subgraph_selection_method="greedy"):
         if precursor_map is None:
             precursor_map = PrecursorMap({})
         self.feature_map = LCMSFeatureMap([f.clone(deep=True) for f in feature_map])
@@ -283,12 +360,13 @@ class LCMSFeatureProcessor(LCMSFeatureProcessorBase):
         self.minimum_size = minimum_size
         self.maximum_time_gap = maximum_time_gap
         self.dependence_network = FeatureDependenceGraph(self.feature_map)
+        self.subgraph_selection_method = subgraph_selection_method
         self.orphaned_nodes = []
 
     def select_best_disjoint_subgraphs(self, disjoint_envelopes):
         solutions = []
         for cluster in disjoint_envelopes:
-            disjoint_best_fits = cluster.disjoint_best_fits()
+            disjoint_best_fits = cluster.disjoint_best_fits(self.subgraph_selection_method)
             for fit in disjoint_best_fits:
                 solutions.append(fit)
         return solutions
@@ -532,42 +610,182 @@ class LCMSFeatureProcessor(LCMSFeatureProcessorBase):
     def build_dependence_network(self):
         self.dependence_network = FeatureDependenceGraph(self.feature_map)
 
+    def _partition_margins(self, mz, charge_range=(1, 8), left_search=1, right_search=0,
+                           charge_carrier=PROTON, truncate_after=0.95, error_tolerance=2e-5):
+        lower = 0
+        upper = 0
+        for charge in charge_range_(*charge_range):
+            shift = abs(isotopic_shift(charge))
+            lower = max(lower, left_search * shift)
+            tid = self.create_theoretical_distribution(
+                mz + right_search * shift, charge, charge_carrier, truncate_after)
+            upper = max(upper, right_search * shift + tid[-1].mz - tid[0].mz)
+        # Leave room for the matching tolerance of the peaks at either end
+        slack = 2 * mz * error_tolerance
+        return lower + slack, upper + slack
+
+    def partition_feature_map(self, n_partitions, error_tolerance=2e-5, charge_range=(1, 8),
+                              left_search=1, right_search=0, charge_carrier=PROTON,
+                              truncate_after=0.95):
+        """Split :attr:`feature_map` into at most `n_partitions` m/z slabs holding
+        similar numbers of features, each with margins wide enough to contain every
+        feature that a fit seeded in the slab can use.
+
+        Collecting the fits seeded by each slab's own features on just that slab's
+        features gives the same fits as collecting them on the whole map.
+
+        Parameters
+        ----------
+        n_partitions : int
+            The number of slabs to make
+        error_tolerance : float, optional
+            Permitted parts-per-million mass accuracy
+        charge_range : tuple, optional
+            The range of charge states fits will be sought at
+        left_search : int, optional
+            The number of peaks to the left of a seed feature fits will be sought from
+        right_search : int, optional
+            The number of peaks to the right of a seed feature fits will be sought from
+        charge_carrier : float, optional
+            Mass of the charge carrier
+        truncate_after : float, optional
+            Fraction of the total isotopic pattern to include
+
+        Returns
+        -------
+        list of :class:`FeatureMapPartition`
+        """
+        features = self.feature_map.features
+        n = len(features)
+        if n == 0:
+            return []
+        mzs = [f.mz for f in features]
+        n_partitions = max(min(n_partitions, n), 1)
+        partitions = []
+        start = 0
+        k = 0
+        while start < n:
+            k += 1
+            end = max(int(round(float(n) * k / n_partitions)), start + 1)
+            # Never split features with the same m/z between two slabs
+            while end < n and mzs[end] == mzs[end - 1]:
+                end += 1
+            start_mz = mzs[start] if start > 0 else -float('inf')
+            end_mz = mzs[end] if end < n else float('inf')
+            lower, upper = self._partition_margins(
+                mzs[end - 1], charge_range, left_search, right_search, charge_carrier,
+                truncate_after, error_tolerance)
+            lo = bisect_left(mzs, mzs[start] - lower)
+            hi = bisect_right(mzs, mzs[end - 1] + upper)
+            partitions.append(FeatureMapPartition(start_mz, end_mz, features[lo:hi]))
+            start = end
+        return partitions
+
+    def collect_fits_in_partitions(self, n_processes, error_tolerance=2e-5, charge_range=(1, 8),
+                                   left_search=1, right_search=0, charge_carrier=PROTON,
+                                   truncate_after=0.95, max_missed_peaks=1, threshold_scale=0.3,
+                                   partitions_per_process=4, callback=None):
+        """Collect the fits of every feature in :attr:`feature_map` into :attr:`dependence_network`
+        like calling :meth:`charge_state_determination` on each feature, but searching the m/z slabs
+        made by :meth:`partition_feature_map` in a pool of `n_processes` worker processes.
+
+        The workers search with copies of this processor, without its features, so they
+        share its configuration, its :attr:`averagine` cache and any overridden methods.
+
+        Parameters
+        ----------
+        n_processes : int
+            The number of worker processes to use
+        partitions_per_process : int, optional
+            The number of slabs to make per worker process. More slabs balance uneven
+            regions of the map better, at the cost of copying more margin features
+        callback : callable, optional
+            Called with the number of features whose fits have been collected so far
+            after each slab is finished
+
+        Returns
+        -------
+        int
+            The number of fits collected
+        """
+        partitions = self.partition_feature_map(
+            n_processes * partitions_per_process, error_tolerance=error_tolerance,
+            charge_range=charge_range, left_search=left_search, right_search=right_search,
+            charge_carrier=charge_carrier, truncate_after=truncate_after)
+        # Visit the slabs from high m/z to low, in the same order the features are visited serially
+        partitions.reverse()
+        # Send the workers this processor without its features, which they receive by partition
+        template = copy.copy(self)
+        template.feature_map = LCMSFeatureMap([])
+        template.orphaned_nodes = []
+        template.build_dependence_network()
+        task = _PartitionFitCollector(
+            template, dict(
+                error_tolerance=error_tolerance, charge_range=charge_range, left_search=left_search,
+                right_search=right_search, charge_carrier=charge_carrier, truncate_after=truncate_after,
+                max_missed_peaks=max_missed_peaks, threshold_scale=threshold_scale))
+        index = {feature_key(f): f for f in self.feature_map}
+        n_fits = 0
+        n_seeds = 0
+        pool = multiprocessing.Pool(n_processes)
+        try:
+            for partition_seeds, packed in pool.imap(task, partitions):
+                for keys, theoretical, score, charge, missing_features, neutral_mass, scores, times in packed:
+                    features = [index[k] if isinstance(k, tuple) else k for k in keys]
+                    fit = LCMSFeatureSetFit(
+                        features, theoretical, score, charge, missing_features,
+                        neutral_mass=neutral_mass, scores=scores, times=times)
+                    self.dependence_network.add_fit_dependence(fit)
+                    n_fits += 1
+                n_seeds += partition_seeds
+                if callback is not None:
+                    callback(n_seeds)
+        finally:
+            pool.close()
+            pool.join()
+        return n_fits
+
     def _map_precursors(self, error_tolerance):
         printer("\tConstructing Precursor Seeds")
         rt_map = RTMap(self.feature_map)
-        cache = dict()
         seeds = set()
 
         for key, pinfo in (self.precursor_map.mapping.items()):
             time, ix = key
-            try:
-                candidates = cache[time]
-            except KeyError:
-                candidates = rt_map.rt_tree.contains_point(time)
-                cache[time] = candidates
-            mz = pinfo["mz"]
-            hits = [c.members[0] for c in candidates if c.contains_mz(mz, error_tolerance)]
-            seeds.update(hits)
+            seeds.update(rt_map.find_features(pinfo["mz"], time, error_tolerance))
         return seeds
 
     def _make_iterator_state(self, error_tolerance=2e-5, charge_range=(1, 8), left_search=1, right_search=0,
                              charge_carrier=PROTON, truncate_after=0.95, maxiter=10, minimum_intensity=100,
                              convergence=0.01, max_missed_peaks=1, threshold_scale=0.3, relfitter=None,
-                             detection_threshold=0.1):
+                             detection_threshold=0.1, n_processes=1):
         state = FeatureDeconvolutionIterationState(
             self, error_tolerance, charge_range, left_search, right_search, charge_carrier,
             truncate_after, maxiter, minimum_intensity, convergence, max_missed_peaks, threshold_scale,
-            relfitter, detection_threshold)
+            relfitter, detection_threshold, n_processes)
         return state
 
     def deconvolute(self, error_tolerance=2e-5, charge_range=(1, 8), left_search=1, right_search=0,
                     charge_carrier=PROTON, truncate_after=0.95, maxiter=10, minimum_intensity=100,
                     convergence=0.01, max_missed_peaks=1, threshold_scale=0.3, relfitter=None,
-                    detection_threshold=0.1):
+                    detection_threshold=0.1, n_processes=1):
+        """Deconvolute the features in :attr:`feature_map`, iterating until the signal
+        left over converges or `maxiter` iterations have been done.
+
+        When `n_processes` is greater than 1, the fits of each iteration are collected
+        from m/z slabs of the feature map in a pool of worker processes with
+        :meth:`collect_fits_in_partitions`. The fits are merged into one
+        :class:`~.FeatureDependenceGraph`, so the fits selected are the same as
+        when they are collected serially.
+
+        Returns
+        -------
+        :class:`~.DeconvolutedLCMSFeatureMap`
+        """
         state = FeatureDeconvolutionIterationState(
             self, error_tolerance, charge_range, left_search, right_search, charge_carrier,
             truncate_after, maxiter, minimum_intensity, convergence, max_missed_peaks, threshold_scale,
-            relfitter, detection_threshold)
+            relfitter, detection_threshold, n_processes)
         return state.run()
 
 
@@ -575,7 +793,7 @@ class FeatureDeconvolutionIterationState(object):
     def __init__(self, processor, error_tolerance=2e-5, charge_range=(1, 8), left_search=1, right_search=0,
                  charge_carrier=PROTON, truncate_after=0.95, maxiter=10, minimum_intensity=100,
                  convergence=0.01, max_missed_peaks=1, threshold_scale=0.3, relfitter=None,
-                 detection_threshold=0.1):
+                 detection_threshold=0.1, n_processes=1):
         self.processor = processor
         self.last_signal_magnitude = sum(f.total_signal for f in self.processor.feature_map)
         self.next_signal_magnitude = 1.0
@@ -601,6 +819,7 @@ class FeatureDeconvolutionIterationState(object):
         self.threshold_scale = threshold_scale
         self.relfitter = relfitter
         self.detection_threshold = detection_threshold
+        self.n_processes = n_processes
         self.debug = False
 
     def update_signal_ratio(self):
@@ -617,7 +836,42 @@ class FeatureDeconvolutionIterationState(object):
         self.processor.remove_peaks_below_threshold(self.minimum_intensity)
         self.processor.build_dependence_network()
 
+    def _map_fits_in_partitions(self):
+        n = len(self.processor.feature_map)
+
+        def report(i):
+            printer("\t%0.1f%%" % ((100. * i) / n,))
+
+        self.processor.collect_fits_in_partitions(
+            self.n_processes,
+            error_tolerance=self.error_tolerance,
+            charge_range=self.charge_range,
+            left_search=self.left_search,
+            right_search=self.right_search,
+            charge_carrier=self.charge_carrier,
+            truncate_after=self.truncate_after,
+            max_missed_peaks=self.max_missed_peaks,
+            threshold_scale=self.threshold_scale,
+            callback=report)
+
     def map_fits(self, report_interval=5):
+        if self.n_processes > 1:
+            self._map_fits_in_partitions()
+        else:
+            self._map_fits_serially(report_interval)
+        self.all_fits = list(self.processor.dependence_network.dependencies)
+        self.disjoint_feature_clusters = self.processor.dependence_network.find_non_overlapping_intervals()
+
+        if self.relfitter is not None:
+            self.relations = self.relfitter.fit(
+                (d for cluster in self.disjoint_feature_clusters
+                 for d in cluster), self.solutions)
+            self.relfitter.predict((d for cluster in self.disjoint_feature_clusters
+                                    for d in cluster))
+        printer("\tExtracting Fits")
+        self.fits = self.processor.select_best_disjoint_subgraphs(self.disjoint_feature_clusters)
+
+    def _map_fits_serially(self, report_interval=5):
         i = 0
         n = len(self.processor.feature_map)
         interval = int(max(n // report_interval, 1000))
@@ -637,17 +891,6 @@ class FeatureDeconvolutionIterationState(object):
             i += 1
             if i % interval == 0:
                 printer("\t%0.1f%%" % ((100. * i) / n,))
-        self.all_fits = list(self.processor.dependence_network.dependencies)
-        self.disjoint_feature_clusters = self.processor.dependence_network.find_non_overlapping_intervals()
-
-        if self.relfitter is not None:
-            self.relations = self.relfitter.fit(
-                (d for cluster in self.disjoint_feature_clusters
-                 for d in cluster), self.solutions)
-            self.relfitter.predict((d for cluster in self.disjoint_feature_clusters
-                                    for d in cluster))
-        printer("\tExtracting Fits")
-        self.fits = self.processor.select_best_disjoint_subgraphs(self.disjoint_feature_clusters)
 
     def postprocess(self, subtract=True, detection_threshold=0.1):
         self.generation = self.processor.store_solutions(
@@ -768,21 +1011,36 @@ class RTFeatureNode(Interval):
 
 class RTMap(object):
     def __init__(self, features):
-        self.rt_tree = IntervalTreeNode.build(map(RTFeatureNode, features))
+        nodes = list(map(RTFeatureNode, features))
+        self.rt_tree = IntervalTreeNode.build(nodes)
+        self.spatial_index = PackedRTree(
+            nodes, [node.mz for node in nodes], [node.mz for node in nodes],
+            [node.start for node in nodes], [node.end for node in nodes])
 
     def locate_precursor_candidates(self, precursor_info):
         time = precursor_info.precursor.scan_time
         candidates = self.rt_tree.contains_point(time)
         return candidates
 
+    def _find_nodes(self, mz, time, error_tolerance=2e-5):
+        width = abs(mz * error_tolerance)
+        candidates = self.spatial_index.search(mz - width, mz + width, time, time)
+        return [candidate for candidate in candidates
+                if candidate.contains_mz(mz, time, error_tolerance)]
+
     def find_precursor(self, precursor_info, error_tolerance=2e-5):
         time = precursor_info.precursor.scan_time
-        candidates = self.rt_tree.contains_point(time)
-        matches = []
-        for candidate in candidates:
-            if candidate.contains_mz(precursor_info.mz, time, error_tolerance):
-                matches.append(candidate)
-        return matches
+        return self._find_nodes(precursor_info.mz, time, error_tolerance)
+
+    def find_features(self, mz, time, error_tolerance=2e-5):
+        """Find the features eluting at `time` whose m/z matches `mz`
+        within `error_tolerance` PPM error.
+
+        Returns
+        -------
+        list
+        """
+        return [node.members[0] for node in self._find_nodes(mz, time, error_tolerance)]
 
     def find_features_at_time(self, time):
         hits = self.rt_tree.contains_point(time)
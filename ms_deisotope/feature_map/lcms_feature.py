@@ -3,6 +3,8 @@ import numpy as np
 
 from collections import OrderedDict
 
+from ms_peak_picker import FittedPeak
+
 from ms_deisotope.utils import uid
 
 
@@ -267,7 +269,7 @@ class LCMSFeatureTreeList(object):
         lo = 0
         hi = len(self.roots)
         while lo != hi:
-            i = (lo + hi) / 2
+            i = (lo + hi) // 2
             node = self.roots[i]
             if node.time == time:
                 return node, i
@@ -388,7 +390,11 @@ class LCMSFeatureTreeNode(object):
 
     def _recalculate(self):
         self._calculate_most_abundant_member()
-        self._mz = self._most_abundant_member.mz
+        if self._most_abundant_member is not None:
+            self._mz = self._most_abundant_member.mz
+        else:
+            # Nodes are created empty when unpickled, before their members are restored
+            self._mz = None
 
     def __getstate__(self):
         return (self.time, self.members, self.node_id)
@@ -719,3 +725,416 @@ class SimpleLCMSFeature(object):
     @property
     def end_time(self):
         return tuple(self.storage.keys())[-1]
+
+
+#: The attributes of each :class:`~.FittedPeak` kept by :class:`CompactLCMSFeature`,
+#: besides its m/z and intensity, which are kept in their own arrays
+PEAK_ATTRIBUTE_DTYPE = np.dtype([
+    ("signal_to_noise", np.float64),
+    ("peak_count", np.int64),
+    ("index", np.int64),
+    ("full_width_at_half_max", np.float64),
+    ("area", np.float64),
+    ("left_width", np.float64),
+    ("right_width", np.float64),
+])
+
+_NODE_ID_MASK = (1 << 64) - 1
+
+
+class CompactLCMSFeature(object):
+    """An :class:`LCMSFeature` whose peaks are stored in contiguous arrays instead
+    of as a list of :class:`LCMSFeatureTreeNode` objects.
+
+    The peaks of all time points are stored in time order in :attr:`mz_array`,
+    :attr:`intensity_array` and :attr:`peak_attributes`, and the peaks of the
+    ``i`` th time point are those from ``offsets[i]`` up to ``offsets[i + 1]``.
+    Nodes are only built when they are asked for, by indexing or iterating over
+    the feature.
+
+    Use :meth:`from_feature` and :meth:`to_feature` to convert to and from
+    :class:`LCMSFeature`. Each node's :attr:`~.LCMSFeatureTreeNode.node_id` is
+    kept, split into two 64-bit halves.
+
+    Attributes
+    ----------
+    times : :class:`np.ndarray`
+        The time of each time point
+    offsets : :class:`np.ndarray`
+        The position in the peak arrays of the first peak of each time point,
+        followed by the total number of peaks
+    mz_array : :class:`np.ndarray`
+        The m/z of each peak
+    intensity_array : :class:`np.ndarray`
+        The intensity of each peak
+    peak_attributes : :class:`np.ndarray`
+        The remaining attributes of each peak, with the dtype :data:`PEAK_ATTRIBUTE_DTYPE`
+    node_id_high : :class:`np.ndarray`
+        The high 64 bits of each time point's node id
+    node_id_low : :class:`np.ndarray`
+        The low 64 bits of each time point's node id
+    """
+
+    created_at = "new"
+
+    def __init__(self, times=None, offsets=None, mz_array=None, intensity_array=None,
+                 peak_attributes=None, node_id_high=None, node_id_low=None, adducts=None,
+                 used_as_adduct=None, feature_id=None):
+        if times is None:
+            times = np.zeros(0, dtype=np.float64)
+        n = len(times)
+        if offsets is None:
+            offsets = np.zeros(n + 1, dtype=np.intp)
+        if mz_array is None:
+            mz_array = np.zeros(0, dtype=np.float64)
+        if intensity_array is None:
+            intensity_array = np.zeros(len(mz_array), dtype=np.float64)
+        if peak_attributes is None:
+            peak_attributes = np.zeros(len(mz_array), dtype=PEAK_ATTRIBUTE_DTYPE)
+        if node_id_high is None or node_id_low is None:
+            node_id_high, node_id_low = self._split_node_ids([uid() for _ in range(n)])
+        if adducts is None:
+            adducts = []
+        if used_as_adduct is None:
+            used_as_adduct = []
+        if feature_id is None:
+            feature_id = uid()
+        self.times = np.asarray(times, dtype=np.float64)
+        self.offsets = np.asarray(offsets, dtype=np.intp)
+        self.mz_array = np.asarray(mz_array, dtype=np.float64)
+        self.intensity_array = np.asarray(intensity_array, dtype=np.float64)
+        self.peak_attributes = np.asarray(peak_attributes, dtype=PEAK_ATTRIBUTE_DTYPE)
+        self.node_id_high = np.asarray(node_id_high, dtype=np.uint64)
+        self.node_id_low = np.asarray(node_id_low, dtype=np.uint64)
+        self.adducts = adducts
+        self.used_as_adduct = used_as_adduct
+        self.feature_id = feature_id
+        self._invalidate()
+
+    @staticmethod
+    def _split_node_ids(node_ids):
+        high = np.array([(node_id >> 64) & _NODE_ID_MASK for node_id in node_ids], dtype=np.uint64)
+        low = np.array([node_id & _NODE_ID_MASK for node_id in node_ids], dtype=np.uint64)
+        return high, low
+
+    def _node_id(self, i):
+        return (int(self.node_id_high[i]) << 64) | int(self.node_id_low[i])
+
+    @classmethod
+    def from_feature(cls, feature):
+        """Copy the peaks of an :class:`LCMSFeature` into a new :class:`CompactLCMSFeature`
+
+        Parameters
+        ----------
+        feature : :class:`LCMSFeature`
+
+        Returns
+        -------
+        :class:`CompactLCMSFeature`
+        """
+        n = len(feature)
+        times = np.zeros(n, dtype=np.float64)
+        offsets = np.zeros(n + 1, dtype=np.intp)
+        peaks = []
+        node_ids = []
+        for i, node in enumerate(feature):
+            times[i] = node.time
+            peaks.extend(node.members)
+            offsets[i + 1] = len(peaks)
+            node_ids.append(node.node_id)
+        mz_array = np.array([p.mz for p in peaks], dtype=np.float64)
+        intensity_array = np.array([p.intensity for p in peaks], dtype=np.float64)
+        peak_attributes = np.array(
+            [(p.signal_to_noise, p.peak_count, p.index, p.full_width_at_half_max, p.area,
+              p.left_width, p.right_width) for p in peaks], dtype=PEAK_ATTRIBUTE_DTYPE)
+        node_id_high, node_id_low = cls._split_node_ids(node_ids)
+        inst = cls(times, offsets, mz_array, intensity_array, peak_attributes, node_id_high,
+                   node_id_low, list(feature.adducts), list(feature.used_as_adduct),
+                   feature.feature_id)
+        inst.created_at = feature.created_at
+        return inst
+
+    def to_feature(self, cls=None):
+        """Build an :class:`LCMSFeature` holding the same peaks and nodes as this feature
+
+        Parameters
+        ----------
+        cls : type, optional
+            The feature type to build, :class:`LCMSFeature` by default
+
+        Returns
+        -------
+        :class:`LCMSFeature`
+        """
+        if cls is None:
+            cls = LCMSFeature
+        feature = cls(list(self), list(self.adducts), list(self.used_as_adduct),
+                      feature_id=self.feature_id)
+        feature.created_at = self.created_at
+        return feature
+
+    def _invalidate(self):
+        self._mz = None
+        self._signal = None
+
+    def invalidate(self, reaverage=False):
+        self._invalidate()
+
+    def _make_peak(self, j):
+        attrs = self.peak_attributes[j]
+        return FittedPeak(
+            float(self.mz_array[j]), float(self.intensity_array[j]), float(attrs['signal_to_noise']),
+            int(attrs['peak_count']), int(attrs['index']), float(attrs['full_width_at_half_max']),
+            float(attrs['area']), float(attrs['left_width']), float(attrs['right_width']))
+
+    def _make_node(self, i):
+        members = [self._make_peak(j) for j in range(self.offsets[i], self.offsets[i + 1])]
+        node = LCMSFeatureTreeNode(float(self.times[i]), members)
+        node.node_id = self._node_id(i)
+        return node
+
+    def __len__(self):
+        return len(self.times)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self._make_node(j) for j in range(*i.indices(len(self)))]
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError(i)
+        return self._make_node(i)
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self._make_node(i)
+
+    @property
+    def nbytes(self):
+        """The number of bytes used by the arrays holding the feature's data"""
+        return (self.times.nbytes + self.offsets.nbytes + self.mz_array.nbytes +
+                self.intensity_array.nbytes + self.peak_attributes.nbytes +
+                self.node_id_high.nbytes + self.node_id_low.nbytes)
+
+    def _node_signal(self):
+        if self._signal is None:
+            n = len(self)
+            counts = np.diff(self.offsets)
+            if len(self.intensity_array) == 0:
+                signal = np.zeros(n, dtype=np.float64)
+            else:
+                starts = np.minimum(self.offsets[:-1], len(self.intensity_array) - 1)
+                signal = np.add.reduceat(self.intensity_array, starts) if n else np.zeros(0)
+                signal[counts == 0] = 0.
+            self._signal = signal
+        return self._signal
+
+    def as_arrays(self):
+        return self.times.copy(), self._node_signal().copy()
+
+    @property
+    def total_signal(self):
+        return float(self._node_signal().sum())
+
+    @property
+    def intensity(self):
+        return self.total_signal
+
+    @property
+    def mz(self):
+        """The intensity weighted mean m/z of the feature's peaks"""
+        if self._mz is None:
+            total = self.intensity_array.sum()
+            if total > 0:
+                self._mz = float(np.dot(self.mz_array, self.intensity_array) / total)
+            elif len(self.mz_array):
+                self._mz = float(self.mz_array[0])
+            else:
+                self._mz = 0.
+        return self._mz
+
+    @property
+    def neutral_mass(self):
+        return self.mz
+
+    @property
+    def start_time(self):
+        return float(self.times[0])
+
+    @property
+    def end_time(self):
+        return float(self.times[-1])
+
+    @property
+    def apex_time(self):
+        return float(self.times[np.argmax(self._node_signal())])
+
+    def overlaps_in_time(self, interval):
+        return self.start_time <= interval.end_time and self.end_time >= interval.start_time
+
+    def _search_time(self, time):
+        # Mirrors :meth:`LCMSFeatureTreeList.find_time`
+        times = self.times
+        if len(times) == 0:
+            raise ValueError()
+        lo = 0
+        hi = len(times)
+        while lo != hi:
+            i = (lo + hi) // 2
+            if times[i] == time:
+                return True, i
+            elif (hi - lo) == 1:
+                return False, i
+            elif times[i] < time:
+                lo = i
+            else:
+                hi = i
+
+    def find_time(self, time):
+        """Find the node at `time`, like :meth:`LCMSFeatureTreeList.find_time`
+
+        Returns
+        -------
+        node : :class:`LCMSFeatureTreeNode` or :const:`None`
+            The node at `time`, if there is one
+        index : int
+            The index of the node at `time`, or of the nearest node
+            searched if there is none
+        """
+        found, i = self._search_time(time)
+        return (self._make_node(i) if found else None), i
+
+    def _split_index(self, time):
+        _, i = self._search_time(time)
+        if self.times[i] < time:
+            i += 1
+        return i
+
+    def _slice(self, start, end, feature_id=None):
+        # Copy so that a chunk does not keep its parent's arrays alive
+        lo, hi = self.offsets[start], self.offsets[end]
+        chunk = self.__class__(
+            self.times[start:end].copy(), self.offsets[start:end + 1] - lo,
+            self.mz_array[lo:hi].copy(), self.intensity_array[lo:hi].copy(),
+            self.peak_attributes[lo:hi].copy(), self.node_id_high[start:end].copy(),
+            self.node_id_low[start:end].copy(), feature_id=feature_id)
+        return chunk
+
+    def split_at(self, time):
+        i = self._split_index(time)
+        return self._slice(0, i), self._slice(i, len(self))
+
+    def split_sparse(self, delta_rt=1.):
+        breaks = np.flatnonzero(np.diff(self.times) > delta_rt) + 1
+        bounds = [0] + breaks.tolist() + [len(self)]
+        chunks = []
+        for start, end in zip(bounds[:-1], bounds[1:]):
+            chunk = self._slice(start, end)
+            chunk.used_as_adduct = list(self.used_as_adduct)
+            chunk.created_at = self.created_at
+            chunks.append(chunk)
+        return chunks
+
+    def _replace_with(self, chunk):
+        self.times = chunk.times
+        self.offsets = chunk.offsets
+        self.mz_array = chunk.mz_array
+        self.intensity_array = chunk.intensity_array
+        self.peak_attributes = chunk.peak_attributes
+        self.node_id_high = chunk.node_id_high
+        self.node_id_low = chunk.node_id_low
+        self._invalidate()
+
+    def truncate_before(self, time):
+        self._replace_with(self._slice(self._split_index(time), len(self)))
+
+    def truncate_after(self, time):
+        self._replace_with(self._slice(0, self._split_index(time)))
+
+    def clone(self, deep=False, cls=None):
+        if cls is None:
+            cls = self.__class__
+        c = cls(self.times.copy(), self.offsets.copy(), self.mz_array.copy(),
+                self.intensity_array.copy(), self.peak_attributes.copy(),
+                self.node_id_high.copy(), self.node_id_low.copy(), list(self.adducts),
+                list(self.used_as_adduct), self.feature_id)
+        c.created_at = self.created_at
+        return c
+
+    def merge(self, other):
+        """Combine the peaks of this feature and `other` into a new feature.
+
+        As with :meth:`LCMSFeature.merge`, the peaks of time points present in
+        both features are combined into one node, which keeps this feature's node id.
+
+        Parameters
+        ----------
+        other : :class:`CompactLCMSFeature` or :class:`LCMSFeature`
+
+        Returns
+        -------
+        :class:`CompactLCMSFeature`
+        """
+        if not isinstance(other, CompactLCMSFeature):
+            other = self.from_feature(other)
+        times = np.concatenate((self.times, other.times))
+        starts = np.concatenate((self.offsets[:-1], other.offsets[:-1] + self.offsets[-1]))
+        counts = np.concatenate((np.diff(self.offsets), np.diff(other.offsets)))
+        node_id_high = np.concatenate((self.node_id_high, other.node_id_high))
+        node_id_low = np.concatenate((self.node_id_low, other.node_id_low))
+        # A stable sort keeps this feature's node first when both have a time point
+        order = np.argsort(times, kind='mergesort')
+        times = times[order]
+        starts = starts[order]
+        counts = counts[order]
+        node_id_high = node_id_high[order]
+        node_id_low = node_id_low[order]
+        total = int(counts.sum())
+        # Gather each node's peaks in the new node order
+        positions = np.repeat(starts - (np.cumsum(counts) - counts), counts) + np.arange(total)
+        mz_array = np.concatenate((self.mz_array, other.mz_array))[positions]
+        intensity_array = np.concatenate((self.intensity_array, other.intensity_array))[positions]
+        peak_attributes = np.concatenate((self.peak_attributes, other.peak_attributes))[positions]
+        # Collapse nodes with the same time into the first of them
+        is_first = np.ones(len(times), dtype=bool)
+        is_first[1:] = times[1:] != times[:-1]
+        duplicated = ~is_first & (node_id_high == np.roll(node_id_high, 1)) & (
+            node_id_low == np.roll(node_id_low, 1))
+        if duplicated.any():
+            raise ValueError("Duplicate Node at %r" % (times[np.argmax(duplicated)], ))
+        first = np.flatnonzero(is_first)
+        offsets = np.zeros(len(first) + 1, dtype=np.intp)
+        offsets[1:] = np.add.reduceat(counts, first) if len(first) else []
+        offsets = np.cumsum(offsets)
+        new = self.__class__(
+            times[first], offsets, mz_array, intensity_array, peak_attributes,
+            node_id_high[first], node_id_low[first], list(self.adducts),
+            list(self.used_as_adduct), self.feature_id)
+        new.created_at = "merge"
+        return new
+
+    def __eq__(self, other):
+        if other is None:
+            return False
+        if len(self) != len(other):
+            return False
+        if len(self) == 0:
+            return True
+        if abs(self.start_time - other.start_time) > 1e-4:
+            return False
+        elif abs(self.end_time - other.end_time) > 1e-4:
+            return False
+        for a, b in zip(self, other):
+            if a != b:
+                return False
+        return True
+
+    def __ne__(self, other):
+        return not (self == other)
+
+    def __hash__(self):
+        return hash((self.mz, self.start_time, self.end_time))
+
+    def __repr__(self):
+        return "%s(%0.4f, %0.2f, %0.2f)" % (
+            self.__class__.__name__, self.mz, self.start_time, self.end_time)
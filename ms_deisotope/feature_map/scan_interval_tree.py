@@ -4,6 +4,8 @@ from collections import namedtuple, deque
 
 from ms_deisotope.peak_dependency_network import Interval, IntervalTreeNode
 
+from .spatial_index import PackedRTree
+
 
 class BoundingBox(namedtuple("BoundingBox", ['mz', 'rt'])):
     def merge(self, other):
@@ -83,6 +85,44 @@ class ScanIntervalTree(object):
     def __init__(self, rt_tree, original_intervals=None):
         self.rt_tree = rt_tree
         self.original_intervals = original_intervals
+        self._spatial_index = None
+
+    def bounding_boxes(self):
+        if self.original_intervals is not None:
+            return list(self.original_intervals)
+        if self.rt_tree is None:
+            return []
+        return [BoundingBox(i.members[0], i) for i in self.rt_tree.flatten()]
+
+    def build_spatial_index(self, node_size=16):
+        """Build a :class:`~.PackedRTree` over the m/z and time extent of
+        the intervals, to search both dimensions at once.
+
+        Returns
+        -------
+        :class:`~.PackedRTree`
+        """
+        return PackedRTree.from_bounding_boxes(self.bounding_boxes(), node_size=node_size)
+
+    @property
+    def spatial_index(self):
+        if self._spatial_index is None:
+            self._spatial_index = self.build_spatial_index()
+        return self._spatial_index
+
+    def get_intervals_for_point(self, mz, rt_point):
+        """Find the intervals which contain both `mz` and `rt_point`
+
+        Returns
+        -------
+        list of :class:`BoundingBox`
+        """
+        return self.spatial_index.contains_point(mz, rt_point)
+
+    def contains_point(self, mz, rt_point):
+        if self.rt_tree is None:
+            return True
+        return bool(self.spatial_index.search_indices(mz, mz, rt_point, rt_point).size)
 
     def get_mz_intervals_for_rt(self, rt_point):
         if self.rt_tree is None:
@@ -25,6 +25,17 @@ class PeakShapeModelBase(object):
     def __repr__(self):
         return "{self.__class__.__name__}()".format(self=self)
 
+    @staticmethod
+    def alternate_starts(params):
+        """Derive more starting points for a batch fit from the rows of `params`,
+        for models whose fits are prone to settle in a local minimum.
+
+        Returns
+        -------
+        list of np.ndarray
+        """
+        return []
+
 
 class SkewedGaussianModel(PeakShapeModelBase):
     @staticmethod
@@ -63,6 +74,51 @@ class SkewedGaussianModel(PeakShapeModelBase):
     def spread(params_dict):
         return params_dict['sigma']
 
+    @staticmethod
+    def fit_batch(params, xs, ys):
+        """Compute the residuals of :meth:`fit` for many profiles at once.
+
+        Parameters
+        ----------
+        params : np.ndarray
+            The parameters of each profile, one row per profile
+        xs : np.ndarray
+            The time points of each profile, one row per profile. Rows are
+            padded with their last time point
+        ys : np.ndarray
+            The signal of each profile, one row per profile
+
+        Returns
+        -------
+        np.ndarray
+        """
+        center, amplitude, sigma, gamma = (params[:, i:i + 1] for i in range(4))
+        return ys - SkewedGaussianModel.shape(xs, center, amplitude, sigma, gamma) * np.where(
+            np.abs(sigma) > 2, sigma / 2., 1.)
+
+    @staticmethod
+    def params_from_gaussian(center, height, sigma):
+        """Convert the parameters of a Gaussian profile to this model's parameters,
+        with the fitted height :meth:`fit` uses.
+
+        Returns
+        -------
+        np.ndarray
+        """
+        scale = np.where(np.abs(sigma) > 2, sigma / 2., 1.)
+        amplitude = height * sigma * sqrt(2 * pi) / scale
+        return np.column_stack((center, amplitude, sigma, np.zeros_like(center)))
+
+    @staticmethod
+    def alternate_starts(params):
+        # A symmetric start sits on a saddle between tailing to the left or the right
+        starts = []
+        for gamma in (-2., 2.):
+            start = params.copy()
+            start[:, 3] = gamma
+            starts.append(start)
+        return starts
+
 
 class PenalizedSkewedGaussianModel(SkewedGaussianModel):
     @staticmethod
@@ -72,6 +128,13 @@ class PenalizedSkewedGaussianModel(SkewedGaussianModel):
             sigma / 2. if abs(sigma) > 2 else 1.) * (gamma / 2. if abs(gamma) > 40 else 1.) * (
             center if center > xs[-1] or center < xs[0] else 1.)
 
+    @staticmethod
+    def fit_batch(params, xs, ys):
+        center, amplitude, sigma, gamma = (params[:, i:i + 1] for i in range(4))
+        return ys - PenalizedSkewedGaussianModel.shape(xs, center, amplitude, sigma, gamma) * np.where(
+            np.abs(sigma) > 2, sigma / 2., 1.) * np.where(np.abs(gamma) > 40, gamma / 2., 1.) * np.where(
+            (center > xs[:, -1:]) | (center < xs[:, :1]), center, 1.)
+
 
 class BiGaussianModel(PeakShapeModelBase):
 
@@ -99,6 +162,19 @@ class BiGaussianModel(PeakShapeModelBase):
             xs, center, amplitude, sigma_left, sigma_right) * (
             center if center > xs[-1] or center < xs[0] else 1.)
 
+    @staticmethod
+    def fit_batch(params, xs, ys):
+        center, amplitude, sigma_left, sigma_right = (params[:, i:i + 1] for i in range(4))
+        sigma = np.where(xs < center, sigma_left, sigma_right)
+        shape = np.where(
+            xs != center, amplitude * np.exp(-(xs - center) ** 2 / (2 * sigma ** 2)) * sqrt(2 * pi), 0.)
+        return ys - shape * np.where((center > xs[:, -1:]) | (center < xs[:, :1]), center, 1.)
+
+    @staticmethod
+    def params_from_gaussian(center, height, sigma):
+        amplitude = height / sqrt(2 * pi)
+        return np.column_stack((center, amplitude, sigma, sigma))
+
     @staticmethod
     def params_to_dict(params):
         center, amplitude, sigma_left, sigma_right = params
@@ -255,6 +331,320 @@ def shape_fit_test(chromatogram, smooth=DEFAULT_SMOOTH):
     return ChromatogramShapeFitter(chromatogram, smooth).line_test
 
 
+def gaussian_guess_batch(xs, ys, mask):
+    """Estimate the center, height and width of a Gaussian for each profile in closed form
+    by fitting a parabola to the logarithm of the points above half of each profile's maximum,
+    weighted by the square of their signal.
+
+    Parameters
+    ----------
+    xs, ys : np.ndarray
+        The padded time points and signal of each profile, one row per profile
+    mask : np.ndarray
+        Which entries of `xs` and `ys` are real rather than padding
+
+    Returns
+    -------
+    center, height, sigma : np.ndarray
+        The Gaussian parameters of each profile
+    valid : np.ndarray
+        Which profiles could be estimated
+    """
+    apex = np.where(mask, ys, -np.inf).max(axis=1)
+    usable = mask & (ys > 0) & (ys >= apex[:, None] / 2.)
+    # Center the time axis on each profile's apex to keep the normal equations well conditioned
+    offset = xs[np.arange(len(xs)), np.where(mask, ys, -np.inf).argmax(axis=1)]
+    x = np.where(usable, xs - offset[:, None], 0.)
+    log_y = np.where(usable, np.log(np.where(usable, ys, 1.)), 0.)
+    w = np.where(usable, ys ** 2, 0.)
+    moments = [(w * x ** k).sum(axis=1) for k in range(5)]
+    lhs = np.empty((len(xs), 3, 3))
+    for i in range(3):
+        for j in range(3):
+            lhs[:, i, j] = moments[i + j]
+    rhs = np.stack([(w * x ** k * log_y).sum(axis=1) for k in range(3)], axis=1)
+    valid = usable.sum(axis=1) >= 3
+    coefs = np.zeros((len(xs), 3))
+    with np.errstate(all='ignore'):
+        det = np.linalg.det(lhs)
+        solvable = valid & np.isfinite(det) & (np.abs(det) > 0)
+        if solvable.any():
+            coefs[solvable] = np.linalg.solve(lhs[solvable], rhs[solvable][:, :, None])[:, :, 0]
+        a, b, c = coefs[:, 0], coefs[:, 1], coefs[:, 2]
+        valid = solvable & (c < 0)
+        c = np.where(valid, c, -1.)
+        sigma = np.sqrt(-1. / (2 * c))
+        center = offset - b / (2 * c)
+        height = np.exp(a - b ** 2 / (4 * c))
+    valid &= np.isfinite(sigma) & np.isfinite(center) & np.isfinite(height)
+    return center, height, sigma, valid
+
+
+class BatchChromatogramShapeFitter(object):
+    """Fit the same peak shape model to many elution profiles at once, with the
+    results :class:`ChromatogramShapeFitter` would give for each of them.
+
+    The profiles are packed into padded arrays, sorted by length to limit padding,
+    and fit `batch_size` at a time with a Levenberg-Marquardt solver shared by all of
+    the profiles in a batch. Like :func:`scipy.optimize.leastsq`, the Jacobian is
+    estimated by forward differences of the model's residuals, here computed for the
+    whole batch by the model's ``fit_batch`` method.
+
+    Each profile starts from the closer of the model's own ``guess`` and a closed form
+    Gaussian estimate from :func:`gaussian_guess_batch`, and is fit again from any
+    alternative starting points the model's ``alternate_starts`` derives from that fit,
+    keeping the best. When the Gaussian estimate already passes the line test with a
+    value below `fast_path_threshold`, the peak is well-behaved and is accepted without
+    any iterations, at the cost of a slightly less exact fit.
+
+    Parameters
+    ----------
+    max_iterations : int
+        The iteration budget of each run of the solver
+    fast_path_threshold : float
+        The line test below which a Gaussian estimate is accepted as is. Set to 0 to
+        fit every profile
+    batch_size : int
+        The number of profiles fit together
+    tolerance : float
+        The relative change in cost or parameters at which a fit has converged
+
+    Attributes
+    ----------
+    chromatograms : list
+        The profiles fit, anything with an ``as_arrays`` method
+    params : np.ndarray
+        The fitted parameters of each profile, one row per profile. Rows for
+        profiles too short to fit are :const:`NaN`
+    peak_shapes : list of :class:`FittedPeakShape`
+        The fitted shape of each profile, or :const:`None` for profiles too short to fit
+    line_tests : np.ndarray
+        The line test of each profile, as :attr:`ChromatogramShapeFitter.line_test`
+    n_iterations : np.ndarray
+        The number of solver iterations each profile took
+    fast_path : np.ndarray
+        Which profiles were accepted from their closed form estimate
+    """
+
+    def __init__(self, chromatograms, smooth=DEFAULT_SMOOTH, fitter=PenalizedSkewedGaussianModel(),
+                 max_iterations=200, fast_path_threshold=0.01, batch_size=512, tolerance=1.49012e-8):
+        self.chromatograms = list(chromatograms)
+        self.smooth = smooth
+        self.shape_fitter = fitter
+        self.max_iterations = max_iterations
+        self.fast_path_threshold = fast_path_threshold
+        self.batch_size = batch_size
+        self.tolerance = tolerance
+
+        n = len(self.chromatograms)
+        self.n_params = len(fitter.params_to_dict([0.] * 4))
+        self.params = np.full((n, self.n_params), np.nan)
+        self.line_tests = np.full(n, 0.5)
+        self.off_center = np.full(n, np.nan)
+        self.n_iterations = np.zeros(n, dtype=int)
+        self.fast_path = np.zeros(n, dtype=bool)
+        self.peak_shapes = [None] * n
+        self.fit()
+
+    def __len__(self):
+        return len(self.chromatograms)
+
+    def __getitem__(self, i):
+        return self.peak_shapes[i]
+
+    def __iter__(self):
+        return iter(self.peak_shapes)
+
+    def __repr__(self):
+        return "BatchChromatogramShapeFitter(%d, %r)" % (len(self), self.shape_fitter)
+
+    def _extract_arrays(self, chromatogram):
+        # Reuse the smoothing and resampling of the single profile fitters
+        base = ChromatogramShapeFitterBase(chromatogram, smooth=self.smooth, fitter=self.shape_fitter)
+        base.extract_arrays()
+        return np.asarray(base.xs, dtype=np.float64), np.asarray(base.ys, dtype=np.float64)
+
+    def fit(self):
+        profiles = []
+        for i, chromatogram in enumerate(self.chromatograms):
+            if len(chromatogram) < 5:
+                continue
+            profiles.append((i, ) + self._extract_arrays(chromatogram))
+        profiles.sort(key=lambda x: len(x[1]))
+        for start in range(0, len(profiles), self.batch_size):
+            self._fit_batch(profiles[start:start + self.batch_size])
+        for i in range(len(self)):
+            if not np.isnan(self.params[i]).all():
+                self.peak_shapes[i] = FittedPeakShape(
+                    self.shape_fitter.params_to_dict(self.params[i]), self.shape_fitter)
+        return self
+
+    def _pack(self, profiles):
+        width = max(len(xs) for _, xs, _ in profiles)
+        n = len(profiles)
+        xs = np.zeros((n, width))
+        ys = np.zeros((n, width))
+        mask = np.zeros((n, width), dtype=bool)
+        for row, (_, x, y) in enumerate(profiles):
+            k = len(x)
+            xs[row, :k] = x
+            xs[row, k:] = x[-1]
+            ys[row, :k] = y
+            mask[row, :k] = True
+        return xs, ys, mask
+
+    def _residuals(self, params, xs, ys, mask):
+        with np.errstate(all='ignore'):
+            return np.where(mask, self.shape_fitter.fit_batch(params, xs, ys), 0.)
+
+    def _cost(self, residuals):
+        cost = (residuals ** 2).sum(axis=1)
+        return np.where(np.isfinite(cost), cost, np.inf)
+
+    def _line_test(self, residuals, xs, ys, mask):
+        # The residuals of a least squares line through each profile
+        n_points = mask.sum(axis=1)
+        x = np.where(mask, xs, 0.)
+        y = np.where(mask, ys, 0.)
+        sx, sy = x.sum(axis=1), y.sum(axis=1)
+        sxx, sxy = (x * x).sum(axis=1), (x * y).sum(axis=1)
+        with np.errstate(all='ignore'):
+            slope = (n_points * sxy - sx * sy) / (n_points * sxx - sx ** 2)
+            intercept = (sy - slope * sx) / n_points
+            null = np.where(mask, (y - (intercept[:, None] + slope[:, None] * x)) ** 2, 0.)
+            line_test = (residuals ** 2).sum(axis=1) / null.sum(axis=1)
+        return np.minimum(line_test, 1.0)
+
+    def _jacobian(self, params, residuals, xs, ys, mask):
+        step = np.sqrt(self.tolerance) * np.abs(params)
+        step[step == 0] = np.sqrt(self.tolerance)
+        jacobian = np.empty(residuals.shape + (params.shape[1], ))
+        for j in range(params.shape[1]):
+            shifted = params.copy()
+            shifted[:, j] += step[:, j]
+            jacobian[:, :, j] = (self._residuals(shifted, xs, ys, mask) - residuals) / step[:, j:j + 1]
+        jacobian[~np.isfinite(jacobian)] = 0.
+        return jacobian
+
+    def _solve(self, lhs, rhs):
+        try:
+            return np.linalg.solve(lhs, rhs[:, :, None])[:, :, 0]
+        except np.linalg.LinAlgError:
+            return np.einsum("nij,nj->ni", np.linalg.pinv(lhs), rhs)
+
+    def _levenberg_marquardt(self, params, xs, ys, mask, active):
+        residuals = self._residuals(params, xs, ys, mask)
+        cost = self._cost(residuals)
+        damping = np.full(len(params), 1e-3)
+        growth = np.full(len(params), 2.)
+        iterations = np.zeros(len(params), dtype=int)
+        active = active & np.isfinite(cost)
+        identity = np.eye(params.shape[1])
+        for _ in range(self.max_iterations):
+            rows = np.flatnonzero(active)
+            if len(rows) == 0:
+                break
+            p, r = params[rows], residuals[rows]
+            x, y, m = xs[rows], ys[rows], mask[rows]
+            jacobian = self._jacobian(p, r, x, y, m)
+            jacobian_t = jacobian.transpose(0, 2, 1)
+            jtj = np.matmul(jacobian_t, jacobian)
+            gradient = np.matmul(jacobian_t, r[:, :, None])[:, :, 0]
+            diagonal = np.einsum("nii->ni", jtj)
+            lhs = jtj + (damping[rows, None] * np.maximum(diagonal, 1e-12))[:, :, None] * identity
+            delta = self._solve(lhs, -gradient)
+            trial = p + delta
+            trial_residuals = self._residuals(trial, x, y, m)
+            trial_cost = self._cost(trial_residuals)
+            iterations[rows] += 1
+            # The reduction in cost predicted by the linearized model, to rate each step
+            predicted = np.einsum("ni,ni->n", delta, (damping[rows, None] * np.maximum(
+                diagonal, 1e-12)) * delta - gradient)
+            improved = trial_cost < cost[rows]
+            accepted = rows[improved]
+            reduction = (cost[accepted] - trial_cost[improved]) / np.maximum(cost[accepted], 1e-300)
+            small_step = (np.abs(delta[improved]) <= self.tolerance * (
+                np.abs(trial[improved]) + self.tolerance)).all(axis=1)
+            with np.errstate(all='ignore'):
+                rho = (cost[accepted] - trial_cost[improved]) / predicted[improved]
+            rho = np.where(np.isfinite(rho), rho, 0.)
+            params[accepted] = trial[improved]
+            residuals[accepted] = trial_residuals[improved]
+            cost[accepted] = trial_cost[improved]
+            # Nielsen's update of the damping factor
+            damping[accepted] *= np.maximum(1. / 3., 1 - (2 * rho - 1) ** 3)
+            growth[accepted] = 2.
+            rejected = rows[~improved]
+            damping[rejected] *= growth[rejected]
+            growth[rejected] *= 2.
+            active[accepted[(reduction <= self.tolerance) | small_step]] = False
+            active[rejected[damping[rejected] > 1e16]] = False
+        return params, residuals, iterations
+
+    def _fit_batch(self, profiles):
+        indices = np.array([i for i, _, _ in profiles])
+        xs, ys, mask = self._pack(profiles)
+        n = len(profiles)
+        guesses = np.array([self.shape_fitter.guess(x, y) for _, x, y in profiles], dtype=np.float64)
+        center, height, sigma, valid = gaussian_guess_batch(xs, ys, mask)
+        gaussian = guesses.copy()
+        fast_path = np.zeros(n, dtype=bool)
+        if valid.any():
+            gaussian[valid] = self.shape_fitter.params_from_gaussian(
+                center[valid], height[valid], sigma[valid])
+            gaussian_residuals = self._residuals(gaussian, xs, ys, mask)
+            if self.fast_path_threshold:
+                fast_path = valid & (self._line_test(
+                    gaussian_residuals, xs, ys, mask) < self.fast_path_threshold)
+            # Start from whichever of the two estimates is closer
+            closer = valid & (self._cost(gaussian_residuals) < self._cost(self._residuals(guesses, xs, ys, mask)))
+            guesses[closer] = gaussian[closer]
+        params, residuals, iterations = self._levenberg_marquardt(guesses, xs, ys, mask, ~fast_path)
+        # Restart from any alternatives the model derives from each fit, as they may
+        # lead to a better local minimum, and keep the best
+        fitted = np.flatnonzero(~fast_path)
+        starts = self.shape_fitter.alternate_starts(params[fitted])
+        if starts and len(fitted):
+            rows = np.tile(fitted, len(starts))
+            alt_params, alt_residuals, alt_iterations = self._levenberg_marquardt(
+                np.concatenate(starts), xs[rows], ys[rows], mask[rows], np.ones(len(rows), dtype=bool))
+            cost = self._cost(residuals)
+            alt_cost = self._cost(alt_residuals)
+            for k in range(len(starts)):
+                block = slice(k * len(fitted), (k + 1) * len(fitted))
+                iterations[fitted] += alt_iterations[block]
+                better = alt_cost[block] < cost[fitted]
+                chosen = fitted[better]
+                params[chosen] = alt_params[block][better]
+                residuals[chosen] = alt_residuals[block][better]
+                cost[chosen] = alt_cost[block][better]
+        self.fast_path[indices] = fast_path
+        line_tests = self._line_test(residuals, xs, ys, mask)
+        # As in :meth:`ChromatogramShapeFitter.off_center_factor`
+        apex_x = xs[np.arange(len(xs)), np.where(mask, ys, -np.inf).argmax(axis=1)]
+        fitted_center = np.array([self.shape_fitter.center(self.shape_fitter.params_to_dict(p)) for p in params])
+        spread = np.array([self.shape_fitter.spread(self.shape_fitter.params_to_dict(p)) for p in params])
+        with np.errstate(all='ignore'):
+            off_center = np.abs(1 - np.abs(1 - (2 * np.abs(apex_x - fitted_center) / np.abs(spread))))
+            off_center = np.where(off_center > 1, 1. / off_center, off_center)
+            line_tests = line_tests / off_center
+        self.params[indices] = params
+        self.line_tests[indices] = line_tests
+        self.off_center[indices] = off_center
+        self.n_iterations[indices] = iterations
+
+
+def batch_shape_fit_test(chromatograms, smooth=DEFAULT_SMOOTH, **kwargs):
+    """Compute :func:`shape_fit_test` for many profiles at once with
+    :class:`BatchChromatogramShapeFitter`
+
+    Returns
+    -------
+    np.ndarray
+    """
+    return BatchChromatogramShapeFitter(chromatograms, smooth, **kwargs).line_tests
+
+
 def peak_indices(x, min_height=0):
     """Find the index of local maxima.
 
@@ -323,11 +713,11 @@ class MultimodalChromatogramShapeFitter(ChromatogramShapeFitterBase):
         if len(indices) > 0:
             center = xs[max(indices, key=lambda x: ys[x])]
         else:
-            center = xs[len(xs) / 2]
+            center = xs[len(xs) // 2]
         params_dict['center'] = center
 
         fit = leastsq(self.shape_fitter.fit,
-                      params_dict.values(), (xs, ys))
+                      list(params_dict.values()), (xs, ys))
         params = fit[0]
         params_dict = FittedPeakShape(self.shape_fitter.params_to_dict(params), self.shape_fitter)
         self.params_list.append(params)
@@ -504,7 +894,7 @@ class ProfileSplittingMultimodalChromatogramShapeFitter(ChromatogramShapeFitterB
             return ys, params_dict
 
         fit = leastsq(self.shape_fitter.fit,
-                      params_dict.values(), (xs, ys))
+                      list(params_dict.values()), (xs, ys))
         params = fit[0]
         params_dict = FittedPeakShape(self.shape_fitter.params_to_dict(params), self.shape_fitter)
         self.params_list.append(params)
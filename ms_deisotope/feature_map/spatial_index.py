@@ -0,0 +1,231 @@
+'''A two dimensional index over the bounding boxes of LC-MS features in m/z
+and retention time.
+
+:class:`PackedRTree` is an R-tree which is bulk-loaded once with the
+Sort-Tile-Recursive algorithm and not modified after, stored as a stack
+of arrays, one per level of the tree. The children of the node at position
+``i`` of a level are at positions ``i * node_size`` to ``(i + 1) * node_size``
+of the level below, so a search only needs to test the bounding boxes of
+the children of the nodes which matched at the level above it.
+'''
+import heapq
+
+import numpy as np
+
+
+class PackedRTree(object):
+    """A static R-tree over items with bounding boxes in m/z and retention time,
+    answering box queries and nearest neighbor queries in logarithmic time.
+
+    Parameters
+    ----------
+    items : list
+        The objects to index
+    mz_start, mz_end : array-like
+        The lower and upper bound of each item in the m/z dimension
+    rt_start, rt_end : array-like
+        The lower and upper bound of each item in the time dimension
+    node_size : int, optional
+        The largest number of children of each node
+
+    Attributes
+    ----------
+    items : list
+        The indexed objects, in the order they are stored at the leaves
+    levels : list of np.ndarray
+        The bounding boxes of the nodes of each level of the tree, from the leaves
+        to the root, as the rows ``mz_start, mz_end, rt_start, rt_end``
+    """
+
+    def __init__(self, items, mz_start, mz_end, rt_start, rt_end, node_size=16):
+        if node_size < 2:
+            raise ValueError("node_size must be at least 2")
+        self.node_size = node_size
+        items = list(items)
+        bounds = np.array([mz_start, mz_end, rt_start, rt_end], dtype=np.float64).reshape(4, -1)
+        if bounds.shape[1] != len(items):
+            raise ValueError("Every item must have a bounding box")
+        order = self._sort_tile(bounds, len(items))
+        self.items = [items[i] for i in order.tolist()]
+        self.levels = [bounds[:, order]]
+        while self.levels[-1].shape[1] > node_size:
+            self.levels.append(self._pack_level(self.levels[-1]))
+
+    @classmethod
+    def from_features(cls, features, use_mz=True, node_size=16):
+        """Index LC-MS features by their m/z, or neutral mass, and their
+        elution time range.
+
+        Parameters
+        ----------
+        features : iterable
+            The features to index
+        use_mz : bool, optional
+            Whether to index the features' m/z or their neutral mass
+        node_size : int, optional
+            The largest number of children of each node
+
+        Returns
+        -------
+        PackedRTree
+        """
+        features = list(features)
+        mass = np.array([f.mz if use_mz else f.neutral_mass for f in features], dtype=np.float64)
+        start_time = np.array([f.start_time for f in features], dtype=np.float64)
+        end_time = np.array([f.end_time for f in features], dtype=np.float64)
+        return cls(features, mass, mass, start_time, end_time, node_size=node_size)
+
+    @classmethod
+    def from_bounding_boxes(cls, boxes, node_size=16):
+        """Index :class:`~.BoundingBox` objects, or any pair of ``(mz, rt)``
+        intervals
+
+        Returns
+        -------
+        PackedRTree
+        """
+        boxes = list(boxes)
+        return cls(
+            boxes, [b[0].start for b in boxes], [b[0].end for b in boxes],
+            [b[1].start for b in boxes], [b[1].end for b in boxes], node_size=node_size)
+
+    def _sort_tile(self, bounds, n):
+        # Cut the items into vertical slabs by m/z, then order each slab by time,
+        # so that each run of `node_size` items covers a compact box
+        if n == 0:
+            return np.arange(0)
+        mz_center = (bounds[0] + bounds[1]) / 2.
+        rt_center = (bounds[2] + bounds[3]) / 2.
+        n_leaves = -(-n // self.node_size)
+        n_slabs = int(np.ceil(np.sqrt(n_leaves)))
+        slab_size = n_slabs * self.node_size
+        by_mz = np.argsort(mz_center, kind='mergesort')
+        slab = np.empty(n, dtype=np.intp)
+        slab[by_mz] = np.arange(n) // slab_size
+        return np.lexsort((rt_center, slab))
+
+    def _pack_level(self, level):
+        starts = np.arange(0, level.shape[1], self.node_size)
+        lower = np.minimum.reduceat(level[[0, 2]], starts, axis=1)
+        upper = np.maximum.reduceat(level[[1, 3]], starts, axis=1)
+        return np.array([lower[0], upper[0], lower[1], upper[1]])
+
+    def __len__(self):
+        return len(self.items)
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def __repr__(self):
+        return "{self.__class__.__name__}(<{size} items>, depth={depth})".format(
+            self=self, size=len(self), depth=len(self.levels))
+
+    def _children(self, nodes, level):
+        # The positions of the children, in `level`, of `nodes` of the level above
+        children = (nodes[:, None] * self.node_size + np.arange(self.node_size)).ravel()
+        return children[children < self.levels[level].shape[1]]
+
+    def search_indices(self, mz_start, mz_end, rt_start, rt_end):
+        """Find the positions in :attr:`items` of every item whose bounding box
+        overlaps the query box, including its edges.
+
+        Returns
+        -------
+        np.ndarray
+        """
+        if not self.items:
+            return np.arange(0)
+        top = len(self.levels) - 1
+        nodes = np.arange(self.levels[top].shape[1])
+        for level in range(top, -1, -1):
+            if level != top:
+                nodes = self._children(nodes, level)
+            lo_mz, hi_mz, lo_rt, hi_rt = self.levels[level][:, nodes]
+            nodes = nodes[(lo_mz <= mz_end) & (hi_mz >= mz_start) & (lo_rt <= rt_end) & (hi_rt >= rt_start)]
+            if len(nodes) == 0:
+                break
+        return nodes
+
+    def search(self, mz_start, mz_end, rt_start, rt_end):
+        """Find every item whose bounding box overlaps the query box, including its edges.
+
+        Parameters
+        ----------
+        mz_start, mz_end : float
+            The m/z range to search
+        rt_start, rt_end : float
+            The time range to search
+
+        Returns
+        -------
+        list
+        """
+        return [self.items[i] for i in self.search_indices(mz_start, mz_end, rt_start, rt_end).tolist()]
+
+    def contains_point(self, mz, time):
+        """Find every item whose bounding box contains the point (`mz`, `time`)
+
+        Returns
+        -------
+        list
+        """
+        return self.search(mz, mz, time, time)
+
+    def nearest(self, mz, time, k=1, mz_scale=1.0, rt_scale=1.0, max_distance=float('inf')):
+        """Find the `k` items nearest to the point (`mz`, `time`), by the Euclidean
+        distance from the point to the nearest edge of each item's bounding box,
+        which is zero for boxes containing the point.
+
+        The two dimensions are made comparable by dividing distances along them by
+        `mz_scale` and `rt_scale` respectively.
+
+        Parameters
+        ----------
+        mz, time : float
+            The query point
+        k : int, optional
+            The number of items to find
+        mz_scale, rt_scale : float, optional
+            The units of distance in each dimension
+        max_distance : float, optional
+            The largest distance of any item to return
+
+        Returns
+        -------
+        list of tuple
+            Pairs of ``(distance, item)`` in ascending order of distance
+        """
+        results = []
+        if not self.items or k < 1:
+            return results
+        top = len(self.levels) - 1
+        # A heap of (distance, tie breaker, level, position). Entries of the leaf level are
+        # items, and as no node is nearer than any item under it, an item is nearest once popped
+        heap = []
+        counter = 0
+        nodes = np.arange(self.levels[top].shape[1])
+        for distance, node in zip(self._distances(top, nodes, mz, time, mz_scale, rt_scale).tolist(),
+                                  nodes.tolist()):
+            heap.append((distance, counter, top, node))
+            counter += 1
+        heapq.heapify(heap)
+        while heap and len(results) < k:
+            distance, _, level, position = heapq.heappop(heap)
+            if distance > max_distance:
+                break
+            if level == 0:
+                results.append((distance, self.items[position]))
+                continue
+            children = self._children(np.array([position]), level - 1)
+            for child_distance, child in zip(
+                    self._distances(level - 1, children, mz, time, mz_scale, rt_scale).tolist(),
+                    children.tolist()):
+                heapq.heappush(heap, (child_distance, counter, level - 1, child))
+                counter += 1
+        return results
+
+    def _distances(self, level, nodes, mz, time, mz_scale, rt_scale):
+        lo_mz, hi_mz, lo_rt, hi_rt = self.levels[level][:, nodes]
+        d_mz = np.maximum(np.maximum(lo_mz - mz, mz - hi_mz), 0) / mz_scale
+        d_rt = np.maximum(np.maximum(lo_rt - time, time - hi_rt), 0) / rt_scale
+        return np.sqrt(d_mz ** 2 + d_rt ** 2)
@@ -0,0 +1,267 @@
+'''Record where the time goes while processing scans.
+
+A :class:`PipelineMetrics` object collects the wall time spent in each named
+stage of processing, like peak picking or deconvolution, along with a histogram
+of how long each call took, and named event counters, like the number of peaks
+picked. Metrics recorded in different processes can be combined with
+:meth:`PipelineMetrics.merge`, and written out as JSON.
+
+When nothing should be recorded, :data:`NULL_METRICS` accepts the same calls
+and does nothing.
+'''
+import json
+
+from collections import OrderedDict
+from timeit import default_timer
+
+
+#: The upper bounds of the latency histogram buckets, in seconds. Calls
+#: slower than the last bound are counted in one extra, final bucket.
+LATENCY_BUCKETS = (
+    1e-4, 3e-4, 1e-3, 3e-3, 0.01, 0.03, 0.1, 0.3, 1.0, 3.0, 10.0, 30.0, 100.0)
+
+
+class StageStatistics(object):
+    """The time spent in one stage of processing.
+
+    Attributes
+    ----------
+    name : str
+        The name of the stage
+    count : int
+        The number of times the stage was run
+    total_time : float
+        The total time spent in the stage, in seconds
+    max_time : float
+        The longest time a single run of the stage took, in seconds
+    histogram : list of int
+        The number of runs of the stage whose time fell in each bucket of
+        :data:`LATENCY_BUCKETS`
+    """
+
+    __slots__ = ("name", "count", "total_time", "max_time", "histogram")
+
+    def __init__(self, name, count=0, total_time=0.0, max_time=0.0, histogram=None):
+        if histogram is None:
+            histogram = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.name = name
+        self.count = count
+        self.total_time = total_time
+        self.max_time = max_time
+        self.histogram = histogram
+
+    def add(self, elapsed):
+        self.count += 1
+        self.total_time += elapsed
+        if elapsed > self.max_time:
+            self.max_time = elapsed
+        i = 0
+        n = len(LATENCY_BUCKETS)
+        while i < n and elapsed > LATENCY_BUCKETS[i]:
+            i += 1
+        self.histogram[i] += 1
+
+    @property
+    def mean_time(self):
+        if self.count == 0:
+            return 0.0
+        return self.total_time / self.count
+
+    def merge(self, other):
+        self.count += other.count
+        self.total_time += other.total_time
+        self.max_time = max(self.max_time, other.max_time)
+        self.histogram = [a + b for a, b in zip(self.histogram, other.histogram)]
+
+    def to_dict(self):
+        return OrderedDict([
+            ("count", self.count),
+            ("total_time", self.total_time),
+            ("mean_time", self.mean_time),
+            ("max_time", self.max_time),
+            ("histogram", list(self.histogram)),
+        ])
+
+    @classmethod
+    def from_dict(cls, name, state):
+        return cls(name, state['count'], state['total_time'], state['max_time'], list(state['histogram']))
+
+    def __repr__(self):
+        return "{self.__class__.__name__}({self.name!r}, {self.count}, {self.total_time:0.3f})".format(self=self)
+
+
+class _StageTimer(object):
+    __slots__ = ("metrics", "stage", "start")
+
+    def __init__(self, metrics, stage):
+        self.metrics = metrics
+        self.stage = stage
+        self.start = None
+
+    def __enter__(self):
+        self.start = default_timer()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.metrics.record(self.stage, default_timer() - self.start)
+        return False
+
+
+class PipelineMetrics(object):
+    """Collects per-stage timings and event counts.
+
+    Examples
+    --------
+    >>> metrics = PipelineMetrics()
+    >>> with metrics.time("peak_picking"):
+    ...     peaks = [1, 2, 3]
+    >>> metrics.increment("peaks_picked", len(peaks))
+    >>> metrics.stages["peak_picking"].count
+    1
+
+    Attributes
+    ----------
+    stages : :class:`~.OrderedDict`
+        A mapping from stage name to :class:`StageStatistics`, in the order
+        the stages were first seen
+    counters : :class:`~.OrderedDict`
+        A mapping from counter name to count
+    """
+
+    enabled = True
+
+    def __init__(self):
+        self.stages = OrderedDict()
+        self.counters = OrderedDict()
+
+    def time(self, stage):
+        """Get a context manager which records the time spent inside it
+        as one run of `stage`.
+
+        Parameters
+        ----------
+        stage : str
+            The name of the stage
+
+        Returns
+        -------
+        context manager
+        """
+        return _StageTimer(self, stage)
+
+    def record(self, stage, elapsed):
+        """Record one run of `stage` which took `elapsed` seconds."""
+        try:
+            statistics = self.stages[stage]
+        except KeyError:
+            statistics = self.stages[stage] = StageStatistics(stage)
+        statistics.add(elapsed)
+
+    def increment(self, counter, value=1):
+        self.counters[counter] = self.counters.get(counter, 0) + value
+
+    def merge(self, other):
+        """Add the stages and counters of `other` to this object.
+
+        Parameters
+        ----------
+        other : :class:`PipelineMetrics` or dict
+            The metrics to add, or their :meth:`to_dict` form
+
+        Returns
+        -------
+        :class:`PipelineMetrics`
+        """
+        if isinstance(other, dict):
+            other = self.from_dict(other)
+        for name, statistics in other.stages.items():
+            try:
+                self.stages[name].merge(statistics)
+            except KeyError:
+                self.stages[name] = StageStatistics.from_dict(name, statistics.to_dict())
+        for name, value in other.counters.items():
+            self.increment(name, value)
+        return self
+
+    def reset(self):
+        self.stages = OrderedDict()
+        self.counters = OrderedDict()
+
+    def __bool__(self):
+        return bool(self.stages) or bool(self.counters)
+
+    __nonzero__ = __bool__
+
+    def to_dict(self):
+        return OrderedDict([
+            ("stages", OrderedDict([(name, statistics.to_dict()) for name, statistics in self.stages.items()])),
+            ("counters", OrderedDict(self.counters)),
+        ])
+
+    @classmethod
+    def from_dict(cls, state):
+        inst = cls()
+        for name, statistics in state.get('stages', {}).items():
+            inst.stages[name] = StageStatistics.from_dict(name, statistics)
+        for name, value in state.get('counters', {}).items():
+            inst.counters[name] = value
+        return inst
+
+    def report(self, **extra):
+        """Build a JSON-compatible description of the metrics.
+
+        Parameters
+        ----------
+        **extra
+            Additional top-level entries, like the elapsed wall time of the run
+
+        Returns
+        -------
+        dict
+        """
+        result = OrderedDict(sorted(extra.items()))
+        result["latency_buckets"] = list(LATENCY_BUCKETS)
+        result.update(self.to_dict())
+        return result
+
+    def write_json(self, handle, **extra):
+        json.dump(self.report(**extra), handle, indent=2)
+
+    def __repr__(self):
+        return "{self.__class__.__name__}({stages})".format(self=self, stages=list(self.stages.values()))
+
+
+class _NullTimer(object):
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+
+_NULL_TIMER = _NullTimer()
+
+
+class NullPipelineMetrics(PipelineMetrics):
+    """A :class:`PipelineMetrics` which records nothing, used when instrumentation
+    is turned off.
+    """
+
+    enabled = False
+
+    def time(self, stage):
+        return _NULL_TIMER
+
+    def record(self, stage, elapsed):
+        pass
+
+    def increment(self, counter, value=1):
+        pass
+
+    def merge(self, other):
+        return self
+
+
+NULL_METRICS = NullPipelineMetrics()
@@ -10,6 +10,9 @@ from .text import (
 from .mgf import (
     ProcessedMGFDeserializer, MGFSerializer)
 
+from .columnar import (
+    ProcessedColumnarDeserializer, ColumnarSerializer)
+
 
 __all__ = [
     "ScanSerializerBase",
@@ -18,6 +21,8 @@ __all__ = [
     "ProcessedMzMLDeserializer",
     "MGFSerializer",
     "ProcessedMGFDeserializer",
+    "ColumnarSerializer",
+    "ProcessedColumnarDeserializer",
     "TextScanSerializerBase",
     "HeaderedDelimitedWriter"
 ]
@@ -0,0 +1,549 @@
+'''A binary, columnar storage format for processed scans.
+
+A store is a directory holding one flat binary file per peak attribute and a
+JSON header table describing each scan. Peaks are appended to the binary files
+as each scan is written, and each scan's header records the range of rows it
+occupies, so a single scan's peaks can be read by slicing the memory-mapped
+columns without decoding any other scan's data.
+
+The layout of a store is::
+
+    <path>/
+        header.json                        format version, column dtypes and scan headers
+        deconvoluted_<attribute>.bin       one file per :class:`~.DeconvolutedPeak` attribute
+        envelope_mz.bin                    the isotopic envelope points of every deconvoluted peak
+        envelope_intensity.bin
+        centroid_<attribute>.bin           one file per centroided :class:`~.FittedPeak` attribute
+
+All numeric columns are little-endian.
+'''
+import os
+import json
+from collections import OrderedDict
+
+import numpy as np
+
+from ms_peak_picker import PeakIndex, PeakSet, FittedPeak
+
+from .common import ScanSerializerBase, ScanDeserializerBase
+from ms_deisotope.peak_set import ColumnarDeconvolutedPeakSet
+from ms_deisotope.envelope_statistics import CoIsolation
+from ms_deisotope.data_source.common import (
+    ProcessedScan, PrecursorInformation, ChargeNotProvided, RandomAccessScanSource,
+    _SingleScanIteratorImpl, _GroupedScanIteratorImpl)
+from ms_deisotope.data_source.metadata.activation import (
+    ActivationInformation, MultipleActivationInformation)
+from ms_deisotope.data_source.metadata.scan_traits import IsolationWindow
+
+
+FORMAT_NAME = "ms_deisotope-columnar"
+FORMAT_VERSION = 1
+HEADER_FILE_NAME = "header.json"
+
+
+deconvoluted_columns = [
+    (name, np.dtype(dtype).newbyteorder('<'))
+    for name, dtype in ColumnarDeconvolutedPeakSet._columns
+] + [("envelope_size", np.dtype("<i4"))]
+
+envelope_columns = [
+    ("mz", np.dtype("<f8")),
+    ("intensity", np.dtype("<f8")),
+]
+
+centroid_columns = [
+    ("mz", np.dtype("<f8")),
+    ("intensity", np.dtype("<f8")),
+    ("signal_to_noise", np.dtype("<f8")),
+    ("full_width_at_half_max", np.dtype("<f8")),
+    ("area", np.dtype("<f8")),
+]
+
+column_groups = OrderedDict([
+    ("deconvoluted", deconvoluted_columns),
+    ("envelope", envelope_columns),
+    ("centroid", centroid_columns),
+])
+
+
+def is_columnar_store(path):
+    """Check whether `path` is a directory containing a columnar scan store
+
+    Parameters
+    ----------
+    path : str
+
+    Returns
+    -------
+    bool
+    """
+    return os.path.isdir(path) and os.path.exists(os.path.join(path, HEADER_FILE_NAME))
+
+
+def _column_file_name(group, name):
+    return "%s_%s.bin" % (group, name)
+
+
+def _json_default(value):
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    return str(value)
+
+
+def _encode_charge(charge):
+    if charge == ChargeNotProvided:
+        return "ChargeNotProvided"
+    return charge
+
+
+def _decode_charge(charge):
+    if charge == "ChargeNotProvided":
+        return ChargeNotProvided
+    return charge
+
+
+class ColumnarSerializer(ScanSerializerBase):
+    """Write processed scans to a binary, columnar store.
+
+    Peak arrays are appended to their column files as each scan is saved, so
+    memory use does not grow with the number of scans written. The header
+    table is written by :meth:`complete`, and the store cannot be read until
+    it has been called.
+
+    Attributes
+    ----------
+    path : str
+        The directory to write the store to
+    deconvoluted : bool
+        Whether to write the deconvoluted peak list of each scan. If :const:`False`,
+        or if a scan has no deconvoluted peak list, its centroided peak list is written
+    sample_name : str
+        The name of the sample the scans were acquired from
+    """
+
+    def __init__(self, path, sample_name=None, deconvoluted=True):
+        if not os.path.exists(path):
+            os.makedirs(path)
+        self.path = path
+        self.sample_name = sample_name
+        self.deconvoluted = deconvoluted
+        self.headers = []
+        self._row_counts = {}
+        self._handles = {}
+        for group, columns in column_groups.items():
+            self._row_counts[group] = 0
+            for name, _ in columns:
+                self._handles[group, name] = open(
+                    os.path.join(path, _column_file_name(group, name)), 'wb')
+        self._closed = False
+
+    def _append(self, group, columns, n):
+        start = self._row_counts[group]
+        for name, dtype in column_groups[group]:
+            array = np.ascontiguousarray(columns[name], dtype=dtype)
+            self._handles[group, name].write(array.tobytes())
+        self._row_counts[group] = start + n
+        return [start, start + n]
+
+    def _write_deconvoluted_peaks(self, peaks):
+        if not isinstance(peaks, ColumnarDeconvolutedPeakSet):
+            peaks = ColumnarDeconvolutedPeakSet(peaks)
+        columns = {name: getattr(peaks, name) for name, _ in ColumnarDeconvolutedPeakSet._columns}
+        columns['envelope_size'] = np.diff(peaks.envelope_offsets)
+        peak_range = self._append("deconvoluted", columns, len(peaks))
+        envelope_range = self._append("envelope", {
+            "mz": peaks.envelope_mz,
+            "intensity": peaks.envelope_intensity
+        }, len(peaks.envelope_mz))
+        return peak_range, envelope_range
+
+    def _write_centroided_peaks(self, peaks):
+        columns = {
+            name: np.array([getattr(p, name) for p in peaks], dtype=dtype)
+            for name, dtype in centroid_columns
+        }
+        return self._append("centroid", columns, len(peaks))
+
+    def _pack_precursor_information(self, precursor_information):
+        return {
+            "mz": precursor_information.mz,
+            "intensity": precursor_information.intensity,
+            "charge": _encode_charge(precursor_information.charge),
+            "precursor_scan_id": precursor_information.precursor_scan_id,
+            "product_scan_id": precursor_information.product_scan_id,
+            "extracted_neutral_mass": precursor_information.extracted_neutral_mass,
+            "extracted_charge": _encode_charge(precursor_information.extracted_charge),
+            "extracted_intensity": precursor_information.extracted_intensity,
+            "defaulted": precursor_information.defaulted,
+            "orphan": precursor_information.orphan,
+            "coisolation": [
+                [p.neutral_mass, p.intensity, p.charge]
+                for p in (precursor_information.coisolation or [])
+            ],
+            "annotations": dict(precursor_information.annotations or {}),
+        }
+
+    def _pack_activation(self, activation):
+        if activation.is_multiple_dissociation():
+            methods = [str(method) for method in activation.methods]
+            energies = list(activation.energies)
+        else:
+            methods = [str(activation.method)]
+            energies = [activation.energy]
+        return {
+            "methods": methods,
+            "energies": energies,
+            "data": dict(activation.data),
+        }
+
+    def save_scan(self, scan, **kwargs):
+        """Append a processed scan to the store.
+
+        Parameters
+        ----------
+        scan : :class:`~.ProcessedScan`
+            The scan to write.
+        deconvoluted : bool, optional
+            Whether to write the scan's deconvoluted peak list, overriding :attr:`deconvoluted`
+        """
+        deconvoluted = kwargs.get("deconvoluted", self.deconvoluted)
+        header = {
+            "id": scan.id,
+            "title": scan.title,
+            "index": scan.index,
+            "ms_level": scan.ms_level,
+            "scan_time": scan.scan_time,
+            "polarity": scan.polarity,
+            "precursor_information": None,
+            "activation": None,
+            "isolation_window": None,
+            "annotations": dict(scan.annotations or {}),
+            "deconvoluted": None,
+            "envelope": None,
+            "centroid": None,
+        }
+        if scan.precursor_information is not None:
+            header['precursor_information'] = self._pack_precursor_information(
+                scan.precursor_information)
+        if scan.activation is not None:
+            header['activation'] = self._pack_activation(scan.activation)
+        if scan.isolation_window is not None:
+            header['isolation_window'] = list(scan.isolation_window)
+        if deconvoluted and scan.deconvoluted_peak_set is not None:
+            header['deconvoluted'], header['envelope'] = self._write_deconvoluted_peaks(
+                scan.deconvoluted_peak_set)
+        elif scan.peak_set is not None:
+            header['centroid'] = self._write_centroided_peaks(scan.peak_set)
+        self.headers.append(header)
+
+    def complete(self):
+        """Write the header table and close the column files.
+        """
+        if self._closed:
+            return
+        for handle in self._handles.values():
+            handle.close()
+        header = {
+            "format": FORMAT_NAME,
+            "version": FORMAT_VERSION,
+            "sample_name": self.sample_name,
+            "columns": {
+                group: [[name, dtype.str] for name, dtype in columns]
+                for group, columns in column_groups.items()
+            },
+            "row_counts": self._row_counts,
+            "scans": self.headers,
+        }
+        with open(os.path.join(self.path, HEADER_FILE_NAME), 'wt') as handle:
+            json.dump(header, handle, default=_json_default)
+        self._closed = True
+
+    def close(self):
+        self.complete()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+class ProcessedColumnarDeserializer(ScanDeserializerBase, RandomAccessScanSource):
+    """Read processed scans from a store written by :class:`ColumnarSerializer`.
+
+    Only the header table is parsed when the store is opened. The column files are
+    memory-mapped, and a scan's peaks are read only when that scan is requested.
+
+    Attributes
+    ----------
+    source_file : str
+        The path to the store's directory
+    mmap : bool
+        Whether the column files are memory-mapped rather than read into memory
+    columnar_peaks : bool
+        Whether deconvoluted peak lists are returned as :class:`~.ColumnarDeconvolutedPeakSet`
+        views over the column files, rather than :class:`~.DeconvolutedPeakSet`
+    sample_name : str
+        The name of the sample the scans were acquired from
+    headers : list of dict
+        The header record of each scan, in the order they were written
+    """
+
+    def __init__(self, source_file, mmap=True, columnar_peaks=False):
+        self.source_file = source_file
+        self.mmap = mmap
+        self.columnar_peaks = columnar_peaks
+        with open(os.path.join(source_file, HEADER_FILE_NAME), 'rt') as handle:
+            header = json.load(handle)
+        if header.get("format") != FORMAT_NAME:
+            raise ValueError("%r is not a columnar scan store" % (source_file, ))
+        if header.get("version", 0) > FORMAT_VERSION:
+            raise ValueError("Unsupported columnar scan store version %r" % (header['version'], ))
+        self.sample_name = header.get('sample_name')
+        self.headers = header['scans']
+        self._row_counts = header['row_counts']
+        self._column_types = {
+            group: [(name, np.dtype(dtype)) for name, dtype in columns]
+            for group, columns in header['columns'].items()
+        }
+        self._columns = {}
+        self._index = OrderedDict((record['id'], i) for i, record in enumerate(self.headers))
+        self._scan_times = np.array([record['scan_time'] for record in self.headers], dtype=np.float64)
+        self._time_order = np.argsort(self._scan_times, kind='mergesort')
+        self._producer = None
+        self.initialize_scan_cache()
+        self.make_iterator()
+
+    def __reduce__(self):
+        return self.__class__, (self.source_file, self.mmap, self.columnar_peaks)
+
+    def __repr__(self):
+        return "%s(%r)" % (self.__class__.__name__, self.source_file)
+
+    @property
+    def index(self):
+        return self._index
+
+    def __len__(self):
+        return len(self.headers)
+
+    def _load_column(self, group, name, dtype):
+        path = os.path.join(self.source_file, _column_file_name(group, name))
+        if self._row_counts[group] == 0:
+            return np.zeros(0, dtype=dtype)
+        if self.mmap:
+            return np.memmap(path, dtype=dtype, mode='r', shape=(self._row_counts[group], ))
+        return np.fromfile(path, dtype=dtype, count=self._row_counts[group])
+
+    def _get_columns(self, group):
+        try:
+            return self._columns[group]
+        except KeyError:
+            columns = self._columns[group] = {
+                name: self._load_column(group, name, dtype)
+                for name, dtype in self._column_types[group]
+            }
+            return columns
+
+    # ScanDataSource accessors over header records
+
+    def _scan_arrays(self, scan):
+        peaks = self._read_centroided_peaks(scan)
+        if peaks is None:
+            return np.array([]), np.array([])
+        return (np.array([p.mz for p in peaks]), np.array([p.intensity for p in peaks]))
+
+    def _precursor_information(self, scan):
+        record = scan['precursor_information']
+        if record is None:
+            return None
+        coisolation = [CoIsolation(*entry) for entry in record.get('coisolation', [])]
+        return PrecursorInformation(
+            record['mz'], record['intensity'], _decode_charge(record['charge']),
+            record['precursor_scan_id'], self, record['extracted_neutral_mass'],
+            _decode_charge(record['extracted_charge']), record['extracted_intensity'],
+            defaulted=record['defaulted'], orphan=record['orphan'],
+            product_scan_id=record['product_scan_id'], annotations=record.get('annotations'),
+            coisolation=coisolation)
+
+    def _scan_title(self, scan):
+        return scan['title']
+
+    def _scan_id(self, scan):
+        return scan['id']
+
+    def _scan_index(self, scan):
+        return scan['index']
+
+    def _ms_level(self, scan):
+        return scan['ms_level']
+
+    def _scan_time(self, scan):
+        return scan['scan_time']
+
+    def _is_profile(self, scan):
+        return False
+
+    def _polarity(self, scan):
+        return scan['polarity']
+
+    def _activation(self, scan):
+        record = scan['activation']
+        if record is None:
+            return None
+        if len(record['methods']) > 1:
+            return MultipleActivationInformation(
+                record['methods'], record['energies'], record['data'])
+        return ActivationInformation(record['methods'][0], record['energies'][0], record['data'])
+
+    def _isolation_window(self, scan):
+        record = scan['isolation_window']
+        if record is None:
+            return None
+        return IsolationWindow(*record)
+
+    def _annotations(self, scan):
+        return dict(scan['annotations'])
+
+    # Peak decoding
+
+    def _read_deconvoluted_peaks(self, scan):
+        if scan['deconvoluted'] is None:
+            return None
+        start, end = scan['deconvoluted']
+        env_start, env_end = scan['envelope']
+        columns = self._get_columns("deconvoluted")
+        envelope = self._get_columns("envelope")
+        values = {name: columns[name][start:end] for name, _ in ColumnarDeconvolutedPeakSet._columns}
+        envelope_offsets = np.zeros(end - start + 1, dtype=np.int64)
+        np.cumsum(columns['envelope_size'][start:end], out=envelope_offsets[1:])
+        peaks = ColumnarDeconvolutedPeakSet.from_arrays(
+            envelope_offsets=envelope_offsets,
+            envelope_mz=envelope['mz'][env_start:env_end],
+            envelope_intensity=envelope['intensity'][env_start:env_end],
+            **values)
+        if self.columnar_peaks:
+            return peaks
+        return peaks.to_peak_set()
+
+    def _read_centroided_peaks(self, scan):
+        if scan['centroid'] is None:
+            return None
+        start, end = scan['centroid']
+        columns = self._get_columns("centroid")
+        peaks = []
+        for i, (mz, intensity, snr, fwhm, area) in enumerate(zip(*[
+                columns[name][start:end].tolist() for name, _ in centroid_columns])):
+            peaks.append(FittedPeak(mz, intensity, snr, i, i, fwhm, area, fwhm / 2., fwhm / 2.))
+        peak_set = PeakSet(peaks)
+        peak_set.reindex()
+        return peak_set
+
+    def _make_scan_header(self, data):
+        return ProcessedScan(
+            self._scan_id(data), self._scan_title(data), self._precursor_information(data),
+            self._ms_level(data), self._scan_time(data), self._scan_index(data),
+            None, None, self._polarity(data), self._activation(data),
+            isolation_window=self._isolation_window(data),
+            annotations=self._annotations(data))
+
+    def _make_scan(self, data):
+        scan = self._make_scan_header(data)
+        scan.deconvoluted_peak_set = self._read_deconvoluted_peaks(data)
+        centroided = self._read_centroided_peaks(data)
+        if centroided is None:
+            centroided = PeakSet([])
+        scan.peak_set = PeakIndex(np.array([]), np.array([]), centroided)
+        return scan
+
+    # Iteration and random access
+
+    def has_ms1_scans(self):
+        return any(record['ms_level'] == 1 for record in self.headers)
+
+    def has_msn_scans(self):
+        return any(record['ms_level'] > 1 for record in self.headers)
+
+    def _make_default_iterator(self):
+        return iter(self.headers)
+
+    def make_iterator(self, iterator=None, grouped=True):
+        if grouped and not self.has_ms1_scans():
+            grouped = False
+        super(ProcessedColumnarDeserializer, self).make_iterator(iterator, grouped)
+
+    def reset(self):
+        self.make_iterator(None)
+
+    def next(self):
+        return next(self._producer)
+
+    def iter_scan_headers(self, grouped=True):
+        """Iterate over the scans in the store without reading any of their peaks.
+
+        Parameters
+        ----------
+        grouped : bool, optional
+            Whether to produce :class:`~.ScanBunch` objects or single scans. Defaults to :const:`True`
+
+        Yields
+        ------
+        :class:`~.ScanBunch` or :class:`~.ProcessedScan`
+        """
+        if grouped and self.has_ms1_scans():
+            impl = _GroupedScanIteratorImpl(iter(self.headers), self._make_scan_header)
+        else:
+            impl = _SingleScanIteratorImpl(iter(self.headers), self._make_scan_header)
+        for item in impl:
+            yield item
+
+    def get_scan_header_by_id(self, scan_id):
+        """Retrieve the scan with id `scan_id` without reading its peaks.
+
+        Parameters
+        ----------
+        scan_id : str
+
+        Returns
+        -------
+        :class:`~.ProcessedScan`
+        """
+        return self._make_scan_header(self.headers[self._index[scan_id]])
+
+    def get_scan_by_id(self, scan_id):
+        try:
+            return self._scan_cache[scan_id]
+        except KeyError:
+            scan = self._make_scan(self.headers[self._index[scan_id]])
+            self._cache_scan(scan)
+            return scan
+
+    def get_scan_by_index(self, index):
+        return self.get_scan_by_id(self.headers[index]['id'])
+
+    def get_scan_by_time(self, time, require_ms1=False):
+        times = self._scan_times[self._time_order]
+        if len(times) == 0:
+            return None
+        i = int(np.searchsorted(times, time))
+        if i == len(times) or (i > 0 and abs(times[i - 1] - time) <= abs(times[i] - time)):
+            i -= 1
+        scan = self.get_scan_by_index(int(self._time_order[i]))
+        if require_ms1 and scan.ms_level > 1:
+            scan = self._locate_ms1_scan(scan)
+        return scan
+
+    def start_from_scan(self, scan_id=None, rt=None, index=None, require_ms1=True, grouped=True):
+        if scan_id is not None:
+            index = self._index[scan_id]
+        elif rt is not None:
+            index = self._index[self.get_scan_by_time(rt).id]
+        elif index is None:
+            raise ValueError("Must provide a scan locator, one of (scan_id, rt, index)")
+        if require_ms1:
+            while index > 0 and self.headers[index]['ms_level'] > 1:
+                index -= 1
+        self.make_iterator(iter(self.headers[index:]), grouped=grouped)
+        return self
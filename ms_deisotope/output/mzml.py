@@ -866,6 +866,21 @@ class MzMLSerializer(ScanSerializerBase):
                     chromatogram.pop("chromatogram"),
                     **chromatogram)
 
+    def flush(self):
+        """Flush all of the spectra written so far through to the output file.
+
+        The document is not well-formed until :meth:`complete` is called, but
+        every spectrum written before this call is present in the output file.
+        """
+        try:
+            self.writer.writer.flush()
+        except (IOError, AttributeError, ValueError):
+            pass
+        try:
+            self.writer.flush()
+        except (IOError, AttributeError, ValueError):
+            pass
+
     def complete(self):
         """Finish writing to the output document.
 
@@ -1267,6 +1282,53 @@ class ProcessedMzMLDeserializer(MzMLLoader, ScanDeserializerBase):
                     out.append(pinfo)
         return out
 
+    def msms_for_many(self, neutral_masses, mass_error_tolerance=1e-5, start_time=None, end_time=None):
+        """Find the precursors of MSn scans matching each of `neutral_masses`, equivalent to
+        calling :meth:`msms_for` for each mass, but reading the precursor index only once
+        and searching it for all masses at once.
+
+        Parameters
+        ----------
+        neutral_masses : array-like
+            The neutral masses to search for
+        mass_error_tolerance : float, optional
+            The PPM error tolerance to use
+        start_time : float, optional
+            The earliest product scan time to accept
+        end_time : float, optional
+            The latest product scan time to accept
+
+        Returns
+        -------
+        list of list of :class:`~.PrecursorInformation`
+        """
+        pinfos = self.precursor_information()
+        masses = np.array([pinfo.neutral_mass for pinfo in pinfos], dtype=np.float64)
+        order = np.argsort(masses, kind='mergesort')
+        masses = masses[order]
+        queries = np.asarray(neutral_masses, dtype=np.float64)
+        width = queries * mass_error_tolerance
+        starts = np.searchsorted(masses, queries - width, side='left')
+        ends = np.searchsorted(masses, queries + width, side='right')
+        check_time = start_time is not None or end_time is not None
+        valid = {}
+        out = []
+        for i, j in zip(starts.tolist(), ends.tolist()):
+            hits = []
+            for k in sorted(order[i:j].tolist()):
+                pinfo = pinfos[k]
+                if check_time:
+                    if k not in valid:
+                        product = self.get_scan_header_by_id(pinfo.product_scan_id)
+                        valid[k] = not (
+                            (start_time is not None and product.scan_time < start_time) or
+                            (end_time is not None and product.scan_time > end_time))
+                    if not valid[k]:
+                        continue
+                hits.append(pinfo)
+            out.append(hits)
+        return out
+
 
 try:
     has_c = True
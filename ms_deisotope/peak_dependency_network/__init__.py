@@ -6,7 +6,8 @@ from .peak_network import (
 
 from .subgraph import (
     ConnectedSubgraph, FitNode,
-    GreedySubgraphSelection)
+    GreedySubgraphSelection, IntervalSchedulingSelection,
+    BranchAndBoundSelection)
 
 from .intervals import (
     Interval, IntervalTreeNode, SpanningMixin)
@@ -24,6 +25,8 @@ __all__ = [
     "FitNode",
     "ConnectedSubgraph",
     "GreedySubgraphSelection",
+    "IntervalSchedulingSelection",
+    "BranchAndBoundSelection",
     "Interval",
     "IntervalTreeNode",
     "SpanningMixin",
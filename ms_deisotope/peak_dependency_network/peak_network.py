@@ -104,9 +104,9 @@ class DependenceCluster(SpanningMixin):
         self.dependencies.sort(key=lambda x: x.score, reverse=self.maximize)
         self._reset()
 
-    def disjoint_subset(self):
+    def disjoint_subset(self, method="greedy"):
         graph = self.build_graph()
-        return graph.find_heaviest_path()
+        return graph.find_heaviest_path(method)
 
     def build_graph(self):
         graph = ConnectedSubgraph(self.dependencies, maximize=self.maximize)
@@ -123,15 +123,20 @@ class DependenceCluster(SpanningMixin):
         """
         return self.dependencies[0]
 
-    def disjoint_best_fits(self):
+    def disjoint_best_fits(self, method="greedy"):
         """
         Compute the best set of disjoint isotopic fits spanning this cluster
 
+        Parameters
+        ----------
+        method : str, optional
+            The subgraph solver to use, as in :meth:`~.ConnectedSubgraph.find_heaviest_path`
+
         Returns
         -------
         list of IsotopicFitRecord
         """
-        fit_sets = tuple(self.disjoint_subset())
+        fit_sets = tuple(self.disjoint_subset(method))
         best_fits = fit_sets
         return [node.fit for node in best_fits]
 
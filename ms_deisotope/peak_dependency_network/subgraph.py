@@ -1,3 +1,5 @@
+from bisect import bisect_left
+
 from .utils import GeneratorQueue
 from .intervals import SpanningMixin
 
@@ -6,14 +8,59 @@ def ident(x):
     return x
 
 
+def peak_index_mask(indices):
+    """Pack a collection of non-negative integers into a bitmask relative to
+    the smallest of them.
+
+    Parameters
+    ----------
+    indices : iterable of int
+        The integers to pack
+
+    Returns
+    -------
+    offset : int
+        The smallest integer, or 0 if `indices` is empty
+    mask : int
+        A bitmask with bit ``i - offset`` set for each ``i`` in `indices`
+    """
+    indices = list(indices)
+    if not indices:
+        return 0, 0
+    offset = min(indices)
+    mask = 0
+    for i in indices:
+        mask |= 1 << (i - offset)
+    return offset, mask
+
+
+def masks_overlap(offset_a, mask_a, offset_b, mask_b):
+    """Test whether two bitmasks built by :func:`peak_index_mask` share any integer.
+
+    Returns
+    -------
+    bool
+    """
+    if offset_a > offset_b:
+        offset_a, mask_a, offset_b, mask_b = offset_b, mask_b, offset_a, mask_a
+    shift = offset_b - offset_a
+    # When the lower mask ends before the higher one starts the two cannot
+    # share a bit, and need not be shifted to compare them.
+    if shift >= mask_a.bit_length():
+        return False
+    return ((mask_a >> shift) & mask_b) != 0
+
+
 class FitNode(SpanningMixin):
     def __init__(self, fit, index=None):
         self.index = index
         self.fit = fit
-        self.edges = set()
+        self._edges = set()
         self.overlap_edges = set()
+        self.members = None
         # Placeholder Peaks have a peak_count of -1
         self.peak_indices = {p.peak_count for p in fit.experimental if p.peak_count >= 0}
+        self.peak_offset, self.peak_mask = peak_index_mask(self.peak_indices)
         self._hash = None
         self.score = fit.score
         self.start = fit.experimental[0].mz
@@ -36,13 +83,27 @@ class FitNode(SpanningMixin):
     def __ne__(self, other):
         return self.fit is not other.fit
 
+    @property
+    def edges(self):
+        """The nodes sharing no peaks with this node.
+
+        Once this node belongs to a :class:`ConnectedSubgraph`, this is every other
+        node in :attr:`members` not in :attr:`overlap_edges`. It is built each time it
+        is requested rather than stored, as nearly every pair of nodes of a large graph
+        is disjoint.
+        """
+        if self.members is None:
+            return self._edges
+        overlaps = self.overlap_edges
+        return {node for node in self.members if node is not self and node not in overlaps}
+
     def isdisjoint(self, other):
-        return self.peak_indices.isdisjoint(other.peak_indices)
+        return not masks_overlap(self.peak_offset, self.peak_mask, other.peak_offset, other.peak_mask)
 
     def visit(self, other):
         if self.isdisjoint(other):
-            self.edges.add(other)
-            other.edges.add(self)
+            self._edges.add(other)
+            other._edges.add(self)
         else:
             self.overlap_edges.add(other)
             other.overlap_edges.add(self)
@@ -65,7 +126,7 @@ def span_overlap(a, b):
 
 
 def peak_overlap(a, b):
-    return len(a.peak_indices & b.peak_indices) > 0
+    return not a.isdisjoint(b)
 
 
 def layout_layers(envelopes, overlap_fn=peak_overlap, maximize=True):
@@ -114,6 +175,197 @@ class GreedySubgraphSelection(object):
         return solution
 
 
+def node_span(node):
+    return node.start, node.end
+
+
+def selection_weights(nodes, maximize=True):
+    """Convert the scores of `nodes` into non-negative weights whose sum an optimal
+    selection maximizes.
+
+    When maximizing, a node weighs its score. When minimizing, a node weighs how much
+    better its score is than the worst score among `nodes`.
+
+    Returns
+    -------
+    list of float
+    """
+    scores = [node.score for node in nodes]
+    if maximize:
+        return [max(score, 0.0) for score in scores]
+    worst = max(scores)
+    return [worst - score for score in scores]
+
+
+def _extend_selection(selected, nodes, conflicts):
+    # Add any node which conflicts with nothing chosen so far, best first, so that
+    # nodes whose weight is zero are still reported as they would be by the greedy solver
+    chosen = set(selected)
+    extended = list(selected)
+    for node in nodes:
+        if node in chosen:
+            continue
+        if not any(conflicts(node, other) for other in extended):
+            extended.append(node)
+            chosen.add(node)
+    return extended
+
+
+class IntervalSchedulingSelection(object):
+    """Select the set of nodes whose spans do not overlap with the largest
+    total weight, solving the weighted interval scheduling problem exactly
+    in O(n log n) time.
+
+    Two nodes conflict when their spans overlap, including sharing an end point, which
+    is a stricter condition than sharing a peak, so this solver may leave out a node
+    which shares no peaks with any selected node but lies between them.
+
+    Attributes
+    ----------
+    nodes : list
+        The nodes to select from, in descending order of quality
+    maximize : bool
+        Whether higher scores are better
+    span_fn : callable
+        Returns the ``(start, end)`` span of a node
+    """
+
+    def __init__(self, subgraph, maximize=True, span_fn=node_span):
+        self.nodes = sorted(subgraph, key=lambda x: x.score, reverse=maximize)
+        self.maximize = maximize
+        self.span_fn = span_fn
+
+    def _overlaps(self, a, b):
+        a_start, a_end = self.span_fn(a)
+        b_start, b_end = self.span_fn(b)
+        return a_start <= b_end and b_start <= a_end
+
+    def select(self):
+        weights = selection_weights(self.nodes, self.maximize)
+        spans = [self.span_fn(node) for node in self.nodes]
+        order = sorted(range(len(self.nodes)), key=lambda i: spans[i][1])
+        ends = [spans[i][1] for i in order]
+        # The number of nodes, in order of their end, which end before each node starts
+        previous = [bisect_left(ends, spans[i][0]) for i in order]
+        best = [0.0] * (len(order) + 1)
+        for j, i in enumerate(order):
+            best[j + 1] = max(best[j], weights[i] + best[previous[j]])
+        selected = []
+        j = len(order)
+        while j > 0:
+            i = order[j - 1]
+            if weights[i] + best[previous[j - 1]] > best[j - 1]:
+                selected.append(self.nodes[i])
+                j = previous[j - 1]
+            else:
+                j -= 1
+        return _extend_selection(selected, self.nodes, self._overlaps)
+
+    @classmethod
+    def solve(cls, nodes, maximize=True, span_fn=node_span):
+        solver = cls(nodes, maximize=maximize, span_fn=span_fn)
+        return solver.select()
+
+
+class BranchAndBoundSelection(object):
+    """Select the set of nodes sharing no peaks with the largest total weight,
+    the maximum weight independent set of the graph whose edges join overlapping
+    nodes, by a depth-first branch and bound search.
+
+    The search starts from the greedy solution and explores at most `max_steps`
+    partial solutions, so that dense clusters still take bounded time. When the
+    budget runs out, the best solution found so far is used, which is never worse
+    than the greedy solution.
+
+    The nodes must come from a :class:`ConnectedSubgraph`, whose edges record which
+    nodes overlap.
+
+    Attributes
+    ----------
+    nodes : list
+        The nodes to select from, in descending order of weight
+    maximize : bool
+        Whether higher scores are better
+    max_steps : int
+        The largest number of partial solutions to explore
+    optimal : bool
+        Whether the last search finished within its budget, proving its
+        solution optimal
+    """
+
+    def __init__(self, subgraph, maximize=True, max_steps=10000):
+        nodes = sorted(subgraph, key=lambda x: x.score, reverse=maximize)
+        weights = selection_weights(nodes, maximize)
+        order = sorted(range(len(nodes)), key=lambda i: weights[i], reverse=True)
+        self.nodes = [nodes[i] for i in order]
+        self.weights = [weights[i] for i in order]
+        self.maximize = maximize
+        self.max_steps = max_steps
+        self.optimal = False
+        position = {node: i for i, node in enumerate(self.nodes)}
+        self.conflicts = []
+        for node in self.nodes:
+            mask = 0
+            for other in node.overlap_edges:
+                j = position.get(other)
+                if j is not None:
+                    mask |= 1 << j
+            self.conflicts.append(mask)
+
+    def _bound(self, candidates):
+        total = 0.0
+        while candidates:
+            low = candidates & -candidates
+            total += self.weights[low.bit_length() - 1]
+            candidates ^= low
+        return total
+
+    def _greedy(self):
+        chosen = 0
+        weight = 0.0
+        blocked = 0
+        for i in range(len(self.nodes)):
+            if not (blocked >> i) & 1:
+                chosen |= 1 << i
+                weight += self.weights[i]
+                blocked |= self.conflicts[i]
+        return chosen, weight
+
+    def select(self):
+        n = len(self.nodes)
+        best, best_weight = self._greedy()
+        stack = [((1 << n) - 1, 0, 0.0)]
+        steps = 0
+        while stack:
+            if steps >= self.max_steps:
+                break
+            candidates, chosen, weight = stack.pop()
+            steps += 1
+            if not candidates:
+                if weight > best_weight:
+                    best, best_weight = chosen, weight
+                continue
+            if weight + self._bound(candidates) <= best_weight:
+                continue
+            low = candidates & -candidates
+            i = low.bit_length() - 1
+            # Explore including the heaviest candidate first
+            stack.append((candidates ^ low, chosen, weight))
+            stack.append((candidates & ~low & ~self.conflicts[i], chosen | low, weight + self.weights[i]))
+        self.optimal = not stack
+        selected = [self.nodes[i] for i in range(n) if (best >> i) & 1]
+        return _extend_selection(
+            selected, self.nodes, lambda a, b: a in b.overlap_edges or b in a.overlap_edges)
+
+    @classmethod
+    def solve(cls, nodes, maximize=True, max_steps=10000):
+        solver = cls(nodes, maximize=maximize, max_steps=max_steps)
+        return solver.select()
+
+
+SUBGRAPH_SELECTION_METHODS = ("greedy", "interval", "branch_and_bound")
+
+
 class ExhaustiveDisjointSolutionSelection(object):  # pragma: no cover
     shard_size = 7
 
@@ -238,20 +490,48 @@ class ConnectedSubgraph(object):
         return len(self.nodes)
 
     def populate_edges(self):
-        for i in range(len(self.nodes)):
-            node = self.nodes[i]
-            for j in range(len(self.nodes)):
-                if i == j:
-                    continue
-                other = self.nodes[j]
-                node.visit(other)
+        # Two nodes can only share a peak if their m/z spans overlap, so sweeping
+        # over the nodes in order of their start, each node need only visit the
+        # nodes starting before it ends. Every pair skipped is disjoint. Only the
+        # overlapping pairs are stored, the disjoint pairs are implied by them.
+        nodes = sorted(self.nodes, key=node_span)
+        n = len(nodes)
+        for i in range(n):
+            node = nodes[i]
+            node.members = self.nodes
+            end = node.end
+            for j in range(i + 1, n):
+                other = nodes[j]
+                if other.start > end:
+                    break
+                if not node.isdisjoint(other):
+                    node.overlap_edges.add(other)
+                    other.overlap_edges.add(node)
 
     def find_heaviest_path(self, method="greedy"):
+        """Select a set of nodes which do not share any peaks.
+
+        Parameters
+        ----------
+        method : str, optional
+            The solver to use. ``"greedy"`` takes nodes in order of score, ``"interval"``
+            solves the weighted interval scheduling problem over the nodes' m/z spans
+            with :class:`IntervalSchedulingSelection`, and ``"branch_and_bound"`` searches
+            for the best set of nodes sharing no peaks with :class:`BranchAndBoundSelection`
+
+        Returns
+        -------
+        list of :class:`FitNode`
+        """
         if len(self) == 1:
             return set(self.nodes)
         if method == "greedy":
             solution = GreedySubgraphSelection.solve(tuple(self), maximize=self.maximize)
             return solution
+        elif method == "interval":
+            return IntervalSchedulingSelection.solve(tuple(self), maximize=self.maximize)
+        elif method == "branch_and_bound":
+            return BranchAndBoundSelection.solve(tuple(self), maximize=self.maximize)
         else:
             raise NotImplementedError(method)
 
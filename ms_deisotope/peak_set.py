@@ -1,8 +1,12 @@
 import operator
 from collections import namedtuple
 
-from .utils import Base, ppm_error
-from brainpy import mass_charge_ratio
+import numpy as np
+
+from .utils import (
+    Base, ppm_error, ppm_search_intervals, ppm_search_nearest,
+    ppm_search_interval, ppm_search_nearest_one)
+from brainpy import mass_charge_ratio, PROTON
 
 
 class _Index(object):
@@ -222,6 +226,8 @@ class DeconvolutedPeakSet(Base):
     def __init__(self, peaks):
         self.peaks = peaks
         self._mz_ordered = None
+        self._neutral_mass_array = None
+        self._mz_array = None
 
     def reindex(self):
         """
@@ -250,6 +256,8 @@ class DeconvolutedPeakSet(Base):
             peak.index.neutral_mass = i
         for i, peak in enumerate(self._mz_ordered):
             peak.index.mz = i
+        self._neutral_mass_array = None
+        self._mz_array = None
         return self
 
     def __len__(self):
@@ -325,6 +333,559 @@ class DeconvolutedPeakSet(Base):
 
         return self.__class__(acc)._reindex()
 
+    def _search_array(self, use_mz=False):
+        if use_mz:
+            if self._mz_array is None:
+                self._mz_array = np.array([p.mz for p in self._mz_ordered], dtype=np.float64)
+            return self._mz_array
+        if self._neutral_mass_array is None:
+            self._neutral_mass_array = np.array([p.neutral_mass for p in self.peaks], dtype=np.float64)
+        return self._neutral_mass_array
+
+    def search_intervals(self, neutral_masses, error_tolerance=1e-5, use_mz=False):
+        """Find the range of peaks matching each of `neutral_masses` within `error_tolerance`
+        PPM error, searching for all of them at once.
+
+        If ``use_mz`` is :const:`True`, the ranges are positions in the m/z ordering
+        instead of the neutral mass ordering.
+
+        Parameters
+        ----------
+        neutral_masses : array-like
+            The masses to search for
+        error_tolerance : float
+            The PPM error tolerance to apply
+        use_mz : bool
+            Whether to search using m/z instead of neutral mass
+
+        Returns
+        -------
+        starts : np.ndarray
+            The position of the first matching peak for each query
+        ends : np.ndarray
+            One past the position of the last matching peak for each query
+        """
+        return ppm_search_intervals(
+            self._search_array(use_mz), neutral_masses, error_tolerance, strict=True)
+
+    def has_peaks(self, neutral_masses, error_tolerance=1e-5, use_mz=False):
+        """Find the peak that best matches each of `neutral_masses` within `error_tolerance`
+        PPM error, searching for all of them at once.
+
+        Parameters
+        ----------
+        neutral_masses : array-like
+            The masses to search for
+        error_tolerance : float
+            The PPM error tolerance to apply
+        use_mz : bool
+            Whether to search using m/z instead of neutral mass
+
+        Returns
+        -------
+        list
+            The best matching :class:`DeconvolutedPeak` for each query, or :const:`None`
+        """
+        ordered = self._mz_ordered if use_mz else self.peaks
+        indices = ppm_search_nearest(
+            self._search_array(use_mz), neutral_masses, error_tolerance, strict=True)
+        return [ordered[i] if i >= 0 else None for i in indices.tolist()]
+
+    def all_peaks_for_many(self, neutral_masses, tolerance=1e-5):
+        """Find all peaks that match each of `neutral_masses` within `tolerance`
+        PPM error, searching for all of them at once.
+
+        Parameters
+        ----------
+        neutral_masses : array-like
+            The masses to search for
+        tolerance : float
+            The PPM error tolerance to apply
+
+        Returns
+        -------
+        list of tuple of DeconvolutedPeak
+            The matching peaks for each query
+        """
+        starts, ends = self.search_intervals(neutral_masses, tolerance)
+        peaks = tuple(self.peaks)
+        return [peaks[i:j] for i, j in zip(starts.tolist(), ends.tolist())]
+
+
+class ColumnarDeconvolutedPeakSet(Base):
+    """
+    Represents a collection of deconvoluted peaks as parallel arrays, one per
+    peak attribute, ordered by `neutral_mass`.
+
+    Supports the same query methods as :class:`DeconvolutedPeakSet`, but searches
+    the arrays directly and only creates :class:`DeconvolutedPeak` instances for
+    the peaks that are actually accessed. Materialized peaks are cached, so
+    retrieving the same position twice returns the same object. The :attr:`~.DeconvolutedPeak.fit`
+    of each peak is not retained.
+
+    Attributes
+    ----------
+    neutral_mass : np.ndarray
+        The neutral mass of each peak, in ascending order
+    mz : np.ndarray
+        The m/z of each peak
+    intensity : np.ndarray
+        The intensity of each peak
+    charge : np.ndarray
+        The charge state of each peak
+    signal_to_noise : np.ndarray
+        The signal-to-noise ratio of each peak
+    full_width_at_half_max : np.ndarray
+        The full width at half max of each peak
+    score : np.ndarray
+        The isotopic fit score of each peak
+    a_to_a2_ratio : np.ndarray
+        The A to A+2 ratio of each peak
+    most_abundant_mass : np.ndarray
+        The most abundant neutral mass of each peak
+    average_mass : np.ndarray
+        The average neutral mass of each peak
+    area : np.ndarray
+        The area of each peak
+    chosen_for_msms : np.ndarray
+        Whether each peak was chosen for MSn
+    envelope_offsets : np.ndarray
+        The envelope of peak ``i`` is held in positions ``envelope_offsets[i]`` to
+        ``envelope_offsets[i + 1]`` of :attr:`envelope_mz` and :attr:`envelope_intensity`
+    envelope_mz : np.ndarray
+        The m/z of every envelope point of every peak
+    envelope_intensity : np.ndarray
+        The intensity of every envelope point of every peak
+    """
+
+    _columns = [
+        ("neutral_mass", np.float64),
+        ("mz", np.float64),
+        ("intensity", np.float64),
+        ("charge", np.int32),
+        ("signal_to_noise", np.float64),
+        ("full_width_at_half_max", np.float64),
+        ("score", np.float64),
+        ("a_to_a2_ratio", np.float64),
+        ("most_abundant_mass", np.float64),
+        ("average_mass", np.float64),
+        ("area", np.float64),
+        ("chosen_for_msms", np.bool_),
+    ]
+
+    def __init__(self, peaks=()):
+        peaks = list(peaks)
+        columns = {}
+        for name, dtype in self._columns:
+            columns[name] = np.array([getattr(peak, name) for peak in peaks], dtype=dtype)
+        envelope_sizes = np.zeros(len(peaks) + 1, dtype=np.int64)
+        envelope_mz = []
+        envelope_intensity = []
+        for i, peak in enumerate(peaks):
+            for point in peak.envelope:
+                envelope_mz.append(point.mz)
+                envelope_intensity.append(point.intensity)
+                envelope_sizes[i + 1] += 1
+        self._set_columns(
+            columns, np.cumsum(envelope_sizes),
+            np.array(envelope_mz, dtype=np.float64),
+            np.array(envelope_intensity, dtype=np.float64))
+        self.reindex()
+
+    @classmethod
+    def from_arrays(cls, neutral_mass, intensity, charge, signal_to_noise=None,
+                    full_width_at_half_max=None, score=None, mz=None, envelope_offsets=None,
+                    envelope_mz=None, envelope_intensity=None, a_to_a2_ratio=None,
+                    most_abundant_mass=None, average_mass=None, area=None, chosen_for_msms=None):
+        """Build a peak set directly from arrays of peak attributes, without
+        creating any :class:`DeconvolutedPeak` instances.
+
+        The arrays need not be sorted. Any omitted attribute defaults to zero, except
+        for `mz`, which is computed from `neutral_mass` and `charge`.
+
+        Parameters
+        ----------
+        neutral_mass : array-like
+            The neutral mass of each peak
+        intensity : array-like
+            The intensity of each peak
+        charge : array-like
+            The charge state of each peak
+        envelope_offsets : array-like, optional
+            The boundaries of each peak's envelope in `envelope_mz` and `envelope_intensity`,
+            with one more entry than there are peaks. If omitted, every envelope is empty.
+        envelope_mz : array-like, optional
+            The m/z of every envelope point
+        envelope_intensity : array-like, optional
+            The intensity of every envelope point
+
+        Returns
+        -------
+        ColumnarDeconvolutedPeakSet
+        """
+        neutral_mass = np.asarray(neutral_mass, dtype=np.float64)
+        charge = np.asarray(charge, dtype=np.int32)
+        if mz is None:
+            abs_charge = np.abs(charge)
+            mz = (neutral_mass + charge * PROTON) / np.where(abs_charge == 0, 1, abs_charge)
+        values = {
+            "neutral_mass": neutral_mass, "mz": mz, "intensity": intensity, "charge": charge,
+            "signal_to_noise": signal_to_noise, "full_width_at_half_max": full_width_at_half_max,
+            "score": score, "a_to_a2_ratio": a_to_a2_ratio, "most_abundant_mass": most_abundant_mass,
+            "average_mass": average_mass, "area": area, "chosen_for_msms": chosen_for_msms
+        }
+        n = len(neutral_mass)
+        columns = {}
+        for name, dtype in cls._columns:
+            value = values[name]
+            if value is None:
+                columns[name] = np.zeros(n, dtype=dtype)
+            else:
+                columns[name] = np.asarray(value, dtype=dtype)
+                if len(columns[name]) != n:
+                    raise ValueError("Column %r has %d values, expected %d" % (
+                        name, len(columns[name]), n))
+        if envelope_offsets is None:
+            envelope_offsets = np.zeros(n + 1, dtype=np.int64)
+            envelope_mz = envelope_intensity = ()
+        inst = cls.__new__(cls)
+        inst._set_columns(
+            columns, np.asarray(envelope_offsets, dtype=np.int64),
+            np.asarray(envelope_mz, dtype=np.float64),
+            np.asarray(envelope_intensity, dtype=np.float64))
+        return inst.reindex()
+
+    def _set_columns(self, columns, envelope_offsets, envelope_mz, envelope_intensity):
+        for name, _ in self._columns:
+            setattr(self, name, columns[name])
+        self.envelope_offsets = envelope_offsets
+        self.envelope_mz = envelope_mz
+        self.envelope_intensity = envelope_intensity
+        self._mz_order = None
+        self._sorted_mz = None
+        self._mz_rank = None
+        self._peak_cache = {}
+
+    def reindex(self):
+        """
+        Sorts the columns by `neutral_mass` and rebuilds the m/z ordering.
+
+        Any previously materialized peaks are discarded.
+
+        Returns
+        -------
+        self: ColumnarDeconvolutedPeakSet
+        """
+        order = np.argsort(self.neutral_mass, kind='mergesort')
+        if len(order) and np.any(order != np.arange(len(order))):
+            self._take_inplace(order)
+        self._mz_order = np.argsort(self.mz, kind='mergesort')
+        self._sorted_mz = self.mz[self._mz_order]
+        self._mz_rank = np.empty_like(self._mz_order)
+        self._mz_rank[self._mz_order] = np.arange(len(self._mz_order))
+        self._peak_cache = {}
+        return self
+
+    def _take_columns(self, indices):
+        columns = {}
+        for name, _ in self._columns:
+            columns[name] = getattr(self, name)[indices]
+        starts = self.envelope_offsets[:-1][indices]
+        ends = self.envelope_offsets[1:][indices]
+        sizes = ends - starts
+        envelope_offsets = np.zeros(len(sizes) + 1, dtype=np.int64)
+        np.cumsum(sizes, out=envelope_offsets[1:])
+        if envelope_offsets[-1]:
+            points = np.repeat(starts - envelope_offsets[:-1], sizes) + np.arange(envelope_offsets[-1])
+        else:
+            points = np.zeros(0, dtype=np.int64)
+        return columns, envelope_offsets, self.envelope_mz[points], self.envelope_intensity[points]
+
+    def _take_inplace(self, indices):
+        self._set_columns(*self._take_columns(indices))
+
+    def take(self, indices):
+        """Create a new peak set from the peaks at `indices`, which may be
+        integer positions or a boolean mask over the peaks in this set.
+
+        Parameters
+        ----------
+        indices : array-like
+            The positions of the peaks to keep, or a boolean mask
+
+        Returns
+        -------
+        ColumnarDeconvolutedPeakSet
+        """
+        indices = np.asarray(indices)
+        if indices.dtype == np.bool_:
+            indices = np.flatnonzero(indices)
+        inst = self.__class__.__new__(self.__class__)
+        inst._set_columns(*self._take_columns(indices.astype(np.intp)))
+        return inst.reindex()
+
+    def __len__(self):
+        return len(self.neutral_mass)
+
+    def __repr__(self):
+        return "<ColumnarDeconvolutedPeakSet %d Peaks>" % (len(self))
+
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        state['_peak_cache'] = {}
+        return state
+
+    def _make_peak(self, i):
+        start = self.envelope_offsets[i]
+        end = self.envelope_offsets[i + 1]
+        envelope = list(zip(
+            self.envelope_mz[start:end].tolist(), self.envelope_intensity[start:end].tolist()))
+        return DeconvolutedPeak(
+            float(self.neutral_mass[i]), float(self.intensity[i]), int(self.charge[i]),
+            float(self.signal_to_noise[i]), _Index(i, int(self._mz_rank[i])),
+            float(self.full_width_at_half_max[i]), float(self.a_to_a2_ratio[i]),
+            float(self.most_abundant_mass[i]), float(self.average_mass[i]), float(self.score[i]),
+            envelope, float(self.mz[i]), None, bool(self.chosen_for_msms[i]), float(self.area[i]))
+
+    def getitem(self, i):
+        """Materialize the peak at position `i` in `neutral_mass` order.
+
+        Parameters
+        ----------
+        i : int
+            The position of the peak
+
+        Returns
+        -------
+        DeconvolutedPeak
+        """
+        try:
+            return self._peak_cache[i]
+        except KeyError:
+            peak = self._peak_cache[i] = self._make_peak(i)
+            return peak
+
+    def __getitem__(self, item):
+        if isinstance(item, slice):
+            return self.take(np.arange(len(self))[item])
+        if isinstance(item, (list, tuple, np.ndarray)):
+            return self.take(item)
+        n = len(self)
+        if item < 0:
+            item += n
+        if item < 0 or item >= n:
+            raise IndexError(item)
+        return self.getitem(int(item))
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self.getitem(i)
+
+    @property
+    def peaks(self):
+        return tuple(self)
+
+    def clone(self):
+        return self.take(np.arange(len(self)))
+
+    def to_peak_set(self):
+        """Convert this collection into a :class:`DeconvolutedPeakSet`
+
+        Returns
+        -------
+        DeconvolutedPeakSet
+        """
+        return DeconvolutedPeakSet([self._make_peak(i) for i in range(len(self))]).reindex()
+
+    def __eq__(self, other):
+        try:
+            if len(self) != len(other):
+                return False
+        except TypeError:
+            return False
+        return tuple(self) == tuple(other)
+
+    def __ne__(self, other):
+        return not (self == other)
+
+    def _search_array(self, use_mz=False):
+        if use_mz:
+            return self._sorted_mz
+        return self.neutral_mass
+
+    def _resolve_index(self, i, use_mz=False):
+        if use_mz:
+            return int(self._mz_order[i])
+        return int(i)
+
+    def _interval_for(self, value, tolerance, use_mz=False):
+        return ppm_search_interval(self._search_array(use_mz), value, tolerance, strict=True)
+
+    def search_intervals(self, neutral_masses, error_tolerance=1e-5, use_mz=False):
+        """Find the range of peaks matching each of `neutral_masses` within `error_tolerance`
+        PPM error, searching for all of them at once.
+
+        If ``use_mz`` is :const:`True`, the ranges are positions in the m/z ordering
+        instead of the neutral mass ordering.
+
+        Parameters
+        ----------
+        neutral_masses : array-like
+            The masses to search for
+        error_tolerance : float
+            The PPM error tolerance to apply
+        use_mz : bool
+            Whether to search using m/z instead of neutral mass
+
+        Returns
+        -------
+        starts : np.ndarray
+            The position of the first matching peak for each query
+        ends : np.ndarray
+            One past the position of the last matching peak for each query
+        """
+        return ppm_search_intervals(
+            self._search_array(use_mz), neutral_masses, error_tolerance, strict=True)
+
+    def has_peaks(self, neutral_masses, error_tolerance=1e-5, use_mz=False):
+        """Find the peak that best matches each of `neutral_masses` within `error_tolerance`
+        PPM error, searching for all of them at once.
+
+        Parameters
+        ----------
+        neutral_masses : array-like
+            The masses to search for
+        error_tolerance : float
+            The PPM error tolerance to apply
+        use_mz : bool
+            Whether to search using m/z instead of neutral mass
+
+        Returns
+        -------
+        list
+            The best matching :class:`DeconvolutedPeak` for each query, or :const:`None`
+        """
+        indices = ppm_search_nearest(
+            self._search_array(use_mz), neutral_masses, error_tolerance, strict=True)
+        if use_mz:
+            indices = np.where(indices >= 0, self._mz_order[indices], -1)
+        return [self.getitem(i) if i >= 0 else None for i in indices.tolist()]
+
+    def all_peaks_for_many(self, neutral_masses, tolerance=1e-5):
+        """Find all peaks that match each of `neutral_masses` within `tolerance`
+        PPM error, searching for all of them at once.
+
+        Parameters
+        ----------
+        neutral_masses : array-like
+            The masses to search for
+        tolerance : float
+            The PPM error tolerance to apply
+
+        Returns
+        -------
+        list of tuple of DeconvolutedPeak
+            The matching peaks for each query
+        """
+        starts, ends = self.search_intervals(neutral_masses, tolerance)
+        return [tuple(self.getitem(k) for k in range(i, j))
+                for i, j in zip(starts.tolist(), ends.tolist())]
+
+    def has_peak(self, neutral_mass, error_tolerance=1e-5, use_mz=False):
+        '''Find the peak that best matches ``neutral_mass`` within ``error_tolerance`` mass accuracy ppm.
+
+        If ``use_mz`` is True, instead of matching neutral masses, match peaks using m/z instead.
+
+        Parameters
+        ----------
+        neutral_mass: float
+            The mass to search for
+        error_tolerance: float
+            The PPM error tolerance to apply
+        use_mz: bool
+            Whether to search using m/z instead of neutral mass
+
+        Returns
+        -------
+        DeconvolutedPeak
+            The found peak, or None if no peak is found
+        '''
+        i = ppm_search_nearest_one(self._search_array(use_mz), neutral_mass, error_tolerance, strict=True)
+        if i < 0:
+            return None
+        return self.getitem(self._resolve_index(i, use_mz))
+
+    def all_peaks_for(self, neutral_mass, tolerance=1e-5):
+        '''Find all peaks that match ``neutral_mass`` within ``tolerance`` mass accuracy ppm.
+
+        Parameters
+        ----------
+        neutral_mass: float
+            The mass to search for
+        tolerance: float
+            The PPM error tolerance to apply
+
+        Returns
+        -------
+        tuple of DeconvolutedPeak
+            The found peaks
+        '''
+        start, end = self._interval_for(neutral_mass, tolerance)
+        return tuple(self.getitem(i) for i in range(start, end))
+
+    def get_nearest_peak(self, neutral_mass, use_mz=False):
+        '''Find the peak nearest to ``neutral_mass``, regardless of error.
+
+        Parameters
+        ----------
+        neutral_mass: float
+            The mass to search for
+        use_mz: bool
+            Whether to search using m/z instead of neutral mass
+
+        Returns
+        -------
+        DeconvolutedPeak
+            The nearest peak, or :const:`None` if the peak set is empty
+        float
+            The absolute difference between ``neutral_mass`` and the found peak
+        '''
+        array = self._search_array(use_mz)
+        n = len(array)
+        if n == 0:
+            return None, float('inf')
+        i = int(np.searchsorted(array, neutral_mass))
+        if i == n or (i > 0 and abs(array[i - 1] - neutral_mass) <= abs(array[i] - neutral_mass)):
+            i -= 1
+        return self.getitem(self._resolve_index(i, use_mz)), abs(float(array[i]) - neutral_mass)
+
+    def between(self, m1, m2, tolerance=1e-5, use_mz=False):
+        """Retrieve a :class:`ColumnarDeconvolutedPeakSet` containing all the peaks
+        whose mass is between ``m1`` and ``m2``.
+
+        If ``use_mz`` is :const:`True` then search by m/z instead of mass
+
+        Parameters
+        ----------
+        m1 : float
+            The lower mass limit
+        m2 : float
+            The upper mass limit
+        use_mz: bool
+            Whether to search for m/z instead of neutral mass
+
+        Returns
+        -------
+        ColumnarDeconvolutedPeakSet
+        """
+        array = self._search_array(use_mz)
+        start = np.searchsorted(array, m1, side='left')
+        end = np.searchsorted(array, m2, side='right')
+        indices = np.arange(start, end)
+        if use_mz:
+            indices = self._mz_order[indices]
+        return self.take(indices)
+
 
 mz_getter = operator.attrgetter('mz')
 neutral_mass_getter = operator.attrgetter("neutral_mass")
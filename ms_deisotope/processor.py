@@ -6,10 +6,12 @@ from ms_peak_picker import pick_peaks
 
 from .deconvolution import deconvolute_peaks
 from .data_source import MSFileLoader, ScanIterator
-from .data_source.common import Scan, ScanBunch, ChargeNotProvided
+from .data_source.common import (
+    Scan, ScanBunch, ChargeNotProvided, RandomAccessScanSource, RollingScanAverager)
 from .utils import Base
 from .peak_dependency_network import NoIsotopicClustersError
 from .envelope_statistics import PrecursorPurityEstimator
+from .instrumentation import NULL_METRICS
 from .task import LogUtilsMixin
 
 logger = logging.getLogger("deconvolution_scan_processor")
@@ -162,6 +164,10 @@ class ScanProcessor(Base, LogUtilsMixin):
         solution
     terminate_on_error: bool
         Whether or not  to stop processing on an error. Defaults to `True`
+    metrics: :class:`~.PipelineMetrics`
+        Records the time spent reading, picking peaks, averaging, deconvoluting and
+        estimating precursor coisolation, and counts of peaks picked, envelopes fitted
+        and precursor fits rejected. Defaults to :data:`~.NULL_METRICS`, which records nothing
     """
 
     def __init__(self, data_source, ms1_peak_picking_args=None,
@@ -175,7 +181,8 @@ class ScanProcessor(Base, LogUtilsMixin):
                  envelope_selector=None,
                  terminate_on_error=True,
                  ms1_averaging=0,
-                 respect_isolation_window=False):
+                 respect_isolation_window=False,
+                 metrics=None):
         if loader_type is None:
             loader_type = _loader_creator
 
@@ -199,6 +206,9 @@ class ScanProcessor(Base, LogUtilsMixin):
         self._signal_source = self.loader_type(data_source)
         self.envelope_selector = envelope_selector
         self.terminate_on_error = terminate_on_error
+        self.metrics = metrics if metrics is not None else NULL_METRICS
+        self._scan_time_index_prepared = False
+        self._ms1_averager = None
 
     def _reject_candidate_precursor_peak(self, peak, product_scan):
         isolation = product_scan.isolation_window
@@ -263,11 +273,32 @@ class ScanProcessor(Base, LogUtilsMixin):
                                     **self.ms1_peak_picking_args)
         return prec_peaks
 
+    def _prepare_scan_time_index(self):
+        """Build the :attr:`~.RandomAccessScanSource.scan_time_index` of :attr:`reader`
+        if it is missing, so that finding the MS1 scans to average with does not
+        load every scan in between.
+        """
+        self._scan_time_index_prepared = True
+        reader = self.reader
+        if not isinstance(reader, RandomAccessScanSource) or reader.scan_time_index is not None:
+            return
+        try:
+            reader.build_scan_time_index()
+        except (TypeError, KeyError, IndexError, ValueError) as err:
+            self.log("Could not build the scan time index of %r: %r" % (reader, err))
+
     def _average_ms1(self, precursor_scan):
         """Average signal from :attr:`self.ms1_averaging` scans from
         before and after ``precursor_scan`` and pick peaks from the
         averaged arrays.
 
+        The resampled signal of each MS1 scan is kept by a :class:`~.RollingScanAverager`
+        for as long as it falls in the window of the scans being averaged, so it is only
+        re-used when the same :class:`ScanProcessor` averages consecutive MS1 scans. The
+        deisotoping workers each take batches of at most ``batch_size`` (1 by default)
+        consecutive scan bunches, fewer once a batch's estimated cost is reached, so each
+        batch still resamples the ``ms1_averaging`` scans on either side of it afresh.
+
         Parameters
         ----------
         precursor_scan: Scan
@@ -277,10 +308,16 @@ class ScanProcessor(Base, LogUtilsMixin):
         -------
         PeakSet
         """
-        new_scan = precursor_scan.average(self.ms1_averaging)
-        prec_peaks = pick_peaks(*new_scan.arrays,
-                                target_envelopes=self._get_envelopes(precursor_scan),
-                                **self.ms1_peak_picking_args)
+        if not self._scan_time_index_prepared:
+            self._prepare_scan_time_index()
+        if self._ms1_averager is None:
+            self._ms1_averager = RollingScanAverager(self.ms1_averaging)
+        with self.metrics.time("ms1_averaging"):
+            new_scan = self._ms1_averager.average(precursor_scan)
+        with self.metrics.time("ms1_peak_picking"):
+            prec_peaks = pick_peaks(*new_scan.arrays,
+                                    target_envelopes=self._get_envelopes(precursor_scan),
+                                    **self.ms1_peak_picking_args)
         return prec_peaks
 
     def pick_precursor_scan_peaks(self, precursor_scan):
@@ -302,7 +339,10 @@ class ScanProcessor(Base, LogUtilsMixin):
         if self.ms1_averaging > 0:
             prec_peaks = self._average_ms1(precursor_scan)
         else:
-            prec_peaks = self._pick_precursor_scan_peaks(precursor_scan)
+            with self.metrics.time("ms1_peak_picking"):
+                prec_peaks = self._pick_precursor_scan_peaks(precursor_scan)
+        if prec_peaks is not None:
+            self.metrics.increment("ms1_peaks_picked", len(prec_peaks))
         precursor_scan.peak_set = prec_peaks
         return prec_peaks
 
@@ -311,12 +351,14 @@ class ScanProcessor(Base, LogUtilsMixin):
             peak_mode = 'profile'
         else:
             peak_mode = 'centroid'
-        product_mz, product_intensity = product_scan.arrays
-        peaks = pick_peaks(product_mz, product_intensity, peak_mode=peak_mode, **self.msn_peak_picking_args)
+        with self.metrics.time("msn_peak_picking"):
+            product_mz, product_intensity = product_scan.arrays
+            peaks = pick_peaks(product_mz, product_intensity, peak_mode=peak_mode, **self.msn_peak_picking_args)
 
         if peaks is None:
             raise EmptyScanError(
                 "Could not pick peaks for empty product scan", self)
+        self.metrics.increment("msn_peaks_picked", len(peaks))
 
         product_scan.peak_set = peaks
         return peaks
@@ -441,9 +483,10 @@ class ScanProcessor(Base, LogUtilsMixin):
             ms1_deconvolution_args['charge_range'] = tuple(
                 polarity * abs(c) for c in ms1_deconvolution_args['charge_range'])
         try:
-            decon_result = deconvolute_peaks(
-                precursor_scan.peak_set, priority_list=priorities,
-                **ms1_deconvolution_args)
+            with self.metrics.time("ms1_deconvolution"):
+                decon_result = deconvolute_peaks(
+                    precursor_scan.peak_set, priority_list=priorities,
+                    **ms1_deconvolution_args)
         except NoIsotopicClustersError as e:
             e.scan_id = precursor_scan.id
             if self.terminate_on_error:
@@ -456,6 +499,7 @@ class ScanProcessor(Base, LogUtilsMixin):
             self.error("Errors occurred during deconvolution of %s, %r" % (
                 precursor_scan.id, decon_result.errors))
         precursor_scan.deconvoluted_peak_set = dec_peaks
+        self.metrics.increment("ms1_envelopes_fitted", len(dec_peaks))
         for pr in priority_results:
             if pr is None:
                 continue
@@ -473,6 +517,7 @@ class ScanProcessor(Base, LogUtilsMixin):
             precursor_scan.id, [
                 (p.mz, p.charge) if p is not None else None for p in priorities
             ]))
+        accepted = []
         for product_scan in precursor_scan.product_scans:
             precursor_information = product_scan.precursor_information
 
@@ -497,6 +542,7 @@ class ScanProcessor(Base, LogUtilsMixin):
                     "Could not find deconvolution for %r (No solution was found for this region)" %
                     precursor_information)
                 precursor_information.default(orphan=True)
+                self.metrics.increment("precursor_fits_rejected")
 
                 continue
             elif peak.charge == 1 or (peak.charge != precursor_information.charge and self.trust_charge_hint):
@@ -505,19 +551,27 @@ class ScanProcessor(Base, LogUtilsMixin):
                         "Could not find deconvolution for %r (Unacceptable solution was proposed: %r)" %
                         (precursor_information, peak))
                     precursor_information.default()
+                    self.metrics.increment("precursor_fits_rejected")
                     continue
 
-            precursor_purity = -1.0
-            if peak is not None:
-                precursor_purity, coisolation = coisolation_detection(precursor_scan, peak)
-                precursor_information.coisolation = coisolation
-                self.debug(
-                    "Precursor m/z %f\nExperimental = %r\nTheoretical = %r" % (
-                        peak.mz,
-                        ', '.join(["(%0.4f, %0.1f)" % (p.mz, p.intensity) for p in peak.envelope]),
-                        ', '.join(["(%0.4f, %0.1f)" % (p.mz, p.intensity) for p in peak.fit.theoretical]))
-                )
+            accepted.append((product_scan, peak))
 
+        # Estimate the purity of every accepted precursor ion at once, sharing
+        # one index over the precursor scan's peaks
+        estimates = []
+        if accepted:
+            with self.metrics.time("coisolation"):
+                estimates = coisolation_detection.estimate_batch(
+                    precursor_scan, [peak for _, peak in accepted])
+        for (product_scan, peak), (precursor_purity, coisolation) in zip(accepted, estimates):
+            precursor_information = product_scan.precursor_information
+            precursor_information.coisolation = coisolation
+            self.debug(
+                "Precursor m/z %f\nExperimental = %r\nTheoretical = %r" % (
+                    peak.mz,
+                    ', '.join(["(%0.4f, %0.1f)" % (p.mz, p.intensity) for p in peak.envelope]),
+                    ', '.join(["(%0.4f, %0.1f)" % (p.mz, p.intensity) for p in peak.fit.theoretical]))
+            )
             product_scan.annotations['precursor purity'] = precursor_purity
             precursor_information.extract(peak)
         return dec_peaks, priority_results
@@ -540,7 +594,8 @@ class ScanProcessor(Base, LogUtilsMixin):
                 polarity * abs(c) for c in deconargs["charge_range"]]
 
         try:
-            dec_peaks, _ = deconvolute_peaks(product_scan.peak_set, **deconargs)
+            with self.metrics.time("msn_deconvolution"):
+                dec_peaks, _ = deconvolute_peaks(product_scan.peak_set, **deconargs)
         except NoIsotopicClustersError as e:
             self.log("No Isotopic Clusters found in %r" % product_scan.id)
             e.scan_id = product_scan.id
@@ -548,10 +603,12 @@ class ScanProcessor(Base, LogUtilsMixin):
                 raise e
 
         product_scan.deconvoluted_peak_set = dec_peaks
+        self.metrics.increment("msn_envelopes_fitted", len(dec_peaks))
         return dec_peaks
 
     def _get_next_scans(self):
-        bunch = next(self.reader)
+        with self.metrics.time("read"):
+            bunch = next(self.reader)
         try:
             precursor, products = bunch
         except ValueError:
@@ -590,15 +647,17 @@ class ScanProcessor(Base, LogUtilsMixin):
         product_scans: :class:`list` of :class:`~.Scan`
             The fully processed version of `products`
         """
-        precursor_scan, priorities, product_scans = self.process_scan_group(precursor, products)
-        if precursor_scan is not None:
-            self.deconvolute_precursor_scan(precursor_scan, priorities)
-        else:
-            self._default_all_precursor_information(product_scans)
+        with self.metrics.time("ms1_scan"):
+            precursor_scan, priorities, product_scans = self.process_scan_group(precursor, products)
+            if precursor_scan is not None:
+                self.deconvolute_precursor_scan(precursor_scan, priorities)
+            else:
+                self._default_all_precursor_information(product_scans)
 
         for product_scan in product_scans:
-            self.pick_product_scan_peaks(product_scan)
-            self.deconvolute_product_scan(product_scan)
+            with self.metrics.time("msn_scan"):
+                self.pick_product_scan_peaks(product_scan)
+                self.deconvolute_product_scan(product_scan)
 
         return ScanBunch(precursor_scan, product_scans)
 
@@ -285,6 +285,20 @@ class IsotopicFitterBase(Base):
         """
         return self.select.reject(fit)
 
+    def reject_score(self, score):
+        """Test whether this score is too poor for its fit to be used
+
+        Parameters
+        ----------
+        score : float
+            The score to test
+
+        Returns
+        -------
+        bool
+        """
+        return self.select.reject_score(score)
+
     def is_maximizing(self):
         """Whether or not this fitter's score gets better as it grows
 
@@ -582,6 +596,298 @@ penalized_msdeconv = PenalizedMSDeconVFitter()
 distinct_pattern_fitter = DistinctPatternFitter()
 
 
+class IsotopicFitBatch(object):
+    """A collection of experimental and theoretical isotopic pattern pairs packed
+    into padded two-dimensional arrays so that they can be scored at once.
+
+    Each row holds one pair of patterns, and each column one position in the pattern.
+    Positions past the end of a shorter pattern are padded with a neutral value and
+    excluded by :attr:`mask`.
+
+    Attributes
+    ----------
+    observed_mz : :class:`np.ndarray`
+        The m/z of each experimental peak
+    observed_intensity : :class:`np.ndarray`
+        The intensity of each experimental peak
+    observed_signal_to_noise : :class:`np.ndarray`
+        The signal-to-noise ratio of each experimental peak
+    theoretical_mz : :class:`np.ndarray`
+        The m/z of each theoretical peak
+    theoretical_intensity : :class:`np.ndarray`
+        The intensity of each theoretical peak
+    mask : :class:`np.ndarray`
+        A boolean array marking positions which hold real peaks
+    """
+
+    __slots__ = ["observed_mz", "observed_intensity", "observed_signal_to_noise",
+                 "theoretical_mz", "theoretical_intensity", "mask"]
+
+    def __init__(self, observed_mz, observed_intensity, observed_signal_to_noise,
+                 theoretical_mz, theoretical_intensity, mask):
+        self.observed_mz = observed_mz
+        self.observed_intensity = observed_intensity
+        self.observed_signal_to_noise = observed_signal_to_noise
+        self.theoretical_mz = theoretical_mz
+        self.theoretical_intensity = theoretical_intensity
+        self.mask = mask
+
+    def __len__(self):
+        return self.mask.shape[0]
+
+    @property
+    def width(self):
+        return self.mask.shape[1]
+
+    @classmethod
+    def from_pairs(cls, pairs):
+        """Pack a sequence of (experimental, theoretical) peak list pairs.
+
+        Parameters
+        ----------
+        pairs : Iterable
+            Pairs of experimental :class:`~.FittedPeak` lists and theoretical
+            peak lists of the same length
+
+        Returns
+        -------
+        :class:`IsotopicFitBatch`
+        """
+        lengths = []
+        obs_mz = []
+        obs_intensity = []
+        obs_snr = []
+        theo_mz = []
+        theo_intensity = []
+        for observed, expected in pairs:
+            n = 0
+            for obs, theo in zip(observed, expected):
+                obs_mz.append(obs.mz)
+                obs_intensity.append(obs.intensity)
+                obs_snr.append(obs.signal_to_noise)
+                theo_mz.append(theo.mz)
+                theo_intensity.append(theo.intensity)
+                n += 1
+            lengths.append(n)
+        lengths = np.array(lengths, dtype=np.intp)
+        n_rows = lengths.shape[0]
+        width = lengths.max() if n_rows else 0
+        rows = np.repeat(np.arange(n_rows), lengths)
+        starts = np.cumsum(lengths) - lengths
+        columns = np.arange(rows.shape[0]) - np.repeat(starts, lengths)
+
+        def pad(values, fill):
+            block = np.full((n_rows, width), fill, dtype=np.float64)
+            block[rows, columns] = values
+            return block
+
+        mask = np.zeros((n_rows, width), dtype=bool)
+        mask[rows, columns] = True
+        # Padding uses an intensity of 1 so that ratios and logarithms stay finite
+        # in positions which are discarded through `mask`.
+        return cls(pad(obs_mz, 0.0), pad(obs_intensity, 1.0), pad(obs_snr, 0.0),
+                   pad(theo_mz, 0.0), pad(theo_intensity, 1.0), mask)
+
+    @classmethod
+    def from_fits(cls, fits):
+        """Pack the experimental and theoretical patterns of a sequence of
+        :class:`IsotopicFitRecord` objects.
+
+        Parameters
+        ----------
+        fits : Sequence of :class:`IsotopicFitRecord`
+
+        Returns
+        -------
+        :class:`IsotopicFitBatch`
+        """
+        return cls.from_pairs((fit.experimental, fit.theoretical) for fit in fits)
+
+
+def _row_sum(values, mask):
+    # Accumulate one column at a time so that each row is summed in the same
+    # order as the scalar scoring functions, making the results bit-for-bit equal.
+    total = np.zeros(values.shape[0])
+    values = np.where(mask, values, 0.0)
+    for j in range(values.shape[1]):
+        total += values[:, j]
+    return total
+
+
+def _row_max(values, mask):
+    if values.shape[1] == 0:
+        return np.zeros(values.shape[0])
+    return np.where(mask, values, -np.inf).max(axis=1)
+
+
+def _batch_g_test(scorer, batch):
+    obs = batch.observed_intensity
+    theo = batch.theoretical_intensity
+    return 2 * _row_sum(obs * np.log(obs / theo), batch.mask)
+
+
+def _batch_scaled_g_test(scorer, batch, eps=eps, split_log=False):
+    mask = batch.mask
+    total_observed = _row_sum(batch.observed_intensity, mask)[:, None]
+    total_expected = _row_sum(batch.theoretical_intensity, mask)[:, None] + eps
+    obs = np.where(mask, batch.observed_intensity / total_observed, 1.0)
+    theo = np.where(mask, batch.theoretical_intensity / total_expected, 1.0)
+    if split_log:
+        log_ratio = np.log(obs) - np.log(theo)
+    else:
+        log_ratio = np.log(obs / theo)
+    return 2 * _row_sum(obs * log_ratio, mask)
+
+
+def _batch_least_squares(scorer, batch):
+    mask = batch.mask
+    normed_expr = batch.observed_intensity / _row_max(batch.observed_intensity, mask)[:, None]
+    normed_theo = batch.theoretical_intensity / _row_max(batch.theoretical_intensity, mask)[:, None]
+    sum_of_squared_errors = _row_sum((normed_theo - normed_expr) ** 2, mask)
+    sum_of_squared_theoreticals = _row_sum(normed_theo ** 2, mask)
+    return sum_of_squared_errors / sum_of_squared_theoreticals
+
+
+def _batch_msdeconv_peaks(batch, mass_error_tolerance, minimum_signal_to_noise=1):
+    obs = batch.observed_intensity
+    theo = batch.theoretical_intensity
+    mass_error = np.abs(batch.observed_mz - batch.theoretical_mz)
+    mass_accuracy = np.where(
+        mass_error <= mass_error_tolerance, 1 - mass_error / mass_error_tolerance, 0.0)
+
+    under = (theo - obs) / obs
+    over = (obs - theo) / obs
+    under_valid = (obs < theo) & (under <= 1)
+    over_valid = (obs >= theo) & (over <= 1)
+    abundance_diff = np.where(
+        under_valid, 1 - under,
+        np.where(over_valid, np.sqrt(np.where(over_valid, 1 - over, 0.0)), 0.0))
+    score = np.sqrt(theo) * mass_accuracy * abundance_diff
+    return np.where(batch.observed_signal_to_noise < minimum_signal_to_noise, 0.0, score)
+
+
+def _batch_msdeconv(scorer, batch):
+    return _row_sum(_batch_msdeconv_peaks(batch, scorer.mass_error_tolerance), batch.mask)
+
+
+def _batch_penalized_msdeconv(scorer, batch):
+    score = _row_sum(
+        _batch_msdeconv_peaks(batch, scorer.msdeconv.mass_error_tolerance), batch.mask)
+    penalty = np.abs(_batch_scaled_g_test(scorer.penalizer, batch))
+    return score * (1 - penalty * scorer.penalty_factor)
+
+
+def _batch_penalized_msdeconv_c(scorer, batch):
+    score = _row_sum(
+        _batch_msdeconv_peaks(batch, scorer.mass_error_tolerance), batch.mask)
+    penalty = np.abs(_batch_scaled_g_test(scorer, batch, eps=0.0, split_log=True))
+    return score * (1 - penalty * scorer.penalty_factor)
+
+
+def _batch_dot_product(scorer, batch):
+    return _row_sum(batch.observed_intensity * batch.theoretical_intensity, batch.mask)
+
+
+_batch_kernels = {
+    GTestFitter: _batch_g_test,
+    _ScaledGTestFitter: _batch_scaled_g_test,
+    _LeastSquaresFitter: _batch_least_squares,
+    _MSDeconVFitter: _batch_msdeconv,
+    _PenalizedMSDeconVFitter: _batch_penalized_msdeconv,
+    _DotProductFitter: _batch_dot_product,
+}
+
+if _c:
+    _batch_kernels.update({
+        ScaledGTestFitter: lambda scorer, batch: _batch_scaled_g_test(
+            scorer, batch, eps=0.0, split_log=True),
+        LeastSquaresFitter: _batch_least_squares,
+        MSDeconVFitter: _batch_msdeconv,
+        PenalizedMSDeconVFitter: _batch_penalized_msdeconv_c,
+        DotProductFitter: _batch_dot_product,
+    })
+
+
+class BatchIsotopicFitScorer(Base):
+    """Scores many isotopic pattern fits in a single pass using the same
+    criterion as a wrapped :class:`IsotopicFitterBase`.
+
+    The fits are packed into an :class:`IsotopicFitBatch` and evaluated with
+    vectorized array operations which reproduce the wrapped scorer's arithmetic
+    exactly. If no vectorized implementation is known for the type of the
+    wrapped scorer, each fit is evaluated one at a time with the wrapped scorer
+    instead, so any scorer may be used.
+
+    Attributes
+    ----------
+    scorer : :class:`IsotopicFitterBase`
+        The scoring criterion to reproduce
+    kernel : callable or :const:`None`
+        The vectorized scoring function for :attr:`scorer`, if one is available
+    """
+
+    def __init__(self, scorer):
+        self.scorer = scorer
+        self.kernel = _batch_kernels.get(type(scorer))
+
+    @property
+    def is_vectorized(self):
+        return self.kernel is not None
+
+    def score(self, peaklist, pairs):
+        """Score each pair of experimental and theoretical peak lists.
+
+        Parameters
+        ----------
+        peaklist : :class:`~.PeakSet`
+            The full set of all experimental peaks
+        pairs : Sequence
+            Pairs of experimental and theoretical peak lists
+
+        Returns
+        -------
+        :class:`np.ndarray`
+            The score of each pair, in order
+        """
+        pairs = list(pairs)
+        if not pairs:
+            return np.zeros(0)
+        if self.kernel is None:
+            return np.array([
+                self.scorer.evaluate(peaklist, observed, expected)
+                for observed, expected in pairs], dtype=np.float64)
+        return self.kernel(self.scorer, IsotopicFitBatch.from_pairs(pairs))
+
+    def score_fits(self, peaklist, fits):
+        """Score each :class:`IsotopicFitRecord` in `fits`, updating
+        their :attr:`~IsotopicFitRecord.score` in place.
+
+        Parameters
+        ----------
+        peaklist : :class:`~.PeakSet`
+            The full set of all experimental peaks
+        fits : Sequence of :class:`IsotopicFitRecord`
+
+        Returns
+        -------
+        Sequence of :class:`IsotopicFitRecord`
+            `fits`
+        """
+        scores = self.score(peaklist, [(fit.experimental, fit.theoretical) for fit in fits])
+        for fit, score in zip(fits, scores):
+            fit.score = float(score)
+        return fits
+
+    def __call__(self, peaklist, fits):
+        return self.score_fits(peaklist, fits)
+
+    def reject(self, fit):
+        return self.scorer.reject(fit)
+
+    def is_maximizing(self):
+        return self.scorer.is_maximizing()
+
+
 class MassShiftSupportPostProcessorBase(object):
 
     def __init__(self, shifts=None):
@@ -1,10 +1,16 @@
+import os
+import pickle
+import shutil
+import tempfile
 import unittest
 
 from ms_deisotope.averagine import (
     peptide, calculate_mass, average_compositions,
     _Averagine, Averagine, add_compositions,
     AveragineCache, _AveragineCache, TheoreticalIsotopicPattern,
-    _TheoreticalIsotopicPattern)
+    _TheoreticalIsotopicPattern, AveragineTable, AveragineTableCache,
+    LRUEvictionPolicy, SizeEvictionPolicy, LFUEvictionPolicy,
+    isotopic_pattern_size)
 
 
 tid1 = [
@@ -62,6 +68,84 @@ TestAveragineCache = make_averagine_suite(AveragineCache)
 TestPurePythonAveragineCache = make_averagine_suite(_AveragineCache)
 
 
+class TestAveragineCacheEviction(unittest.TestCase):
+    def test_lru(self):
+        cache = AveragineCache(peptide, eviction_policy=LRUEvictionPolicy(3), cache_truncation=0.0)
+        for mz in [1000., 1001., 1002., 1000., 1003.]:
+            cache.isotopic_cluster(mz, 1)
+        self.assertEqual(len(cache.backend), 3)
+        self.assertEqual((cache.hits, cache.misses, cache.evictions), (1, 4, 1))
+        self.assertEqual(sorted(k[0] for k in cache.backend), [1000., 1002., 1003.])
+        cache.clear()
+        self.assertEqual(len(cache.eviction_policy), 0)
+
+    def test_lfu(self):
+        cache = AveragineCache(peptide, eviction_policy=LFUEvictionPolicy(3), cache_truncation=0.0)
+        for mz in [1000., 1000., 1001., 1001., 1002., 1003., 1004.]:
+            cache.isotopic_cluster(mz, 1)
+        self.assertEqual(sorted(k[0] for k in cache.backend), [1000., 1001., 1004.])
+        self.assertEqual((cache.hits, cache.misses, cache.evictions), (2, 5, 2))
+
+    def test_size(self):
+        size = isotopic_pattern_size(peptide.isotopic_cluster(1000., 1))
+        cache = AveragineCache(
+            peptide, eviction_policy=SizeEvictionPolicy(size * 2), cache_truncation=0.0)
+        for mz in [1000., 1000.5, 1001., 1001.5]:
+            cache.isotopic_cluster(mz, 1)
+        self.assertLessEqual(cache.eviction_policy.total_bytes, size * 2)
+        self.assertEqual(len(cache.backend), len(cache.eviction_policy))
+        self.assertEqual(cache.evictions, 4 - len(cache.backend))
+
+    def test_cached_patterns_unchanged(self):
+        cache = AveragineCache(peptide, eviction_policy=LRUEvictionPolicy(1))
+        for mz in [1000., 1500., 1000.]:
+            tid = cache.isotopic_cluster(mz, 2)
+            for peak, match in zip(tid, peptide.isotopic_cluster(mz, 2)):
+                self.assertAlmostEqual(peak.mz, match.mz, 3)
+                self.assertAlmostEqual(peak.intensity, match.intensity, 3)
+        self.assertEqual(cache.misses, 3)
+
+
+class TestAveragineTable(unittest.TestCase):
+    table = AveragineTable.build(peptide, 50.0, 3000.0, 1.0)
+
+    def test_isotopic_cluster(self):
+        for mz, charge in [(1000, 1), (1000, 2), (766.4321, 3), (500.25, -2)]:
+            expected = peptide.isotopic_cluster(mz, charge, truncate_after=0.95)
+            tid = self.table.isotopic_cluster(mz, charge, truncate_after=0.95)
+            self.assertEqual(len(tid), len(expected))
+            self.assertAlmostEqual(tid.monoisotopic_mz, mz)
+            for peak, match in zip(tid, expected):
+                self.assertAlmostEqual(peak.mz, match.mz, 4)
+                self.assertAlmostEqual(peak.intensity, match.intensity, 3)
+                self.assertEqual(peak.charge, charge)
+
+    def test_out_of_range(self):
+        self.assertFalse(self.table.covers(2000.0, 2))
+        self.assertRaises(ValueError, self.table.isotopic_cluster, 2000.0, 2)
+        cache = AveragineTableCache(self.table)
+        tid = cache.isotopic_cluster(2000.0, 2)
+        expected = peptide.isotopic_cluster(2000.0, 2)
+        self.assertAlmostEqual(tid[0].intensity, expected[0].intensity)
+
+    def test_save_load(self):
+        directory = tempfile.mkdtemp()
+        try:
+            path = os.path.join(directory, "peptide.npy")
+            self.table.save(path)
+            loaded = AveragineTable.load(path)
+            self.assertEqual(loaded.averagine, self.table.averagine)
+            self.assertEqual(loaded.maximum_mass, self.table.maximum_mass)
+            expected = [(p.mz, p.intensity) for p in self.table.isotopic_cluster(1000, 2)]
+            self.assertEqual([(p.mz, p.intensity) for p in loaded.isotopic_cluster(1000, 2)], expected)
+            cache = pickle.loads(pickle.dumps(AveragineTableCache(loaded)))
+            self.assertEqual(cache.table.path, path)
+            self.assertEqual([(p.mz, p.intensity) for p in cache.isotopic_cluster(1000, 2)], expected)
+            del loaded, cache
+        finally:
+            shutil.rmtree(directory, ignore_errors=True)
+
+
 class TestSupportMethods(unittest.TestCase):
     def test_average_composition(self):
         avgd = average_compositions([composition, composition])
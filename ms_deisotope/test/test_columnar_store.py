@@ -0,0 +1,118 @@
+import os
+import unittest
+import shutil
+import tempfile
+
+from click.testing import CliRunner
+
+from ms_deisotope import processor
+from ms_deisotope.averagine import glycopeptide, peptide
+from ms_deisotope.scoring import PenalizedMSDeconVFitter, MSDeconVFitter
+from ms_deisotope.peak_set import ColumnarDeconvolutedPeakSet
+from ms_deisotope.output.columnar import (
+    ColumnarSerializer, ProcessedColumnarDeserializer, is_columnar_store)
+from ms_deisotope.output.mzml import MzMLSerializer, ProcessedMzMLDeserializer
+from ms_deisotope.tools.indexing import cli
+
+from ms_deisotope.test.common import datafile
+
+
+class TestColumnarStore(unittest.TestCase):
+    mzml_path = datafile("three_test_scans.mzML")
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def make_scans(self):
+        proc = processor.ScanProcessor(self.mzml_path, ms1_deconvolution_args={
+            "averagine": glycopeptide,
+            "scorer": PenalizedMSDeconVFitter(5., 2.)
+        }, msn_deconvolution_args={
+            "averagine": peptide,
+            "scorer": MSDeconVFitter(10.),
+        })
+        bunch = next(iter(proc))
+        return bunch
+
+    def test_round_trip(self):
+        bunch = self.make_scans()
+        with ColumnarSerializer(self.path, sample_name="test") as writer:
+            writer.save(bunch)
+        self.assertTrue(is_columnar_store(self.path))
+
+        reader = ProcessedColumnarDeserializer(self.path)
+        self.assertEqual(len(reader), 1 + len(bunch.products))
+        self.assertEqual(reader.sample_name, "test")
+        for scan in [bunch.precursor] + list(bunch.products):
+            stored = reader.get_scan_by_id(scan.id)
+            self.assertIs(stored, reader.get_scan_by_id(scan.id))
+            self.assertEqual(stored.ms_level, scan.ms_level)
+            self.assertAlmostEqual(stored.scan_time, scan.scan_time)
+            self.assertEqual(stored.deconvoluted_peak_set, scan.deconvoluted_peak_set)
+            for a, b in zip(stored.deconvoluted_peak_set, scan.deconvoluted_peak_set):
+                self.assertEqual([tuple(p) for p in a.envelope], [tuple(p) for p in b.envelope])
+                self.assertEqual(a.signal_to_noise, b.signal_to_noise)
+            if scan.precursor_information is not None:
+                self.assertEqual(stored.precursor_information, scan.precursor_information)
+                self.assertEqual(stored.activation, scan.activation)
+                self.assertEqual(stored.isolation_window, scan.isolation_window)
+
+        stored_bunch = next(reader)
+        self.assertEqual(stored_bunch.precursor.id, bunch.precursor.id)
+        self.assertEqual([p.id for p in stored_bunch.products], [p.id for p in bunch.products])
+
+        headers = list(reader.iter_scan_headers())
+        self.assertEqual(len(headers), 1)
+        self.assertIsNone(headers[0].precursor.deconvoluted_peak_set)
+        product = bunch.products[-1]
+        self.assertEqual(reader.get_scan_by_time(product.scan_time).id, product.id)
+        self.assertEqual(reader.get_scan_by_time(product.scan_time, require_ms1=True).id,
+                         bunch.precursor.id)
+        self.assertEqual(reader.get_scan_by_index(0).id, bunch.precursor.id)
+
+    def test_columnar_peaks(self):
+        bunch = self.make_scans()
+        writer = ColumnarSerializer(self.path, deconvoluted=False)
+        writer.save_scan(bunch.precursor, deconvoluted=True)
+        writer.save_scan(bunch.products[0])
+        writer.complete()
+
+        reader = ProcessedColumnarDeserializer(self.path, mmap=False, columnar_peaks=True)
+        precursor = reader.get_scan_by_id(bunch.precursor.id)
+        self.assertIsInstance(precursor.deconvoluted_peak_set, ColumnarDeconvolutedPeakSet)
+        self.assertEqual(precursor.deconvoluted_peak_set, bunch.precursor.deconvoluted_peak_set)
+        product = reader.get_scan_by_id(bunch.products[0].id)
+        self.assertIsNone(product.deconvoluted_peak_set)
+        self.assertEqual(
+            [p.mz for p in product.peak_set], [p.mz for p in bunch.products[0].peak_set])
+
+    def test_convert_command(self):
+        bunch = self.make_scans()
+        mzml_path = os.path.join(self.path, "processed.mzML")
+        with open(mzml_path, 'wb') as fh:
+            writer = MzMLSerializer(fh, n_spectra=1 + len(bunch.products), deconvoluted=True)
+            writer.save(bunch)
+            writer.complete()
+        store_path = os.path.join(self.path, "store")
+        result = CliRunner().invoke(cli, ["columnar", mzml_path, store_path])
+        self.assertEqual(result.exit_code, 0, result.output)
+        self.assertTrue(is_columnar_store(store_path))
+
+        expected = ProcessedMzMLDeserializer(mzml_path)
+        reader = ProcessedColumnarDeserializer(store_path)
+        self.assertEqual(len(reader), len(expected))
+        for scan in [bunch.precursor] + list(bunch.products):
+            stored = reader.get_scan_by_id(scan.id)
+            source = expected.get_scan_by_id(scan.id)
+            self.assertEqual(stored.ms_level, source.ms_level)
+            self.assertEqual(stored.deconvoluted_peak_set, source.deconvoluted_peak_set)
+
+        result = CliRunner().invoke(cli, ["columnar", os.path.join(self.path, "missing.mzML"), store_path])
+        self.assertNotEqual(result.exit_code, 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -6,7 +6,8 @@ import brainpy
 
 from ms_deisotope.data_source import common, mzml, MSFileLoader
 from ms_deisotope.averagine import peptide, glycopeptide, TheoreticalIsotopicPattern
-from ms_peak_picker import reprofile
+from ms_peak_picker import reprofile, PeakSet
+from ms_deisotope import deconvolution
 from ms_deisotope.deconvolution import (
     deconvolute_peaks, AveragineDeconvoluter,
     AveraginePeakDependenceGraphDeconvoluter,
@@ -54,6 +55,14 @@ class TestAveragineDeconvolution(unittest.TestCase):
         charge_states.sequence_from_quickcharge(peaks, peak)
         states = list(charge_states)
         self.assertEqual(states, [1, 3])
+        self.assertTrue(all(type(state) is int for state in states))
+
+    def test_quick_charge_at_max_charge(self):
+        # Use the pure Python implementation even when the C extension is available
+        quick_charge = getattr(deconvolution, '_quick_charge', deconvolution.quick_charge)
+        peaks = PeakSet([FittedPeak(1000 + i / 3., 100. - i, 10, i, i, 0.01, 100.) for i in range(3)])
+        peaks.reindex()
+        self.assertEqual(list(quick_charge(peaks, 0, 1, 3)), [3])
 
     def test_deconvolution(self):
         scan = self.make_scan()
@@ -91,6 +100,34 @@ class TestAveragineDeconvolution(unittest.TestCase):
                 deconvoluter.peak_dependency_network.find_solution_for(fp).mz,
                 peak.mz, 3)
 
+    def test_subgraph_selection_methods(self):
+        scan = self.make_scan()
+        for method in ("interval", "branch_and_bound"):
+            deconresult = deconvolute_peaks(
+                scan.peak_set.clone(), {
+                    "averagine": peptide,
+                    "scorer": PenalizedMSDeconVFitter(5., 1.),
+                    "subgraph_selection_method": method
+                }, deconvoluter_type=AveraginePeakDependenceGraphDeconvoluter)
+            dpeaks = deconresult.peak_set
+            for point in points:
+                self.assertIsNotNone(dpeaks.has_peak(neutral_mass(point[0], point[1])))
+
+    def test_batch_scoring(self):
+        scan = self.make_scan()
+        for algorithm_type in (AveragineDeconvoluter, AveraginePeakDependenceGraphDeconvoluter):
+            results = []
+            for batch_scoring in (False, True):
+                deconresult = deconvolute_peaks(
+                    scan.peak_set.clone(), {
+                        "averagine": peptide,
+                        "scorer": PenalizedMSDeconVFitter(5., 1.)
+                    }, deconvoluter_type=algorithm_type, batch_scoring=batch_scoring)
+                results.append([(p.neutral_mass, p.charge, p.intensity, p.score)
+                                for p in deconresult.peak_set])
+            self.assertEqual(results[0], results[1])
+            self.assertTrue(len(results[0]) > 0)
+
 
 class TestCompositionListDeconvolution(unittest.TestCase):
     compositions = [
@@ -0,0 +1,208 @@
+import os
+import shutil
+import tempfile
+import threading
+import multiprocessing
+import unittest
+
+try:
+    from Queue import Queue
+except ImportError:
+    from queue import Queue
+
+from ms_deisotope import MSFileLoader
+from ms_deisotope.output.mzml import ProcessedMzMLDeserializer
+from ms_deisotope.tools.deisotoper.workflow import BatchSampleConsumer, SampleConsumer
+from ms_deisotope.tools.deisotoper.collator import ScanCollator, ScanDemultiplexer, BatchScanCollator
+from ms_deisotope.tools.deisotoper.process import (
+    DONE, FILE_START, BUNCH_DONE, SCAN_STATUS_SKIP, ScanIDYieldingProcess, preindex_file)
+
+from ms_deisotope.test.common import datafile
+
+
+class _Scan(object):
+    def __init__(self, index):
+        self.index = index
+
+
+class TestBatchScanCollator(unittest.TestCase):
+
+    def make_queue(self):
+        queue = Queue()
+        messages = [
+            (0, (FILE_START, 0, None)),
+            (0, (_Scan(2), 2, 1)),
+            (0, (_Scan(3), 3, 2)),
+            (0, (BUNCH_DONE, None, None)),
+            (1, (FILE_START, 0, None)),
+            (1, (_Scan(0), 0, 1)),
+            (1, (BUNCH_DONE, None, None)),
+            (0, (_Scan(0), 0, 1)),
+            (0, (SCAN_STATUS_SKIP, 1, 2)),
+            (0, (BUNCH_DONE, None, None)),
+            (1, (DONE, 1, None)),
+            (0, (DONE, 3, None)),
+            (0, (_Scan(4), 4, 1)),
+            (0, (BUNCH_DONE, None, None)),
+        ]
+        for message in messages:
+            queue.put(message)
+        return queue
+
+    def test_collate_interleaved_files(self):
+        demultiplexer = ScanDemultiplexer(self.make_queue())
+        first = BatchScanCollator(demultiplexer, 0)
+        assert [scan.index for scan in first] == [0, 2, 3, 4]
+        assert first.is_complete()
+        # The second file's messages were read while collating the first
+        assert demultiplexer.count_buffered_items(1) == 4
+        second = BatchScanCollator(demultiplexer, 1)
+        assert [scan.index for scan in second] == [0]
+        assert demultiplexer.count_buffered_items() == 0
+
+
+class TestWorkDistribution(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.mzml_path = os.path.join(self.directory, "small.mzML")
+        shutil.copyfile(datafile("small.mzML"), self.mzml_path)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def batch_sizes(self, target_batch_cost):
+        process = ScanIDYieldingProcess(
+            self.mzml_path, None, batch_size=4, target_batch_cost=target_batch_cost)
+        process.loader = process._open_loader(self.mzml_path)
+        sizes = []
+        starts = []
+        while True:
+            batch, _ = process._make_scan_batch()
+            if not batch:
+                break
+            sizes.append(len(batch))
+            starts.append(process._batch_start_index)
+        return sizes, starts
+
+    def test_adaptive_batch_size(self):
+        sizes, starts = self.batch_sizes(None)
+        assert sizes == [4, 4, 4, 2]
+        assert starts == [0, 14, 28, 41]
+        # Each MS1-only bunch is grouped with the following bunch and its MSn scans
+        sizes, starts = self.batch_sizes(5000)
+        assert sizes == [2] * 7
+        assert starts == [0, 7, 14, 21, 28, 34, 41]
+
+    def test_estimate_peak_count(self):
+        process = ScanIDYieldingProcess(self.mzml_path, None)
+        reader = MSFileLoader(self.mzml_path)
+        profile_scan = reader.get_scan_by_index(0)
+        centroid_scan = reader.get_scan_by_index(2)
+        assert profile_scan.is_profile and not centroid_scan.is_profile
+        # A profile scan is counted by its peaks, not its data points
+        assert process.estimate_peak_count(profile_scan) == 1752
+        assert len(profile_scan.arrays.mz) == 19914
+        assert process.estimate_peak_count(centroid_scan) == len(centroid_scan.arrays.mz)
+
+    def test_preindex_scan_time_index(self):
+        path = self.mzml_path
+        preindex_file(path, scan_time_index=True)
+        reader = MSFileLoader(path)
+        assert os.path.exists(reader._scan_time_index_file_name())
+        # Workers read the index written up front instead of building their own
+        loaded = reader.scan_time_index
+        assert loaded is not None
+        assert list(loaded.ms_levels) == [
+            MSFileLoader(path).get_scan_by_index(i).ms_level for i in range(len(reader))]
+
+    def test_collator_progress(self):
+        progress = multiprocessing.Value('l', -1)
+        collator = ScanCollator(Queue(), None, progress=progress)
+        collator.store_item(SCAN_STATUS_SKIP, 3)
+        collator.store_item(SCAN_STATUS_SKIP, 4)
+        collator.last_index = 2
+        assert progress.value == 2
+        stats = collator.stats()
+        assert stats['reorder_buffer_size'] == 2
+        assert stats['max_reorder_buffer_size'] == 2
+        assert stats['input_queue_depth'] is None
+
+    def test_wait_for_reorder_window(self):
+        progress = multiprocessing.Value('l', -1)
+        progress_changed = multiprocessing.Condition(progress.get_lock())
+        collator = ScanCollator(Queue(), None, progress=progress, progress_changed=progress_changed)
+        process = ScanIDYieldingProcess(
+            self.mzml_path, None, collator_progress=progress,
+            collator_progress_changed=progress_changed, reorder_window=5)
+        process._batch_start_index = 0
+        process._wait_for_reorder_window()
+        # The next batch starts too far ahead of the collator until it is told to move on
+        process._batch_start_index = 8
+        waiter = threading.Thread(target=process._wait_for_reorder_window)
+        waiter.start()
+        waiter.join(0.2)
+        assert waiter.is_alive()
+        collator.last_index = 1
+        waiter.join(0.2)
+        assert waiter.is_alive()
+        collator.last_index = 3
+        waiter.join(5)
+        assert not waiter.is_alive()
+
+
+class TestBatchSampleConsumer(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def copy_datafile(self, name):
+        # Processing a file writes its byte offset index next to it
+        path = os.path.join(self.directory, name)
+        shutil.copyfile(datafile(name), path)
+        return path
+
+    def test_process_files_with_missing_file(self):
+        ms_files = [
+            self.copy_datafile("three_test_scans.mzML"),
+            os.path.join(self.directory, "missing.mzML"),
+            self.copy_datafile("small.mzML"),
+        ]
+        storage_paths = [
+            os.path.join(self.directory, "%d.mzML" % i) for i in range(len(ms_files))]
+        end_scan_ids = [None, None, "controllerType=0 controllerNumber=1 scan=15"]
+        consumer = BatchSampleConsumer(
+            ms_files, storage_paths, None, *SampleConsumer.default_processing_configuration(),
+            end_scan_ids=end_scan_ids, n_processes=1, deconvolute=False)
+        # A file which fails to open must not leave the consumer waiting forever
+        runner = threading.Thread(target=consumer.run)
+        runner.daemon = True
+        runner.start()
+        runner.join(120)
+        if runner.is_alive():
+            consumer.scheduler.close()
+        assert not runner.is_alive()
+
+        assert consumer.files_completed == 2
+        assert consumer.files_failed == [ms_files[1]]
+        assert not os.path.exists(storage_paths[1])
+        for ms_file, storage_path, end_scan_id in zip(ms_files, storage_paths, end_scan_ids):
+            if ms_file in consumer.files_failed:
+                continue
+            reader = MSFileLoader(ms_file)
+            reader.make_iterator(grouped=False)
+            expected = []
+            for scan in reader:
+                expected.append(scan.id)
+                if scan.id == end_scan_id:
+                    break
+            reader.close()
+            processed = ProcessedMzMLDeserializer(storage_path, use_index=False)
+            processed.make_iterator(grouped=False)
+            assert [scan.id for scan in processed] == expected
+            processed.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,153 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+from ms_deisotope import MSFileLoader
+from ms_deisotope.output.mzml import ProcessedMzMLDeserializer
+from ms_deisotope.tools.deisotoper.checkpoint import Checkpoint
+from ms_deisotope.tools.deisotoper.output import MzMLScanStorageHandler, _terminate_partial_mzml
+from ms_deisotope.tools.deisotoper.workflow import _completed_bunches, SampleConsumer
+
+from ms_deisotope.test.common import datafile
+
+
+class TestCheckpoint(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.output_path = os.path.join(self.directory, "processed.mzML")
+        # Reading the file writes its byte offset index next to it
+        self.mzml_path = os.path.join(self.directory, "small.mzML")
+        shutil.copy(datafile("small.mzML"), self.mzml_path)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def test_state_round_trip(self):
+        assert Checkpoint.load(self.output_path) is None
+        checkpoint = Checkpoint(self.mzml_path, self.output_path)
+        checkpoint.update("scan=8", 10)
+        checkpoint.save()
+        restored = Checkpoint.load(self.output_path)
+        assert restored.to_dict() == checkpoint.to_dict()
+        restored.remove()
+        assert Checkpoint.load(self.output_path) is None
+
+    def test_read_partial_output(self):
+        reader = MSFileLoader(self.mzml_path)
+        store = MzMLScanStorageHandler(self.output_path, "test", n_spectra=48, deconvoluted=False)
+        expected = []
+        for _ in range(3):
+            bunch = next(reader)
+            for scan in [bunch.precursor] + list(bunch.products):
+                scan = scan.pick_peaks().pack()
+                expected.append(scan.id)
+                store.accumulate(scan)
+        # Saves the third bunch, but leaves the fourth pending when "interrupted"
+        store.accumulate(next(reader).precursor.pick_peaks().pack())
+        store.flush()
+        assert store.spectra_saved == len(expected)
+        last_scan_id = store.last_saved_scan_id
+        store.handle.close()
+
+        recovered = list(MzMLScanStorageHandler.read_partial_output(self.output_path))
+        assert [scan.id for scan in recovered] == expected
+        bunches = list(_completed_bunches(recovered, last_scan_id))
+        assert len(bunches) == 3
+        assert bunches[-1][0].id == last_scan_id
+        # Without knowing the last bunch was complete, it must be reprocessed
+        assert len(list(_completed_bunches(recovered))) == 2
+
+    def test_read_partial_output_precursors(self):
+        reader = MSFileLoader(self.mzml_path)
+        store = MzMLScanStorageHandler(self.output_path, "test", n_spectra=48, deconvoluted=False)
+        bunch = next(reader)
+        while not bunch.products:
+            bunch = next(reader)
+        expected = []
+        for scan in [bunch.precursor] + list(bunch.products):
+            scan = scan.pick_peaks().pack()
+            if scan.precursor_information is not None:
+                # Precursors of a deconvoluted run are defaulted when their charge state is unknown
+                scan.precursor_information.default()
+                expected.append(scan.precursor_information.extracted_mz)
+            store.accumulate(scan)
+        # The bunch is saved once the next one begins
+        next_precursor = next(reader).precursor.pick_peaks().pack()
+        store.accumulate(next_precursor)
+        store.flush()
+        store.handle.close()
+        assert expected
+
+        # Writing the scans read back out again must give back the same precursors
+        for path in (self.output_path + ".1", self.output_path + ".2"):
+            recovered = list(MzMLScanStorageHandler.read_partial_output(self.output_path))
+            store = MzMLScanStorageHandler(path, "test", n_spectra=48, deconvoluted=False)
+            for scan in recovered:
+                store.accumulate(scan)
+            store.accumulate(next_precursor)
+            store.flush()
+            store.handle.close()
+            self.output_path = path
+        _terminate_partial_mzml(self.output_path)
+        precursors = [scan.precursor_information for scan in self._read(self.output_path)
+                      if scan.precursor_information is not None]
+        assert [p.mz for p in precursors] == expected
+        assert all(p.defaulted for p in precursors)
+
+    def _run(self, output_path, resume=False):
+        consumer = SampleConsumer(
+            self.mzml_path, *SampleConsumer.default_processing_configuration(),
+            end_scan_id="controllerType=0 controllerNumber=1 scan=22",
+            storage_path=output_path, sample_name="test", n_processes=1,
+            deconvolute=False, checkpoint_interval=1, resume=resume)
+        consumer.run()
+
+    def _read(self, path):
+        reader = ProcessedMzMLDeserializer(path, use_index=False)
+        reader.make_iterator(grouped=False)
+        scans = list(reader)
+        reader.close()
+        return scans
+
+    def test_resume_matches_uninterrupted_run(self):
+        self._run(self.output_path)
+        with open(self.output_path, 'rb') as handle:
+            content = handle.read()
+
+        # Interrupt the run part of the way through writing the scan bunch of scan=16,
+        # after the checkpoint for the bunch of scan=15 was written
+        resumed_path = os.path.join(self.directory, "resumed.mzML")
+        cut = content.index(b'id="controllerType=0 controllerNumber=1 scan=18"') + 200
+        with open(resumed_path, 'wb') as handle:
+            handle.write(content[:cut])
+        checkpoint = Checkpoint(self.mzml_path, resumed_path)
+        checkpoint.update("controllerType=0 controllerNumber=1 scan=15", 14)
+        checkpoint.save()
+        self._run(resumed_path, resume=True)
+
+        expected = self._read(self.output_path)
+        resumed = self._read(resumed_path)
+        assert [scan.id for scan in resumed] == [scan.id for scan in expected]
+        for a, b in zip(expected, resumed):
+            assert a.scan_time == b.scan_time
+            assert np.array_equal([p.mz for p in a.peak_set], [p.mz for p in b.peak_set])
+            assert np.array_equal([p.intensity for p in a.peak_set], [p.intensity for p in b.peak_set])
+            if a.precursor_information is None:
+                assert b.precursor_information is None
+                continue
+            pa = a.precursor_information
+            pb = b.precursor_information
+            assert (pa.precursor_scan_id, pa.mz, pa.extracted_mz, pa.intensity, pa.charge,
+                    pa.extracted_charge, pa.defaulted, pa.orphan) == (
+                        pb.precursor_scan_id, pb.mz, pb.extracted_mz, pb.intensity, pb.charge,
+                        pb.extracted_charge, pb.defaulted, pb.orphan)
+        assert Checkpoint.load(resumed_path) is None
+        assert not os.path.exists(resumed_path + ".partial")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,146 @@
+import os
+import pickle
+import subprocess
+import sys
+import time
+import unittest
+
+try:
+    from queue import Queue
+except ImportError:
+    from Queue import Queue
+
+import numpy as np
+
+from ms_deisotope import processor
+from ms_deisotope.peak_set import ColumnarDeconvolutedPeakSet
+from ms_deisotope.averagine import peptide
+from ms_deisotope.scoring import PenalizedMSDeconVFitter
+from ms_deisotope.tools.deisotoper.transport import SharedMemoryScan, shared_memory_available
+from ms_deisotope.tools.deisotoper.collator import ScanCollator
+
+from ms_deisotope.test.common import datafile
+
+
+@unittest.skipIf(not shared_memory_available(), "Requires multiprocessing.shared_memory")
+class TestSharedMemoryScan(unittest.TestCase):
+    mzml_path = datafile("three_test_scans.mzML")
+
+    def make_scans(self):
+        proc = processor.ScanProcessor(self.mzml_path, ms1_deconvolution_args={
+            "averagine": peptide,
+            "scorer": PenalizedMSDeconVFitter(5., 2.)
+        })
+        bunch = next(iter(proc))
+        return [bunch.precursor.pack()] + [p.pack() for p in bunch.products]
+
+    def test_round_trip(self):
+        for scan in self.make_scans():
+            scan.product_scans = []
+            expected_peaks = [(p.mz, p.intensity, p.full_width_at_half_max) for p in scan.peak_set]
+            expected_deconvoluted = [
+                (p.neutral_mass, p.intensity, p.charge, p.score, p.a_to_a2_ratio, list(p.envelope))
+                for p in scan.deconvoluted_peak_set]
+            message = pickle.loads(pickle.dumps(SharedMemoryScan.pack(scan)))
+            self.assertIsNone(message.scan.deconvoluted_peak_set)
+            self.assertEqual(message.index, scan.index)
+            unpacked = message.unpack()
+            self.assertEqual(
+                [(p.mz, p.intensity, p.full_width_at_half_max) for p in unpacked.peak_set], expected_peaks)
+            self.assertEqual([
+                (p.neutral_mass, p.intensity, p.charge, p.score, p.a_to_a2_ratio, list(p.envelope))
+                for p in unpacked.deconvoluted_peak_set], expected_deconvoluted)
+            self.assertIsNotNone(unpacked.deconvoluted_peak_set.has_peak(expected_deconvoluted[0][0]))
+            self.assertIsNone(message.name)
+
+    def test_exclude_fitted(self):
+        scan = self.make_scans()[0]
+        scan.product_scans = []
+        unpacked = SharedMemoryScan.pack(scan).unpack(include_fitted=False)
+        self.assertIsNone(unpacked.peak_set)
+        self.assertTrue(len(unpacked.deconvoluted_peak_set) > 0)
+
+    def test_pack_columnar(self):
+        scan = _PeakListScan(0)
+        expected = scan.deconvoluted_peak_set
+        unpacked = SharedMemoryScan.pack(scan).unpack()
+        self.assertEqual(len(unpacked.deconvoluted_peak_set), len(expected))
+        for a, b in zip(unpacked.deconvoluted_peak_set, expected):
+            self.assertEqual(a, b)
+            self.assertEqual(a.score, b.score)
+            self.assertEqual(list(a.envelope), list(b.envelope))
+
+    def test_release_when_collator_stops(self):
+        queue = Queue()
+        stranded = SharedMemoryScan.pack(_PeakListScan(2))
+        queue.put((stranded, 2, 1))
+        queue.put((SharedMemoryScan.pack(_PeakListScan(0)), 0, 1))
+        collator = ScanCollator(queue, None)
+        collator.last_index = -1
+        iterator = iter(collator)
+        self.assertEqual(next(iterator).index, 0)
+        self.assertTrue(_block_exists(stranded.name))
+        name = stranded.name
+        iterator.close()
+        self.assertFalse(_block_exists(name))
+        self.assertEqual(collator.waiting, {})
+
+    @unittest.skipIf(not os.path.isdir("/dev/shm"), "Requires /dev/shm")
+    def test_cleanup_after_crash(self):
+        process = subprocess.Popen(
+            [sys.executable, "-c", _crash_script], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        out, _ = process.communicate()
+        name, survived_worker = out.decode('utf8').strip().splitlines()[-1].split()
+        # The block outlives the worker which created it
+        self.assertEqual(survived_worker, "True")
+        # The resource tracker notices the consumer is gone and removes the block
+        deadline = time.time() + 30
+        while _block_exists(name) and time.time() < deadline:
+            time.sleep(0.1)
+        self.assertFalse(_block_exists(name))
+
+
+class _PeakListScan(object):
+    def __init__(self, index):
+        self.id = "scan=%d" % index
+        self.index = index
+        self.ms_level = 1
+        mass = np.linspace(1000, 2000, 50)
+        self.deconvoluted_peak_set = ColumnarDeconvolutedPeakSet.from_arrays(
+            mass, np.linspace(1, 50, 50), np.ones(50, dtype=int), score=np.linspace(0, 1, 50),
+            envelope_offsets=np.arange(51) * 2,
+            envelope_mz=np.repeat(mass + 1.007, 2) + np.tile([0, 1.003], 50),
+            envelope_intensity=np.tile([10.0, 5.0], 50))
+        self.peak_set = None
+
+
+def _block_exists(name):
+    return os.path.exists(os.path.join("/dev/shm", name))
+
+
+_crash_script = """
+import multiprocessing, os, signal, sys
+from ms_deisotope.test.test_deisotoper_transport import _PeakListScan, _block_exists
+from ms_deisotope.tools.deisotoper.transport import SharedMemoryScan, start_resource_tracker
+
+
+def work(queue):
+    queue.put(SharedMemoryScan.pack(_PeakListScan(0)))
+
+
+if __name__ == '__main__':
+    start_resource_tracker()
+    context = multiprocessing.get_context('fork')
+    queue = context.Queue()
+    worker = context.Process(target=work, args=(queue,))
+    worker.start()
+    message = queue.get()
+    worker.join()
+    print(message.name, _block_exists(message.name))
+    sys.stdout.flush()
+    os.kill(os.getpid(), signal.SIGKILL)
+"""
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,454 @@
+import unittest
+
+from collections import defaultdict
+
+import numpy as np
+
+from ms_peak_picker import FittedPeak
+
+from ms_deisotope.averagine import AveragineCache, peptide
+from ms_deisotope.scoring import MSDeconVFitter
+from ms_deisotope.feature_map import lcms_feature
+from ms_deisotope.feature_map.lcms_feature import LCMSFeature, CompactLCMSFeature
+from ms_deisotope.feature_map.feature_relationships import binsearch
+from ms_deisotope.feature_map.feature_processor import LCMSFeatureProcessor, RTMap, feature_key
+from ms_deisotope.feature_map.scan_interval_tree import ScanIntervalTree, BoundingBox, make_rt_tree
+from ms_deisotope.feature_map.spatial_index import PackedRTree
+from ms_deisotope.feature_map.dependence_network import ConnectedSubgraph
+from ms_deisotope.peak_dependency_network import Interval
+from ms_deisotope.feature_map.shape_fitter import (
+    BatchChromatogramShapeFitter, ChromatogramShapeFitter, BiGaussianModel,
+    MultimodalChromatogramShapeFitter)
+from ms_deisotope.feature_map.feature_map import (
+    LCMSFeatureMap, DeconvolutedLCMSFeatureMap, MZIndex, NeutralMassIndex,
+    LCMSFeatureForest, StreamingLCMSFeatureForest, FeatureSpillStore)
+
+
+class _MassFeature(object):
+    def __init__(self, neutral_mass, mz):
+        self.neutral_mass = neutral_mass
+        self.mz = mz
+
+
+class _Scan(object):
+    def __init__(self, scan_time, peak_set):
+        self.scan_time = scan_time
+        self.peak_set = peak_set
+
+
+def make_run(n_scans=40):
+    # Each m/z elutes over a window of scans, and 600.0 elutes twice with a gap between
+    elution = {400.0: (0, 10), 500.0: (5, 30), 600.0: (0, 8), 700.0: (12, 40)}
+    elution_2 = {600.0: (20, 25)}
+    scans = []
+    for i in range(n_scans):
+        peaks = []
+        for windows in (elution, elution_2):
+            for mz, (start, end) in windows.items():
+                if start <= i < end:
+                    peaks.append(FittedPeak(mz + (i % 3) * 1e-4, 1000.0 + i, 10.0, 0, 0, 0.01, 1.0))
+        peaks.sort(key=lambda p: p.mz)
+        scans.append(_Scan(i * 0.1, peaks))
+    return scans
+
+
+def make_isotopic_run(n_scans=20):
+    # Several isotopic patterns at different charges, some close enough in m/z to
+    # interfere, each eluting with a triangular profile
+    analytes = [(450.25, 1, 0), (612.33, 2, 3), (613.01, 3, 5), (820.41, 2, 2), (1025.52, 4, 6),
+                (1210.66, 1, 4), (1404.71, 3, 1)]
+    scans = []
+    for i in range(n_scans):
+        peaks = []
+        for mz, charge, apex in analytes:
+            scale = 1e5 * max(1 - abs(i - apex - 6) / 8., 0)
+            if scale == 0:
+                continue
+            for tp in peptide.isotopic_cluster(mz, charge, truncate_after=0.99):
+                peaks.append(FittedPeak(tp.mz, tp.intensity * scale, 10.0, 0, 0, 0.01, tp.intensity * scale))
+        peaks.sort(key=lambda p: p.mz)
+        scans.append(_Scan(i * 0.1, peaks))
+    forest = LCMSFeatureForest(error_tolerance=2e-5)
+    forest.aggregate_peaks(scans, minimum_intensity=0)
+    return forest
+
+
+def make_features(values):
+    features = []
+    for mz in values:
+        feature = LCMSFeature()
+        feature.insert(FittedPeak(mz, 100.0, 10.0, 0, 0, 0.01, 1.0), 1.0)
+        features.append(feature)
+    return features
+
+
+class TestFeatureMapBatchSearch(unittest.TestCase):
+    values = np.concatenate([np.arange(400, 410, 0.25), [405.0001, 405.0002]])
+    queries = np.array([399.0, 400.0, 405.0, 405.00015, 409.75, 410.0, 500.0, 401.1])
+
+    def test_lcms_feature_map(self):
+        feature_map = LCMSFeatureMap(make_features(self.values))
+        found = feature_map.search_many(self.queries, 2e-5)
+        for q, feature, matches in zip(self.queries, found, feature_map.find_all_many(self.queries, 2e-5)):
+            expected = [f for f in feature_map if abs(f.mz - q) / q <= 2e-5]
+            self.assertEqual([f.mz for f in matches], [f.mz for f in expected])
+            if expected:
+                self.assertAlmostEqual(feature.mz, min(expected, key=lambda f: abs(f.mz - q)).mz)
+            else:
+                self.assertIsNone(feature)
+
+    def test_deconvoluted_feature_map(self):
+        features = [_MassFeature(v, (v + 1.007) / 2) for v in self.values]
+        feature_map = DeconvolutedLCMSFeatureMap(features)
+        for use_mz, attr, queries in ((False, 'neutral_mass', self.queries),
+                                      (True, 'mz', (self.queries + 1.007) / 2)):
+            all_matches = feature_map.find_all_many(queries, 2e-5, use_mz=use_mz)
+            found = feature_map.search_many(queries, 2e-5, use_mz=use_mz)
+            for q, feature, matches in zip(queries, found, all_matches):
+                expected = sorted(
+                    [f for f in features if abs(getattr(f, attr) - q) / q <= 2e-5],
+                    key=lambda f: getattr(f, attr))
+                self.assertEqual(matches, expected)
+                self.assertEqual(feature is None, not expected)
+
+    def test_feature_indices(self):
+        features = [_MassFeature(v, v) for v in self.values]
+        for index in (MZIndex(features), NeutralMassIndex(features)):
+            for q, matches in zip(self.queries, index.find_all_many(self.queries, 2e-5)):
+                self.assertEqual(matches, index.find_all(q, 2e-5))
+            starts, ends = index.search_intervals([], 2e-5)
+            self.assertEqual(len(starts), 0)
+
+
+class TestStreamingLCMSFeatureForest(unittest.TestCase):
+
+    def feature_key(self, feature):
+        return (round(feature.mz, 2), round(feature.start_time, 2), round(feature.end_time, 2), len(feature))
+
+    def test_matches_forest(self):
+        scans = make_run()
+        forest = LCMSFeatureForest(error_tolerance=2e-5)
+        forest.aggregate_peaks(scans, minimum_intensity=0)
+        expected = sorted(self.feature_key(chunk) for feature in forest for chunk in feature.split_sparse(0.25))
+
+        streaming = StreamingLCMSFeatureForest(error_tolerance=2e-5, maximum_time_gap=0.25, minimum_intensity=0)
+        closed_at = {}
+        for scan in scans:
+            for feature in streaming.add_scan(scan):
+                closed_at[self.feature_key(feature)] = scan.scan_time
+        for feature in streaming.complete():
+            closed_at[self.feature_key(feature)] = None
+        self.assertEqual(sorted(closed_at), expected)
+        # The 400 and first 600 features close as soon as they can no longer be extended
+        self.assertAlmostEqual(closed_at[(400.0, 0.0, 0.9, 10)], 1.2)
+        self.assertAlmostEqual(closed_at[(600.0, 0.0, 0.7, 8)], 1.0)
+        self.assertIsNone(closed_at[(700.0, 1.2, 3.9, 28)])
+        self.assertEqual(streaming.max_active_features, 3)
+        self.assertEqual(streaming.features_closed, len(expected))
+        self.assertEqual(streaming.count, sum(len(scan.peak_set) for scan in scans))
+
+        with self.assertRaises(ValueError):
+            streaming.add_peaks([], 0.0)
+
+    def test_spill_store(self):
+        streaming = StreamingLCMSFeatureForest(error_tolerance=2e-5, maximum_time_gap=0.25, minimum_intensity=0)
+        with FeatureSpillStore() as store:
+            store.extend(streaming.extract_features(make_run()))
+            self.assertEqual(len(store), 5)
+            feature_map = store.to_feature_map()
+            self.assertEqual([round(f.mz) for f in feature_map], [400, 500, 600, 600, 700])
+            self.assertEqual(sum(len(f) for f in feature_map), streaming.count)
+            # Reading the store does not consume it
+            self.assertEqual(len(list(store)), 5)
+
+
+class TestCompactLCMSFeature(unittest.TestCase):
+
+    def make_feature(self):
+        feature = LCMSFeature()
+        for i in range(20):
+            # Skip a stretch of time points to leave a gap
+            if 8 <= i < 12:
+                continue
+            feature.insert(FittedPeak(500.0 + i * 1e-4, 100.0 + i, 10.0, 0, i, 0.01, 1.0), i * 0.1)
+            if i % 3 == 0:
+                feature.insert(FittedPeak(500.001, 50.0, 5.0, 0, 100 + i, 0.01, 1.0), i * 0.1)
+        return feature
+
+    def test_round_trip(self):
+        feature = self.make_feature()
+        compact = CompactLCMSFeature.from_feature(feature)
+        self.assertEqual(len(compact), len(feature))
+        self.assertAlmostEqual(compact.mz, feature.mz)
+        self.assertAlmostEqual(compact.total_signal, feature.total_signal)
+        self.assertAlmostEqual(compact.apex_time, feature.apex_time)
+        self.assertTrue(np.allclose(compact.as_arrays()[1], feature.as_arrays()[1]))
+        restored = compact.to_feature()
+        self.assertEqual(restored, feature)
+        self.assertEqual(restored.feature_id, feature.feature_id)
+        self.assertEqual([node.node_id for node in restored], [node.node_id for node in feature])
+        self.assertEqual([p.index for node in restored for p in node.members],
+                         [p.index for node in feature for p in node.members])
+
+    def test_split_and_truncate(self):
+        feature = self.make_feature()
+        compact = CompactLCMSFeature.from_feature(feature)
+        self.assertEqual(compact.find_time(0.5)[1], feature.find_time(0.5)[1])
+        self.assertEqual(compact.find_time(0.5)[0], feature.find_time(0.5)[0])
+
+        for expected, chunk in zip(feature.split_at(0.55), compact.split_at(0.55)):
+            self.assertEqual(chunk.to_feature(), expected)
+        chunks = compact.split_sparse(0.25)
+        self.assertEqual(len(chunks), 2)
+        self.assertEqual([c.to_feature() for c in chunks], feature.split_sparse(0.25))
+
+        expected = feature.clone()
+        expected.truncate_before(0.35)
+        expected.truncate_after(1.5)
+        compact.truncate_before(0.35)
+        compact.truncate_after(1.5)
+        self.assertEqual(compact.to_feature(), expected)
+        self.assertAlmostEqual(compact.total_signal, expected.total_signal)
+
+    def test_merge(self):
+        feature = self.make_feature()
+        other = LCMSFeature()
+        for i in range(5, 25):
+            other.insert(FittedPeak(500.0, 30.0, 3.0, 0, 200 + i, 0.01, 1.0), i * 0.1)
+        merged = CompactLCMSFeature.from_feature(feature).merge(other)
+        self.assertEqual(merged.to_feature(), feature.merge(other))
+        self.assertEqual(merged.created_at, "merge")
+
+
+class TestPartitionedFeatureProcessing(unittest.TestCase):
+
+    def make_processor(self):
+        processor = LCMSFeatureProcessor(make_isotopic_run(), peptide, MSDeconVFitter(10.), maximum_time_gap=1.0)
+        # Without rounding the m/z of cached isotopic patterns, the patterns do not depend on
+        # the order in which they were first requested, which differs between processes
+        processor.averagine = AveragineCache(peptide, cache_truncation=0.0)
+        return processor
+
+    def collect_fits(self, n_processes):
+        processor = self.make_processor()
+        state = processor._make_iterator_state(n_processes=n_processes)
+        state.setup()
+        state.map_fits()
+        # The same features may be fit from several seeds against slightly different
+        # isotopic patterns, so keep the scores of every fit of each set of features
+        fits = defaultdict(list)
+        for fit in state.all_fits:
+            key = (tuple(feature_key(f) if f is not None else None for f in fit.features), fit.charge)
+            fits[key].append(fit.score)
+        return {key: sorted(scores) for key, scores in fits.items()}, sorted((fit.mz, fit.charge) for fit in state.fits)
+
+    def test_partitions(self):
+        processor = self.make_processor()
+        partitions = processor.partition_feature_map(3, charge_range=(1, 4))
+        self.assertEqual(len(partitions), 3)
+        for feature in processor.feature_map:
+            self.assertEqual(sum(partition.is_seed(feature) for partition in partitions), 1)
+        # Each slab holds the neighbors an isotopic pattern seeded in it could reach
+        for partition in partitions:
+            members = set(map(feature_key, partition.features))
+            for seed in filter(partition.is_seed, processor.feature_map):
+                for feature in processor.feature_map:
+                    if seed.mz - 1.0 <= feature.mz <= seed.mz + 2.0:
+                        self.assertIn(feature_key(feature), members)
+
+    def test_parallel_fits_match_serial(self):
+        serial_fits, serial_solutions = self.collect_fits(1)
+        parallel_fits, parallel_solutions = self.collect_fits(2)
+        self.assertGreater(len(serial_fits), 0)
+        self.assertEqual(serial_fits, parallel_fits)
+        self.assertEqual(serial_solutions, parallel_solutions)
+
+    def test_subgraph_selection_methods(self):
+        solutions = {}
+        for method in ("greedy", "interval", "branch_and_bound"):
+            processor = LCMSFeatureProcessor(
+                make_isotopic_run(), peptide, MSDeconVFitter(10.), maximum_time_gap=1.0,
+                subgraph_selection_method=method)
+            state = processor._make_iterator_state()
+            state.setup()
+            state.map_fits()
+            self.assertGreater(len(state.fits), 0)
+            claimed = set()
+            for fit in state.fits:
+                keys = {feature_key(f) for f in fit.features if f is not None}
+                self.assertTrue(claimed.isdisjoint(keys))
+                claimed |= keys
+            solutions[method] = sorted((fit.mz, fit.charge) for fit in state.fits)
+        self.assertEqual(solutions["greedy"], solutions["branch_and_bound"])
+
+    def test_subgraph_edges(self):
+        processor = LCMSFeatureProcessor(
+            make_isotopic_run(), peptide, MSDeconVFitter(10.), maximum_time_gap=1.0)
+        state = processor._make_iterator_state()
+        state.setup()
+        state.map_fits()
+        for cluster in state.disjoint_feature_clusters:
+            graph = ConnectedSubgraph(cluster, maximize=processor.dependence_network.maximize)
+            for node in graph:
+                for other in graph:
+                    if other is node:
+                        continue
+                    shared = not node.feature_indices.isdisjoint(other.feature_indices)
+                    self.assertEqual(other in node.overlap_edges, shared)
+                    self.assertEqual(other in node.edges, not shared)
+
+
+class _Profile(object):
+    def __init__(self, xs, ys):
+        self.xs = xs
+        self.ys = ys
+
+    def as_arrays(self):
+        return self.xs, self.ys
+
+    def __len__(self):
+        return len(self.xs)
+
+
+def make_profiles(n=30):
+    rng = np.random.RandomState(1)
+    profiles = []
+    for i in range(n):
+        xs = np.linspace(0, 10, rng.randint(10, 60))
+        center = rng.uniform(3, 7)
+        sigma = rng.uniform(0.5, 2)
+        height = rng.uniform(1e3, 1e6)
+        # Every other profile tails to the right and is noisy
+        ys = height * np.exp(-(xs - center) ** 2 / (2 * sigma ** 2)) * (1 + (i % 2) * 0.5 * (xs > center))
+        ys = np.abs(ys + rng.normal(0, height * 0.03 * (i % 2), len(xs)))
+        profiles.append(_Profile(xs, ys))
+    return profiles
+
+
+class TestBatchChromatogramShapeFitter(unittest.TestCase):
+    def test_matches_single_fits(self):
+        profiles = make_profiles()
+        for model in (BiGaussianModel(), ChromatogramShapeFitter(profiles[0]).shape_fitter):
+            batch = BatchChromatogramShapeFitter(profiles, fitter=model)
+            self.assertEqual(len(batch), len(profiles))
+            for i, profile in enumerate(profiles):
+                if batch.fast_path[i]:
+                    continue
+                single = ChromatogramShapeFitter(profile, fitter=model)
+                single_cost = (model.fit(single.params, single.xs, single.ys) ** 2).sum()
+                batch_cost = (model.fit(batch.params[i], single.xs, single.ys) ** 2).sum()
+                self.assertLessEqual(batch_cost, single_cost * 1.05 + 1e-6)
+                self.assertEqual(list(batch[i].keys()), list(single.params_dict.keys()))
+
+    def test_fast_path(self):
+        profiles = make_profiles()
+        batch = BatchChromatogramShapeFitter(profiles)
+        # The clean, symmetric profiles are accepted from their closed form estimate
+        self.assertTrue(batch.fast_path[::2].all())
+        self.assertFalse(batch.fast_path[1::2].any())
+        self.assertTrue((batch.n_iterations[batch.fast_path] == 0).all())
+        self.assertTrue((batch.line_tests[::2] < 0.05).all())
+        batch = BatchChromatogramShapeFitter(profiles, fast_path_threshold=0)
+        self.assertFalse(batch.fast_path.any())
+
+    def test_short_profiles(self):
+        profiles = make_profiles(3) + [_Profile(np.arange(4.), np.array([1., 3., 2., 1.]))]
+        batch = BatchChromatogramShapeFitter(profiles)
+        self.assertIsNone(batch[3])
+        self.assertEqual(batch.line_tests[3], 0.5)
+        self.assertIsNotNone(batch[0])
+
+
+class TestIntegerIndexing(unittest.TestCase):
+    def test_find_time(self):
+        # Use the pure Python implementation even when the C extension is available
+        tree_list_type = getattr(lcms_feature, '_LCMSFeatureTreeList', lcms_feature.LCMSFeatureTreeList)
+        node_type = getattr(lcms_feature, '_LCMSFeatureTreeNode', lcms_feature.LCMSFeatureTreeNode)
+        tree_list = tree_list_type([node_type(float(i)) for i in range(5)])
+        node, i = tree_list.find_time(3.0)
+        self.assertEqual((node.time, i), (3.0, 3))
+        node, i = tree_list.find_time(2.5)
+        self.assertIsNone(node)
+        self.assertEqual(i, 2)
+
+    def test_binsearch(self):
+        self.assertEqual(binsearch([1, 2, 3, 4, 5], 4), 3)
+        self.assertEqual(binsearch([1, 2, 3, 4, 5], 3.5), 2)
+
+    def test_multimodal_fit_without_maxima(self):
+        # A flat profile has no local maxima, so the first fit starts from the middle time point
+        fitter = MultimodalChromatogramShapeFitter(_Profile(np.arange(9.), np.ones(9)), smooth=0)
+        self.assertEqual(fitter.params_dict_list[0]['center'], 4.0)
+
+
+class TestPackedRTree(unittest.TestCase):
+    def make_boxes(self, n=2000):
+        rng = np.random.RandomState(0)
+        mz = rng.uniform(200, 2000, n)
+        rt = rng.uniform(0, 100, n)
+        return mz, mz + rng.uniform(0, 0.5, n), rt, rt + rng.uniform(0, 5, n)
+
+    def test_search(self):
+        mz_start, mz_end, rt_start, rt_end = self.make_boxes()
+        index = PackedRTree(range(len(mz_start)), mz_start, mz_end, rt_start, rt_end, node_size=8)
+        self.assertEqual(len(index), len(mz_start))
+        rng = np.random.RandomState(1)
+        for _ in range(50):
+            lo = rng.uniform(200, 2000)
+            hi = lo + rng.uniform(0, 10)
+            start = rng.uniform(0, 100)
+            end = start + rng.uniform(0, 5)
+            expected = np.flatnonzero(
+                (mz_start <= hi) & (mz_end >= lo) & (rt_start <= end) & (rt_end >= start)).tolist()
+            self.assertEqual(sorted(index.search(lo, hi, start, end)), expected)
+        self.assertEqual(PackedRTree([], [], [], [], []).search(0, 1, 0, 1), [])
+
+    def test_nearest(self):
+        mz_start, mz_end, rt_start, rt_end = self.make_boxes()
+        index = PackedRTree(range(len(mz_start)), mz_start, mz_end, rt_start, rt_end)
+        rng = np.random.RandomState(2)
+        for _ in range(20):
+            mz = rng.uniform(200, 2000)
+            time = rng.uniform(0, 100)
+            d_mz = np.maximum(np.maximum(mz_start - mz, mz - mz_end), 0) / 0.1
+            d_rt = np.maximum(np.maximum(rt_start - time, time - rt_end), 0)
+            distances = np.sqrt(d_mz ** 2 + d_rt ** 2)
+            found = index.nearest(mz, time, k=3, mz_scale=0.1)
+            self.assertEqual(len(found), 3)
+            self.assertTrue(np.allclose([d for d, _ in found], np.sort(distances)[:3]))
+            self.assertAlmostEqual(distances[found[0][1]], found[0][0])
+        self.assertEqual(index.nearest(1000., 50., max_distance=-1), [])
+
+    def test_feature_maps(self):
+        feature_map = LCMSFeatureForest(error_tolerance=2e-5)
+        feature_map.aggregate_peaks(make_run(), minimum_intensity=0)
+        index = feature_map.build_spatial_index()
+        self.assertEqual(len(index), len(feature_map))
+        for mz, time in [(600.0, 0.5), (600.0, 2.2), (400.0, 1.5), (500.0, 0.0), (700.0, 0.5)]:
+            expected = [f for f in feature_map if abs(f.mz - mz) <= 0.01 and f.start_time <= time <= f.end_time]
+            self.assertEqual(sorted(index.search(mz - 0.01, mz + 0.01, time, time), key=lambda f: f.mz),
+                             expected)
+        rt_map = RTMap(feature_map)
+        expected = [f for f in feature_map if abs(f.mz - 600.0) / 600.0 < 2e-5 and
+                    f.start_time <= 2.2 <= f.end_time]
+        self.assertEqual(len(expected), 1)
+        self.assertEqual(rt_map.find_features(600.0, 2.2), expected)
+        self.assertEqual(rt_map.find_features(600.1, 2.2), [])
+        deconvoluted = DeconvolutedLCMSFeatureMap(feature_map.features)
+        index = deconvoluted.build_spatial_index(use_mz=True)
+        self.assertEqual(sorted(f.mz for f in index.search(0, 1e4, 0.45, 0.45)),
+                         sorted(f.mz for f in feature_map if f.start_time <= 0.45 <= f.end_time))
+
+    def test_scan_interval_tree(self):
+        boxes = [BoundingBox(Interval(400., 405.), Interval(0., 10.)),
+                 BoundingBox(Interval(600., 605.), Interval(5., 15.))]
+        for tree in (ScanIntervalTree(make_rt_tree(boxes), boxes), ScanIntervalTree(make_rt_tree(boxes))):
+            self.assertTrue(tree.contains_point(402., 1.))
+            self.assertFalse(tree.contains_point(602., 1.))
+            self.assertTrue(tree.contains_point(602., 12.))
+            self.assertEqual(len(tree.get_intervals_for_point(402., 1.)), 1)
+        self.assertTrue(ScanIntervalTree(None).contains_point(602., 1.))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,63 @@
+import io
+import json
+import unittest
+
+from ms_deisotope.instrumentation import PipelineMetrics, NULL_METRICS, LATENCY_BUCKETS
+from ms_deisotope.processor import ScanProcessor
+
+from ms_deisotope.test.common import datafile
+
+
+class TestPipelineMetrics(unittest.TestCase):
+
+    def test_record_and_merge(self):
+        metrics = PipelineMetrics()
+        with metrics.time("read"):
+            pass
+        metrics.record("read", 0.5)
+        metrics.increment("peaks_picked", 10)
+        stage = metrics.stages['read']
+        assert stage.count == 2
+        assert stage.max_time == 0.5
+        assert sum(stage.histogram) == 2
+        assert len(stage.histogram) == len(LATENCY_BUCKETS) + 1
+
+        other = PipelineMetrics()
+        other.record("read", 2.0)
+        other.record("deconvolution", 0.1)
+        other.increment("peaks_picked", 5)
+        metrics.merge(other.to_dict())
+        assert metrics.stages['read'].count == 3
+        assert metrics.stages['read'].max_time == 2.0
+        assert metrics.stages['deconvolution'].count == 1
+        assert metrics.counters['peaks_picked'] == 15
+
+        restored = PipelineMetrics.from_dict(json.loads(json.dumps(metrics.to_dict())))
+        assert restored.to_dict() == metrics.to_dict()
+
+        buffer = io.StringIO()
+        metrics.write_json(buffer, elapsed=3.0)
+        report = json.loads(buffer.getvalue())
+        assert report['elapsed'] == 3.0
+        assert report['counters'] == {"peaks_picked": 15}
+
+    def test_null_metrics(self):
+        with NULL_METRICS.time("read"):
+            pass
+        NULL_METRICS.increment("peaks_picked")
+        NULL_METRICS.merge({"stages": {}, "counters": {"peaks_picked": 1}})
+        assert not NULL_METRICS
+        assert not NULL_METRICS.enabled
+
+    def test_processor_stages(self):
+        metrics = PipelineMetrics()
+        processor = ScanProcessor(datafile("three_test_scans.mzML"), metrics=metrics)
+        processor.next()
+        assert metrics.stages['read'].count == 1
+        assert metrics.stages['ms1_peak_picking'].count == 1
+        assert metrics.stages['ms1_scan'].count == 1
+        assert metrics.counters['ms1_peaks_picked'] > 0
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,7 +1,15 @@
 import unittest
 import os
+import pickle
+import itertools
+import shutil
+import tempfile
+
+import numpy as np
 
 from ms_deisotope.data_source import MzMLLoader
+from ms_deisotope.data_source.mzml import LazyArrayRecord
+from ms_deisotope.data_source.scan import RollingScanAverager
 from ms_deisotope.test.common import datafile
 from ms_deisotope.data_source import infer_type
 
@@ -209,6 +217,158 @@ class TestMzMLLoaderScanBehavior(unittest.TestCase):
         reader = infer_type.MSFileLoader(self.path)
         assert len(reader.software_list()) == 2
 
+    def test_lazy_arrays(self):
+        eager = MzMLLoader(self.path)
+        lazy = MzMLLoader(self.path, lazy_arrays=True, skip_extra_arrays=True)
+        assert lazy._memory_map is not None
+        eager.make_iterator(grouped=False)
+        lazy.make_iterator(grouped=False)
+        for eager_scan, lazy_scan in zip(eager, lazy):
+            assert eager_scan.id == lazy_scan.id
+            assert eager_scan.scan_time == lazy_scan.scan_time
+            assert eager_scan.precursor_information == lazy_scan.precursor_information
+            record = lazy_scan._data['m/z array']
+            assert isinstance(record, LazyArrayRecord)
+            assert not record.is_decoded
+            assert np.allclose(eager_scan.arrays.mz, lazy_scan.arrays.mz)
+            assert np.allclose(eager_scan.arrays.intensity, lazy_scan.arrays.intensity)
+            assert record.is_decoded
+        scan = lazy.get_scan_by_id(scan_ids[1])
+        dup = pickle.loads(pickle.dumps(scan))
+        assert np.allclose(dup.arrays.mz, scan.arrays.mz)
+        dup_reader = pickle.loads(pickle.dumps(lazy))
+        assert dup_reader._lazy_arrays
+        lazy.close()
+        assert lazy._memory_map is None
+
+    def test_read_ahead(self):
+        eager = MzMLLoader(self.path)
+        threaded = MzMLLoader(self.path, read_ahead=2, decode_threads=2)
+        for grouped in (True, False):
+            eager.reset()
+            threaded.reset()
+            eager.make_iterator(grouped=grouped)
+            threaded.make_iterator(grouped=grouped)
+            eager_scans = []
+            threaded_scans = []
+            for eager_item, threaded_item in zip(eager, threaded):
+                if grouped:
+                    eager_scans.extend([eager_item.precursor] + eager_item.products)
+                    threaded_scans.extend([threaded_item.precursor] + threaded_item.products)
+                else:
+                    eager_scans.append(eager_item)
+                    threaded_scans.append(threaded_item)
+            assert len(threaded_scans) == 3
+            for eager_scan, threaded_scan in zip(eager_scans, threaded_scans):
+                assert eager_scan.id == threaded_scan.id
+                assert threaded_scan._arrays is not None
+                assert np.allclose(eager_scan.arrays.mz, threaded_scan.arrays.mz)
+                assert np.allclose(eager_scan.arrays.intensity, threaded_scan.arrays.intensity)
+
+    def test_scan_time_index(self):
+        path = datafile("small.mzML")
+        indexed = MzMLLoader(path)
+        plain = MzMLLoader(path)
+        plain.build_scan_time_index_on_demand = False
+        assert plain.scan_time_index is None
+        time_index = indexed.build_scan_time_index()
+        assert len(time_index) == len(plain)
+        for i in range(len(plain)):
+            scan = plain.get_scan_by_index(i)
+            assert time_index.ms_levels[i] == scan.ms_level
+            assert np.isclose(time_index.scan_times[i], scan.scan_time)
+            for method in ("find_previous_ms1", "find_next_ms1"):
+                expected = getattr(plain, method)(i)
+                found = getattr(indexed, method)(i)
+                assert (found.id if found else None) == (expected.id if expected else None)
+            assert indexed._locate_ms1_scan(indexed[i]).id == plain._locate_ms1_scan(scan).id
+            if scan.ms_level > 1:
+                precursor = plain.get_scan_by_id(scan.precursor_information.precursor_scan_id)
+                assert time_index.precursor_indices[i] == precursor.index
+        for time in list(time_index.scan_times) + [0.0, float('inf')]:
+            assert indexed.get_scan_by_time(time).id == plain.get_scan_by_time(time).id
+        assert plain.scan_time_index is None
+
+    def test_scan_time_index_on_demand(self):
+        path = datafile("small.mzML")
+        reader = MzMLLoader(path)
+        plain = MzMLLoader(path)
+        plain.build_scan_time_index_on_demand = False
+        assert reader.scan_time_index is None
+        # The first lookup by time builds the index, and later lookups use it
+        time = plain.get_scan_by_index(20).scan_time
+        assert reader.get_scan_by_time(time).id == plain.get_scan_by_time(time).id
+        time_index = reader.scan_time_index
+        assert time_index is not None
+        assert reader._locate_ms1_scan(reader[5]).id == plain._locate_ms1_scan(plain[5]).id
+        assert reader.scan_time_index is time_index
+
+    def test_scan_time_index_persistence(self):
+        directory = tempfile.mkdtemp()
+        path = os.path.join(directory, os.path.basename(self.path))
+        shutil.copyfile(self.path, path)
+        try:
+            reader = MzMLLoader(path)
+            index_file_name = reader._scan_time_index_file_name()
+            built = reader.build_scan_time_index(persist=True)
+            assert os.path.exists(index_file_name)
+            loaded = MzMLLoader(path).scan_time_index
+            assert loaded is not None
+            assert np.allclose(loaded.scan_times, built.scan_times)
+            assert list(loaded.ms_levels) == [1, 2, 2]
+            assert list(loaded.precursor_indices) == [-1, 0, 0]
+            # Once the data file changes, the saved index no longer describes it
+            stat = os.stat(path)
+            os.utime(path, (stat.st_atime, stat.st_mtime + 10))
+            assert MzMLLoader(path).scan_time_index is None
+        finally:
+            shutil.rmtree(directory, ignore_errors=True)
+
+    def test_scan_average(self):
+        reader = MzMLLoader(datafile("small.mzML"))
+        ms1_indices = [i for i in range(len(reader)) if reader.get_scan_by_index(i).ms_level == 1]
+        for index_interval in (1, 2):
+            for i in ms1_indices:
+                scan = reader.get_scan_by_index(i)
+                before, after = scan._get_adjacent_scans(index_interval)
+                window = before + [scan] + after
+                # Averaging repeatedly must not pick up stray values outside of each scan's m/z range
+                for _ in range(3):
+                    averaged = scan.average(index_interval)
+                    assert averaged.scan_indices == [s.index for s in window]
+                    mz = averaged.arrays.mz
+                    expected = np.zeros_like(mz)
+                    for neighbor in window:
+                        arrays = neighbor.arrays
+                        expected += np.interp(mz, arrays.mz, arrays.intensity, left=0, right=0)
+                    expected /= len(window)
+                    assert np.allclose(averaged.arrays.intensity, expected)
+
+    def test_rolling_average(self):
+        path = datafile("small.mzML")
+        indexed = MzMLLoader(path)
+        indexed.build_scan_time_index()
+        plain = MzMLLoader(path)
+        plain.build_scan_time_index_on_demand = False
+        ms1_indices = [i for i in range(len(plain)) if plain.get_scan_by_index(i).ms_level == 1]
+        for reader, index_interval in itertools.product((plain, indexed), (1, 2)):
+            averager = RollingScanAverager(index_interval)
+            # Averaging in acquisition order and then jumping back must give the same windows
+            for i in ms1_indices + ms1_indices[:3]:
+                scan = reader.get_scan_by_index(i)
+                before, after = scan._get_adjacent_scans(index_interval)
+                window = before + [scan] + after
+                averaged = averager.average(scan)
+                assert averaged.scan_indices == [s.index for s in window]
+                assert list(averager.window) == averaged.scan_indices
+                mz = averaged.arrays.mz
+                assert np.allclose(np.diff(mz), averager.dx)
+                expected = np.zeros_like(mz)
+                for neighbor in window:
+                    arrays = neighbor.arrays
+                    expected += np.interp(mz, arrays.mz, arrays.intensity, left=0, right=0)
+                expected /= len(window)
+                assert np.allclose(averaged.arrays.intensity, expected, atol=1e-6 * expected.max())
 
 if __name__ == '__main__':
     unittest.main()
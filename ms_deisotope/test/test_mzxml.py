@@ -1,5 +1,7 @@
 import unittest
 
+import numpy as np
+
 from ms_deisotope.data_source import MzXMLLoader
 from ms_deisotope.test.common import datafile
 from ms_deisotope.data_source import infer_type
@@ -53,6 +55,17 @@ class TestMzXMLLoaderScanBehavior(unittest.TestCase):
         proc_info = self.reader.data_processing()
         assert len(proc_info) == 2
 
+    def test_read_ahead(self):
+        eager = MzXMLLoader(self.path)
+        threaded = MzXMLLoader(self.path, read_ahead=2, decode_threads=2)
+        for eager_bunch, threaded_bunch in zip(eager, threaded):
+            assert eager_bunch.precursor.id == threaded_bunch.precursor.id
+            assert threaded_bunch.precursor._arrays is not None
+            assert np.allclose(eager_bunch.precursor.arrays.mz, threaded_bunch.precursor.arrays.mz)
+            assert np.allclose(
+                eager_bunch.precursor.arrays.intensity, threaded_bunch.precursor.arrays.intensity)
+            assert [p.id for p in eager_bunch.products] == [p.id for p in threaded_bunch.products]
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -1,7 +1,11 @@
+import pickle
 import unittest
 
 import numpy as np
 
+from ms_deisotope.peak_set import (
+    ColumnarDeconvolutedPeakSet, DeconvolutedPeak, DeconvolutedPeakSet)
+
 
 def make_peak_set_test_suite(peak_set_cls, peak_cls):
 
@@ -31,6 +35,29 @@ def make_peak_set_test_suite(peak_set_cls, peak_cls):
                 for p in ps.all_peaks_for(xi):
                     assert abs((xi - p.neutral_mass) / p.neutral_mass) < 1e-5
 
+        def test_batch_search(self):
+            x = np.arange(1000, 1200, 0.005)
+            y = np.ones_like(x)
+
+            peaks = [peak_cls(x[i], y[i], 1, 1, None, 0) for i in range(len(x))]
+            ps = peak_set_cls(peaks)
+            ps.reindex()
+            queries = np.concatenate([np.arange(999, 1201, 0.37), [x[0], x[-1], 1e4]])
+            for use_mz in (False, True):
+                attr = 'mz' if use_mz else 'neutral_mass'
+                values = np.array([getattr(p, attr) for p in ps])
+                found = ps.has_peaks(queries, 1e-5, use_mz=use_mz)
+                self.assertEqual(len(found), len(queries))
+                for q, peak in zip(queries, found):
+                    errors = np.abs((values - q) / q)
+                    if errors.min() >= 1e-5:
+                        self.assertIsNone(peak)
+                    else:
+                        self.assertAlmostEqual(getattr(peak, attr), values[np.argmin(errors)])
+            for q, matches in zip(queries, ps.all_peaks_for_many(queries, 1e-5)):
+                expected = ps.all_peaks_for(q, 1e-5)
+                self.assertEqual([p.neutral_mass for p in matches], [p.neutral_mass for p in expected])
+
     return TestDeconvolutedPeakSet
 
 
@@ -55,5 +82,76 @@ except ImportError:
     TestPythonDeconvolutedPeakSet = make_peak_set_test_suite(_DeconvolutedPeakSet, _DeconvolutedPeak)
 
 
+TestColumnarDeconvolutedPeakSet = make_peak_set_test_suite(ColumnarDeconvolutedPeakSet, DeconvolutedPeak)
+
+
+class TestColumnarDeconvolutedPeakSetConversion(unittest.TestCase):
+    def make_peaks(self):
+        peaks = []
+        for i, mass in enumerate([1500.5, 1000.25, 1200.75, 999.8, 1800.1]):
+            charge = (i % 3) + 1
+            envelope = [(mass / charge + j / float(charge), 100.0 - 10 * j) for j in range(i + 1)]
+            peaks.append(DeconvolutedPeak(
+                mass, 100.0 * (i + 1), charge, 10.0 + i, None, 0.05, 0.5, mass + 1, mass + 0.5,
+                50.0 + i, envelope, 0, None, i % 2 == 0, 20.0 * i))
+        return peaks
+
+    def test_round_trip(self):
+        peaks = self.make_peaks()
+        ps = ColumnarDeconvolutedPeakSet(peaks)
+        ref = DeconvolutedPeakSet(peaks).reindex()
+        self.assertEqual(len(ps), len(ref))
+        for a, b in zip(ps, ref):
+            self.assertEqual(a, b)
+            self.assertEqual(a.mz, b.mz)
+            self.assertEqual(a.chosen_for_msms, b.chosen_for_msms)
+            self.assertEqual(a.area, b.area)
+            self.assertEqual([tuple(p) for p in a.envelope], [tuple(p) for p in b.envelope])
+            self.assertEqual(a.index.mz, b.index.mz)
+            self.assertEqual(a.index.neutral_mass, b.index.neutral_mass)
+        self.assertEqual(ps.to_peak_set(), ref)
+        self.assertEqual(pickle.loads(pickle.dumps(ps)), ps)
+
+    def test_queries(self):
+        peaks = self.make_peaks()
+        ps = ColumnarDeconvolutedPeakSet(peaks)
+        ref = DeconvolutedPeakSet(peaks).reindex()
+        for peak in ref:
+            self.assertEqual(ps.has_peak(peak.mz, use_mz=True), peak)
+            self.assertEqual(ps.has_peak(peak.neutral_mass + 1e-3), peak)
+        self.assertIsNone(ps.has_peak(1100.0))
+        nearest, error = ps.get_nearest_peak(1199.0)
+        self.assertAlmostEqual(nearest.neutral_mass, 1200.75)
+        self.assertAlmostEqual(error, 1.75)
+        subset = ps.between(1000.0, 1600.0)
+        self.assertEqual([p.neutral_mass for p in subset], [1000.25, 1200.75, 1500.5])
+        self.assertEqual([tuple(p.envelope) for p in subset],
+                         [tuple(p.envelope) for p in ref.between(1000.0, 1600.0)])
+        subset = ps.between(500, 900, use_mz=True)
+        self.assertEqual(sorted(p.mz for p in subset), sorted(p.mz for p in ref if 500 <= p.mz <= 900))
+
+    def test_single_query_matches_batch(self):
+        x = np.arange(1000, 1010, 0.005)
+        ps = ColumnarDeconvolutedPeakSet.from_arrays(x, np.ones_like(x), np.ones_like(x, dtype=int))
+        queries = np.concatenate([np.arange(999, 1011, 0.0037), x[[0, -1]], x[[0, -1]] * (1 + 1e-5)])
+        for use_mz in (False, True):
+            for q, peak in zip(queries, ps.has_peaks(queries, 1e-5, use_mz=use_mz)):
+                self.assertIs(ps.has_peak(q, 1e-5, use_mz=use_mz), peak)
+        for q, matches in zip(queries, ps.all_peaks_for_many(queries, 1e-5)):
+            self.assertEqual(ps.all_peaks_for(q, 1e-5), matches)
+        self.assertIsNone(ColumnarDeconvolutedPeakSet().has_peak(1000.0))
+
+    def test_from_arrays(self):
+        peaks = self.make_peaks()
+        ref = ColumnarDeconvolutedPeakSet(peaks)
+        ps = ColumnarDeconvolutedPeakSet.from_arrays(
+            ref.neutral_mass[::-1], ref.intensity[::-1], ref.charge[::-1],
+            score=ref.score[::-1])
+        self.assertEqual(ps, ref)
+        self.assertTrue(np.allclose(ps.mz, ref.mz))
+        selected = ps.take(ps.intensity > 250)
+        self.assertEqual(len(selected), 3)
+
+
 if __name__ == '__main__':
     unittest.main()
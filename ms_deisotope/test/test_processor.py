@@ -3,10 +3,18 @@ import unittest
 from ms_deisotope import processor
 from ms_deisotope.averagine import glycopeptide, peptide
 from ms_deisotope.scoring import PenalizedMSDeconVFitter, MSDeconVFitter
+from ms_deisotope.envelope_statistics import PrecursorPurityEstimator
 
 from ms_deisotope.test.common import datafile
 
 
+class _IsolatedScan(object):
+    def __init__(self, peak_set, deconvoluted_peak_set, isolation_window):
+        self.peak_set = peak_set
+        self.deconvoluted_peak_set = deconvoluted_peak_set
+        self.isolation_window = isolation_window
+
+
 class TestScanProcessor(unittest.TestCase):
     mzml_path = datafile("three_test_scans.mzML")
     missing_charge_mzml = datafile("has_missing_charge_state_info.mzML")
@@ -32,6 +40,31 @@ class TestScanProcessor(unittest.TestCase):
             self.assertIsNotNone(scan_bunch.precursor)
             self.assertIsNotNone(scan_bunch.products)
 
+    def test_batch_precursor_purity(self):
+        proc = processor.ScanProcessor(self.mzml_path, ms1_deconvolution_args={
+            "averagine": glycopeptide,
+            "scorer": PenalizedMSDeconVFitter(5., 2.)
+        })
+        bunch = next(iter(proc))
+        precursor = bunch.precursor
+        peaks = list(precursor.deconvoluted_peak_set)
+        self.assertGreater(len(peaks), 0)
+        estimator = PrecursorPurityEstimator()
+        batch = estimator.estimate_batch(precursor, peaks)
+        self.assertEqual(len(batch), len(peaks))
+        for peak, (purity, coisolation) in zip(peaks, batch):
+            expected_purity, expected_coisolation = estimator(precursor, peak)
+            self.assertAlmostEqual(purity, expected_purity)
+            self.assertEqual(coisolation, expected_coisolation)
+        windows = [product.isolation_window for product in bunch.products]
+        batch = estimator.estimate_batch(
+            precursor, peaks[:len(windows)], windows, ignore_singly_charged=True)
+        for peak, window, (purity, coisolation) in zip(peaks, windows, batch):
+            # An MS1 scan never reports an isolation window of its own
+            view = _IsolatedScan(precursor.peak_set, precursor.deconvoluted_peak_set, window)
+            self.assertAlmostEqual(purity, estimator.precursor_purity(view, peak))
+            self.assertEqual(coisolation, estimator.coisolation(view, peak, ignore_singly_charged=True))
+
     def test_missing_charge_processing(self):
         proc = processor.ScanProcessor(self.missing_charge_mzml, ms1_deconvolution_args={
             "averagine": glycopeptide,
@@ -7,7 +7,8 @@ from brainpy._c.isotopic_distribution import TheoreticalPeak as Peak
 
 from ms_deisotope.scoring import (
         PenalizedMSDeconVFitter, MSDeconVFitter, DotProductFitter, ScaledGTestFitter,
-        GTestFitter, LeastSquaresFitter)
+        GTestFitter, LeastSquaresFitter, BatchIsotopicFitScorer,
+        IsotopicFitBatch)
 
 experimental = [
     FittedPeak(mz=739.920, intensity=8356.829, signal_to_noise=100.000,
@@ -77,5 +78,47 @@ class IsotopicFitScoringTests(unittest.TestCase):
         self.assertAlmostEqual(score, 7.463484119741042e-05, 3)
 
 
+class BatchIsotopicFitScoringTests(unittest.TestCase):
+    def make_pairs(self):
+        pairs = [(experimental, theoretical)]
+        # A shorter pattern to exercise padding
+        pairs.append((experimental[:3], theoretical[:3]))
+        # A pattern with a placeholder and a poorly matched peak
+        pairs.append((
+            [experimental[0], FittedPeak(740.255, 1.0, 1.0, -1, 0, 0, 0), experimental[2]],
+            [theoretical[0], theoretical[1], theoretical[2]]))
+        pairs.append(([experimental[1], experimental[0]], [theoretical[0], theoretical[1]]))
+        return pairs
+
+    def test_batch_matches_evaluate(self):
+        pairs = self.make_pairs()
+        for scorer in [PenalizedMSDeconVFitter(20, 2.0), MSDeconVFitter(), DotProductFitter(),
+                       ScaledGTestFitter(), GTestFitter(), LeastSquaresFitter()]:
+            batch_scorer = BatchIsotopicFitScorer(scorer)
+            self.assertTrue(batch_scorer.is_vectorized)
+            scores = batch_scorer.score(None, pairs)
+            expected = [scorer.evaluate(None, list(obs), list(theo)) for obs, theo in pairs]
+            self.assertEqual(list(scores), expected)
+
+    def test_fallback(self):
+        class CustomMSDeconVFitter(MSDeconVFitter):
+            pass
+
+        pairs = self.make_pairs()
+        scorer = CustomMSDeconVFitter()
+        batch_scorer = BatchIsotopicFitScorer(scorer)
+        self.assertFalse(batch_scorer.is_vectorized)
+        scores = batch_scorer.score(None, pairs)
+        expected = [scorer.evaluate(None, list(obs), list(theo)) for obs, theo in pairs]
+        self.assertEqual(list(scores), expected)
+        self.assertEqual(len(batch_scorer.score(None, [])), 0)
+
+    def test_packing(self):
+        batch = IsotopicFitBatch.from_pairs(self.make_pairs())
+        self.assertEqual(len(batch), 4)
+        self.assertEqual(batch.width, 4)
+        self.assertEqual(batch.mask.sum(axis=1).tolist(), [4, 3, 3, 2])
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,138 @@
+import unittest
+import itertools
+import random
+
+from ms_peak_picker import FittedPeak
+from brainpy._c.isotopic_distribution import TheoreticalPeak as Peak
+
+from ms_deisotope.averagine import TheoreticalIsotopicPattern
+from ms_deisotope.scoring import IsotopicFitRecord
+from ms_deisotope.peak_dependency_network import subgraph
+from ms_deisotope.peak_dependency_network.subgraph import (
+    ConnectedSubgraph, BranchAndBoundSelection, selection_weights,
+    peak_index_mask, masks_overlap)
+
+
+def make_peaks(n=14):
+    return [FittedPeak(400 + i * 0.5, 100., 10., i, i, 0.01, 100.) for i in range(n)]
+
+
+def make_fits(seed, n_fits=10, n_peaks=14):
+    rng = random.Random(seed)
+    peaks = make_peaks(n_peaks)
+    fits = []
+    for _ in range(n_fits):
+        start = rng.randrange(0, n_peaks - 2)
+        size = rng.randint(2, 4)
+        experimental = peaks[start:start + size]
+        theoretical = TheoreticalIsotopicPattern(
+            [Peak(p.mz, p.intensity, 1) for p in experimental], experimental[0].mz)
+        fits.append(IsotopicFitRecord(
+            experimental[0], rng.uniform(10, 200), 1, theoretical, experimental))
+    return fits
+
+
+def best_total(nodes, maximize, conflicts):
+    weights = dict(zip(nodes, selection_weights(nodes, maximize)))
+    best = 0
+    for size in range(len(nodes) + 1):
+        for subset in itertools.combinations(nodes, size):
+            if any(conflicts(a, b) for a, b in itertools.combinations(subset, 2)):
+                continue
+            best = max(best, sum(weights[node] for node in subset))
+    return best
+
+
+def span_conflict(a, b):
+    return a.start <= b.end and b.start <= a.end
+
+
+def peak_conflict(a, b):
+    return not a.isdisjoint(b)
+
+
+class TestPeakIndexMask(unittest.TestCase):
+    def test_masks_overlap(self):
+        rng = random.Random(7)
+        for _ in range(200):
+            a = set(rng.sample(range(300), rng.randint(0, 6)))
+            b = set(rng.sample(range(300), rng.randint(0, 6)))
+            self.assertEqual(
+                masks_overlap(*(peak_index_mask(a) + peak_index_mask(b))),
+                not a.isdisjoint(b))
+
+    def check_populate_edges(self, graph_type):
+        for seed in range(5):
+            graph = graph_type(make_fits(seed, n_fits=25, n_peaks=30))
+            for node in graph:
+                self.assertNotIn(node, node.edges)
+                self.assertNotIn(node, node.overlap_edges)
+                for other in graph:
+                    if other is node:
+                        continue
+                    shared = not node.peak_indices.isdisjoint(other.peak_indices)
+                    self.assertEqual(other in node.overlap_edges, shared)
+                    self.assertEqual(other in node.edges, not shared)
+
+    def test_populate_edges(self):
+        self.check_populate_edges(subgraph._ConnectedSubgraph)
+
+    @unittest.skipIf(not subgraph.has_c, "Requires the C extension")
+    def test_populate_edges_c(self):
+        self.check_populate_edges(subgraph.ConnectedSubgraph)
+
+    @unittest.skipIf(not subgraph.has_c, "Requires the C extension")
+    def test_c_selection_matches_python(self):
+        for seed in range(5):
+            fits = make_fits(seed, n_fits=25, n_peaks=30)
+            for method in ("greedy", "interval", "branch_and_bound"):
+                expected = subgraph._ConnectedSubgraph(fits).find_heaviest_path(method)
+                solution = subgraph.ConnectedSubgraph(fits).find_heaviest_path(method)
+                self.assertEqual({id(node.fit) for node in solution}, {id(node.fit) for node in expected})
+
+
+class TestSubgraphSelection(unittest.TestCase):
+    def check_solution(self, graph, method, conflicts):
+        solution = list(graph.find_heaviest_path(method))
+        for a, b in itertools.combinations(solution, 2):
+            self.assertFalse(conflicts(a, b))
+        weights = dict(zip(graph.nodes, selection_weights(graph.nodes, graph.maximize)))
+        self.assertAlmostEqual(sum(weights[node] for node in solution),
+                               best_total(graph.nodes, graph.maximize, conflicts))
+        return solution
+
+    def test_interval_scheduling(self):
+        for seed in range(5):
+            for maximize in (True, False):
+                graph = ConnectedSubgraph(make_fits(seed), maximize=maximize)
+                self.check_solution(graph, "interval", span_conflict)
+
+    def test_branch_and_bound(self):
+        for seed in range(5):
+            for maximize in (True, False):
+                graph = ConnectedSubgraph(make_fits(seed), maximize=maximize)
+                solution = self.check_solution(graph, "branch_and_bound", peak_conflict)
+                greedy = graph.find_heaviest_path("greedy")
+                weights = dict(zip(graph.nodes, selection_weights(graph.nodes, maximize)))
+                self.assertGreaterEqual(
+                    sum(weights[node] for node in solution) + 1e-9,
+                    sum(weights[node] for node in greedy))
+
+    def test_branch_and_bound_budget(self):
+        graph = ConnectedSubgraph(make_fits(3, n_fits=40, n_peaks=30))
+        solver = BranchAndBoundSelection(graph, max_steps=5)
+        solution = solver.select()
+        self.assertFalse(solver.optimal)
+        for a, b in itertools.combinations(solution, 2):
+            self.assertTrue(a.isdisjoint(b))
+        greedy = graph.find_heaviest_path("greedy")
+        self.assertGreaterEqual(sum(n.score for n in solution) + 1e-9, sum(n.score for n in greedy))
+
+    def test_unknown_method(self):
+        graph = ConnectedSubgraph(make_fits(0))
+        with self.assertRaises(NotImplementedError):
+            graph.find_heaviest_path("exhaustive")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -5,7 +5,8 @@ from six import string_types as basestring
 
 import ms_deisotope
 from ms_deisotope.data_source.metadata import activation as activation_module, data_transformation
-from ms_deisotope.output import MzMLSerializer, MGFSerializer
+from ms_deisotope.output import MzMLSerializer, MGFSerializer, ProcessedMzMLDeserializer
+from ms_deisotope.output.columnar import ColumnarSerializer
 from ms_peak_picker.scan_filter import parse as parse_filter
 from pyteomics.xml import unitfloat
 
@@ -100,6 +101,28 @@ def mzml(source, output, ms1_filters=None, msn_filters=None, pick_peaks=False):
     to_mzml(reader, output, pick_peaks=pick_peaks, ms1_filters=ms1_filters, msn_filters=msn_filters)
 
 
+def to_columnar(reader, path, sample_name=None):
+    reader.make_iterator(grouped=False)
+    with ColumnarSerializer(path, sample_name=sample_name, deconvoluted=True) as writer:
+        for scan in reader:
+            writer.save_scan(scan)
+
+
+@ms_conversion.command("columnar", short_help="Convert a processed mzML file to a binary columnar store")
+@click.argument("source", type=click.Path(exists=True, dir_okay=False))
+@click.argument("output", type=click.Path(file_okay=False, writable=True))
+def columnar(source, output):
+    """Convert a processed mzML file, as written by ms-deisotope, into a binary columnar
+    store directory which can be read with :class:`~.ProcessedColumnarDeserializer`.
+    """
+    reader = ProcessedMzMLDeserializer(source)
+    try:
+        sample_name = reader.sample_run.name
+    except (KeyError, IndexError, AttributeError):
+        sample_name = None
+    to_columnar(reader, output, sample_name=sample_name)
+
+
 if __name__ == '__main__':
     import traceback
 
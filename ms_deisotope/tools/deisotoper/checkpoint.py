@@ -0,0 +1,115 @@
+'''Record how far a deisotoping run has gotten, so that an interrupted run can
+be resumed without reprocessing the scans it has already written.
+
+The state is kept in a small JSON file next to the output file, which is
+rewritten after the output file has been flushed, so it never describes scans
+which are not on disk.
+'''
+import os
+import json
+
+try:
+    _replace_file = os.replace
+except AttributeError:
+    # Python 2 only has os.rename, which is still atomic on POSIX systems
+    _replace_file = os.rename
+
+
+class Checkpoint(object):
+    """The state of a deisotoping run that may not have finished.
+
+    Attributes
+    ----------
+    source_file : str
+        The path to the data file being processed
+    output_path : str
+        The path to the output file being written
+    last_scan_id : str
+        The id of the precursor scan of the last scan bunch completely written
+        to the output file, or :const:`None` if none have been written yet
+    spectra_written : int
+        The number of spectra completely written to the output file
+    """
+
+    def __init__(self, source_file, output_path, last_scan_id=None, spectra_written=0):
+        self.source_file = source_file
+        self.output_path = output_path
+        self.last_scan_id = last_scan_id
+        self.spectra_written = spectra_written
+
+    @staticmethod
+    def path_for(output_path):
+        """Get the path of the state file for the output file `output_path`
+
+        Parameters
+        ----------
+        output_path : str
+            The path to the output file
+
+        Returns
+        -------
+        str
+        """
+        return output_path + ".checkpoint.json"
+
+    @property
+    def path(self):
+        return self.path_for(self.output_path)
+
+    def update(self, last_scan_id, spectra_written):
+        self.last_scan_id = last_scan_id
+        self.spectra_written = spectra_written
+
+    def to_dict(self):
+        return {
+            "source_file": self.source_file,
+            "output_path": self.output_path,
+            "last_scan_id": self.last_scan_id,
+            "spectra_written": self.spectra_written,
+        }
+
+    @classmethod
+    def from_dict(cls, state):
+        return cls(
+            state["source_file"], state["output_path"],
+            state.get("last_scan_id"), state.get("spectra_written", 0))
+
+    def save(self):
+        """Write the state file, replacing the previous one atomically so that an
+        interruption never leaves a truncated state file behind.
+        """
+        temp_path = self.path + ".tmp"
+        with open(temp_path, 'wt') as handle:
+            json.dump(self.to_dict(), handle, sort_keys=True, indent=2)
+            handle.flush()
+            os.fsync(handle.fileno())
+        _replace_file(temp_path, self.path)
+
+    @classmethod
+    def load(cls, output_path):
+        """Read the state file for the output file `output_path`, if it exists.
+
+        Parameters
+        ----------
+        output_path : str
+            The path to the output file
+
+        Returns
+        -------
+        :class:`Checkpoint` or :const:`None`
+        """
+        path = cls.path_for(output_path)
+        if not os.path.exists(path):
+            return None
+        with open(path, 'rt') as handle:
+            return cls.from_dict(json.load(handle))
+
+    def remove(self):
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
+
+    def __repr__(self):
+        template = "{self.__class__.__name__}({self.source_file!r}, {self.output_path!r}, {self.last_scan_id!r})"
+        return template.format(self=self)
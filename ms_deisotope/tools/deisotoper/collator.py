@@ -1,3 +1,5 @@
+from collections import defaultdict, deque
+
 try:
     from Queue import Empty as QueueEmpty
 except ImportError:
@@ -5,9 +7,11 @@ except ImportError:
 
 from ms_deisotope.data_source.common import ProcessedScan
 from ms_deisotope.task import TaskBase, CallInterval
+from ms_deisotope.instrumentation import NULL_METRICS
 
 from .process import (
-    SCAN_STATUS_SKIP, DONE)
+    SCAN_STATUS_SKIP, DONE, FILE_START, BUNCH_DONE, METRICS)
+from .transport import SharedMemoryScan
 
 
 class ScanCollator(TaskBase):
@@ -49,15 +53,30 @@ class ScanCollator(TaskBase):
     waiting : dict
         A mapping from scan index to `Scan` object. Used to serve
         scans through the iterator when their index is called for
+    max_waiting : int
+        The largest number of items held in :attr:`waiting` at once
+    progress : multiprocessing.Value
+        A shared copy of :attr:`last_index`, used by the process dealing out
+        scans to keep from getting too far ahead of the collator. May be :const:`None`
+    progress_changed : multiprocessing.Condition
+        Notified whenever :attr:`progress` is updated, so the process dealing out scans
+        can wait for it without polling. May be :const:`None`
+    metrics : :class:`~.PipelineMetrics`
+        Accumulates the metrics sent by the workers
     """
     _log_received_scans = False
 
     def __init__(self, queue, done_event, helper_producers=None, primary_worker=None,
-                 include_fitted=False, input_queue=None):
+                 include_fitted=False, input_queue=None, progress=None, metrics=None,
+                 progress_changed=None):
         if helper_producers is None:
             helper_producers = []
         self.queue = queue
-        self.last_index = None
+        self.progress = progress
+        self.progress_changed = progress_changed
+        self.metrics = metrics if metrics is not None else NULL_METRICS
+        self._last_index = None
+        self.max_waiting = 0
         self.count_jobs_done = 0
         self.count_since_last = 0
         self.waiting = {}
@@ -68,6 +87,22 @@ class ScanCollator(TaskBase):
         self.include_fitted = include_fitted
         self.input_queue = input_queue
 
+    @property
+    def last_index(self):
+        return self._last_index
+
+    @last_index.setter
+    def last_index(self, value):
+        self._last_index = value
+        if self.progress is None or value is None:
+            return
+        if self.progress_changed is None:
+            self.progress.value = value
+        else:
+            with self.progress_changed:
+                self.progress.value = value
+                self.progress_changed.notify_all()
+
     def all_workers_done(self):
         if self.done_event.is_set():
             if self.primary_worker.all_work_done():
@@ -96,8 +131,12 @@ class ScanCollator(TaskBase):
         if self._log_received_scans:
             self.log("-- received %d: %s" % (index, item))
         self.waiting[index] = item
+        if len(self.waiting) > self.max_waiting:
+            self.max_waiting = len(self.waiting)
         if not self.include_fitted and isinstance(item, ProcessedScan):
-            item.peak_set = []
+            item.peak_set = None
+        # Peak lists sent through shared memory are left there until the
+        # scan is produced, see :meth:`produce`
 
     def consume(self, timeout=10):
         """Fetches the next work item from the input
@@ -120,7 +159,9 @@ class ScanCollator(TaskBase):
             item, index, _ = self.queue.get(blocking, timeout)
             self.queue.task_done()
             # DONE message may be sent many times.
-            while item == DONE:
+            while item == DONE or item == METRICS:
+                if item == METRICS:
+                    self.metrics.merge(index)
                 item, index, _ = self.queue.get(blocking, timeout)
                 self.queue.task_done()
             self.store_item(item, index)
@@ -149,9 +190,12 @@ class ScanCollator(TaskBase):
 
         Resets :attr:`count_since_last` to `0`.
 
+        If `scan` is a :class:`~.SharedMemoryScan`, its peak lists are
+        read out of shared memory now.
+
         Parameters
         ----------
-        scan : ProcessedScan
+        scan : ProcessedScan or SharedMemoryScan
             The scan object being finalized for hand-off
             to client code
 
@@ -162,11 +206,54 @@ class ScanCollator(TaskBase):
             parts of the program
         """
         self.count_since_last = 0
+        if isinstance(scan, SharedMemoryScan):
+            scan = scan.unpack(include_fitted=self.include_fitted)
         return scan
 
     def count_pending_items(self):
         return len(self.waiting)
 
+    def release_pending(self):
+        """Discard every item received but not yet produced, freeing the shared
+        memory blocks of any :class:`~.SharedMemoryScan` among them.
+
+        Called when iteration stops, so that blocks are not left behind when
+        the consumer stops early.
+        """
+        for key in list(self.waiting):
+            item = self.waiting.pop(key)
+            if isinstance(item, SharedMemoryScan):
+                item.release()
+
+    def _queue_depth(self, queue):
+        if queue is None:
+            return None
+        try:
+            return queue.qsize()
+        except NotImplementedError:
+            # Some platforms do not support qsize
+            return None
+
+    def stats(self):
+        """Describe how work is flowing through the collator.
+
+        Returns
+        -------
+        dict
+            The number of items waiting in the output queue (``queue_depth``) and the input
+            queue (``input_queue_depth``), which are :const:`None` where the platform cannot
+            tell, the number of out-of-order items held back (``reorder_buffer_size``) and the
+            most held back at once (``max_reorder_buffer_size``), and :attr:`last_index`
+        """
+        return {
+            "queue_depth": self._queue_depth(self.queue),
+            "input_queue_depth": self._queue_depth(self.input_queue),
+            "reorder_buffer_size": len(self.waiting),
+            "max_reorder_buffer_size": self.max_waiting,
+            "last_index": self.last_index,
+            "count_jobs_done": self.count_jobs_done,
+        }
+
     def drain_queue(self):
         i = 0
         while self.count_pending_items() < 500 and self.consume(0):
@@ -187,6 +274,7 @@ class ScanCollator(TaskBase):
                 self.log("The last index handled: %r" % (self.last_index,))
                 self.log("Number of items waiting in the queue: %d" %
                          (self.queue.qsize(),))
+                self.log("Largest number of keys waiting: %d" % (self.max_waiting, ))
         except NotImplementedError:
             # Some platforms do not support qsize
             pass
@@ -201,53 +289,193 @@ class ScanCollator(TaskBase):
         # Log the state of the collator every 3 minutes
         status_monitor = CallInterval(60 * 3, self.print_state)
         status_monitor.start()
-        while has_more:
-            if self.consume(1):
-                self.count_jobs_done += 1
-                try:
-                    if self.queue.qsize() > 500:
-                        self.drain_queue()
-                except NotImplementedError:
-                    # Some platforms do not support qsize
-                    pass
-            if self.last_index is None:
-                keys = sorted(self.waiting)
-                if keys:
-                    i = 0
-                    n = len(keys)
-                    found_content = False
-                    while i < n:
-                        scan = self.waiting.pop(keys[i])
+        try:
+            while has_more:
+                if self.consume(1):
+                    self.count_jobs_done += 1
+                    try:
+                        if self.queue.qsize() > 500:
+                            self.drain_queue()
+                    except NotImplementedError:
+                        # Some platforms do not support qsize
+                        pass
+                if self.last_index is None:
+                    keys = sorted(self.waiting)
+                    if keys:
+                        i = 0
+                        n = len(keys)
+                        found_content = False
+                        while i < n:
+                            scan = self.waiting.pop(keys[i])
+                            if scan == SCAN_STATUS_SKIP:
+                                self.last_index = keys[i]
+                                i += 1
+                                continue
+                            else:
+                                found_content = True
+                                break
+                        if found_content:
+                            self.last_index = scan.index
+                            yield self.produce(scan)
+                        if self.last_index is not None:
+                            self.start_helper_producers()
+                elif self.last_index + 1 in self.waiting:
+                    while self.last_index + 1 in self.waiting:
+                        scan = self.waiting.pop(self.last_index + 1)
                         if scan == SCAN_STATUS_SKIP:
-                            self.last_index = keys[i]
-                            i += 1
+                            self.last_index += 1
                             continue
                         else:
-                            found_content = True
-                            break
-                    if found_content:
-                        self.last_index = scan.index
-                        yield self.produce(scan)
-                    if self.last_index is not None:
-                        self.start_helper_producers()
-            elif self.last_index + 1 in self.waiting:
-                while self.last_index + 1 in self.waiting:
-                    scan = self.waiting.pop(self.last_index + 1)
-                    if scan == SCAN_STATUS_SKIP:
+                            self.last_index = scan.index
+                            yield self.produce(scan)
+                elif len(self.waiting) == 0:
+                    if self.all_workers_done():
+                        self.log("All Workers Claim Done.")
+                        has_something = self.consume()
+                        self.log("Checked Queue For Work: %r" % has_something)
+                        if not has_something and len(self.waiting) == 0 and self.queue.empty():
+                            has_more = False
+                else:
+                    self.count_since_last += 1
+                    if self.count_since_last % 1000 == 0:
+                        self.print_state()
+        finally:
+            status_monitor.stop()
+            self.release_pending()
+
+
+class ScanDemultiplexer(object):
+    """Reads the results of a worker pool shared by several files from a single queue,
+    holding the items for each file until that file's :class:`BatchScanCollator` asks
+    for them.
+
+    Attributes
+    ----------
+    queue : multiprocessing.JoinableQueue
+        The queue that all workers place their results on, tagged with the index of
+        the file they belong to
+    buffers : defaultdict of deque
+        The items received for each file which have not been taken yet
+    """
+
+    def __init__(self, queue):
+        self.queue = queue
+        self.buffers = defaultdict(deque)
+
+    def get(self, file_index, block=True, timeout=None):
+        """Get the next item for the file `file_index`, reading from :attr:`queue`
+        until one arrives.
+
+        Raises
+        ------
+        QueueEmpty:
+            If no item for `file_index` could be found
+        """
+        buffer = self.buffers[file_index]
+        while not buffer:
+            key, item = self.queue.get(block, timeout)
+            self.queue.task_done()
+            self.buffers[key].append(item)
+        return buffer.popleft()
+
+    def qsize(self):
+        return self.queue.qsize()
+
+    def count_buffered_items(self, file_index=None):
+        if file_index is None:
+            return sum(map(len, self.buffers.values()))
+        return len(self.buffers[file_index])
+
+    def discard(self, file_index):
+        """Drop every item buffered for the file `file_index`, freeing the shared
+        memory blocks of any :class:`~.SharedMemoryScan` among them.
+        """
+        for item, _, _ in self.buffers.pop(file_index, ()):
+            if isinstance(item, SharedMemoryScan):
+                item.release()
+
+
+class BatchScanCollator(ScanCollator):
+    """Collates the scans of one file processed by a worker pool shared by several
+    files, passing them along in the correct order.
+
+    Instead of relying on the first worker to run alone, the collator starts from
+    the index announced by the :const:`FILE_START` message, and knows it has received
+    everything once it has seen as many :const:`BUNCH_DONE` messages as the
+    :const:`DONE` message says were dealt.
+
+    Attributes
+    ----------
+    file_index : int
+        The index of the file this collator handles
+    bunches_done : int
+        The number of scan bunches the workers have finished for this file
+    total_bunches : int
+        The number of scan bunches dealt for this file, or :const:`None` if
+        they have not all been dealt yet
+    """
+
+    def __init__(self, demultiplexer, file_index, include_fitted=False, metrics=None):
+        ScanCollator.__init__(self, demultiplexer, None, include_fitted=include_fitted, metrics=metrics)
+        self.file_index = file_index
+        self.bunches_done = 0
+        self.total_bunches = None
+
+    def consume(self, timeout=10):
+        blocking = timeout != 0
+        try:
+            item, index, _ = self.queue.get(self.file_index, blocking, timeout)
+        except QueueEmpty:
+            return False
+        if item == BUNCH_DONE:
+            self.bunches_done += 1
+            if index is not None:
+                self.metrics.merge(index)
+        elif item == FILE_START:
+            self.last_index = index - 1
+        elif item == DONE:
+            self.total_bunches = index
+        else:
+            self.store_item(item, index)
+        return True
+
+    def is_complete(self):
+        return self.total_bunches is not None and self.bunches_done >= self.total_bunches
+
+    def print_state(self):
+        self.log("%d since last work item" % (self.count_since_last,))
+        keys = sorted(self.waiting.keys())
+        if len(keys) > 5:
+            self.log("Waiting Keys: %r..." % (keys[:5],))
+        else:
+            self.log("Waiting Keys: %r" % (keys,))
+        self.log("The last index handled: %r" % (self.last_index,))
+        self.log("%d of %r scan bunches done" % (self.bunches_done, self.total_bunches))
+
+    def __iter__(self):
+        status_monitor = CallInterval(60 * 3, self.print_state)
+        status_monitor.start()
+        try:
+            while True:
+                if self.consume(1):
+                    self.count_jobs_done += 1
+                else:
+                    self.count_since_last += 1
+                if self.last_index is not None:
+                    while self.last_index + 1 in self.waiting:
                         self.last_index += 1
-                        continue
-                    else:
-                        self.last_index = scan.index
-                        yield self.produce(scan)
-            elif len(self.waiting) == 0:
-                if self.all_workers_done():
-                    self.log("All Workers Claim Done.")
-                    has_something = self.consume()
-                    self.log("Checked Queue For Work: %r" % has_something)
-                    if not has_something and len(self.waiting) == 0 and self.queue.empty():
-                        has_more = False
-            else:
-                self.count_since_last += 1
-                if self.count_since_last % 1000 == 0:
-                    self.print_state()
-        status_monitor.stop()
+                        scan = self.waiting.pop(self.last_index)
+                        if scan != SCAN_STATUS_SKIP:
+                            yield self.produce(scan)
+                if self.is_complete():
+                    # Every bunch has been handled, so anything still waiting follows a scan
+                    # that no worker reported on.
+                    for key in sorted(self.waiting):
+                        scan = self.waiting.pop(key)
+                        self.last_index = key
+                        if scan != SCAN_STATUS_SKIP:
+                            yield self.produce(scan)
+                    break
+        finally:
+            status_monitor.stop()
+            self.release_pending()
@@ -9,9 +9,11 @@ from ms_peak_picker.scan_filter import parse as parse_filter
 import ms_deisotope
 from ms_deisotope import MSFileLoader
 from ms_deisotope.data_source import RandomAccessScanSource
+from ms_deisotope.averagine import AveragineTable, AveragineTableCache
 
 from ms_deisotope.tools.utils import processes_option, AveragineParamType
 from ms_deisotope.tools.deisotoper import workflow
+from ms_deisotope.tools.deisotoper.transport import shared_memory_available
 
 
 def check_random_access(loader, start_time, end_time):
@@ -46,6 +48,20 @@ def check_random_access(loader, start_time, end_time):
     return start_scan_id, start_scan_time, end_scan_id, end_scan_time
 
 
+def load_averagine_table(averagine, directory):
+    '''Load the precomputed isotopic pattern table for `averagine` from `directory`,
+    building and saving it there first if it does not exist yet.
+    '''
+    name = '-'.join("%s%0.4f" % kv for kv in sorted(averagine.base_composition.items()))
+    path = os.path.join(directory, "averagine-%s.npy" % name)
+    if not os.path.exists(path + '.json'):
+        click.echo("Precomputing isotopic patterns for %r" % (averagine, ))
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+        AveragineTable.build(averagine).save(path)
+    return AveragineTableCache(AveragineTable.load(path))
+
+
 def check_if_profile(loader):
     first_bunch = next(loader)
     if first_bunch.precursor is not None:
@@ -60,100 +76,90 @@ def check_if_profile(loader):
     return is_profile
 
 
-@click.command("deisotope", short_help=(
-    "Convert raw mass spectra data into deisotoped neutral mass peak lists written to mzML."
-    " Can accept mzML, mzXML, MGF with either profile or centroided scans."),
-    context_settings=dict(help_option_names=['-h', '--help']))
-@click.argument("ms-file", type=click.Path(exists=True))
-@click.argument("outfile-path", type=click.Path(writable=True))
-@click.option("-a", "--averagine", default=["peptide"],
-              type=AveragineParamType(),
-              help='Averagine model to use for MS1 scans. Either a name or formula',
-              multiple=True)
-@click.option("-an", "--msn-averagine", default="peptide",
-              type=AveragineParamType(),
-              help='Averagine model to use for MS^n scans. Either a name or formula')
-@click.option("-s", "--start-time", type=float, default=0.0,
-              help='Scan time to begin processing at in minutes')
-@click.option("-e", "--end-time", type=float, default=float('inf'),
-              help='Scan time to stop processing at in minutes')
-@click.option("-c", "--maximum-charge", type=int, default=8,
-              help=('Highest absolute charge state to consider'))
-@click.option("-n", "--name", default=None,
-              help="Name for the sample run to be stored. Defaults to the base name of the input data file")
-@click.option("-t", "--score-threshold", type=float, default=workflow.SampleConsumer.MS1_SCORE_THRESHOLD,
-              help="Minimum score to accept an isotopic pattern fit in an MS1 scan")
-@click.option("-tn", "--msn-score-threshold", type=float, default=workflow.SampleConsumer.MSN_SCORE_THRESHOLD,
-              help="Minimum score to accept an isotopic pattern fit in an MS^n scan")
-@click.option("-m", "--missed-peaks", type=int, default=3,
-              help="Number of missing peaks to permit before an isotopic fit is discarded")
-@click.option("-mn", "--msn-missed-peaks", type=int, default=1,
-              help="Number of missing peaks to permit before an isotopic fit is discarded in an MSn scan")
-@processes_option
-@click.option("-b", "--background-reduction", type=float, default=0., help=(
-              "Background reduction factor. Larger values more aggresively remove low abundance"
-              " signal in MS1 scans."))
-@click.option("-bn", "--msn-background-reduction", type=float, default=0., help=(
-              "Background reduction factor. Larger values more aggresively remove low abundance"
-              " signal in MS^n scans."))
-@click.option("-r", '--transform', multiple=True, type=parse_filter, help=(
-    "Scan transformations to apply to MS1 scans. May specify more than once."))
-@click.option("-rn", '--msn-transform', multiple=True, type=parse_filter, help=(
-    "Scan transformations to apply to MS^n scans. May specify more than once."))
-@click.option("-v", "--extract-only-tandem-envelopes", is_flag=True, default=False,
-              help='Only work on regions that will be chosen for MS/MS')
-@click.option("-g", "--ms1-averaging", default=0, type=int, help=(
-    "The number of MS1 scans before and after the current MS1 "
-    "scan to average when picking peaks."))
-@click.option("--ignore-msn", is_flag=True, default=False, help="Ignore MS^n scans")
-@click.option("-i", "--isotopic-strictness", default=2.0, type=float)
-@click.option("-in", "--msn-isotopic-strictness", default=0.0, type=float)
-@click.option("-snr", "--signal-to-noise-threshold", default=1.0, type=float, help=(
-    "Signal-to-noise ratio threshold to apply when filtering peaks"))
-@click.option("-mo", "--mass-offset", default=0.0, type=float, help=("Shift peak masses by the given amount"))
-def deisotope(ms_file, outfile_path, averagine=None, start_time=None, end_time=None, maximum_charge=None,
-              name=None, msn_averagine=None, score_threshold=35., msn_score_threshold=10., missed_peaks=1,
-              msn_missed_peaks=1, background_reduction=0., msn_background_reduction=0.,
-              transform=None, msn_transform=None, processes=4, extract_only_tandem_envelopes=False,
-              ignore_msn=False, isotopic_strictness=2.0, ms1_averaging=0,
-              msn_isotopic_strictness=0.0, signal_to_noise_threshold=1.0, mass_offset=0.0, deconvolute=True):
-    '''Convert raw mass spectra data into deisotoped neutral mass peak lists written to mzML.
+def processing_options(f):
+    '''Add the peak picking and deconvolution options shared by :func:`deisotope` and
+    :func:`deisotope_batch` to a command.
+    '''
+    options = [
+        click.option("-a", "--averagine", default=["peptide"],
+                     type=AveragineParamType(),
+                     help='Averagine model to use for MS1 scans. Either a name or formula',
+                     multiple=True),
+        click.option("-an", "--msn-averagine", default="peptide",
+                     type=AveragineParamType(),
+                     help='Averagine model to use for MS^n scans. Either a name or formula'),
+        click.option("-s", "--start-time", type=float, default=0.0,
+                     help='Scan time to begin processing at in minutes'),
+        click.option("-e", "--end-time", type=float, default=float('inf'),
+                     help='Scan time to stop processing at in minutes'),
+        click.option("-c", "--maximum-charge", type=int, default=8,
+                     help=('Highest absolute charge state to consider')),
+        click.option("-t", "--score-threshold", type=float, default=workflow.SampleConsumer.MS1_SCORE_THRESHOLD,
+                     help="Minimum score to accept an isotopic pattern fit in an MS1 scan"),
+        click.option("-tn", "--msn-score-threshold", type=float,
+                     default=workflow.SampleConsumer.MSN_SCORE_THRESHOLD,
+                     help="Minimum score to accept an isotopic pattern fit in an MS^n scan"),
+        click.option("-m", "--missed-peaks", type=int, default=3,
+                     help="Number of missing peaks to permit before an isotopic fit is discarded"),
+        click.option("-mn", "--msn-missed-peaks", type=int, default=1,
+                     help="Number of missing peaks to permit before an isotopic fit is discarded in an MSn scan"),
+        processes_option,
+        click.option("-b", "--background-reduction", type=float, default=0., help=(
+                     "Background reduction factor. Larger values more aggresively remove low abundance"
+                     " signal in MS1 scans.")),
+        click.option("-bn", "--msn-background-reduction", type=float, default=0., help=(
+                     "Background reduction factor. Larger values more aggresively remove low abundance"
+                     " signal in MS^n scans.")),
+        click.option("-r", '--transform', multiple=True, type=parse_filter, help=(
+            "Scan transformations to apply to MS1 scans. May specify more than once.")),
+        click.option("-rn", '--msn-transform', multiple=True, type=parse_filter, help=(
+            "Scan transformations to apply to MS^n scans. May specify more than once.")),
+        click.option("-g", "--ms1-averaging", default=0, type=int, help=(
+            "The number of MS1 scans before and after the current MS1 "
+            "scan to average when picking peaks.")),
+        click.option("--ignore-msn", is_flag=True, default=False, help="Ignore MS^n scans"),
+        click.option("-i", "--isotopic-strictness", default=2.0, type=float),
+        click.option("-in", "--msn-isotopic-strictness", default=0.0, type=float),
+        click.option("-snr", "--signal-to-noise-threshold", default=1.0, type=float, help=(
+            "Signal-to-noise ratio threshold to apply when filtering peaks")),
+        click.option("-mo", "--mass-offset", default=0.0, type=float, help=("Shift peak masses by the given amount")),
+        click.option("--averagine-table-dir", type=click.Path(file_okay=False, writable=True), default=None, help=(
+            "A directory to store precomputed isotopic pattern tables in, which are shared by all worker"
+            " processes")),
+        click.option("--shared-memory-transport", is_flag=True, default=False, help=(
+            "Send processed peak lists from worker processes through shared memory instead of pickling them")),
+        click.option("--batch-size", type=click.IntRange(1), default=1, help=(
+            "The largest number of scan bunches to send to a worker process at once")),
+        click.option("--target-batch-cost", type=float, default=None, help=(
+            "Send a batch of scan bunches to a worker early once the estimated number of peaks"
+            " in it reaches this value, so that dense scans are not held up behind each other."
+            " Only useful with --batch-size greater than 1")),
+    ]
+    for option in reversed(options):
+        f = option(f)
+    return f
+
+
+def build_processing_arguments(is_profile, averagine, msn_averagine, score_threshold=35.,
+                               msn_score_threshold=10., missed_peaks=1, msn_missed_peaks=1,
+                               background_reduction=0., msn_background_reduction=0., transform=None,
+                               msn_transform=None, isotopic_strictness=2.0, msn_isotopic_strictness=0.0,
+                               signal_to_noise_threshold=1.0, mass_offset=0.0, averagine_table_dir=None,
+                               deconvolute=True):
+    '''Translate command line options into the peak picking and deconvolution arguments
+    passed to :class:`~.ScanProcessor`.
+
+    Returns
+    -------
+    tuple of dict
+        The MS1 and MS^n peak picking arguments and the MS1 and MS^n deconvolution arguments,
+        which are :const:`None` when not deconvoluting
     '''
     if transform is None:
         transform = []
     if msn_transform is None:
         msn_transform = []
 
-    if (ignore_msn and extract_only_tandem_envelopes):
-        click.secho(
-            "Cannot use both --ignore-msn and --extract-only-tandem-envelopes",
-            fg='red')
-        raise click.Abort("Cannot use both --ignore-msn and --extract-only-tandem-envelopes")
-
-    cache_handler_type = workflow.ThreadedMzMLScanStorageHandler
-    click.echo("Preprocessing %s" % ms_file)
-    minimum_charge = 1 if maximum_charge > 0 else -1
-    charge_range = (minimum_charge, maximum_charge)
-
-    loader = MSFileLoader(ms_file)
-    (start_scan_id, start_scan_time,
-     end_scan_id, end_scan_time) = check_random_access(loader, start_time, end_time)
-
-    is_profile = check_if_profile(loader)
-
-    if name is None:
-        name = os.path.splitext(os.path.basename(ms_file))[0]
-
-    if os.path.exists(outfile_path) and not os.access(outfile_path, os.W_OK):
-        click.secho("Can't write to output file path", fg='red')
-        raise click.Abort()
-
-    click.secho("Initializing %s" % name, fg='green')
-    click.echo("from %s (%0.2f) to %s (%0.2f)" % (
-        start_scan_id, start_scan_time, end_scan_id, end_scan_time))
-    if deconvolute:
-        click.echo("charge range: %s" % (charge_range,))
-
     if is_profile:
         ms1_peak_picking_args = {
             "transforms": [
@@ -193,6 +199,9 @@ def deisotope(ms_file, outfile_path, averagine=None, start_time=None, end_time=N
             ms_peak_picker.scan_filter.RecalibrateMass(offset=mass_offset))
 
     if deconvolute:
+        if averagine_table_dir is not None:
+            averagine = [load_averagine_table(a, averagine_table_dir) for a in averagine]
+            msn_averagine = load_averagine_table(msn_averagine, averagine_table_dir)
         if len(averagine) == 1:
             averagine = averagine[0]
             ms1_deconvoluter_type = ms_deisotope.deconvolution.AveraginePeakDependenceGraphDeconvoluter
@@ -226,6 +235,98 @@ def deisotope(ms_file, outfile_path, averagine=None, start_time=None, end_time=N
     else:
         ms1_deconvolution_args = None
         msn_deconvolution_args = None
+    return (ms1_peak_picking_args, msn_peak_picking_args,
+            ms1_deconvolution_args, msn_deconvolution_args)
+
+
+def check_shared_memory_transport(shared_memory_transport):
+    if shared_memory_transport and not shared_memory_available():
+        click.secho("Shared memory is not supported on this platform, --shared-memory-transport"
+                    " will be ignored", fg='yellow')
+        return False
+    return shared_memory_transport
+
+
+@click.command("deisotope", short_help=(
+    "Convert raw mass spectra data into deisotoped neutral mass peak lists written to mzML."
+    " Can accept mzML, mzXML, MGF with either profile or centroided scans."),
+    context_settings=dict(help_option_names=['-h', '--help']))
+@click.argument("ms-file", type=click.Path(exists=True))
+@click.argument("outfile-path", type=click.Path(writable=True))
+@click.option("-n", "--name", default=None,
+              help="Name for the sample run to be stored. Defaults to the base name of the input data file")
+@processing_options
+@click.option("-v", "--extract-only-tandem-envelopes", is_flag=True, default=False,
+              help='Only work on regions that will be chosen for MS/MS')
+@click.option("--checkpoint-interval", type=int, default=0, help=(
+    "Flush the output file and record progress in a checkpoint file after this many scan bunches."
+    " Disabled when 0"))
+@click.option("--resume", is_flag=True, default=False, help=(
+    "Resume an interrupted run from its checkpoint file, keeping the scans already written"
+    " to the output file"))
+@click.option("--metrics-report", type=click.Path(dir_okay=False, writable=True), default=None, help=(
+    "Time each stage of processing and write a JSON report to this path, updated periodically"
+    " while the run is in progress"))
+@click.option("--metrics-interval", type=float, default=60.0, help=(
+    "The number of seconds between updates of the --metrics-report file"))
+@click.option("--reorder-window", type=click.IntRange(1), default=None, help=(
+    "Do not let the workers get more than this many scans ahead of the oldest scan waiting"
+    " to be written, bounding the number of processed scans held in memory. Unlimited by default"))
+def deisotope(ms_file, outfile_path, averagine=None, start_time=None, end_time=None, maximum_charge=None,
+              name=None, msn_averagine=None, score_threshold=35., msn_score_threshold=10., missed_peaks=1,
+              msn_missed_peaks=1, background_reduction=0., msn_background_reduction=0.,
+              transform=None, msn_transform=None, processes=4, extract_only_tandem_envelopes=False,
+              ignore_msn=False, isotopic_strictness=2.0, ms1_averaging=0,
+              msn_isotopic_strictness=0.0, signal_to_noise_threshold=1.0, mass_offset=0.0, averagine_table_dir=None,
+              shared_memory_transport=False, checkpoint_interval=0, resume=False, metrics_report=None,
+              metrics_interval=60.0, batch_size=1, target_batch_cost=None, reorder_window=None,
+              deconvolute=True):
+    '''Convert raw mass spectra data into deisotoped neutral mass peak lists written to mzML.
+    '''
+    if (ignore_msn and extract_only_tandem_envelopes):
+        click.secho(
+            "Cannot use both --ignore-msn and --extract-only-tandem-envelopes",
+            fg='red')
+        raise click.Abort("Cannot use both --ignore-msn and --extract-only-tandem-envelopes")
+
+    shared_memory_transport = check_shared_memory_transport(shared_memory_transport)
+
+    cache_handler_type = workflow.ThreadedMzMLScanStorageHandler
+    click.echo("Preprocessing %s" % ms_file)
+    minimum_charge = 1 if maximum_charge > 0 else -1
+    charge_range = (minimum_charge, maximum_charge)
+
+    loader = MSFileLoader(ms_file)
+    # Only the start and end scans are looked up, which is not worth indexing the whole file
+    loader.build_scan_time_index_on_demand = False
+    (start_scan_id, start_scan_time,
+     end_scan_id, end_scan_time) = check_random_access(loader, start_time, end_time)
+
+    is_profile = check_if_profile(loader)
+
+    if name is None:
+        name = os.path.splitext(os.path.basename(ms_file))[0]
+
+    if os.path.exists(outfile_path) and not os.access(outfile_path, os.W_OK):
+        click.secho("Can't write to output file path", fg='red')
+        raise click.Abort()
+
+    click.secho("Initializing %s" % name, fg='green')
+    click.echo("from %s (%0.2f) to %s (%0.2f)" % (
+        start_scan_id, start_scan_time, end_scan_id, end_scan_time))
+    if deconvolute:
+        click.echo("charge range: %s" % (charge_range,))
+
+    (ms1_peak_picking_args, msn_peak_picking_args,
+     ms1_deconvolution_args, msn_deconvolution_args) = build_processing_arguments(
+        is_profile, averagine, msn_averagine, score_threshold=score_threshold,
+        msn_score_threshold=msn_score_threshold, missed_peaks=missed_peaks,
+        msn_missed_peaks=msn_missed_peaks, background_reduction=background_reduction,
+        msn_background_reduction=msn_background_reduction, transform=transform,
+        msn_transform=msn_transform, isotopic_strictness=isotopic_strictness,
+        msn_isotopic_strictness=msn_isotopic_strictness,
+        signal_to_noise_threshold=signal_to_noise_threshold, mass_offset=mass_offset,
+        averagine_table_dir=averagine_table_dir, deconvolute=deconvolute)
 
     consumer = workflow.SampleConsumer(
         ms_file,
@@ -239,7 +340,108 @@ def deisotope(ms_file, outfile_path, averagine=None, start_time=None, end_time=N
         extract_only_tandem_envelopes=extract_only_tandem_envelopes,
         ignore_tandem_scans=ignore_msn,
         ms1_averaging=ms1_averaging,
-        deconvolute=deconvolute)
+        deconvolute=deconvolute,
+        shared_memory_transport=shared_memory_transport,
+        checkpoint_interval=checkpoint_interval,
+        resume=resume,
+        metrics_path=metrics_report,
+        metrics_interval=metrics_interval,
+        batch_size=batch_size,
+        target_batch_cost=target_batch_cost,
+        reorder_window=reorder_window)
+    consumer.start()
+
+
+@click.command("deisotope-batch", short_help=(
+    "Deisotope many mass spectra data files with a single pool of worker processes,"
+    " writing one mzML file for each."),
+    context_settings=dict(help_option_names=['-h', '--help']))
+@click.argument("ms-files", type=click.Path(exists=True), nargs=-1, required=True)
+@click.option("-o", "--output-directory", type=click.Path(file_okay=False, writable=True), required=True,
+              help="The directory to write the processed mzML files to")
+@processing_options
+@click.option("--max-files-in-flight", type=click.IntRange(1), default=2, help=(
+    "The number of files the workers may be processing at once. Larger values keep workers busy"
+    " when files have slow tails, at the cost of holding more processed scans in memory"))
+@click.option("--metrics-report", type=click.Path(dir_okay=False, writable=True), default=None, help=(
+    "Time each stage of processing and write a JSON report to this path, updated as each"
+    " file is completed"))
+def deisotope_batch(ms_files, output_directory, averagine=None, start_time=None, end_time=None,
+                    maximum_charge=None, msn_averagine=None, score_threshold=35., msn_score_threshold=10.,
+                    missed_peaks=1, msn_missed_peaks=1, background_reduction=0., msn_background_reduction=0.,
+                    transform=None, msn_transform=None, processes=4, ignore_msn=False,
+                    isotopic_strictness=2.0, ms1_averaging=0, msn_isotopic_strictness=0.0,
+                    signal_to_noise_threshold=1.0, mass_offset=0.0, averagine_table_dir=None,
+                    shared_memory_transport=False, max_files_in_flight=2, metrics_report=None,
+                    batch_size=1, target_batch_cost=None, deconvolute=True):
+    '''Deisotope many mass spectra data files with a single pool of worker processes,
+    writing each one to OUTPUT_DIRECTORY as mzML.
+
+    All of the files must be either profile or centroided, as they are processed
+    with the same parameters.
+    '''
+    shared_memory_transport = check_shared_memory_transport(shared_memory_transport)
+    if deconvolute:
+        minimum_charge = 1 if maximum_charge > 0 else -1
+        click.echo("charge range: %s" % ((minimum_charge, maximum_charge),))
+
+    if not os.path.exists(output_directory):
+        os.makedirs(output_directory)
+
+    sample_names = []
+    storage_paths = []
+    start_scan_ids = []
+    end_scan_ids = []
+    profile_states = set()
+    for ms_file in ms_files:
+        click.echo("Preprocessing %s" % ms_file)
+        loader = MSFileLoader(ms_file)
+        loader.build_scan_time_index_on_demand = False
+        (start_scan_id, _start_scan_time,
+         end_scan_id, _end_scan_time) = check_random_access(loader, start_time, end_time)
+        profile_states.add(check_if_profile(loader))
+        loader.close()
+        name = os.path.splitext(os.path.basename(ms_file))[0]
+        storage_path = os.path.join(output_directory, name + ".mzML")
+        if storage_path in storage_paths:
+            click.secho("More than one input file would be written to %s" % (storage_path, ), fg='red')
+            raise click.Abort()
+        sample_names.append(name)
+        storage_paths.append(storage_path)
+        start_scan_ids.append(start_scan_id)
+        end_scan_ids.append(end_scan_id)
+
+    if len(profile_states) > 1:
+        click.secho("Cannot process a mixture of profile and centroided files in one batch", fg='red')
+        raise click.Abort()
+    is_profile = profile_states.pop()
+
+    (ms1_peak_picking_args, msn_peak_picking_args,
+     ms1_deconvolution_args, msn_deconvolution_args) = build_processing_arguments(
+        is_profile, averagine, msn_averagine, score_threshold=score_threshold,
+        msn_score_threshold=msn_score_threshold, missed_peaks=missed_peaks,
+        msn_missed_peaks=msn_missed_peaks, background_reduction=background_reduction,
+        msn_background_reduction=msn_background_reduction, transform=transform,
+        msn_transform=msn_transform, isotopic_strictness=isotopic_strictness,
+        msn_isotopic_strictness=msn_isotopic_strictness,
+        signal_to_noise_threshold=signal_to_noise_threshold, mass_offset=mass_offset,
+        averagine_table_dir=averagine_table_dir, deconvolute=deconvolute)
+
+    consumer = workflow.BatchSampleConsumer(
+        ms_files, storage_paths, sample_names,
+        ms1_peak_picking_args=ms1_peak_picking_args,
+        ms1_deconvolution_args=ms1_deconvolution_args,
+        msn_peak_picking_args=msn_peak_picking_args,
+        msn_deconvolution_args=msn_deconvolution_args,
+        start_scan_ids=start_scan_ids, end_scan_ids=end_scan_ids,
+        storage_type=workflow.ThreadedMzMLScanStorageHandler,
+        n_processes=processes, ignore_tandem_scans=ignore_msn,
+        ms1_averaging=ms1_averaging, deconvolute=deconvolute,
+        shared_memory_transport=shared_memory_transport,
+        max_files_in_flight=max_files_in_flight,
+        metrics_path=metrics_report,
+        batch_size=batch_size,
+        target_batch_cost=target_batch_cost)
     consumer.start()
 
 
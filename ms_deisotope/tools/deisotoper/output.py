@@ -1,4 +1,5 @@
 import os
+import mmap
 import threading
 
 import logging
@@ -8,24 +9,81 @@ try:
 except ImportError:
     from queue import Queue, Empty as QueueEmptyException
 
-from ms_deisotope.data_source import MSFileLoader, ScanBunch
+from ms_deisotope.data_source import MSFileLoader, ScanBunch, ChargeNotProvided
 from ms_deisotope.data_source.metadata.file_information import (
     SourceFile as MetadataSourceFile, FileInformation)
 
-from ms_deisotope.output.mzml import MzMLScanSerializer
+from ms_deisotope.output.mzml import MzMLScanSerializer, ProcessedMzMLDeserializer
 from ms_deisotope.output.mgf import MGFSerializer
 
 from ms_deisotope.task import TaskBase
+from ms_deisotope.instrumentation import NULL_METRICS
 
 DONE = b'---NO-MORE---'
 
 logger = logging.getLogger("ms_deisotope.deisotoper.output")
 
 
+def _restore_precursor_mz(scan):
+    """Make a scan read back from a processed mzML file write out the same precursor
+    m/z again.
+
+    :class:`~.ProcessedMzMLDeserializer` defaults every precursor it reads, and for a
+    precursor with an unknown charge state, :attr:`~.PrecursorInformation.extracted_mz`,
+    which the writer uses for a defaulted precursor, is one proton above the
+    :attr:`~.PrecursorInformation.mz` it was computed from. Setting :attr:`mz` to the
+    defaulted neutral mass makes :attr:`extracted_mz` the m/z which was read.
+    """
+    precursor_information = scan.precursor_information
+    if precursor_information is None or precursor_information.extracted_neutral_mass == 0:
+        return scan
+    if precursor_information.extracted_charge == ChargeNotProvided:
+        precursor_information.mz = precursor_information.extracted_neutral_mass
+    return scan
+
+
+def _terminate_partial_mzml(path):
+    """Make a partially written mzML file well-formed in place, discarding anything
+    after the last complete spectrum and closing the open enclosing tags.
+
+    Returns
+    -------
+    bool:
+        Whether the file contained any complete spectra
+    """
+    closing_tag = b"</spectrum>"
+    with open(path, 'r+b') as handle:
+        try:
+            view = mmap.mmap(handle.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            # The file is empty
+            return False
+        try:
+            end = view.rfind(closing_tag)
+            is_indexed = view.find(b"<indexedmzML", 0, 4096) != -1
+        finally:
+            view.close()
+        if end == -1:
+            return False
+        handle.truncate(end + len(closing_tag))
+        handle.seek(0, os.SEEK_END)
+        handle.write(b"\n</spectrumList>\n</run>\n</mzML>\n")
+        if is_indexed:
+            handle.write(b"</indexedmzML>\n")
+    return True
+
+
 class ScanStorageHandlerBase(TaskBase):
+    #: Whether :meth:`read_partial_output` can read back this type's output files
+    supports_resume = False
+    #: Records the time spent writing scan bunches as the "serialization" stage
+    metrics = NULL_METRICS
+
     def __init__(self, *args, **kwargs):
         self.current_precursor = None
         self.current_products = []
+        self.last_saved_scan_id = None
+        self.spectra_saved = 0
 
     def reset(self):
         self.current_precursor = None
@@ -36,10 +94,34 @@ class ScanStorageHandlerBase(TaskBase):
 
     def save(self):
         if self.current_precursor is not None:
+            self.last_saved_scan_id = self.current_precursor.id
+            self.spectra_saved += 1 + len(self.current_products)
             self.save_bunch(
                 self.current_precursor, self.current_products)
             self.reset()
 
+    def flush(self):
+        """Make sure every scan bunch saved so far has been written through to the
+        output file, so it survives if the process is killed.
+        """
+        pass
+
+    @classmethod
+    def read_partial_output(cls, path):
+        """Read back the scans from an output file which was never completed, in the
+        order they were written.
+
+        Parameters
+        ----------
+        path : str
+            The path to the partially written output file. It may be modified.
+
+        Yields
+        ------
+        :class:`~.ProcessedScan`
+        """
+        raise NotImplementedError()
+
     def register_parameter(self, name, value):
         pass
 
@@ -87,7 +169,8 @@ class ThreadedScanStorageHandlerMixin(object):
         super(ThreadedScanStorageHandlerMixin, self).__init__(*args, **kwargs)
 
     def _save_bunch(self, precursor, products):
-        self.serializer.save(ScanBunch(precursor, products))
+        with self.metrics.time("serialization"):
+            self.serializer.save(ScanBunch(precursor, products))
         try:
             precursor.clear()
             for product in products:
@@ -140,6 +223,10 @@ class ThreadedScanStorageHandlerMixin(object):
         self.worker_thread = threading.Thread(target=self._worker_loop)
         self.worker_thread.start()
 
+    def flush(self):
+        self.sync()
+        super(ThreadedScanStorageHandlerMixin, self).flush()
+
     def _end_thread(self):
         self.queue.put(DONE)
         if self.worker_thread is not None:
@@ -156,6 +243,8 @@ class ThreadedScanStorageHandlerMixin(object):
 
 
 class MzMLScanStorageHandler(ScanStorageHandlerBase):
+    supports_resume = True
+
     def __init__(self, path, sample_name, n_spectra=None, deconvoluted=True):
         if n_spectra is None:
             n_spectra = 2e5
@@ -242,7 +331,23 @@ class MzMLScanStorageHandler(ScanStorageHandlerBase):
         return inst
 
     def save_bunch(self, precursor, products):
-        self.serializer.save_scan_bunch(ScanBunch(precursor, products))
+        with self.metrics.time("serialization"):
+            self.serializer.save_scan_bunch(ScanBunch(precursor, products))
+
+    def flush(self):
+        self.serializer.flush()
+
+    @classmethod
+    def read_partial_output(cls, path):
+        if not _terminate_partial_mzml(path):
+            return
+        reader = ProcessedMzMLDeserializer(path, use_index=False)
+        reader.make_iterator(grouped=False)
+        try:
+            for scan in reader:
+                yield _restore_precursor_mz(scan)
+        finally:
+            reader.close()
 
     def complete(self):
         self.save()
@@ -287,7 +392,11 @@ class MGFScanStorageHandler(ScanStorageHandlerBase):
         return inst
 
     def save_bunch(self, precursor, products):
-        self.serializer.save_scan_bunch(ScanBunch(precursor, products))
+        with self.metrics.time("serialization"):
+            self.serializer.save_scan_bunch(ScanBunch(precursor, products))
+
+    def flush(self):
+        self.handle.flush()
 
     def complete(self):
         self.save()
@@ -3,6 +3,8 @@ import logging
 import multiprocessing
 import traceback
 
+import numpy as np
+
 from collections import deque
 from multiprocessing import Process
 try:
@@ -16,18 +18,102 @@ from ms_deisotope.processor import (
     ScanProcessor, MSFileLoader,
     NoIsotopicClustersError, EmptyScanError)
 
+from ms_deisotope.data_source.scan import RandomAccessScanSource
 from ms_deisotope.task import show_message
+from ms_deisotope.instrumentation import PipelineMetrics, NULL_METRICS, default_timer
+
+from .transport import SharedMemoryScan
 
 
 DONE = b"--NO-MORE--"
 SCAN_STATUS_GOOD = b"good"
 SCAN_STATUS_SKIP = b"skip"
 
+# Control messages used when scans from several files share one worker pool
+FILE_START = b"--FILE-START--"
+BUNCH_DONE = b"--BUNCH-DONE--"
+# Carries the metrics a worker has recorded since it last sent them
+METRICS = b"--METRICS--"
+
+
+def preindex_file(ms_file, error_handler=None, scan_time_index=False):
+    """Write the byte offset index of `ms_file` to disk, if its format supports
+    one, so that each process which opens the file does not have to rebuild it.
+
+    Parameters
+    ----------
+    ms_file : str
+        The path to the data file
+    error_handler : callable, optional
+        Called with a message and the exception if something unexpected goes wrong
+    scan_time_index : bool, optional
+        Whether to also write the :class:`~.ScanTimeIndex` of `ms_file` next to the
+        byte offset index, if it is missing or out of date, for the workers averaging
+        MS1 scans to read
+    """
+    reader = MSFileLoader(ms_file, use_index=False)
+    try:
+        reader.prebuild_byte_offset_file(ms_file)
+    except AttributeError:
+        # the type does not support this type of indexing
+        pass
+    except IOError:
+        # the file could not be written
+        pass
+    except Exception as e:
+        # something else went wrong
+        if error_handler is not None:
+            error_handler("An error occurred while pre-indexing.", e)
+    if not scan_time_index:
+        return
+    reader = MSFileLoader(ms_file)
+    try:
+        if isinstance(reader, RandomAccessScanSource) and reader.scan_time_index is None:
+            reader.build_scan_time_index(persist=True)
+    except IOError:
+        # the file could not be written, so each worker will build its own
+        pass
+    except Exception as e:
+        if error_handler is not None:
+            error_handler("An error occurred while building the scan time index.", e)
+    finally:
+        reader.close()
+
 
 class ScanIDYieldingProcess(Process):
+    """ScanIDYieldingProcess reads through a data file in scan bunches and deals batches
+    of their scan ids to the input queue of the :class:`ScanTransformingProcess` workers.
+
+    When :attr:`target_batch_cost` is set, batches are sized by the estimated cost of the
+    bunches they contain, instead of always holding :attr:`batch_size` bunches: cheap
+    bunches are grouped together to save on inter-process communication, while an
+    expensive bunch is sent on its own, so it does not hold up the bunches behind it.
+
+    When :attr:`reorder_window` is set, the process does not deal bunches which start
+    more than :attr:`reorder_window` scans after the last scan the :class:`~.ScanCollator`
+    has handed off, bounding the number of out-of-order scans the collator has to hold.
+    This requires both :attr:`collator_progress` and :attr:`collator_progress_changed`.
+
+    Attributes
+    ----------
+    batch_size : int
+        The largest number of scan bunches to put in one batch
+    target_batch_cost : float
+        The estimated cost at which a batch is sent without filling it up to
+        :attr:`batch_size`, in the units of :meth:`estimate_bunch_cost`. If
+        :const:`None`, batches are always filled
+    collator_progress : multiprocessing.Value
+        The index of the last scan handed off by the :class:`~.ScanCollator`
+    collator_progress_changed : multiprocessing.Condition
+        Notified by the :class:`~.ScanCollator` whenever it updates :attr:`collator_progress`
+    reorder_window : int
+        The number of scans the process may deal ahead of :attr:`collator_progress`
+    """
 
     def __init__(self, ms_file_path, queue, start_scan=None, max_scans=None, end_scan=None,
-                 no_more_event=None, ignore_tandem_scans=False, batch_size=1, log_handler=None):
+                 no_more_event=None, ignore_tandem_scans=False, batch_size=1, log_handler=None,
+                 target_batch_cost=None, collator_progress=None, reorder_window=None,
+                 collator_progress_changed=None):
         if log_handler is None:
             log_handler = show_message
         Process.__init__(self)
@@ -41,14 +127,74 @@ class ScanIDYieldingProcess(Process):
         self.end_scan = end_scan
         self.ignore_tandem_scans = ignore_tandem_scans
         self.batch_size = batch_size
+        self.target_batch_cost = target_batch_cost
+
+        self.collator_progress = collator_progress
+        self.collator_progress_changed = collator_progress_changed
+        self.reorder_window = reorder_window
+        self._first_dealt_index = None
+        self._batch_start_index = None
 
         self.log_handler = log_handler
 
         self.no_more_event = no_more_event
 
+    def estimate_peak_count(self, scan):
+        """Estimate the number of peaks which will be picked from `scan`.
+
+        A centroided scan already holds one data point per peak, while a profile
+        scan spends many data points on each peak, so it is counted by its local
+        maxima instead.
+
+        Parameters
+        ----------
+        scan : :class:`~.Scan`
+            The scan to estimate the size of
+
+        Returns
+        -------
+        int
+        """
+        intensity = scan.arrays.intensity
+        if not scan.is_profile or len(intensity) < 3:
+            return len(intensity)
+        inner = intensity[1:-1]
+        return int(np.count_nonzero((inner > intensity[:-2]) & (inner >= intensity[2:])))
+
+    def estimate_bunch_cost(self, scan, products):
+        """Estimate the relative cost of processing a scan bunch by the number of
+        peaks in its scans, which deconvolution scales with.
+
+        Parameters
+        ----------
+        scan : :class:`~.Scan`
+            The precursor scan, or :const:`None`
+        products : list of :class:`~.Scan`
+            The product scans
+
+        Returns
+        -------
+        int
+
+        See Also
+        --------
+        :meth:`estimate_peak_count`
+        """
+        cost = 0
+        for member in [scan] + list(products):
+            if member is None:
+                continue
+            try:
+                cost += max(self.estimate_peak_count(member), 1)
+            except Exception:
+                cost += 1
+        return cost
+
     def _make_scan_batch(self):
         batch = []
         scan_ids = []
+        cost = 0
+        self._batch_start_index = None
         for _ in range(self.batch_size):
             try:
                 bunch = next(self.loader)
@@ -63,30 +209,57 @@ class ScanIDYieldingProcess(Process):
             except Exception as e:
                 self.log_handler("An error occurred in _make_scan_batch", e)
                 break
+            if self._batch_start_index is None:
+                self._batch_start_index = scan.index if scan is not None else products[0].index
             if not self.ignore_tandem_scans:
                 batch.append((scan_id, product_scan_ids, True))
             else:
                 batch.append((scan_id, product_scan_ids, False))
             scan_ids.append(scan_id)
+            if self.target_batch_cost is not None:
+                cost += self.estimate_bunch_cost(scan, products)
+                if cost >= self.target_batch_cost:
+                    break
         return batch, scan_ids
 
-    def run(self):
-        self.loader = MSFileLoader(self.ms_file_path)
-
-        if self.start_scan is not None:
+    def _wait_for_reorder_window(self):
+        """Block until the batch just made starts within :attr:`reorder_window` scans of
+        the last scan the collator handed off.
+        """
+        index = self._batch_start_index
+        if index is None:
+            return
+        if self._first_dealt_index is None:
+            self._first_dealt_index = index
+        if self.collator_progress is None or self.collator_progress_changed is None or \
+                self.reorder_window is None:
+            return
+        # Until the collator hands off its first scan, measure from where dealing started
+        with self.collator_progress_changed:
+            while index - max(self.collator_progress.value, self._first_dealt_index - 1) > self.reorder_window:
+                self.collator_progress_changed.wait()
+
+    def _open_loader(self, ms_file_path, start_scan=None):
+        loader = MSFileLoader(ms_file_path)
+
+        if start_scan is not None:
             try:
-                self.loader.start_from_scan(
-                    self.start_scan, require_ms1=self.loader.has_ms1_scans(), grouped=True)
+                loader.start_from_scan(
+                    start_scan, require_ms1=loader.has_ms1_scans(), grouped=True)
             except IndexError as e:
                 self.log_handler("An error occurred while locating start scan", e)
-                self.loader.reset()
-                self.loader.make_iterator(grouped=True)
-            except AttributeError:
+                loader.reset()
+                loader.make_iterator(grouped=True)
+            except AttributeError as e:
                 self.log_handler("The reader does not support random access, start time will be ignored", e)
-                self.loader.reset()
-                self.loader.make_iterator(grouped=True)
+                loader.reset()
+                loader.make_iterator(grouped=True)
         else:
-            self.loader.make_iterator(grouped=True)
+            loader.make_iterator(grouped=True)
+        return loader
+
+    def run(self):
+        self.loader = self._open_loader(self.ms_file_path, self.start_scan)
 
         count = 0
         last = 0
@@ -100,6 +273,7 @@ class ScanIDYieldingProcess(Process):
             try:
                 batch, ids = self._make_scan_batch()
                 if len(batch) > 0:
+                    self._wait_for_reorder_window()
                     self.queue.put(batch)
                 count += len(ids)
                 if (count - last) > 1000:
@@ -121,7 +295,148 @@ class ScanIDYieldingProcess(Process):
             self.queue.put(DONE)
 
 
+class _TaggedQueue(object):
+    """Wraps a queue shared by the workers processing several files, tagging
+    each item put on it with the index of the file it belongs to.
+    """
+
+    def __init__(self, queue, file_index):
+        self.queue = queue
+        self.file_index = file_index
+
+    def put(self, item, *args, **kwargs):
+        self.queue.put((self.file_index, item), *args, **kwargs)
+
+    def join(self):
+        self.queue.join()
+
+
+class BatchScanIDYieldingProcess(ScanIDYieldingProcess):
+    """Deals the scan bunches of several files, one file after another, onto a
+    single input queue shared by a pool of :class:`BatchScanTransformingProcess`.
+
+    Each work item is tagged with the index of its file in :attr:`ms_file_paths`.
+    For each file, a :const:`FILE_START` message carrying the index of the first
+    scan dealt and a :const:`DONE` message carrying the number of bunches dealt
+    are sent to the shared output queue, so the collator for that file knows where
+    it starts and when it has received everything.
+
+    Attributes
+    ----------
+    ms_file_paths : list of str
+        The paths to the data files to deal scans from, in order
+    output_queue : multiprocessing.JoinableQueue
+        The queue the workers send their results to
+    start_scans : list
+        The scan id to start from in each file, or :const:`None` to start from the beginning
+    end_scans : list
+        The scan id to stop at in each file, or :const:`None` to read to the end
+    file_slots : multiprocessing.Semaphore
+        Acquired before dealing each file, and released by the consumer when it has finished
+        collating a file, limiting how far ahead of the consumer the workers can get
+    build_scan_time_index : bool
+        Whether to write the scan time index of each file before dealing it, so the
+        workers averaging MS1 scans read it instead of each building their own
+    """
+
+    def __init__(self, ms_file_paths, queue, output_queue, start_scans=None, end_scans=None,
+                 no_more_event=None, ignore_tandem_scans=False, batch_size=1, file_slots=None,
+                 log_handler=None, target_batch_cost=None, build_scan_time_index=False):
+        ScanIDYieldingProcess.__init__(
+            self, None, queue, no_more_event=no_more_event, ignore_tandem_scans=ignore_tandem_scans,
+            batch_size=batch_size, log_handler=log_handler, target_batch_cost=target_batch_cost)
+        self.ms_file_paths = list(ms_file_paths)
+        self.build_scan_time_index = build_scan_time_index
+        self.output_queue = output_queue
+        if start_scans is None:
+            start_scans = [None] * len(self.ms_file_paths)
+        if end_scans is None:
+            end_scans = [None] * len(self.ms_file_paths)
+        self.start_scans = start_scans
+        self.end_scans = end_scans
+        self.file_slots = file_slots
+
+    def _deal_file(self, file_index):
+        self.ms_file_path = self.ms_file_paths[file_index]
+        self.loader = None
+        end_scan = self.end_scans[file_index]
+        count = 0
+        last = 0
+        n_bunches = 0
+        # The collator for this file waits for the DONE message, so it must be sent
+        # even if the file cannot be opened or read.
+        try:
+            preindex_file(self.ms_file_path, self.log_handler, self.build_scan_time_index)
+            self.loader = self._open_loader(self.ms_file_path, self.start_scans[file_index])
+            while True:
+                batch, ids = self._make_scan_batch()
+                if len(batch) > 0:
+                    if n_bunches == 0:
+                        self.output_queue.put(
+                            (file_index, (FILE_START, self._batch_start_index, None)))
+                    self.queue.put([(file_index, ) + work for work in batch])
+                    n_bunches += len(batch)
+                count += len(ids)
+                if (count - last) > 1000:
+                    last = count
+                    self.queue.join()
+                if (end_scan in ids and end_scan is not None) or len(ids) == 0:
+                    break
+        except Exception as e:
+            self.log_handler("An error occurred while fetching scans from %s" % (self.ms_file_path, ), e)
+        finally:
+            if self.loader is not None:
+                self.loader.close()
+        self.output_queue.put((file_index, (DONE, n_bunches, None)))
+        self.log_handler("All Scan IDs from %s have been dealt. %d scan bunches." % (
+            self.ms_file_path, n_bunches))
+
+    def run(self):
+        for file_index in range(len(self.ms_file_paths)):
+            if self.file_slots is not None:
+                self.file_slots.acquire()
+            self._deal_file(file_index)
+        if self.no_more_event is not None:
+            self.no_more_event.set()
+
+
 class ScanTransformMixin(object):
+    shared_memory_transport = False
+    metrics = NULL_METRICS
+    metrics_interval = 60.0
+    _last_metrics_sent = 0
+
+    def _init_metrics(self, collect_metrics=False, metrics_interval=60.0):
+        self.metrics = PipelineMetrics() if collect_metrics else NULL_METRICS
+        self.metrics_interval = metrics_interval
+        self._last_metrics_sent = default_timer()
+
+    def take_metrics(self):
+        """Get the metrics recorded since the last call, in their :meth:`~.PipelineMetrics.to_dict`
+        form, and start recording afresh.
+
+        Returns
+        -------
+        dict or :const:`None`
+            :const:`None` if nothing has been recorded
+        """
+        if not self.metrics:
+            return None
+        state = self.metrics.to_dict()
+        self.metrics.reset()
+        self._last_metrics_sent = default_timer()
+        return state
+
+    def send_metrics(self, force=False):
+        """Send the metrics recorded so far to the collator, if :attr:`metrics_interval`
+        seconds have passed since they were last sent or `force` is :const:`True`.
+        """
+        if not force and default_timer() - self._last_metrics_sent < self.metrics_interval:
+            return
+        state = self.take_metrics()
+        if state is not None:
+            self.output_queue.put((METRICS, state, None))
+
     def log_error(self, error, scan_id, scan, product_scan_ids):
         tb = traceback.format_exc()
         self.log_handler(
@@ -137,6 +452,7 @@ class ScanTransformMixin(object):
             return self._batch_store.popleft()
         else:
             batch = self.input_queue.get(block, timeout)
+            self.input_queue.task_done()
             self._batch_store.extend(batch)
             result = self._batch_store.popleft()
             return result
@@ -159,7 +475,10 @@ class ScanTransformMixin(object):
         # into the message sent back to the main process which in
         # turn can form a reference cycle and eat a lot of memory
         scan.product_scans = []
-        self.output_queue.put((scan, scan.index, scan.ms_level))
+        if self.shared_memory_transport:
+            self.output_queue.put((SharedMemoryScan.pack(scan), scan.index, scan.ms_level))
+        else:
+            self.output_queue.put((scan, scan.index, scan.ms_level))
 
     def all_work_done(self):
         return self._work_complete.is_set()
@@ -219,6 +538,9 @@ class ScanTransformingProcess(Process, ScanTransformMixin):
     output_queue : multiprocessing.JoinableQueue
         A shared output queue which this object will put
         :class:`ms_deisotope.data_source.common.ProcessedScan` bunches onto.
+    shared_memory_transport : bool
+        Whether to send the peak lists of processed scans through shared memory
+        as :class:`~.SharedMemoryScan` instead of pickling them through :attr:`output_queue`
     """
 
     def __init__(self, ms_file_path, input_queue, output_queue,
@@ -226,7 +548,8 @@ class ScanTransformingProcess(Process, ScanTransformMixin):
                  msn_peak_picking_args=None,
                  ms1_deconvolution_args=None, msn_deconvolution_args=None,
                  envelope_selector=None, ms1_averaging=0, log_handler=None,
-                 deconvolute=True, verbose=False):
+                 deconvolute=True, verbose=False, shared_memory_transport=False,
+                 collect_metrics=False, metrics_interval=60.0):
         if log_handler is None:
             log_handler = show_message
 
@@ -269,12 +592,14 @@ class ScanTransformingProcess(Process, ScanTransformMixin):
         self.envelope_selector = envelope_selector
         self.ms1_averaging = ms1_averaging
         self.deconvolute = deconvolute
+        self.shared_memory_transport = shared_memory_transport
 
         self.transformer = None
 
         self.no_more_event = no_more_event
         self._work_complete = multiprocessing.Event()
         self.log_handler = log_handler
+        self._init_metrics(collect_metrics, metrics_interval)
 
     def make_scan_transformer(self, loader=None):
         transformer = ScanProcessor(
@@ -285,7 +610,8 @@ class ScanTransformingProcess(Process, ScanTransformMixin):
             msn_deconvolution_args=self.msn_deconvolution_args,
             loader_type=lambda x: x,
             envelope_selector=self.envelope_selector,
-            ms1_averaging=self.ms1_averaging)
+            ms1_averaging=self.ms1_averaging,
+            metrics=self.metrics)
         return transformer
 
     def handle_scan_bunch(self, scan, product_scans, scan_id, product_scan_ids, process_msn=True):
@@ -296,6 +622,7 @@ class ScanTransformingProcess(Process, ScanTransformMixin):
                 self.skip_scan(scan)
                 return
 
+            start = default_timer()
             try:
                 scan, priorities, product_scans = transformer.process_scan_group(
                     scan, product_scans)
@@ -317,6 +644,7 @@ class ScanTransformingProcess(Process, ScanTransformMixin):
             except Exception as e:
                 self.skip_scan(scan)
                 self.log_error(e, scan_id, scan, (product_scan_ids))
+            self.metrics.record("ms1_scan", default_timer() - start)
 
         for product_scan in product_scans:
             # no way to report skip
@@ -325,6 +653,7 @@ class ScanTransformingProcess(Process, ScanTransformMixin):
             if len(product_scan.arrays[0]) == 0 or (not process_msn):
                 self.skip_scan(product_scan)
                 continue
+            start = default_timer()
             try:
                 transformer.pick_product_scan_peaks(product_scan)
                 if self.verbose:
@@ -347,6 +676,7 @@ class ScanTransformingProcess(Process, ScanTransformMixin):
                 self.skip_scan(product_scan)
                 self.log_error(e, product_scan.id,
                                product_scan, (product_scan_ids))
+            self.metrics.record("msn_scan", default_timer() - start)
 
     def _silence_loggers(self):
         nologs = ["deconvolution_scan_processor"]
@@ -384,7 +714,6 @@ class ScanTransformingProcess(Process, ScanTransformMixin):
         while has_input:
             try:
                 scan_id, product_scan_ids, process_msn = self.get_work(True, 10)
-                self.input_queue.task_done()
             except QueueEmpty:
                 if self.no_more_event is not None and self.no_more_event.is_set():
                     has_input = False
@@ -397,19 +726,108 @@ class ScanTransformingProcess(Process, ScanTransformMixin):
 
             try:
                 queued_loader.put(scan_id, product_scan_ids)
-                scan, product_scans = queued_loader.get()
+                with self.metrics.time("read"):
+                    scan, product_scans = queued_loader.get()
             except Exception as e:
                 self.log_message("Something went wrong when loading bunch (%s): %r.\nRecovery is not possible." % (
                     (scan_id, product_scan_ids), e))
 
             self.handle_scan_bunch(scan, product_scans, scan_id, product_scan_ids, process_msn)
+            self.send_metrics()
             if (i - last) > 1000:
                 last = i
                 self.output_queue.join()
 
         self.log_message("Done (%d scans)" % i)
 
+        if self.metrics.enabled:
+            self.send_metrics(force=True)
+            # Make sure the collator has taken the last metrics before it may see
+            # this worker as finished
+            self.output_queue.join()
+
         if self.no_more_event is None:
             self.output_queue.put((DONE, DONE, DONE))
 
         self._work_complete.set()
+
+
+class BatchScanTransformingProcess(ScanTransformingProcess):
+    """A :class:`ScanTransformingProcess` which is part of a pool shared by several files,
+    consuming the tagged work items dealt by :class:`BatchScanIDYieldingProcess`.
+
+    The worker keeps the reader and :class:`~.ScanProcessor` for the file it is currently
+    working on, and replaces them when it receives work from the next file, so everything
+    else it has set up, like the isotopic pattern caches of the deconvolution parameters,
+    is reused across files.
+
+    Results are sent to the shared output queue tagged with the index of their file,
+    followed by a :const:`BUNCH_DONE` message after each scan bunch, which carries the
+    metrics recorded while processing the bunch, if any.
+
+    Attributes
+    ----------
+    ms_file_paths : list of str
+        The paths to the data files being processed, in the order they are dealt
+    current_file_index : int
+        The index of the file the worker is currently processing
+    """
+
+    def __init__(self, ms_file_paths, input_queue, output_queue, no_more_event=None, **kwargs):
+        ScanTransformingProcess.__init__(
+            self, None, input_queue, output_queue, no_more_event, **kwargs)
+        self.ms_file_paths = list(ms_file_paths)
+        self.shared_output_queue = output_queue
+        self.current_file_index = None
+        self.loader = None
+        self.queued_loader = None
+
+    def _switch_file(self, file_index):
+        if self.loader is not None:
+            self.loader.close()
+        self.current_file_index = file_index
+        self.ms_file_path = self.ms_file_paths[file_index]
+        self.loader = MSFileLoader(self.ms_file_path)
+        self.queued_loader = ScanBunchLoader(self.loader)
+        self.transformer = self.make_scan_transformer(self.loader)
+        self.output_queue = _TaggedQueue(self.shared_output_queue, file_index)
+
+    def run(self):
+        self._silence_loggers()
+
+        has_input = True
+        i = 0
+        last = 0
+        while has_input:
+            try:
+                file_index, scan_id, product_scan_ids, process_msn = self.get_work(True, 10)
+            except QueueEmpty:
+                if self.no_more_event is not None and self.no_more_event.is_set():
+                    has_input = False
+                continue
+
+            if file_index != self.current_file_index:
+                self._switch_file(file_index)
+
+            i += 1 + len(product_scan_ids)
+            try:
+                self.queued_loader.put(scan_id, product_scan_ids)
+                with self.metrics.time("read"):
+                    scan, product_scans = self.queued_loader.get()
+            except Exception as e:
+                self.log_message("Something went wrong when loading bunch (%s) from %s: %r." % (
+                    (scan_id, product_scan_ids), self.ms_file_path, e))
+                scan, product_scans = None, []
+
+            self.handle_scan_bunch(scan, product_scans, scan_id, product_scan_ids, process_msn)
+            # Metrics travel with the end of each bunch, so they all reach the file's
+            # collator before it finishes
+            self.output_queue.put((BUNCH_DONE, self.take_metrics(), None))
+            if (i - last) > 1000:
+                last = i
+                self.shared_output_queue.join()
+
+        if self.loader is not None:
+            self.loader.close()
+        self.log_message("Done (%d scans)" % i)
+        self._work_complete.set()
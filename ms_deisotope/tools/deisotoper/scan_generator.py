@@ -6,9 +6,13 @@ from ms_deisotope.processor import MSFileLoader
 
 from ms_deisotope.feature_map.quick_index import index as build_scan_index
 from ms_deisotope.task import TaskBase
+from ms_deisotope.instrumentation import PipelineMetrics, NULL_METRICS
 
-from .collator import ScanCollator
-from .process import ScanIDYieldingProcess, ScanTransformingProcess
+from .collator import ScanCollator, ScanDemultiplexer, BatchScanCollator
+from .process import (
+    ScanIDYieldingProcess, ScanTransformingProcess, preindex_file,
+    BatchScanIDYieldingProcess, BatchScanTransformingProcess)
+from .transport import start_resource_tracker
 
 
 class ScanGeneratorBase(object):
@@ -33,6 +37,12 @@ class ScanGeneratorBase(object):
     def close(self):
         pass
 
+    def stats(self):
+        return {}
+
+    #: The metrics sent back by the worker processes
+    metrics = NULL_METRICS
+
     @property
     def scan_source(self):
         return None
@@ -79,11 +89,34 @@ class ScanGeneratorBase(object):
 
 
 class ScanGenerator(TaskBase, ScanGeneratorBase):
+    """Processes the scans of a data file with a pool of worker processes, yielding
+    them in order.
+
+    Parameters
+    ----------
+    batch_size : int
+        The largest number of scan bunches sent to a worker at once
+    target_batch_cost : float
+        The estimated cost, in peaks, at which a batch of scan bunches is sent before
+        it reaches `batch_size`. If :const:`None`, batches are always filled. See
+        :meth:`~.ScanIDYieldingProcess.estimate_bunch_cost`
+    reorder_window : int
+        The number of scans the workers may get ahead of the oldest scan which has not
+        been yielded yet. If :const:`None`, they are not limited
+    collect_metrics : bool
+        Whether the workers should record :class:`~.PipelineMetrics`, which are gathered
+        in :attr:`metrics`
+    metrics_interval : float
+        The number of seconds between the workers sending their metrics
+    """
+
     def __init__(self, ms_file, number_of_helpers=4,
                  ms1_peak_picking_args=None, msn_peak_picking_args=None,
                  ms1_deconvolution_args=None, msn_deconvolution_args=None,
                  extract_only_tandem_envelopes=False, ignore_tandem_scans=False,
-                 ms1_averaging=0, deconvolute=True):
+                 ms1_averaging=0, deconvolute=True, shared_memory_transport=False,
+                 batch_size=1, target_batch_cost=None, reorder_window=None,
+                 collect_metrics=False, metrics_interval=60.0):
         self.ms_file = ms_file
         self.ignore_tandem_scans = ignore_tandem_scans
 
@@ -109,6 +142,15 @@ class ScanGenerator(TaskBase, ScanGeneratorBase):
         self.ms1_deconvolution_args = ms1_deconvolution_args
         self.msn_deconvolution_args = msn_deconvolution_args
         self.extract_only_tandem_envelopes = extract_only_tandem_envelopes
+        self.shared_memory_transport = shared_memory_transport
+        self.batch_size = batch_size
+        self.target_batch_cost = target_batch_cost
+        self.reorder_window = reorder_window
+        self.collect_metrics = collect_metrics
+        self.metrics_interval = metrics_interval
+        self.metrics = PipelineMetrics() if collect_metrics else NULL_METRICS
+        self._collator_progress = None
+        self._collator_progress_changed = None
         self._scan_interval_tree = None
         self.log_controller = self.ipc_logger()
 
@@ -135,18 +177,8 @@ class ScanGenerator(TaskBase, ScanGeneratorBase):
                 helper.terminate()
 
     def _preindex_file(self):
-        reader = MSFileLoader(self.ms_file, use_index=False)
-        try:
-            reader.prebuild_byte_offset_file(self.ms_file)
-        except AttributeError:
-            # the type does not support this type of indexing
-            pass
-        except IOError:
-            # the file could not be written
-            pass
-        except Exception as e:
-            # something else went wrong
-            self.error("An error occurred while pre-indexing.", e)
+        # Every worker averaging MS1 scans needs the scan time index, so it is built once here
+        preindex_file(self.ms_file, self.error, scan_time_index=self.ms1_averaging > 0)
 
     def _make_interval_tree(self, start_scan, end_scan):
         reader = MSFileLoader(self.ms_file)
@@ -176,13 +208,29 @@ class ScanGenerator(TaskBase, ScanGeneratorBase):
             envelope_selector=self._scan_interval_tree,
             log_handler=self.log_controller.sender(),
             ms1_averaging=self.ms1_averaging,
-            deconvolute=self.deconvoluting)
+            deconvolute=self.deconvoluting,
+            shared_memory_transport=self.shared_memory_transport,
+            collect_metrics=self.collect_metrics,
+            metrics_interval=self.metrics_interval)
 
     def _make_collator(self):
         return ScanCollator(
             self._output_queue, self.scan_ids_exhausted_event, self._deconv_helpers,
             self._deconv_process, input_queue=self._input_queue,
-            include_fitted=not self.deconvoluting)
+            include_fitted=not self.deconvoluting, progress=self._collator_progress,
+            progress_changed=self._collator_progress_changed, metrics=self.metrics)
+
+    def stats(self):
+        """Describe how work is flowing through the worker processes.
+
+        Returns
+        -------
+        dict
+            See :meth:`~.ScanCollator.stats`
+        """
+        if self._order_manager is None:
+            return {}
+        return self._order_manager.stats()
 
     def _initialize_workers(self, start_scan=None, end_scan=None, max_scans=None):
         try:
@@ -200,12 +248,23 @@ class ScanGenerator(TaskBase, ScanGeneratorBase):
             self._make_interval_tree(start_scan, end_scan)
 
         self._terminate()
+        if self.reorder_window is not None:
+            self._collator_progress = multiprocessing.Value('l', -1)
+            self._collator_progress_changed = multiprocessing.Condition(self._collator_progress.get_lock())
+        else:
+            self._collator_progress = None
+            self._collator_progress_changed = None
         self._scan_yielder_process = ScanIDYieldingProcess(
             self.ms_file, self._input_queue, start_scan=start_scan, end_scan=end_scan,
             max_scans=max_scans, no_more_event=self.scan_ids_exhausted_event,
-            ignore_tandem_scans=self.ignore_tandem_scans, batch_size=1)
+            ignore_tandem_scans=self.ignore_tandem_scans, batch_size=self.batch_size,
+            target_batch_cost=self.target_batch_cost, collator_progress=self._collator_progress,
+            collator_progress_changed=self._collator_progress_changed,
+            reorder_window=self.reorder_window)
         self._scan_yielder_process.start()
 
+        if self.shared_memory_transport:
+            start_resource_tracker()
         self._deconv_process = self._make_transforming_process()
 
         self._deconv_helpers = []
@@ -230,3 +289,192 @@ class ScanGenerator(TaskBase, ScanGeneratorBase):
 
     def close(self):
         self._terminate()
+
+
+class BatchScanScheduler(TaskBase):
+    """Processes the scans of many files with a single pool of worker processes.
+
+    One :class:`~.BatchScanIDYieldingProcess` deals the scan bunches of each file in
+    turn to a shared pool of :class:`~.BatchScanTransformingProcess` workers, which
+    are started once and live for the whole batch. While the last bunches of one file
+    are being processed, idle workers move on to the next file. Iterating over the
+    scheduler yields a :class:`BatchFileScanGenerator` for each file, in order, which
+    yields that file's processed scans in order.
+
+    At most :attr:`max_files_in_flight` files are dealt out before the consumer has
+    finished with the earliest of them, bounding how many processed scans are held in
+    memory waiting for their file's turn.
+
+    Attributes
+    ----------
+    ms_files : list of str
+        The paths to the data files to process
+    start_scans : list
+        The scan id to start from in each file, or :const:`None`
+    end_scans : list
+        The scan id to stop at in each file, or :const:`None`
+    number_of_workers : int
+        The number of worker processes in the pool
+    max_files_in_flight : int
+        The number of files which may be dealt to the workers at once
+    batch_size : int
+        The largest number of scan bunches sent to a worker at once
+    target_batch_cost : float
+        The estimated cost, in peaks, at which a batch of scan bunches is sent before
+        it reaches :attr:`batch_size`. If :const:`None`, batches are always filled
+    """
+
+    def __init__(self, ms_files, number_of_workers=4,
+                 ms1_peak_picking_args=None, msn_peak_picking_args=None,
+                 ms1_deconvolution_args=None, msn_deconvolution_args=None,
+                 start_scans=None, end_scans=None, ignore_tandem_scans=False,
+                 ms1_averaging=0, deconvolute=True, shared_memory_transport=False,
+                 max_files_in_flight=2, batch_size=1, target_batch_cost=None,
+                 collect_metrics=False):
+        self.ms_files = list(ms_files)
+        if start_scans is None:
+            start_scans = [None] * len(self.ms_files)
+        if end_scans is None:
+            end_scans = [None] * len(self.ms_files)
+        self.start_scans = list(start_scans)
+        self.end_scans = list(end_scans)
+
+        self.number_of_workers = max(number_of_workers, 1)
+        self.max_files_in_flight = max(max_files_in_flight, 1)
+
+        self.ms1_peak_picking_args = ms1_peak_picking_args
+        self.msn_peak_picking_args = msn_peak_picking_args
+        self.ms1_deconvolution_args = ms1_deconvolution_args
+        self.msn_deconvolution_args = msn_deconvolution_args
+        self.ignore_tandem_scans = ignore_tandem_scans
+        self.ms1_averaging = ms1_averaging
+        self.deconvoluting = deconvolute
+        self.shared_memory_transport = shared_memory_transport
+        self.batch_size = batch_size
+        self.target_batch_cost = target_batch_cost
+        self.collect_metrics = collect_metrics
+        self.metrics = PipelineMetrics() if collect_metrics else NULL_METRICS
+
+        self.scan_ids_exhausted_event = multiprocessing.Event()
+        self._file_slots = None
+        self._input_queue = None
+        self._output_queue = None
+        self._demultiplexer = None
+        self._scan_yielder_process = None
+        self._workers = None
+        self.log_controller = self.ipc_logger()
+
+    def _make_transforming_process(self):
+        return BatchScanTransformingProcess(
+            self.ms_files,
+            self._input_queue,
+            self._output_queue,
+            self.scan_ids_exhausted_event,
+            ms1_peak_picking_args=self.ms1_peak_picking_args,
+            msn_peak_picking_args=self.msn_peak_picking_args,
+            ms1_deconvolution_args=self.ms1_deconvolution_args,
+            msn_deconvolution_args=self.msn_deconvolution_args,
+            log_handler=self.log_controller.sender(),
+            ms1_averaging=self.ms1_averaging,
+            deconvolute=self.deconvoluting,
+            shared_memory_transport=self.shared_memory_transport,
+            collect_metrics=self.collect_metrics)
+
+    def _initialize_workers(self):
+        try:
+            self._input_queue = JoinableQueue(int(1e6))
+            self._output_queue = JoinableQueue(5000)
+        except OSError:
+            # Not all platforms permit limiting the size of queues
+            self._input_queue = JoinableQueue()
+            self._output_queue = JoinableQueue()
+        self._demultiplexer = ScanDemultiplexer(self._output_queue)
+        self._file_slots = multiprocessing.Semaphore(self.max_files_in_flight)
+
+        self._terminate()
+        self._scan_yielder_process = BatchScanIDYieldingProcess(
+            self.ms_files, self._input_queue, self._output_queue,
+            start_scans=self.start_scans, end_scans=self.end_scans,
+            no_more_event=self.scan_ids_exhausted_event,
+            ignore_tandem_scans=self.ignore_tandem_scans, batch_size=self.batch_size,
+            target_batch_cost=self.target_batch_cost, file_slots=self._file_slots,
+            log_handler=self.log_controller.sender(),
+            build_scan_time_index=self.ms1_averaging > 0)
+        self._scan_yielder_process.start()
+
+        if self.shared_memory_transport:
+            start_resource_tracker()
+        self._workers = [self._make_transforming_process() for _ in range(self.number_of_workers)]
+        for worker in self._workers:
+            worker.start()
+
+    def _make_collator(self, file_index):
+        return BatchScanCollator(
+            self._demultiplexer, file_index, include_fitted=not self.deconvoluting,
+            metrics=self.metrics)
+
+    def file_completed(self, file_index):
+        """Mark the file `file_index` as finished, allowing another file to be
+        dealt to the workers.
+        """
+        self._demultiplexer.discard(file_index)
+        self._file_slots.release()
+
+    def __iter__(self):
+        self._initialize_workers()
+        for file_index in range(len(self.ms_files)):
+            yield BatchFileScanGenerator(self, file_index)
+        self.log_controller.stop()
+        self.join()
+        self._terminate()
+
+    def join(self):
+        if self._scan_yielder_process is not None:
+            self._scan_yielder_process.join()
+        if self._workers is not None:
+            for worker in self._workers:
+                worker.join()
+
+    def _terminate(self):
+        if self._scan_yielder_process is not None:
+            self._scan_yielder_process.terminate()
+        if self._workers is not None:
+            for worker in self._workers:
+                worker.terminate()
+
+    def close(self):
+        self._terminate()
+
+
+class BatchFileScanGenerator(ScanGeneratorBase):
+    """Yields the processed scans of one file from a :class:`BatchScanScheduler`,
+    in order.
+
+    Closing the generator does not stop the shared worker pool.
+    """
+
+    def __init__(self, scheduler, file_index):
+        self.scheduler = scheduler
+        self.file_index = file_index
+        self._iterator = None
+
+        self.ms1_peak_picking_args = scheduler.ms1_peak_picking_args
+        self.msn_peak_picking_args = scheduler.msn_peak_picking_args
+        self.ms1_deconvolution_args = scheduler.ms1_deconvolution_args
+        self.msn_deconvolution_args = scheduler.msn_deconvolution_args
+        self.ms1_averaging = scheduler.ms1_averaging
+        self.ignore_tandem_scans = scheduler.ignore_tandem_scans
+        self.deconvoluting = scheduler.deconvoluting
+        self.metrics = scheduler.metrics
+
+    @property
+    def scan_source(self):
+        return self.scheduler.ms_files[self.file_index]
+
+    def make_iterator(self, start_scan=None, end_scan=None, max_scans=None):
+        for scan in self.scheduler._make_collator(self.file_index):
+            yield scan
+        self.scheduler.file_completed(self.file_index)
+
+    def configure_iteration(self, start_scan=None, end_scan=None, max_scans=None):
+        self._iterator = self.make_iterator()
@@ -0,0 +1,272 @@
+'''Move the peak lists of processed scans from worker processes to the
+:class:`~.ScanCollator` through shared memory instead of pickling them
+through a queue.
+
+A worker writes a scan's peaks into a single shared memory block as flat
+arrays and sends a small :class:`SharedMemoryScan` through the queue in
+place of the scan. The receiving process rebuilds the peak sets from the
+block only when the scan is actually needed, releasing the block as it does.
+
+Requires :mod:`multiprocessing.shared_memory`, available since Python 3.8.
+'''
+from itertools import chain
+from operator import attrgetter
+
+import numpy as np
+
+try:
+    from multiprocessing import shared_memory, resource_tracker
+except ImportError:
+    shared_memory = None
+    resource_tracker = None
+
+from ms_peak_picker import FittedPeak, PeakSet, PeakIndex
+
+from ms_deisotope.peak_set import DeconvolutedPeak, DeconvolutedPeakSet, ColumnarDeconvolutedPeakSet
+
+
+#: The columns of the deconvoluted peaks, in the order they are laid out in a block
+deconvoluted_peak_columns = ColumnarDeconvolutedPeakSet._columns + [("envelope_size", np.int64)]
+
+#: The columns of the points of the deconvoluted peaks' envelopes
+envelope_point_columns = [
+    ("mz", np.float64),
+    ("intensity", np.float64),
+]
+
+#: The columns of the centroided peaks
+fitted_peak_columns = [
+    ("mz", np.float64),
+    ("intensity", np.float64),
+    ("signal_to_noise", np.float64),
+    ("peak_count", np.int64),
+    ("index", np.int64),
+    ("full_width_at_half_max", np.float64),
+    ("area", np.float64),
+    ("left_width", np.float64),
+    ("right_width", np.float64),
+]
+
+_column_groups = (deconvoluted_peak_columns, envelope_point_columns, fitted_peak_columns)
+
+
+def shared_memory_available():
+    """Check whether the running interpreter supports :mod:`multiprocessing.shared_memory`
+
+    Returns
+    -------
+    bool
+    """
+    return shared_memory is not None
+
+
+def start_resource_tracker():
+    """Start this process's :mod:`multiprocessing.resource_tracker` if it is not running.
+
+    Worker processes started after this share the tracker with this process, so the
+    blocks they create stay tracked after they exit, until the receiving process frees
+    them or every process of the pipeline has exited, whichever comes first.
+    """
+    if resource_tracker is not None:
+        resource_tracker.ensure_running()
+
+
+def _gather_columns(items, columns):
+    n = len(items)
+    return {name: np.fromiter(map(attrgetter(name), items), dtype=dtype, count=n)
+            for name, dtype in columns}
+
+
+def _deconvoluted_peak_columns(peaks):
+    if isinstance(peaks, ColumnarDeconvolutedPeakSet):
+        columns = {name: getattr(peaks, name) for name, _ in ColumnarDeconvolutedPeakSet._columns}
+        columns["envelope_size"] = np.diff(peaks.envelope_offsets)
+        return columns, {"mz": peaks.envelope_mz, "intensity": peaks.envelope_intensity}
+    peaks = list(peaks)
+    columns = _gather_columns(peaks, ColumnarDeconvolutedPeakSet._columns)
+    envelopes = list(map(list, map(attrgetter("envelope"), peaks)))
+    columns["envelope_size"] = np.fromiter(map(len, envelopes), dtype=np.int64, count=len(envelopes))
+    points = list(chain.from_iterable(envelopes))
+    return columns, _gather_columns(points, envelope_point_columns)
+
+
+def _fitted_peak_columns(peaks):
+    return _gather_columns(list(peaks), fitted_peak_columns)
+
+
+def _layout(sizes):
+    # The position of each column in a block, with each column aligned to 8 bytes
+    segments = []
+    offset = 0
+    for group, (columns, n) in enumerate(zip(_column_groups, sizes)):
+        for name, dtype in columns:
+            segments.append((group, name, np.dtype(dtype), n, offset))
+            offset += -(-np.dtype(dtype).itemsize * n // 8) * 8
+    return segments, offset
+
+
+def _unpack_deconvoluted_peaks(columns, envelope):
+    names = [name for name, _ in deconvoluted_peak_columns]
+    envelope = list(zip(envelope["mz"].tolist(), envelope["intensity"].tolist()))
+    peaks = []
+    offset = 0
+    for record in zip(*[columns[name].tolist() for name in names]):
+        (neutral_mass, mz, intensity, charge, signal_to_noise, full_width_at_half_max, score,
+         a_to_a2_ratio, most_abundant_mass, average_mass, area, chosen_for_msms,
+         envelope_size) = record
+        peaks.append(DeconvolutedPeak(
+            neutral_mass, intensity, charge, signal_to_noise, None, full_width_at_half_max,
+            a_to_a2_ratio, most_abundant_mass, average_mass, score,
+            envelope[offset:offset + envelope_size], mz, None, chosen_for_msms, area))
+        offset += envelope_size
+    return DeconvolutedPeakSet(peaks).reindex()
+
+
+def _unpack_fitted_peaks(columns):
+    peaks = PeakSet([FittedPeak(*record) for record in zip(
+        *[columns[name].tolist() for name, _ in fitted_peak_columns])])
+    peaks.reindex()
+    return PeakIndex(np.array([], dtype=np.float64), np.array([], dtype=np.float64), peaks)
+
+
+class SharedMemoryScan(object):
+    """A stand-in for a :class:`~.ProcessedScan` whose peak lists have been
+    written to a shared memory block.
+
+    The :attr:`scan` carries all of the scan's metadata, but its :attr:`peak_set`
+    and :attr:`deconvoluted_peak_set` are :const:`None` until :meth:`unpack` is
+    called. The :attr:`~.DeconvolutedPeak.fit` of each deconvoluted peak is not
+    transferred.
+
+    Attributes
+    ----------
+    scan : :class:`~.ProcessedScan`
+        The scan with its peak lists removed
+    name : str
+        The name of the shared memory block holding the peak lists, or :const:`None`
+        if there were no peaks to transfer
+    has_peak_set : bool
+        Whether the scan had a centroided peak list
+    has_deconvoluted_peak_set : bool
+        Whether the scan had a deconvoluted peak list
+    sizes : tuple of int
+        The number of deconvoluted peaks, envelope points, and centroided peaks in the block
+    """
+
+    def __init__(self, scan, name, has_peak_set, has_deconvoluted_peak_set, sizes):
+        self.scan = scan
+        self.name = name
+        self.has_peak_set = has_peak_set
+        self.has_deconvoluted_peak_set = has_deconvoluted_peak_set
+        self.sizes = sizes
+
+    @property
+    def index(self):
+        return self.scan.index
+
+    @property
+    def ms_level(self):
+        return self.scan.ms_level
+
+    @property
+    def id(self):
+        return self.scan.id
+
+    def __repr__(self):
+        return "%s(%r, %r, %r)" % (self.__class__.__name__, self.scan.id, self.name, self.sizes)
+
+    @classmethod
+    def pack(cls, scan):
+        """Move the peak lists of `scan` into a new shared memory block.
+
+        Each peak attribute is written into the block as one contiguous column. The
+        columns of a :class:`~.ColumnarDeconvolutedPeakSet` are copied as they are.
+
+        The block outlives the calling process, and is freed by :meth:`unpack`
+        or :meth:`release` in the receiving process. Until then it stays registered
+        with the resource tracker, which removes it when every process sharing the
+        tracker has exited, so blocks which are never received are not leaked.
+        See :func:`start_resource_tracker`.
+
+        Parameters
+        ----------
+        scan : :class:`~.ProcessedScan`
+            The scan to pack. Its peak lists are replaced with :const:`None`
+
+        Returns
+        -------
+        :class:`SharedMemoryScan`
+        """
+        has_peak_set = scan.peak_set is not None
+        has_deconvoluted_peak_set = scan.deconvoluted_peak_set is not None
+        deconvoluted, envelope = _deconvoluted_peak_columns(
+            scan.deconvoluted_peak_set if has_deconvoluted_peak_set else [])
+        fitted = _fitted_peak_columns(scan.peak_set if has_peak_set else [])
+        scan.peak_set = None
+        scan.deconvoluted_peak_set = None
+        sizes = (len(deconvoluted["neutral_mass"]), len(envelope["mz"]), len(fitted["mz"]))
+        segments, nbytes = _layout(sizes)
+        if nbytes == 0:
+            return cls(scan, None, has_peak_set, has_deconvoluted_peak_set, sizes)
+        groups = (deconvoluted, envelope, fitted)
+        block = shared_memory.SharedMemory(create=True, size=nbytes)
+        try:
+            for group, name, dtype, n, offset in segments:
+                if n:
+                    np.ndarray(n, dtype=dtype, buffer=block.buf, offset=offset)[:] = groups[group][name]
+            name = block.name
+        finally:
+            block.close()
+        return cls(scan, name, has_peak_set, has_deconvoluted_peak_set, sizes)
+
+    def _read(self):
+        segments, _ = _layout(self.sizes)
+        groups = ({}, {}, {})
+        block = shared_memory.SharedMemory(name=self.name)
+        try:
+            for group, name, dtype, n, offset in segments:
+                groups[group][name] = np.ndarray(n, dtype=dtype, buffer=block.buf, offset=offset).copy()
+        finally:
+            block.close()
+            block.unlink()
+        return groups
+
+    def unpack(self, include_fitted=True):
+        """Rebuild the scan's peak lists from the shared memory block and free it.
+
+        Parameters
+        ----------
+        include_fitted : bool, optional
+            Whether to rebuild the centroided peak list. If :const:`False`, the
+            scan's :attr:`peak_set` is set to :const:`None`. Defaults to :const:`True`
+
+        Returns
+        -------
+        :class:`~.ProcessedScan`
+        """
+        scan = self.scan
+        if self.name is not None:
+            deconvoluted, envelope, fitted = self._read()
+            self.name = None
+        else:
+            deconvoluted, envelope, fitted = [
+                {name: np.zeros(0, dtype=dtype) for name, dtype in columns} for columns in _column_groups]
+        if self.has_deconvoluted_peak_set:
+            scan.deconvoluted_peak_set = _unpack_deconvoluted_peaks(deconvoluted, envelope)
+        if self.has_peak_set:
+            scan.peak_set = _unpack_fitted_peaks(fitted) if include_fitted else None
+        return scan
+
+    def release(self):
+        """Free the shared memory block without rebuilding the peak lists
+        """
+        if self.name is None:
+            return
+        try:
+            block = shared_memory.SharedMemory(name=self.name)
+        except FileNotFoundError:
+            pass
+        else:
+            block.close()
+            block.unlink()
+        self.name = None
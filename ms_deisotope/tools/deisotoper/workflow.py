@@ -1,8 +1,49 @@
+import os
+
 import ms_deisotope
+from ms_deisotope.data_source import MSFileLoader, RandomAccessScanSource
 from ms_deisotope.task import TaskBase
+from ms_deisotope.instrumentation import default_timer
 
 from .output import ThreadedMzMLScanStorageHandler, NullScanStorageHandler
-from .scan_generator import ScanGenerator
+from .scan_generator import ScanGenerator, BatchScanScheduler
+from .checkpoint import Checkpoint, _replace_file
+
+
+def _completed_bunches(scans, last_scan_id=None):
+    """Group scans read back from a partial output file into scan bunches, yielding
+    only the ones known to have been written completely.
+
+    A bunch is complete if another bunch was written after it, or if it is the bunch
+    whose precursor is `last_scan_id`.
+    """
+    bunch = []
+    for scan in scans:
+        if scan.ms_level == 1 and bunch:
+            yield bunch
+            bunch = []
+        bunch.append(scan)
+    if bunch and bunch[0].id == last_scan_id:
+        yield bunch
+
+
+def write_metrics_report(path, metrics, **extra):
+    """Write the JSON report of `metrics` to `path`, replacing any previous
+    report atomically, so that it can be read at any time during a run.
+
+    Parameters
+    ----------
+    path : str
+        The path to write the report to
+    metrics : :class:`~.PipelineMetrics`
+        The metrics to report
+    **extra
+        Additional top-level entries for the report
+    """
+    temp_path = path + ".tmp"
+    with open(temp_path, 'wt') as handle:
+        metrics.write_json(handle, **extra)
+    _replace_file(temp_path, path)
 
 
 class ScanSink(object):
@@ -10,6 +51,10 @@ class ScanSink(object):
         self.scan_generator = scan_generator
         self.scan_store = None
         self._scan_store_type = storage_type
+        self.checkpoint = None
+        self.checkpoint_interval = 0
+        self._bunches_since_checkpoint = 0
+        self.scans_processed = 0
 
     @property
     def scan_source(self):
@@ -28,10 +73,37 @@ class ScanSink(object):
     def configure_cache(self, storage_path=None, name=None, source=None):
         self.scan_store = self._scan_store_type.configure_storage(
             storage_path, name, source)
+        self.scan_store.metrics = self.scan_generator.metrics
 
     def configure_iteration(self, *args, **kwargs):
         self.scan_generator.configure_iteration(*args, **kwargs)
 
+    def configure_checkpoint(self, checkpoint, interval):
+        """Record the progress of the run in `checkpoint` after every `interval`
+        scan bunches.
+
+        Parameters
+        ----------
+        checkpoint : :class:`~.Checkpoint`
+            The checkpoint to update
+        interval : int
+            The number of scan bunches to store between checkpoints
+        """
+        self.checkpoint = checkpoint
+        self.checkpoint_interval = interval
+        self._bunches_since_checkpoint = 0
+
+    def write_checkpoint(self):
+        """Flush the output file and record the last scan bunch written to it
+        in :attr:`checkpoint`.
+        """
+        if self.scan_store is None or self.checkpoint is None:
+            return
+        self.scan_store.flush()
+        self.checkpoint.update(self.scan_store.last_saved_scan_id, self.scan_store.spectra_saved)
+        self.checkpoint.save()
+        self._bunches_since_checkpoint = 0
+
     def store_scan(self, scan):
         if self.scan_store is not None:
             self.scan_store.accumulate(scan)
@@ -47,10 +119,16 @@ class ScanSink(object):
 
     def next_scan(self):
         scan = next(self.scan_generator)
+        self.scans_processed += 1
         self.store_scan(scan)
         while scan.ms_level != 1:
             scan = next(self.scan_generator)
+            self.scans_processed += 1
             self.store_scan(scan)
+        if self.checkpoint is not None:
+            self._bunches_since_checkpoint += 1
+            if self._bunches_since_checkpoint >= self.checkpoint_interval:
+                self.write_checkpoint()
         return scan
 
     def __iter__(self):
@@ -77,7 +155,9 @@ class SampleConsumer(TaskBase):
                  msn_deconvolution_args=None, start_scan_id=None, end_scan_id=None, storage_path=None,
                  sample_name=None, storage_type=None, n_processes=5,
                  extract_only_tandem_envelopes=False, ignore_tandem_scans=False,
-                 ms1_averaging=0, deconvolute=True):
+                 ms1_averaging=0, deconvolute=True, shared_memory_transport=False,
+                 checkpoint_interval=0, resume=False, metrics_path=None, metrics_interval=60.0,
+                 batch_size=1, target_batch_cost=None, reorder_window=None):
 
         if storage_type is None:
             storage_type = ThreadedMzMLScanStorageHandler
@@ -116,11 +196,22 @@ class SampleConsumer(TaskBase):
             msn_deconvolution_args=msn_deconvolution_args,
             extract_only_tandem_envelopes=extract_only_tandem_envelopes,
             ignore_tandem_scans=ignore_tandem_scans,
-            ms1_averaging=ms1_averaging, deconvolute=deconvolute)
+            ms1_averaging=ms1_averaging, deconvolute=deconvolute,
+            shared_memory_transport=shared_memory_transport,
+            batch_size=batch_size, target_batch_cost=target_batch_cost,
+            reorder_window=reorder_window,
+            collect_metrics=metrics_path is not None,
+            metrics_interval=metrics_interval)
 
         self.start_scan_id = start_scan_id
         self.end_scan_id = end_scan_id
 
+        self.checkpoint_interval = checkpoint_interval
+        self.resume = resume
+
+        self.metrics_path = metrics_path
+        self.metrics_interval = metrics_interval
+
         self.sample_run = None
 
     @classmethod
@@ -158,28 +249,262 @@ class SampleConsumer(TaskBase):
         return (ms1_peak_picking_args, msn_peak_picking_args,
                 ms1_deconvolution_args, msn_deconvolution_args)
 
+    @property
+    def _partial_output_path(self):
+        return self.storage_path + ".partial"
+
+    def _set_aside_partial_output(self):
+        """Move the output file of an interrupted run out of the way so that it can
+        be read back while the new output file is written.
+
+        Returns
+        -------
+        :class:`~.Checkpoint` or :const:`None`:
+            The checkpoint of the interrupted run, or :const:`None` if it cannot be resumed
+        """
+        if self.storage_path is None or not self.storage_type.supports_resume:
+            self.log("The output format does not support resuming, starting from the beginning")
+            return None
+        checkpoint = Checkpoint.load(self.storage_path)
+        if checkpoint is None:
+            self.log("No checkpoint found for %s, starting from the beginning" % (self.storage_path, ))
+            return None
+        if os.path.abspath(checkpoint.source_file) != os.path.abspath(self.ms_file):
+            self.log("The checkpoint for %s was made from %s, starting from the beginning" % (
+                self.storage_path, checkpoint.source_file))
+            return None
+        partial_path = self._partial_output_path
+        if os.path.exists(self.storage_path):
+            # If an earlier resumed run was interrupted before it had copied all of the
+            # previous partial output, that partial output is still the more complete one.
+            if not (os.path.exists(partial_path) and
+                    os.path.getsize(partial_path) > os.path.getsize(self.storage_path)):
+                _replace_file(self.storage_path, partial_path)
+        if not os.path.exists(partial_path):
+            return None
+        return checkpoint
+
+    def _restore_partial_output(self, sink, checkpoint):
+        """Copy the completed scan bunches from the interrupted run's output file
+        into the new output file.
+
+        Returns
+        -------
+        str or :const:`None`:
+            The id of the precursor scan of the last bunch recovered
+        """
+        last_scan_id = None
+        count = 0
+        scans = self.storage_type.read_partial_output(self._partial_output_path)
+        for bunch in _completed_bunches(scans, checkpoint.last_scan_id):
+            for scan in bunch:
+                sink.store_scan(scan)
+            last_scan_id = bunch[0].id
+            count += 1
+        self.log("Recovered %d scan bunches from the interrupted run" % (count, ))
+        return last_scan_id
+
+    def _find_next_precursor(self, scan_id):
+        """Find the first MS1 scan after `scan_id` in the input file which should
+        still be processed.
+
+        Returns
+        -------
+        str or :const:`None`:
+            The id of the next MS1 scan, or :const:`None` if there is nothing left to process
+        """
+        reader = MSFileLoader(self.ms_file, lazy_arrays=True)
+        try:
+            if not isinstance(reader, RandomAccessScanSource):
+                raise TypeError("Cannot resume processing a file which does not support random access")
+            if scan_id == self.end_scan_id:
+                return None
+            index = reader.get_scan_by_id(scan_id).index + 1
+            end_index = len(reader) - 1
+            if self.end_scan_id is not None:
+                end_index = reader.get_scan_by_id(self.end_scan_id).index
+            while index <= end_index:
+                scan = reader.get_scan_by_index(index)
+                if scan.ms_level == 1:
+                    return scan.id
+                index += 1
+            return None
+        finally:
+            reader.close()
+
+    def write_metrics_report(self, sink, start_time, complete=False):
+        """Write the metrics gathered so far to :attr:`metrics_path` as JSON.
+        """
+        elapsed = default_timer() - start_time
+        write_metrics_report(
+            self.metrics_path, self.scan_generator.metrics, sample_name=self.sample_name,
+            elapsed=elapsed, scans_processed=sink.scans_processed,
+            scans_per_second=sink.scans_processed / elapsed if elapsed > 0 else 0.0,
+            complete=complete)
+
     def run(self):
-        self.log("Initializing Generator")
-        self.scan_generator.configure_iteration(self.start_scan_id, self.end_scan_id)
         self.log("Setting Sink")
+        start_time = default_timer()
         sink = ScanSink(self.scan_generator, self.storage_type)
+        start_scan_id = self.start_scan_id
+        checkpoint = None
+        if self.resume:
+            checkpoint = self._set_aside_partial_output()
         self.log("Initializing Cache")
         sink.configure_cache(self.storage_path, self.sample_name, self.scan_generator)
 
-        self.log("Begin Processing")
-        last_scan_time = 0
-        last_scan_index = 0
+        has_work = True
+        if checkpoint is not None:
+            last_scan_id = self._restore_partial_output(sink, checkpoint)
+            if last_scan_id is not None:
+                start_scan_id = self._find_next_precursor(last_scan_id)
+                has_work = start_scan_id is not None
+                self.log("Resuming from %s" % (start_scan_id, ))
+        if self.checkpoint_interval > 0 and self.storage_path is not None:
+            sink.configure_checkpoint(Checkpoint(self.ms_file, self.storage_path), self.checkpoint_interval)
+            sink.write_checkpoint()
+
+        if has_work:
+            self.log("Initializing Generator")
+            self.scan_generator.configure_iteration(start_scan_id, self.end_scan_id)
+            self.log("Begin Processing")
+            last_scan_time = 0
+            last_scan_index = 0
+            last_report_time = default_timer()
+            i = 0
+            for scan in sink:
+                i += 1
+                if self.metrics_path is not None and default_timer() - last_report_time > self.metrics_interval:
+                    self.write_metrics_report(sink, start_time)
+                    last_report_time = default_timer()
+                if (scan.scan_time - last_scan_time > 1.0) or (i % 1000 == 0):
+                    self.log("Processed %s (time: %f)" % (
+                        scan.id, scan.scan_time,))
+                    if last_scan_index != 0:
+                        self.log("Count Since Last Log: %d" % (scan.index - last_scan_index,))
+                    stats = self.scan_generator.stats()
+                    if stats:
+                        self.log("Queue Depth: %r, Reorder Buffer Size: %r (max %r)" % (
+                            stats['queue_depth'], stats['reorder_buffer_size'],
+                            stats['max_reorder_buffer_size']))
+                    last_scan_time = scan.scan_time
+                    last_scan_index = scan.index
+            self.log("Finished Recieving Scans")
+        sink.complete()
+        self.log("Completed Sample %s" % (self.sample_name,))
+        sink.commit()
+        if self.metrics_path is not None:
+            self.write_metrics_report(sink, start_time, complete=True)
+        if self.storage_path is not None and (self.checkpoint_interval > 0 or self.resume):
+            Checkpoint(self.ms_file, self.storage_path).remove()
+            if os.path.exists(self._partial_output_path):
+                os.remove(self._partial_output_path)
+
+
+class BatchSampleConsumer(TaskBase):
+    """Processes many data files with a single pool of worker processes, writing
+    each file's processed scans to its own output file.
+
+    Unlike running a :class:`SampleConsumer` for each file, the worker processes
+    are started once for the whole batch, and workers which would sit idle at the
+    end of one file start on the next.
+
+    Attributes
+    ----------
+    ms_files : list of str
+        The paths to the data files to process
+    storage_paths : list of str
+        The path to write the processed scans of each file to
+    sample_names : list of str
+        The name of the sample in each file
+    files_failed : list of str
+        The paths of the data files which could not be opened, and so have no output file
+    """
+
+    def __init__(self, ms_files, storage_paths, sample_names=None,
+                 ms1_peak_picking_args=None, msn_peak_picking_args=None, ms1_deconvolution_args=None,
+                 msn_deconvolution_args=None, start_scan_ids=None, end_scan_ids=None,
+                 storage_type=None, n_processes=5, ignore_tandem_scans=False,
+                 ms1_averaging=0, deconvolute=True, shared_memory_transport=False,
+                 max_files_in_flight=2, metrics_path=None, batch_size=1, target_batch_cost=None):
+        if storage_type is None:
+            storage_type = ThreadedMzMLScanStorageHandler
+        if len(storage_paths) != len(ms_files):
+            raise ValueError("Each input file must have exactly one output path")
+        if sample_names is None:
+            sample_names = [os.path.splitext(os.path.basename(ms_file))[0] for ms_file in ms_files]
+
+        self.ms_files = list(ms_files)
+        self.storage_paths = list(storage_paths)
+        self.sample_names = list(sample_names)
+        self.storage_type = storage_type
+        self.n_processes = n_processes
+        self.deconvolute = deconvolute
+
+        self.scheduler = BatchScanScheduler(
+            self.ms_files,
+            number_of_workers=n_processes,
+            ms1_peak_picking_args=ms1_peak_picking_args,
+            msn_peak_picking_args=msn_peak_picking_args,
+            ms1_deconvolution_args=ms1_deconvolution_args,
+            msn_deconvolution_args=msn_deconvolution_args,
+            start_scans=start_scan_ids, end_scans=end_scan_ids,
+            ignore_tandem_scans=ignore_tandem_scans,
+            ms1_averaging=ms1_averaging, deconvolute=deconvolute,
+            shared_memory_transport=shared_memory_transport,
+            max_files_in_flight=max_files_in_flight,
+            batch_size=batch_size, target_batch_cost=target_batch_cost,
+            collect_metrics=metrics_path is not None)
+        self.metrics_path = metrics_path
+        self.scans_processed = 0
+        self.files_completed = 0
+        self.files_failed = []
+
+    def _process_file(self, scan_generator):
+        file_index = scan_generator.file_index
+        sample_name = self.sample_names[file_index]
+        self.log("Processing %s" % (self.ms_files[file_index], ))
+        sink = ScanSink(scan_generator, self.storage_type)
+        try:
+            sink.configure_cache(self.storage_paths[file_index], sample_name, scan_generator)
+        except Exception as e:
+            self.log("Could not open %s, skipping it: %r" % (self.ms_files[file_index], e))
+            # Wait for the workers to finish with the file, so the next file can be dealt
+            for _ in scan_generator:
+                pass
+            self.files_failed.append(self.ms_files[file_index])
+            return
         i = 0
         for scan in sink:
             i += 1
-            if (scan.scan_time - last_scan_time > 1.0) or (i % 1000 == 0):
-                self.log("Processed %s (time: %f)" % (
-                    scan.id, scan.scan_time,))
-                if last_scan_index != 0:
-                    self.log("Count Since Last Log: %d" % (scan.index - last_scan_index,))
-                last_scan_time = scan.scan_time
-                last_scan_index = scan.index
-        self.log("Finished Recieving Scans")
+            if i % 1000 == 0:
+                self.log("Processed %s (time: %f)" % (scan.id, scan.scan_time))
         sink.complete()
-        self.log("Completed Sample %s" % (self.sample_name,))
         sink.commit()
+        self.scans_processed += sink.scans_processed
+        self.files_completed += 1
+        self.log("Completed Sample %s" % (sample_name, ))
+
+    def write_metrics_report(self, start_time, complete=False):
+        """Write the metrics gathered so far for the whole batch to :attr:`metrics_path`
+        as JSON.
+        """
+        elapsed = default_timer() - start_time
+        write_metrics_report(
+            self.metrics_path, self.scheduler.metrics, elapsed=elapsed,
+            scans_processed=self.scans_processed,
+            scans_per_second=self.scans_processed / elapsed if elapsed > 0 else 0.0,
+            files_completed=self.files_completed, files_failed=len(self.files_failed),
+            files_total=len(self.ms_files), complete=complete)
+
+    def run(self):
+        self.log("Processing %d files with %d workers" % (len(self.ms_files), self.n_processes))
+        start_time = default_timer()
+        try:
+            for scan_generator in self.scheduler:
+                self._process_file(scan_generator)
+                if self.metrics_path is not None:
+                    files_done = self.files_completed + len(self.files_failed)
+                    self.write_metrics_report(start_time, complete=files_done == len(self.ms_files))
+        finally:
+            self.scheduler.close()
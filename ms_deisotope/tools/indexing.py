@@ -38,7 +38,7 @@ def describe(path):
         return -1
     click.echo("File Format: %s" % (sf.file_format, ))
     click.echo("ID Format: %s" % (sf.id_format, ))
-    reader = ms_deisotope.MSFileLoader(path)
+    reader = ms_deisotope.MSFileLoader(path, lazy_arrays=True)
     if isinstance(reader, RandomAccessScanSource):
         click.echo("Format Supports Random Access: True")
         first_scan = reader[0]
@@ -101,6 +101,10 @@ def byte_index(paths):
             click.echo("\"%s\" does not support pre-indexing byte offsets" % (path,))
             return
         fn(path)
+        reader = ms_deisotope.MSFileLoader(path)
+        if isinstance(reader, RandomAccessScanSource):
+            reader.build_scan_time_index(persist=True)
+        reader.close()
 
 
 @cli.command("metadata-index", short_help='Build an external scan metadata index for a mass spectrometry data file')
@@ -108,7 +112,7 @@ def byte_index(paths):
 @processes_option
 def metadata_index(paths, processes=4):
     for path in paths:
-        reader = ms_deisotope.MSFileLoader(path)
+        reader = ms_deisotope.MSFileLoader(path, lazy_arrays=True)
         try:
             fn = reader.prebuild_byte_offset_file
             if not reader.source._check_has_byte_offset_file():
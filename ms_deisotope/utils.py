@@ -4,6 +4,8 @@ import random
 import math
 from datetime import datetime
 from collections import OrderedDict
+
+import numpy as np
 from six import add_metaclass
 
 
@@ -203,6 +205,175 @@ def ppm_error(x, y):
     return (x - y) / y
 
 
+def ppm_search_intervals(values, queries, error_tolerance, strict=False):
+    """Find the range of positions in the sorted array `values` which match
+    each of `queries` within a PPM error tolerance, for all queries at once.
+
+    Parameters
+    ----------
+    values : np.ndarray
+        The values to search, sorted in ascending order
+    queries : array-like
+        The values to search for, in any order
+    error_tolerance : float
+        The PPM error tolerance to use when deciding whether a value matches a query
+    strict : bool, optional
+        Whether the error must be strictly less than `error_tolerance`, rather
+        than less than or equal to it. Defaults to :const:`False`
+
+    Returns
+    -------
+    starts : np.ndarray
+        The first matching position for each query
+    ends : np.ndarray
+        One past the last matching position for each query. When no value matches,
+        the start and end are equal.
+    """
+    values = np.asarray(values, dtype=np.float64)
+    queries = np.asarray(queries, dtype=np.float64)
+    n = len(values)
+    width = np.abs(queries * error_tolerance)
+    starts = np.searchsorted(values, queries - width, side='left')
+    ends = np.searchsorted(values, queries + width, side='right')
+    if n == 0:
+        return starts, ends
+
+    if strict:
+        def rejects(positions):
+            return np.abs(ppm_error(values[positions], queries)) >= error_tolerance
+    else:
+        def rejects(positions):
+            return np.abs(ppm_error(values[positions], queries)) > error_tolerance
+
+    # The searchsorted bounds are computed in Da, so correct any boundary values
+    # whose PPM error falls on the other side of the tolerance.
+    while True:
+        mask = (starts < ends) & rejects(np.minimum(starts, n - 1))
+        if not mask.any():
+            break
+        starts[mask] += 1
+    while True:
+        mask = (ends > starts) & rejects(np.maximum(ends - 1, 0))
+        if not mask.any():
+            break
+        ends[mask] -= 1
+    return starts, ends
+
+
+def ppm_search_nearest(values, queries, error_tolerance, strict=False):
+    """Find the position of the value in the sorted array `values` nearest to
+    each of `queries` if it matches within a PPM error tolerance, for all queries at once.
+
+    Parameters
+    ----------
+    values : np.ndarray
+        The values to search, sorted in ascending order
+    queries : array-like
+        The values to search for, in any order
+    error_tolerance : float
+        The PPM error tolerance to use when deciding whether a value matches a query
+    strict : bool, optional
+        Whether the error must be strictly less than `error_tolerance`, rather
+        than less than or equal to it. Defaults to :const:`False`
+
+    Returns
+    -------
+    np.ndarray
+        The position of the best match for each query, or -1 if no value matched
+    """
+    values = np.asarray(values, dtype=np.float64)
+    queries = np.asarray(queries, dtype=np.float64)
+    starts, ends = ppm_search_intervals(values, queries, error_tolerance, strict)
+    n = len(values)
+    if n == 0:
+        return np.full(len(queries), -1, dtype=np.intp)
+    right = np.clip(np.searchsorted(values, queries), 0, n - 1)
+    left = np.clip(right - 1, 0, n - 1)
+    best = np.where(
+        np.abs(values[left] - queries) <= np.abs(values[right] - queries), left, right)
+    # The nearest value always has the smallest error, so it lies within
+    # any non-empty interval
+    return np.where(starts < ends, best, -1)
+
+
+def _ppm_rejects(value, query, error_tolerance, strict):
+    error = abs(ppm_error(value, query))
+    if strict:
+        return error >= error_tolerance
+    return error > error_tolerance
+
+
+def ppm_search_interval(values, query, error_tolerance, strict=False):
+    """Find the range of positions in the sorted array `values` which match
+    `query` within a PPM error tolerance.
+
+    The single query counterpart of :func:`ppm_search_intervals`, which avoids
+    building arrays for one value.
+
+    Parameters
+    ----------
+    values : np.ndarray
+        The values to search, sorted in ascending order
+    query : float
+        The value to search for
+    error_tolerance : float
+        The PPM error tolerance to use when deciding whether a value matches the query
+    strict : bool, optional
+        Whether the error must be strictly less than `error_tolerance`, rather
+        than less than or equal to it. Defaults to :const:`False`
+
+    Returns
+    -------
+    start : int
+    end : int
+    """
+    query = float(query)
+    width = abs(query * error_tolerance)
+    start = int(values.searchsorted(query - width, side='left'))
+    end = int(values.searchsorted(query + width, side='right'))
+    while start < end and _ppm_rejects(values.item(start), query, error_tolerance, strict):
+        start += 1
+    while end > start and _ppm_rejects(values.item(end - 1), query, error_tolerance, strict):
+        end -= 1
+    return start, end
+
+
+def ppm_search_nearest_one(values, query, error_tolerance, strict=False):
+    """Find the position of the value in the sorted array `values` nearest to
+    `query` if it matches within a PPM error tolerance.
+
+    The single query counterpart of :func:`ppm_search_nearest`, which avoids
+    building arrays for one value.
+
+    Parameters
+    ----------
+    values : np.ndarray
+        The values to search, sorted in ascending order
+    query : float
+        The value to search for
+    error_tolerance : float
+        The PPM error tolerance to use when deciding whether a value matches the query
+    strict : bool, optional
+        Whether the error must be strictly less than `error_tolerance`, rather
+        than less than or equal to it. Defaults to :const:`False`
+
+    Returns
+    -------
+    int
+        The position of the best match, or -1 if no value matched
+    """
+    n = len(values)
+    if n == 0:
+        return -1
+    query = float(query)
+    i = int(values.searchsorted(query))
+    if i == n or (i > 0 and abs(values.item(i - 1) - query) <= abs(values.item(i) - query)):
+        i -= 1
+    if _ppm_rejects(values.item(i), query, error_tolerance, strict):
+        return -1
+    return i
+
+
 def dict_proxy(attribute):
     """Return a decorator for a class to give it a `dict`-like API proxied
     from one of its attributes
@@ -222,7 +222,7 @@ def run_setup(include_cext=True):
     setup(
         name='ms_deisotope',
         version=version,
-        packages=find_packages(),
+        packages=find_packages(exclude=["benchmarks", "benchmarks.*"]),
         author=', '.join(["Joshua Klein"]),
         author_email=["jaklein@bu.edu"],
         description='Access, Deisotope, and Charge Deconvolute Mass Spectra',
@@ -234,6 +234,7 @@ def run_setup(include_cext=True):
                 "ms-index = ms_deisotope.tools.indexing:main",
                 "ms-view = ms_deisotope.tools.view:main",
                 "ms-deisotope = ms_deisotope.tools.deisotoper.main:deisotope",
+                "ms-deisotope-batch = ms_deisotope.tools.deisotoper.main:deisotope_batch",
             ],
         },
         classifiers=[